@@ -646,6 +646,8 @@ if __name__ == '__main__':
                 transcriptome_bowtie2_args=args.transcriptome_bowtie2_args,
                 experimental=args.experimental,
                 count_multiplier=args.count_multiplier,
+                coalesce_bytes=args.coalesce_bytes,
+                index_cache=args.index_cache,
                 max_refs_per_strand=args.max_refs_per_strand,
                 tie_margin=args.tie_margin,
                 normalize_percentile=args.normalize_percentile,
@@ -709,6 +711,8 @@ if __name__ == '__main__':
                 transcriptome_bowtie2_args=args.transcriptome_bowtie2_args,
                 experimental=args.experimental,
                 count_multiplier=args.count_multiplier,
+                coalesce_bytes=args.coalesce_bytes,
+                index_cache=args.index_cache,
                 max_refs_per_strand=args.max_refs_per_strand,
                 tie_margin=args.tie_margin,
                 normalize_percentile=args.normalize_percentile,
@@ -801,6 +805,8 @@ if __name__ == '__main__':
                 transcriptome_bowtie2_args=args.transcriptome_bowtie2_args,
                 experimental=args.experimental,
                 count_multiplier=args.count_multiplier,
+                coalesce_bytes=args.coalesce_bytes,
+                index_cache=args.index_cache,
                 max_refs_per_strand=args.max_refs_per_strand,
                 tie_margin=args.tie_margin,
                 normalize_percentile=args.normalize_percentile,
@@ -867,6 +873,8 @@ if __name__ == '__main__':
                 transcriptome_bowtie2_args=args.transcriptome_bowtie2_args,
                 experimental=args.experimental,
                 count_multiplier=args.count_multiplier,
+                coalesce_bytes=args.coalesce_bytes,
+                index_cache=args.index_cache,
                 max_refs_per_strand=args.max_refs_per_strand,
                 tie_margin=args.tie_margin,
                 normalize_percentile=args.normalize_percentile,
@@ -960,6 +968,8 @@ if __name__ == '__main__':
                 transcriptome_bowtie2_args=args.transcriptome_bowtie2_args,
                 experimental=args.experimental,
                 count_multiplier=args.count_multiplier,
+                coalesce_bytes=args.coalesce_bytes,
+                index_cache=args.index_cache,
                 max_refs_per_strand=args.max_refs_per_strand,
                 tie_margin=args.tie_margin,
                 normalize_percentile=args.normalize_percentile,
@@ -1042,6 +1052,8 @@ if __name__ == '__main__':
                 transcriptome_bowtie2_args=args.transcriptome_bowtie2_args,
                 experimental=args.experimental,
                 count_multiplier=args.count_multiplier,
+                coalesce_bytes=args.coalesce_bytes,
+                index_cache=args.index_cache,
                 max_refs_per_strand=args.max_refs_per_strand,
                 tie_margin=args.tie_margin,
                 normalize_percentile=args.normalize_percentile,
@@ -54,7 +54,12 @@ import tempfile
 import shutil
 import os
 import contextlib
+import threading
+import heapq
+import bisect
+from multiprocessing import AuthenticationError
 from tools import make_temp_dir, make_temp_dir_and_register_cleanup
+from executor import ProcessPoolExecutor, SocketExecutor, IPythonExecutor
 from ansibles import Url
 import site
 import string
@@ -110,6 +115,18 @@ def add_args(parser):
                   'array of cluster setups. Ignores --num-processes in favor '
                   'of the number of available engines.')
         )
+    parser.add_argument('--workers', type=str, required=False,
+            default=None,
+            help=('Comma-separated list of host:port addresses of worker '
+                  'daemons started with "python executor.py --host <host> '
+                  '--port <port>" to which tasks are sent over TCP; the '
+                  'daemons may run on other machines that share a '
+                  'filesystem with this one. Master and daemons authenticate '
+                  'each other with the key in the environment variable '
+                  'DOOPLICITY_AUTHKEY, which daemons listening on addresses '
+                  'other than loopback require. Ignores --num-processes in '
+                  'favor of the number of workers.')
+        )
     parser.add_argument('--ipcontroller-json', type=str, required=False,
             default=None,
             help=('Path to ipcontroller-client.json file; relevant only if '
@@ -148,6 +165,48 @@ def add_args(parser):
             help=('Path to sort executable. Add arguments as necessary, '
                   'e.g. for specifying a directory for storing sort\'s '
                   'temporary files.'))
+    parser.add_argument('--partition-hash', type=str, required=False,
+            default='crc32', choices=['crc32', 'md5'],
+            help=('Hash function for assigning keys to reduce tasks. "md5" '
+                  'is slower but reproduces the task files written by '
+                  'earlier versions of Dooplicity byte for byte.'))
+    parser.add_argument('--merge', type=str, required=False,
+            default='native', choices=['native', 'sort'],
+            help=('How to merge presorted inputs to a reduce task. "native" '
+                  'performs a k-way merge in-process, decompressing gzip\'d '
+                  'inputs with zlib, and feeds the reducer through one '
+                  'pipe; "sort" uses UNIX sort -m and, with --gzip-outputs, '
+                  'a gzip process per input.'))
+    parser.add_argument('--sorted-runs', action='store_const', const=True,
+            default=False,
+            help=('Sort map output in memory while partitioning it into '
+                  'tasks, writing sorted runs of at most --memcap KB that '
+                  'reducers merge directly, rather than writing unsorted '
+                  'task files and sorting each with UNIX sort afterwards.'))
+    parser.add_argument('--no-pipelining', action='store_const', const=True,
+            default=False,
+            help=('Wait for every task of a phase to finish before starting '
+                  'the next phase. By default, map output is partitioned as '
+                  'map tasks complete, and a step whose input is the output '
+                  'of the step before it starts as soon as that output is '
+                  'written.'))
+    parser.add_argument('--speculation-factor', type=float, required=False,
+            default=0,
+            help=('Start a duplicate of a map or reduce task in an idle slot '
+                  'once the task has run for longer than this many times '
+                  'the median duration of completed tasks in its phase; the '
+                  'first copy to finish wins. Only task output written to '
+                  'stdout is kept apart per attempt, so use only if no step '
+                  'writes files of its own, as Rail-RNA\'s bam and coverage '
+                  'steps do. 0, the default, disables speculative '
+                  'execution.'))
+
+# Approximate number of bytes of input to read per partitioning batch
+_partition_batch_size = 8 * 1024 * 1024
+# Buffer size of each task file written while partitioning
+_partition_write_buffer_size = 1024 * 1024
+# Number of bytes read at once from each input file to a native merge
+_merge_readahead = 256 * 1024
 
 def init_worker():
     """ Prevents KeyboardInterrupt from reaching a pool's workers.
@@ -186,6 +245,30 @@ def yopen(gzipped, *args):
         return gzip.open(*args)
     return open(*args)
 
+def parsed_key_options(options):
+    """ Parses UNIX sort -k options into field ranges.
+
+        options: UNIX sort options like -k1,1 -k3 -k3,4r -k 4 -k 5,3
+
+        Return value: list of tuples (start, end, flags), where start and end
+            are 0-based field indexes, end is None if the range extends to the
+            end of the line, and flags is a string of sort ordering options
+            like 'n' or 'nr'. Raises ValueError if options are invalid.
+    """
+    parsed_options = []
+    for arg in options.split('-k'):
+        arg = arg.strip()
+        if not arg: continue
+        bounds = arg.split(',')
+        if len(bounds) > 2:
+            continue
+        flags = ''.join([char for char in bounds[-1] if char in 'nr'])
+        bounds = [int(bound.strip().strip('nr')) - 1 for bound in bounds]
+        parsed_options.append(
+                (bounds[0], bounds[1] if len(bounds) == 2 else None, flags)
+            )
+    return parsed_options
+
 def parsed_keys(partition_options, key_fields):
     """ Parses UNIX sort options to figure out what to partition on.
 
@@ -200,12 +283,9 @@ def parsed_keys(partition_options, key_fields):
     """
     try:
         # Make list of tuples of start, end indexes
-        parsed_args = [
-                tuple([int(el) - 1 
-                        for el in arg.strip().strip('nr').split(',')])
-                        for arg in partition_options.split('-k')
-                        if arg.strip() and len(arg.split(',')) <= 2
-            ]
+        parsed_args = [(start,) if end is None else (start, end)
+                        for start, end, _
+                        in parsed_key_options(partition_options)]
     except Exception:
         # args are invalid
         return False
@@ -221,18 +301,272 @@ def parsed_keys(partition_options, key_fields):
         )
         return partitioned_key
 
+def partition_key_extractor(partition_options, separator):
+    """ Builds a function that extracts the partition key from a line.
+
+        The key returned for a given line is exactly
+        separator.join(parsed_keys(partition_options, separator)(line,
+        separator)), but the line is split no further than the last field
+        the partition options reference, and the common case of a single
+        range starting at the first field avoids building a list of slices.
+
+        partition_options: UNIX sort options like -k1,1 -k3 -k3,4r -k 4 -k 5,3
+        separator: separator between successive fields from line
+
+        Return value: function that takes a line and returns its partition key
+            as a string, or False if partition_options are invalid
+    """
+    try:
+        key_options = parsed_key_options(partition_options)
+    except Exception:
+        return False
+    if not key_options:
+        return False
+    ends = [end for _, end, _ in key_options]
+    maxsplit = -1 if None in ends else max(ends) + 1
+    if len(key_options) == 1 and key_options[0][0] == 0 \
+        and key_options[0][1] is not None:
+        field_count = key_options[0][1] + 1
+        def partition_key(line):
+            return separator.join(
+                    line.strip().split(separator, field_count)[:field_count]
+                )
+        return partition_key
+    key_slices = [slice(start, None if end is None else end + 1)
+                    for start, end, _ in key_options]
+    def partition_key(line):
+        fields = line.strip().split(separator, maxsplit)
+        return separator.join(
+                [field for key_slice in key_slices
+                    for field in fields[key_slice]]
+            )
+    return partition_key
+
+def key_hasher(partition_hash):
+    """ Builds a function that hashes a partition key.
+
+        partition_hash: 'crc32' or 'md5'; see task_assigner()
+
+        Return value: function that takes a key and returns a nonnegative int
+    """
+    import zlib
+    if partition_hash == 'md5':
+        md5 = hashlib.md5
+        def key_hash(key):
+            return int(md5(key).hexdigest(), 16)
+    elif partition_hash == 'crc32':
+        crc32 = zlib.crc32
+        def key_hash(key):
+            return crc32(key) & 0xffffffff
+    else:
+        raise ValueError('Partition hash "%s" is invalid.' % partition_hash)
+    return key_hash
+
+def task_assigner(partition_options, separator, task_count,
+                    mod_partition=False, partition_hash='crc32'):
+    """ Builds a function that assigns a batch of lines to tasks.
+
+        Keys are extracted for a whole batch at once with
+        partition_key_extractor(), then hashed. With partition_hash 'md5',
+        task assignment is identical to the original per-line formula
+            int(hashlib.md5(key).hexdigest(), 16) % (task_count);
+        with 'crc32', the much cheaper
+            (zlib.crc32(key) & 0xffffffff) % (task_count)
+        is used instead. Both are stable across processes and hosts, which
+        Python's hash() is not guaranteed to be.
+
+        partition_options: sort-like options to use when partitioning.
+        separator: separator between successive fields from line.
+        task_count: number of tasks in which to partition input.
+        mod_partition: if True, task is assigned according to formula
+            (single key field) % task_count when the key is a single integer
+        partition_hash: 'crc32' or 'md5'; see above
+
+        Return value: function that takes a list of lines and returns a list
+            of their task numbers, or False if partition_options are invalid
+    """
+    partition_key = partition_key_extractor(partition_options, separator)
+    if not partition_key:
+        return False
+    key_hash = key_hasher(partition_hash)
+    if mod_partition:
+        def key_task(key):
+            if separator not in key:
+                try:
+                    return abs(int(key)) % task_count
+                except ValueError:
+                    # Null key or some field doesn't work with this
+                    pass
+            return key_hash(key) % task_count
+        def assigned_tasks(lines):
+            return map(key_task, map(partition_key, lines))
+    else:
+        def assigned_tasks(lines):
+            return [key_hash(key) % task_count
+                        for key in map(partition_key, lines)]
+    return assigned_tasks
+
+def record_task_assigner(partition_options, task_count,
+                            mod_partition=False, partition_hash='crc32'):
+    """ Builds a function that assigns a batch of binary records to tasks.
+
+        The partition key of a record is the concatenation of the encoded
+        fields the partition options reference, so it is hashed without
+        decoding the record. See records.py for the record format and
+        task_assigner() for the rest.
+
+        partition_options: sort-like options to use when partitioning.
+        task_count: number of tasks in which to partition input.
+        mod_partition: if True, task is assigned according to formula
+            (single key field) % task_count when the key is a single int
+        partition_hash: 'crc32' or 'md5'
+
+        Return value: function that takes a list of record bodies and returns
+            a list of their task numbers, or False if partition_options are
+            invalid
+    """
+    import records
+    try:
+        key_options = parsed_key_options(partition_options)
+    except Exception:
+        return False
+    if not key_options:
+        return False
+    ends = [end for _, end, _ in key_options]
+    field_count = None if None in ends else max(ends) + 1
+    field_offsets = records.field_offsets
+    if len(key_options) == 1 and key_options[0][0] == 0 \
+        and key_options[0][1] is not None:
+        def partition_key(body):
+            return body[:field_offsets(body, field_count)[-1]]
+    else:
+        def partition_key(body):
+            offsets = field_offsets(body, field_count)
+            return ''.join([body[offsets[min(start, len(offsets) - 1)]:
+                                 offsets[-1] if end is None
+                                 else offsets[min(end + 1, len(offsets) - 1)]]
+                            for start, end, _ in key_options])
+    key_hash = key_hasher(partition_hash)
+    if mod_partition:
+        decoded = records.decoded
+        def key_task(key):
+            fields = decoded(key)
+            if len(fields) == 1 and isinstance(fields[0], (int, long)):
+                return abs(fields[0]) % task_count
+            return key_hash(key) % task_count
+        def assigned_tasks(bodies):
+            return map(key_task, map(partition_key, bodies))
+    else:
+        def assigned_tasks(bodies):
+            return [key_hash(key) % task_count
+                        for key in map(partition_key, bodies)]
+    return assigned_tasks
+
+def records_sortable(sort_options):
+    """ Checks whether binary records can be sorted as sort options say.
 
-def gzip_into(gzip_level, outfn):
+        Bodies of binary records sort on all their fields in order, ints and
+        floats numerically, which agrees with sort options whose -k ranges
+        cover leading fields in order with no r flags, like -k1,1 -k2,2n.
+
+        sort_options: UNIX sort options like -k1,1 -k2,2n
+
+        Return value: True iff sorting bodies bytewise honors sort_options
+    """
+    try:
+        key_options = parsed_key_options(sort_options)
+    except Exception:
+        return False
+    next_start = 0
+    for start, end, flags in key_options:
+        if 'r' in flags or start != next_start:
+            return False
+        if end is None:
+            break
+        next_start = end + 1
+    return True
+
+def binary_input(input_files):
+    """ Checks whether input files contain binary records.
+
+        Empty files are skipped; the first file with data decides.
+
+        input_files: list of paths to files, each of which may be gzip'd
+
+        Return value: True iff input is binary records from records.py
+    """
+    import records
+    for input_file in input_files:
+        with yopen(None, input_file, 'rb') as input_stream:
+            start = input_stream.read(len(records.magic))
+        if start:
+            return records.is_record_stream(start)
+    return False
+
+def record_batches(input_stream, batch_size=_partition_batch_size):
+    """ Reads binary records in batches.
+
+        input_stream: file object with binary records
+        batch_size: approximate number of bytes of records per batch
+
+        Yield value: list of record bodies
+    """
+    import records
+    batch, size = [], 0
+    for body in records.stream_bodies(input_stream):
+        batch.append(body)
+        size += len(body) + 4
+        if size >= batch_size:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+def gzip_into(gzip_level, outfn, bufsize=-1):
     return subprocess.Popen('gzip -%d >%s' % (gzip_level, outfn),
-        shell=True, bufsize=-1,
+        shell=True, bufsize=bufsize,
         executable='/bin/bash',
         stdin=subprocess.PIPE)
 
 
+def write_sorted_run(lines, run_file, sort_key, gzip=False, gzip_level=3):
+    """ Sorts lines in place and writes them to a file.
+
+        lines: list of lines, or of binary record bodies if sort_key is None
+        run_file: path to output file; '.gz' is appended if gzip is True
+        sort_key: function returned by sort_key_function(), or None if
+            lines are record bodies, which are sorted bytewise and written
+            as records
+        gzip: True iff run file should be gzipped; else False.
+        gzip_level: Level of gzip compression to use, if applicable.
+
+        Return value: None if no errors encountered; otherwise error string.
+    """
+    if sort_key is None:
+        import records
+        lines.sort()
+        framed = records.framed
+        lines = [records.magic] + [framed(body) for body in lines]
+    else:
+        lines.sort(key=sort_key)
+    if gzip:
+        gzip_process = gzip_into(gzip_level, run_file + '.gz',
+                                    _partition_write_buffer_size)
+        gzip_process.stdin.writelines(lines)
+        gzip_process.stdin.close()
+        if gzip_process.wait():
+            return ('Error encountered compressing sorted run %s.gz; exit '
+                    'code was %d.') % (run_file, gzip_process.returncode)
+    else:
+        with open(run_file, 'w', _partition_write_buffer_size) as run_stream:
+            run_stream.writelines(lines)
+    return None
+
 def presorted_tasks(input_files, process_id, sort_options, output_dir,
                     key_fields, separator, partition_options, task_count,
                     memcap, gzip=False, gzip_level=3, scratch=None,
                     direct_write=False, sort='sort', mod_partition=False,
+                    partition_hash='crc32', sorted_runs=False,
                     max_attempts=4):
     """ Partitions input data into tasks and presorts them.
 
@@ -241,8 +575,25 @@ def presorted_tasks(input_files, process_id, sort_options, output_dir,
         ID that identifies which process created the file. y is unimportant;
         the glob x.* should be catted to the reducer.
 
-        Formula for computing task assignment: 
-            int(hashlib.md5(key).hexdigest(), 16) % (task_count)
+        By default, each task's lines are written to an unsorted file that is
+        then sorted with UNIX sort in a second pass. If sorted_runs is True,
+        lines are instead held in memory until memcap is reached, and the
+        largest in-memory tasks are sorted in Python and written out as runs
+        named x.y.z, where z numbers the runs of task x written by process
+        y. The reducer merges all runs of a task, so intermediate data is
+        written to disk only once.
+
+        Formula for computing task assignment is
+            (zlib.crc32(key) & 0xffffffff) % (task_count)
+        by default or, if partition_hash is 'md5',
+            int(hashlib.md5(key).hexdigest(), 16) % (task_count),
+        which reproduces the task files written by earlier versions of
+        Dooplicity byte for byte. Input is read and assigned to tasks in
+        batches of about _partition_batch_size bytes.
+
+        Input of binary records (see records.py) is always written as sorted
+        runs, with records sorted bytewise; sort options must then be
+        compatible with that order, as records_sortable() checks.
 
         input_files: list of files on which to operate.
         process_id: unique identifier for current process.
@@ -263,6 +614,13 @@ def presorted_tasks(input_files, process_id, sort_options, output_dir,
         sort: path to sort executable
         mod_partition: if True, task is assigned according to formula
             (product of fields) % task_count
+        partition_hash: 'crc32' or 'md5'; hash function used to assign keys
+            to tasks
+        sorted_runs: True iff sorted runs should be written while
+            partitioning rather than presorting each task file with UNIX sort
+            afterwards; see above. Here, memcap is interpreted as sort -S
+            interprets it, in units of 1024 bytes, and bounds the total
+            length of lines held in memory.
         max_attempts: maximum number of times to attempt partitioning input.
             MUST BE FINAL ARG to be compatible with 
             execute_balanced_job_with_retries().
@@ -270,7 +628,7 @@ def presorted_tasks(input_files, process_id, sort_options, output_dir,
         Return value: None if no errors encountered; otherwise error string.
     """
     try:
-        from operator import mul
+        from collections import defaultdict
         task_streams = {}
         if scratch is not None:
             scratch = os.path.expanduser(os.path.expandvars(scratch))
@@ -306,44 +664,105 @@ def presorted_tasks(input_files, process_id, sort_options, output_dir,
             final_output_dir = output_dir
         output_dir = os.path.expandvars(output_dir)
         final_output_dir = os.path.expandvars(final_output_dir)
-        partitioned_key = parsed_keys(partition_options, separator)
-        if not partitioned_key:
+        binary = binary_input(input_files)
+        if binary:
+            assigned_tasks = record_task_assigner(partition_options,
+                                                    task_count, mod_partition,
+                                                    partition_hash)
+        else:
+            assigned_tasks = task_assigner(partition_options, separator,
+                                            task_count, mod_partition,
+                                            partition_hash)
+        if not assigned_tasks:
             # Invalid partition options
             return ('Partition options "%s" are invalid.' % partition_options)
+        if binary:
+            if not records_sortable(sort_options):
+                return ('Sort options "%s" are incompatible with binary '
+                        'records, which sort on leading fields in order.'
+                        % sort_options)
+            sorted_runs = True
+            sort_key = None
+        elif sorted_runs:
+            sort_key = sort_key_function(sort_options, separator)
+            if not sort_key:
+                return ('Sort options "%s" are invalid.' % sort_options)
+        if sorted_runs:
+            run_budget = memcap * 1024
+            task_buffers = defaultdict(list)
+            task_buffer_sizes = defaultdict(int)
+            run_counts = defaultdict(int)
+            buffered_size = 0
+            def spilled_run(task):
+                """ Writes task's buffered lines as a sorted run. """
+                run_file = os.path.join(output_dir, '%d.%s.%d' % (
+                                            task, process_id, run_counts[task]
+                                        ))
+                run_counts[task] += 1
+                return write_sorted_run(task_buffers.pop(task), run_file,
+                                        sort_key, gzip, gzip_level)
         for input_file in input_files:
-            with yopen(None, input_file) as input_stream:
-                for line in input_stream:
-                    key = partitioned_key(line, separator)
-                    if mod_partition and len(key) <= 1:
+            with yopen(None, input_file, 'rb') as input_stream:
+                if binary:
+                    batches = record_batches(input_stream)
+                else:
+                    batches = iter(lambda: input_stream.readlines(
+                                                _partition_batch_size
+                                            ), [])
+                for lines in batches:
+                    task_lines = defaultdict(list)
+                    for task, line in zip(assigned_tasks(lines), lines):
+                        task_lines[task].append(line)
+                    if sorted_runs:
+                        for task in task_lines:
+                            task_buffers[task].extend(task_lines[task])
+                            task_size = sum(map(len, task_lines[task]))
+                            task_buffer_sizes[task] += task_size
+                            buffered_size += task_size
+                        # Spill largest tasks until half the budget is free
+                        while buffered_size > run_budget:
+                            for task in sorted(task_buffers,
+                                        key=task_buffer_sizes.__getitem__,
+                                        reverse=True):
+                                error = spilled_run(task)
+                                if error is not None:
+                                    return error
+                                buffered_size -= task_buffer_sizes.pop(task)
+                                if buffered_size <= run_budget / 2:
+                                    break
+                        continue
+                    for task in task_lines:
                         try:
-                            task = abs(int(key[0])) % task_count
-                        except (IndexError, ValueError):
-                            # Null key or some field doesn't work with this
-                            task = int(
-                                hashlib.md5(separator.join(key)).hexdigest(),
-                                16
-                            ) % task_count
-                    else:
-                        task = int(
-                            hashlib.md5(separator.join(key)).hexdigest(), 16
-                        ) % task_count
-                    try:
-                        task_streams[task].write(line)
-                    except KeyError:
-                        # Task file doesn't exist yet; create it
-                        if gzip:
-                            task_file = os.path.join(output_dir, str(task) +
-                                                        '.' + str(process_id)
-                                                        + '.unsorted.gz')
-                            task_stream_processes[task] = gzip_into(gzip_level, task_file)
-                            task_streams[task] \
-                                = task_stream_processes[task].stdin
-                        else:
-                            task_file = os.path.join(output_dir, str(task) +
-                                                        '.' + str(process_id)
-                                                        + '.unsorted')
-                            task_streams[task] = open(task_file, 'w')
-                        task_streams[task].write(line)
+                            task_streams[task].writelines(task_lines[task])
+                        except KeyError:
+                            # Task file doesn't exist yet; create it
+                            if gzip:
+                                task_file = os.path.join(
+                                        output_dir, str(task) + '.'
+                                        + str(process_id) + '.unsorted.gz'
+                                    )
+                                task_stream_processes[task] = gzip_into(
+                                        gzip_level, task_file,
+                                        _partition_write_buffer_size
+                                    )
+                                task_streams[task] \
+                                    = task_stream_processes[task].stdin
+                            else:
+                                task_file = os.path.join(
+                                        output_dir, str(task) + '.'
+                                        + str(process_id) + '.unsorted'
+                                    )
+                                task_streams[task] = open(
+                                        task_file, 'w',
+                                        _partition_write_buffer_size
+                                    )
+                            task_streams[task].writelines(task_lines[task])
+        if sorted_runs:
+            for task in task_buffers.keys():
+                error = spilled_run(task)
+                if error is not None:
+                    return error
+            return None
         for task in task_streams:
             task_streams[task].close()
         if gzip:
@@ -438,6 +857,641 @@ def presorted_tasks(input_files, process_id, sort_options, output_dir,
             shutil.rmtree(output_dir)
 
 
+class _Descending(object):
+    """ Wraps a sort key so that it compares in reverse order. """
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return self.key != other.key
+
+def numeric_sort_key(field):
+    """ Mimics how UNIX sort -n interprets a field.
+
+        Leading blanks are skipped, and the longest numeric prefix of what
+        remains is the field's value; a field without one is 0.
+
+        field: field from a line
+
+        Return value: int or float
+    """
+    try:
+        return int(field)
+    except ValueError:
+        import re
+        number = re.match(r'\s*(-?\d*(?:\.\d*)?)', field).group(1)
+        try:
+            return float(number)
+        except ValueError:
+            return 0
+
+def sort_key_function(sort_options, separator):
+    """ Builds a function that computes a line's sort key.
+
+        Keys are compared as UNIX sort with LC_ALL=C compares lines: key
+        ranges specified by -k options are compared in order, bytewise
+        unless the n flag is present and in reverse if the r flag is
+        present, and ties are broken by comparing whole lines. Only -k
+        options are respected.
+
+        sort_options: UNIX sort options like -k1,1 -k2,2n -k3,4r
+        separator: separator between successive fields from line
+
+        Return value: function that takes a line and returns a tuple that
+            sorts as the line should, or False if sort_options are invalid
+    """
+    try:
+        key_options = parsed_key_options(sort_options)
+    except Exception:
+        return False
+    ends = [end for _, end, _ in key_options]
+    maxsplit = -1 if None in ends else (max(ends) + 1 if ends else 0)
+    key_slices = [(slice(start, None if end is None else end + 1),
+                    'n' in flags, 'r' in flags)
+                    for start, end, flags in key_options]
+    def line_sort_key(line):
+        line = line.rstrip('\n')
+        fields = line.split(separator, maxsplit)
+        sort_key = []
+        for key_slice, numeric, descending in key_slices:
+            key = separator.join(fields[key_slice])
+            if numeric:
+                key = numeric_sort_key(key)
+            if descending:
+                key = _Descending(key)
+            sort_key.append(key)
+        sort_key.append(line)
+        return tuple(sort_key)
+    return line_sort_key
+
+def input_chunks(input_file, readahead=_merge_readahead):
+    """ Iterates through the data in a file that may be gzip'd.
+
+        Gzip'd files are decompressed in-process with zlib, and no more than
+        about readahead bytes of compressed or decompressed data are held at
+        once. Concatenated gzip members are supported.
+
+        input_file: path to file
+        readahead: number of bytes to read at once
+
+        Yield value: string of successive (decompressed) data
+    """
+    import zlib
+    with open(input_file, 'rb', readahead) as input_stream:
+        gzipped = (input_stream.read(2) == '\x1f\x8b')
+        input_stream.seek(0)
+        if not gzipped:
+            for data in iter(lambda: input_stream.read(readahead), ''):
+                yield data
+            return
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        while True:
+            compressed = input_stream.read(readahead)
+            if not compressed: break
+            while compressed:
+                yield decompressor.decompress(compressed, readahead)
+                if decompressor.unused_data:
+                    # Another gzip member follows
+                    compressed = decompressor.unused_data
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                else:
+                    compressed = decompressor.unconsumed_tail
+        yield decompressor.flush()
+
+def input_lines(input_file, readahead=_merge_readahead):
+    """ Iterates through lines of a file that may be gzip'd.
+
+        Gzip'd files are decompressed in-process with zlib, and no more than
+        about readahead bytes of compressed or decompressed data are held at
+        once. Concatenated gzip members are supported. A newline is appended
+        to the last line if it is missing.
+
+        input_file: path to file
+        readahead: number of bytes to read at once
+
+        Yield value: line
+    """
+    with open(input_file, 'rb', readahead) as input_stream:
+        gzipped = (input_stream.read(2) == '\x1f\x8b')
+        input_stream.seek(0)
+        if not gzipped:
+            for line in input_stream:
+                if line[-1:] != '\n':
+                    line += '\n'
+                yield line
+            return
+    remainder = ''
+    for data in input_chunks(input_file, readahead):
+        lines = (remainder + data).split('\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if remainder:
+        yield remainder + '\n'
+
+def merged_lines(input_files, sort_options, separator,
+                    readahead=_merge_readahead):
+    """ Performs a streaming k-way merge of presorted files.
+
+        Output is in the order of LC_ALL=C sort -m with the same -k options.
+        Files of binary records are merged by comparing record bodies
+        bytewise, and output is a stream of records.
+
+        input_files: list of paths to presorted files, each of which may be
+            gzip'd
+        sort_options: UNIX sort options like -k1,1 -k2,2n
+        separator: separator between successive fields from line
+        readahead: number of bytes to read at once from each file
+
+        Yield value: line, or data from a stream of records
+    """
+    import heapq
+    if binary_input(input_files):
+        import records
+        if len(input_files) == 1:
+            for data in input_chunks(input_files[0], readahead):
+                yield data
+            return
+        yield records.magic
+        framed = records.framed
+        for body in heapq.merge(*[records.record_bodies(
+                                        input_chunks(input_file, readahead)
+                                    ) for input_file in input_files]):
+            yield framed(body)
+        return
+    if len(input_files) == 1:
+        for line in input_lines(input_files[0], readahead):
+            yield line
+        return
+    sort_key = sort_key_function(sort_options, separator)
+    if not sort_key:
+        raise ValueError('Sort options "%s" are invalid.' % sort_options)
+    def keyed_lines(input_file):
+        for line in input_lines(input_file, readahead):
+            yield sort_key(line), line
+    for _, line in heapq.merge(*[keyed_lines(input_file)
+                                    for input_file in input_files]):
+        yield line
+
+class MergeFeeder(threading.Thread):
+    """ Writes a k-way merge of presorted files to a stream in a thread. """
+    def __init__(self, input_files, sort_options, separator, output_stream):
+        """
+            input_files: list of paths to presorted files, each of which may
+                be gzip'd
+            sort_options: UNIX sort options like -k1,1 -k2,2n
+            separator: separator between successive fields from line
+            output_stream: where to write merged lines; closed when the
+                merge is complete
+        """
+        super(MergeFeeder, self).__init__()
+        self.input_files = input_files
+        self.sort_options = sort_options
+        self.separator = separator
+        self.output_stream = output_stream
+        # Formatted traceback if merge fails
+        self.error = None
+        self.daemon = True
+
+    def run(self):
+        import errno
+        try:
+            self.output_stream.writelines(
+                    merged_lines(self.input_files, self.sort_options,
+                                    self.separator)
+                )
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                from traceback import format_exc
+                self.error = format_exc()
+        except Exception:
+            from traceback import format_exc
+            self.error = format_exc()
+        finally:
+            try:
+                self.output_stream.close()
+            except IOError:
+                pass
+
+def timed_task(task_function, *args):
+    """ Runs a task, recording when it starts and finishes.
+
+        task_function: function to run
+        *args: arguments of task_function
+
+        Return value: tuple (return value of task_function, start time,
+            end time), where times are seconds since the epoch on the host
+            that ran the task
+    """
+    import time
+    start_time = time.time()
+    return_value = task_function(*args)
+    return return_value, start_time, time.time()
+
+def spawned(*args, **kwargs):
+    """ Starts a subprocess without waiting for it.
+
+        *args, **kwargs: arguments of subprocess.Popen
+
+        Return value: pid of subprocess, which unlike the Popen object can be
+            returned from a remote worker
+    """
+    import subprocess
+    return subprocess.Popen(*args, **kwargs).pid
+
+class PhaseUtilization(object):
+    """ Accumulates how busy task slots are during each phase of a job.
+
+        A phase's utilization is the total time its task attempts ran divided
+        by the product of the number of slots and the phase's span, which
+        runs from the start of its first task attempt to the end of its last.
+        Phases of a pipelined job may overlap, so utilization is also
+        reported across all phases.
+    """
+    def __init__(self, slot_count):
+        """
+            slot_count: number of tasks that can run at once
+        """
+        self.slot_count = slot_count
+        # Maps phase to [completed tasks, attempts, busy seconds, start, end]
+        self.phases = OrderedDict()
+
+    def add(self, phase, start_time, end_time, succeeded=True):
+        """ Records a task attempt.
+
+            phase: name of phase to which task belongs
+            start_time: when attempt started, in seconds since the epoch
+            end_time: when attempt finished, in seconds since the epoch
+            succeeded: True iff attempt succeeded
+
+            No return value.
+        """
+        try:
+            stats = self.phases[phase]
+        except KeyError:
+            stats = self.phases[phase] = [0, 0, 0.0, start_time, end_time]
+        if succeeded:
+            stats[0] += 1
+        stats[1] += 1
+        stats[2] += end_time - start_time
+        stats[3] = min(stats[3], start_time)
+        stats[4] = max(stats[4], end_time)
+
+    def messages(self):
+        """ Summarizes utilization of each phase and of the whole job.
+
+            Return value: list of strings, one per phase and one for the job,
+                or an empty list if no task attempts were recorded
+        """
+        if not self.phases:
+            return []
+        messages = []
+        def utilization(busy, start, end):
+            if end <= start:
+                return 100.0
+            return min(100. * busy / ((end - start) * self.slot_count), 100.)
+        for phase, (completed, attempts, busy, start, end) \
+                in self.phases.items():
+            messages.append(
+                    ('    Utilization of %s phase: %.1f%% of %s over '
+                     '%.2f s (%s, %s)') % (
+                        phase, utilization(busy, start, end),
+                        dp_iface.inflected(self.slot_count, 'slot'),
+                        end - start,
+                        dp_iface.inflected(completed, 'task'),
+                        dp_iface.inflected(attempts, 'attempt')
+                    )
+                )
+        busy = sum([stats[2] for stats in self.phases.values()])
+        start = min([stats[3] for stats in self.phases.values()])
+        end = max([stats[4] for stats in self.phases.values()])
+        messages.append(
+                '    Utilization across phases: %.1f%% over %.2f s' % (
+                    utilization(busy, start, end), end - start
+                )
+            )
+        return messages
+
+class InputGrouper(object):
+    """ Groups output files of upstream tasks into inputs of partitioning
+        tasks as the upstream tasks complete.
+
+        Groups have the size run_simulation() has always used when
+        partitioning a finished phase: one file if there are no more files
+        than slots, and otherwise the number of files divided by the number
+        of slots.
+    """
+    def __init__(self, expected_count, slot_count):
+        """
+            expected_count: number of files expected from upstream tasks
+            slot_count: number of tasks that can run at once
+        """
+        self.expected_count = expected_count
+        self.slot_count = slot_count
+        self.seen_count = 0
+        self.pending = []
+        self.group_count = 0
+
+    def _group_size(self):
+        if self.expected_count > self.slot_count:
+            return self.expected_count / self.slot_count
+        return 1
+
+    def expect(self, count):
+        """ Adjusts the number of files expected from upstream tasks.
+
+            count: number of files to add to expected count; may be negative
+
+            No return value.
+        """
+        self.expected_count += count
+
+    def add(self, input_files, seen_count=None):
+        """ Adds output files of completed upstream tasks.
+
+            input_files: list of output files; may be empty if a task
+                produced no output
+            seen_count: number of expected files accounted for by
+                input_files, or None if it's the length of input_files.
+                An upstream task that writes no output accounts for one
+                expected file.
+
+            Return value: list of tuples (group number, list of files), one
+                for each group that is ready for partitioning
+        """
+        self.seen_count += (len(input_files) if seen_count is None
+                                else seen_count)
+        self.pending.extend(input_files)
+        group_size = self._group_size()
+        groups = []
+        while len(self.pending) >= group_size:
+            groups.append(self.pending[:group_size])
+            self.pending = self.pending[group_size:]
+        if self.seen_count >= self.expected_count and self.pending:
+            groups.append(self.pending)
+            self.pending = []
+        return self._numbered(groups)
+
+    def remaining(self):
+        """ Returns the files that have not yet been placed in a group.
+
+            Return value: list of tuples (group number, list of files)
+        """
+        groups = [self.pending] if self.pending else []
+        self.pending = []
+        return self._numbered(groups)
+
+    def _numbered(self, groups):
+        numbered = []
+        for group in groups:
+            numbered.append((self.group_count, group))
+            self.group_count += 1
+        return numbered
+
+# Minimum number of seconds a task must run before it's duplicated
+_speculation_min_seconds = 10.0
+
+def task_input_size(task_function, task_function_arg):
+    """ Measures input to a task in bytes.
+
+        task_function: function to execute
+        task_function_arg: list of task_function's arguments, excluding
+            attempt number
+
+        Return value: total size of input files of a task of
+            step_runner_with_error_return() or presorted_tasks(); 0 for tasks
+            of any other function
+    """
+    if task_function is step_runner_with_error_return:
+        input_files = glob.glob(task_function_arg[1])
+    elif task_function is presorted_tasks:
+        input_files = task_function_arg[0]
+    else:
+        return 0
+    input_size = 0
+    for input_file in input_files:
+        try:
+            input_size += os.path.getsize(input_file)
+        except OSError:
+            pass
+    return input_size
+
+def attempt_task_arg(task_function_arg, attempt_number):
+    """ Redirects output of an attempt at a task of
+        step_runner_with_error_return() to a directory of its own.
+
+        Any attempt at a task that may be duplicated speculatively writes to
+        its own directory, whose contents are moved into the task's output
+        directory with published_attempt() only if the attempt is the first
+        to succeed.
+
+        task_function_arg: list of step_runner_with_error_return()'s
+            arguments, excluding attempt number
+        attempt_number: attempt number
+
+        Return value: tuple (copy of task_function_arg writing to attempt
+            directory, attempt directory)
+    """
+    output_dir, task_id = task_function_arg[2], task_function_arg[5]
+    attempt_dir = os.path.join(
+            output_dir, 'dp.attempt.%d.%d' % (task_id, attempt_number)
+        )
+    try:
+        os.makedirs(attempt_dir)
+    except OSError:
+        if not os.path.isdir(attempt_dir):
+            raise
+    return (task_function_arg[:2] + [attempt_dir] + task_function_arg[3:],
+                attempt_dir)
+
+def published_attempt(attempt_dir, output_dir):
+    """ Moves output of an attempt into a task's output directory.
+
+        Every file is renamed into place, so a reader of output_dir sees
+        either no file or the complete file.
+
+        attempt_dir: attempt directory returned by attempt_task_arg()
+        output_dir: task's output directory
+
+        No return value.
+    """
+    for root, _, filenames in os.walk(attempt_dir):
+        if not filenames: continue
+        destination = os.path.normpath(
+                os.path.join(output_dir, os.path.relpath(root, attempt_dir))
+            )
+        try:
+            os.makedirs(destination)
+        except OSError:
+            # Directory already exists
+            pass
+        for filename in filenames:
+            os.rename(os.path.join(root, filename),
+                        os.path.join(destination, filename))
+    shutil.rmtree(attempt_dir, ignore_errors=True)
+
+def discarded_attempt(attempt_dir):
+    """ Deletes output of an attempt that lost to another attempt or failed.
+
+        The attempt directory is first renamed so that no part of it can be
+        mistaken for output, even if the attempt is still running.
+
+        attempt_dir: attempt directory returned by attempt_task_arg()
+
+        No return value.
+    """
+    discarded_dir = attempt_dir + '.discarded'
+    try:
+        os.rename(attempt_dir, discarded_dir)
+    except OSError:
+        # Attempt directory is gone or was already discarded
+        pass
+    shutil.rmtree(discarded_dir, ignore_errors=True)
+    shutil.rmtree(attempt_dir, ignore_errors=True)
+
+class TaskQueue(object):
+    """ Holds tasks of a job that are waiting for slots and decides which
+        running tasks to duplicate speculatively.
+
+        Tasks are handed out largest input first: a slot that frees up takes
+        the biggest waiting task it may run, so the likeliest stragglers
+        start early and small tasks fill in behind them. Once no task is
+        waiting, a task that has run for longer than both
+        _speculation_min_seconds and speculation_factor times the median
+        duration of successful attempts in its phase is a straggler; a
+        duplicate of it may be started, and the first copy to finish wins.
+
+        Tasks are lists whose second item is the task's unique index, as in
+        the schedulers of run_simulation().
+    """
+    def __init__(self, speculation_factor=0):
+        """
+            speculation_factor: how many times the median duration of its
+                phase's successful attempts a task must run before it is
+                duplicated; 0 or None disables speculation
+        """
+        self.speculation_factor = speculation_factor
+        self._heap = []
+        # Maps phase to sorted durations of successful attempts
+        self._durations = defaultdict(list)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, task, size):
+        """ Adds a task to the queue.
+
+            task: task list
+            size: size of task's input in bytes
+
+            No return value.
+        """
+        heapq.heappush(self._heap, (-size, task[1], task))
+
+    def pop(self, assignable=None):
+        """ Removes the largest waiting task that may be assigned.
+
+            assignable: function that takes a task and returns True iff the
+                task may be assigned now, or None if any task may be
+
+            Return value: task, or None if no waiting task is assignable
+        """
+        if assignable is None:
+            if self._heap:
+                return heapq.heappop(self._heap)[2]
+            return None
+        for entry in sorted(self._heap):
+            if assignable(entry[2]):
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                return entry[2]
+        return None
+
+    def record(self, phase, duration):
+        """ Records the duration of a successful attempt.
+
+            phase: name of phase to which task belongs
+            duration: number of seconds attempt took
+
+            No return value.
+        """
+        bisect.insort(self._durations[phase], duration)
+
+    def straggler(self, running, now):
+        """ Finds the running task most in need of a speculative duplicate.
+
+            running: dictionary mapping indexes of candidate tasks to tuples
+                (phase, time a copy of the task was started, in seconds
+                since the epoch)
+            now: current time in seconds since the epoch
+
+            Return value: index of task to duplicate or None if there is
+                none
+        """
+        if not self.speculation_factor:
+            return None
+        straggler, longest = None, 0
+        for task, (phase, start_time) in running.items():
+            durations = self._durations[phase]
+            if not durations:
+                continue
+            elapsed = now - start_time
+            if elapsed >= _speculation_min_seconds and elapsed > longest \
+                and elapsed > (self.speculation_factor
+                                * durations[len(durations) / 2]):
+                straggler, longest = task, elapsed
+        return straggler
+
+def keyed_outputs(output_stream, separator):
+    """ Splits a step's output by the key before its first field.
+
+        Output may be lines or binary records (see records.py); the stream is
+        read a few bytes ahead to tell which. The key of a record is its
+        first field, which must be a string, and the rest of the record is
+        rewritten as a record without it.
+
+        output_stream: file object with output of a step
+        separator: separator between successive fields from a line
+
+        Return value: tuple (generator of tuples (key, line or record without
+            key), string with which to start each file of output: the magic
+            marker if output is binary records, otherwise empty)
+    """
+    import records
+    start = output_stream.read(len(records.magic))
+    if records.is_record_stream(start):
+        def keyed_records():
+            field_offsets, framed = records.field_offsets, records.framed
+            for body in records.stream_bodies(output_stream):
+                key_end = field_offsets(body, 1)[-1]
+                key = records.decoded(body[:key_end])
+                if not key or not isinstance(key[0], str):
+                    raise ValueError('First field of a record must be a '
+                                     'string to divide output by key.')
+                yield key[0], framed(body[key_end:])
+        return keyed_records(), records.magic
+    def keyed_lines():
+        if start:
+            head = (start + output_stream.readline()).split('\n')
+            for line in head[:-1]:
+                key, _, line_to_write = line.partition(separator)
+                yield key, line_to_write + '\n'
+            if head[-1]:
+                key, _, line_to_write = head[-1].partition(separator)
+                yield key, line_to_write
+        for line in output_stream:
+            key, _, line_to_write = line.partition(separator)
+            yield key, line_to_write
+    return keyed_lines(), ''
+
 def counter_cmd(outfn):
     return ("grep '^reporter:counter:' | "
             "sed 's/.*://' | "
@@ -451,7 +1505,8 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
                                   separator, sort_options, memcap,
                                   gzip=False, gzip_level=3, scratch=None,
                                   direct_write=False, sort='sort',
-                                  dir_to_path=None, attempt_number=None):
+                                  dir_to_path=None, merge='native',
+                                  attempt_number=None):
     """ Runs a streaming command on a task, segregating multiple outputs. 
 
         streaming_command: streaming command to run.
@@ -470,8 +1525,8 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
         separator: character separating successive fields in a line from
             input_file.
         sort_options: None if no sort should be performed on input_glob;
-            otherwise, performs merge sort with unix sort -m and the
-            specified string of command-line parameters. EACH INPUT FILE
+            otherwise, performs merge sort with the specified string of
+            command-line parameters; see merge below. EACH INPUT FILE
             SHOULD BE PRESORTED.
         memcap: maximum percent of memory to use per UNIX sort instance.
         gzip: True iff all files written should be gzipped; else False.
@@ -483,6 +1538,11 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
             no matter what scratch is.
         sort: path to sort executable.
         dir_to_path: path to add to PATH.
+        merge: 'native' if a reducer's input files should be merged in-process
+            with merged_lines() and written to the streaming command's stdin;
+            'sort' if they should be merged with UNIX sort -m, which requires
+            a gzip process per input file when gzip is True. Binary records
+            (see records.py) are always merged natively.
         attempt_number: attempt number of current task or None if no retries.
             MUST BE FINAL ARG to be compatible with 
             execute_balanced_job_with_retries().
@@ -527,6 +1587,7 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
         if not input_files:
             # No input!
             return None
+        merge_feeder = None
         if sort_options is None:
             # Mapper. Check if first input file is gzip'd
             with open(input_files[0], 'rb') as binary_input_stream:
@@ -535,6 +1596,9 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
                     prefix = 'gzip -cd %s' % input_glob
                 else:
                     prefix = 'cat %s' % input_glob
+        elif merge == 'native' or binary_input(input_files):
+            # Reducer. Merge sort the input glob in a thread
+            prefix = None
         else:
             # Reducer. Merge sort the input glob.
             if gzip:
@@ -574,9 +1638,11 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
         if multiple_outputs:
             # Must grab each line of output and separate by directory
             command_to_run \
-                = prefix + ' | ' + streaming_command + (
+                = streaming_command + (
                         ' 2> >(tee %s | %s)'
                     ) % (err_file, counter_cmd(counter_file))
+            if prefix is not None:
+                command_to_run = prefix + ' | ' + command_to_run
             # Need bash or zsh for process substitution
             multiple_output_process = subprocess.Popen(
                     ' '.join([('set -eo pipefail; cd %s;' % dir_to_path)
@@ -584,17 +1650,25 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
                                 else 'set -eo pipefail;',
                               command_to_run]),
                     shell=True,
+                    stdin=(subprocess.PIPE if prefix is None else None),
                     stdout=subprocess.PIPE,
                     stderr=open(os.devnull, 'w'),
                     env=new_env,
                     bufsize=-1,
                     executable='/bin/bash'
                 )
+            if prefix is None:
+                merge_feeder = MergeFeeder(input_files, sort_options,
+                                            separator,
+                                            multiple_output_process.stdin)
+                merge_feeder.start()
             task_file_streams = {}
             if gzip:
                 task_file_stream_processes = {}
-            for line in multiple_output_process.stdout:
-                key, _, line_to_write = line.partition(separator)
+            keyed_output, file_header = keyed_outputs(
+                    multiple_output_process.stdout, separator
+                )
+            for key, line_to_write in keyed_output:
                 try:
                     task_file_streams[key].write(line_to_write)
                 except KeyError:
@@ -618,11 +1692,17 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
                         task_file_streams[key] = open(
                                 os.path.join(key_dir, str(task_id)), 'w'
                             )
+                    task_file_streams[key].write(file_header)
                     task_file_streams[key].write(line_to_write)
             multiple_output_process_return = multiple_output_process.wait()
             if multiple_output_process_return != 0:
                 return (('Streaming command "%s" failed; exit level was %d.')
                          % (command_to_run, multiple_output_process_return))
+            if merge_feeder is not None:
+                merge_feeder.join()
+                if merge_feeder.error is not None:
+                    return ('Error\n\n%s\nencountered merging input %s.'
+                            % (merge_feeder.error, input_glob))
             for key in task_file_streams:
                 task_file_streams[key].close()
         else:
@@ -631,7 +1711,7 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
                                 os.path.join(output_dir, str(task_id) + '.gz')
                             )
                 command_to_run \
-                    = prefix + ' | ' + streaming_command + (
+                    = streaming_command + (
                             ' 2> >(tee %s | %s) | gzip -%d >%s'
                                 % (err_file,
                                     counter_cmd(counter_file),
@@ -643,26 +1723,43 @@ def step_runner_with_error_return(streaming_command, input_glob, output_dir,
                                 os.path.join(output_dir, str(task_id))
                             )
                 command_to_run \
-                    = prefix + ' | ' + streaming_command + (
+                    = streaming_command + (
                         ' >%s 2> >(tee %s | %s)'
                                             % (out_file,
                                             err_file,
                                             counter_cmd(counter_file)))
-            try:
-                # Need bash or zsh for process substitution
-                subprocess.check_output(' '.join([('set -eo pipefail; cd %s;'
+            if prefix is not None:
+                command_to_run = prefix + ' | ' + command_to_run
+            # Need bash or zsh for process substitution
+            step_process = subprocess.Popen(' '.join([
+                                                ('set -eo pipefail; cd %s;'
                                                     % dir_to_path)
                                                     if dir_to_path is not None
                                                     else 'set -eo pipefail;',
-                                                  command_to_run]),
+                                                command_to_run]),
                                             shell=True,
                                             env=new_env,
                                             bufsize=-1,
+                                            stdin=(subprocess.PIPE
+                                                    if prefix is None
+                                                    else None),
+                                            stdout=subprocess.PIPE,
                                             stderr=subprocess.STDOUT,
                                             executable='/bin/bash')
-            except subprocess.CalledProcessError as e:
+            if prefix is None:
+                merge_feeder = MergeFeeder(input_files, sort_options,
+                                            separator, step_process.stdin)
+                merge_feeder.start()
+            step_process.stdout.read()
+            step_process_return = step_process.wait()
+            if step_process_return != 0:
                 return (('Streaming command "%s" failed; exit level was %d.')
-                         % (command_to_run, e.returncode))
+                         % (command_to_run, step_process_return))
+            if merge_feeder is not None:
+                merge_feeder.join()
+                if merge_feeder.error is not None:
+                    return ('Error\n\n%s\nencountered merging input %s.'
+                            % (merge_feeder.error, input_glob))
         return None
     except Exception as e:
         # Uncaught miscellaneous exception
@@ -700,7 +1797,9 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                     log, gzip=False, gzip_level=3, ipy=False,
                     ipcontroller_json=None, ipy_profile=None, scratch=None,
                     common=None, sort='sort', max_attempts=4,
-                    direct_write=False):
+                    direct_write=False, partition_hash='crc32',
+                    merge='native', sorted_runs=False, pipelining=True,
+                    speculation_factor=0, workers=None):
     """ Runs Hadoop Streaming simulation.
 
         FUNCTIONALITY IS IDIOSYNCRATIC; it is currently confined to those
@@ -740,6 +1839,24 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
         max_attempts: maximum number of times to attempt a task in ipy mode.
         direct_write: always writes intermediate files directly to final
             destination, even when scratch is specified
+        partition_hash: 'crc32' or 'md5'; hash function for assigning keys
+            to reduce tasks
+        merge: 'native' or 'sort'; how to merge presorted inputs to a reduce
+            task
+        sorted_runs: True iff map output should be written as sorted runs
+            while it is partitioned rather than sorted in a second pass
+        pipelining: True iff tasks of a phase should be started as soon as
+            the upstream tasks whose output they consume are complete rather
+            than after the whole upstream phase is complete
+        speculation_factor: a map or reduce task that has run for longer
+            than this many times the median duration of successful attempts
+            in its phase is duplicated when a slot is idle, and the first copy
+            to finish wins; 0 disables speculative execution. Attempts
+            are kept apart only in what they write to stdout, so a task that
+            writes files of its own must not be speculated.
+        workers: list of host:port addresses of worker daemons to which tasks
+            are sent; None if tasks are run by ipy engines or local
+            processes. See executor.py.
 
         No return value.
     """
@@ -748,6 +1865,7 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
     import os
     import tempfile
     import glob
+    import threading
     if log is not None:
         try:
             os.makedirs(os.path.dirname(log))
@@ -763,7 +1881,7 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                                          log_stream=log_stream)
     failed = False
     try:
-        # Using IPython Parallel?
+        # Choose executor; IPython Parallel?
         if ipy:
             try:
                 from ipyparallel import Client
@@ -779,7 +1897,7 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                 raise
             if ipy_profile:
                 try:
-                    pool = Client(profile=ipy_profile)
+                    client = Client(profile=ipy_profile)
                 except ValueError:
                     iface.fail('Cluster configuration profile "%s" was not '
                                'found.' % ipy_profile)
@@ -787,7 +1905,7 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                     raise
             elif ipcontroller_json:
                 try:
-                    pool = Client(ipcontroller_json)
+                    client = Client(ipcontroller_json)
                 except IOError:
                     iface.fail(
                             'Cannot find connection information JSON file %s.'
@@ -797,7 +1915,7 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                     raise
             else:
                 try:
-                    pool = Client()
+                    client = Client()
                 except IOError:
                     iface.fail(
                             'Cannot find ipcontroller-client.json. Ensure '
@@ -811,236 +1929,302 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                         )
                     failed = True
                     raise
-            if not pool.ids:
+            if not client.ids:
                 iface.fail(
                         'An IPython Parallel controller is running, but no '
                         'engines are connected to it.'
                     )
                 failed = True
                 raise RuntimeError
-            # Use all engines
-            num_processes = len(pool)
-            all_engines = set(pool.ids)
-            from tools import apply_async_with_errors
-            direct_view = pool[:]
-            # Use Dill to permit general serializing
-            try:
-                import dill
-            except ImportError:
-                raise RuntimeError(
-                        'Dooplicity requires Dill. Install it by running '
-                        '"pip install dill", or see the StackOverflow '
-                        'question http://stackoverflow.com/questions/23576969/'
-                        'how-to-install-dill-in-ipython for other leads.'
-                    )
-            else:
-                direct_view.use_dill()
             iface.status('Loading dependencies on IPython Parallel engines...')
-            with direct_view.sync_imports(quiet=True):
-                import subprocess
-                import glob
-                import hashlib
-                import tempfile
-                import shutil
-                import os
-            direct_view.push(dict(
+            pool = IPythonExecutor(client, dict(
                     yopen=yopen,
                     step_runner_with_error_return=\
                         step_runner_with_error_return,
                     presorted_tasks=presorted_tasks,
+                    parsed_key_options=parsed_key_options,
                     parsed_keys=parsed_keys,
+                    partition_key_extractor=partition_key_extractor,
+                    task_assigner=task_assigner,
+                    gzip_into=gzip_into,
+                    _partition_batch_size=_partition_batch_size,
+                    _partition_write_buffer_size=\
+                        _partition_write_buffer_size,
+                    _Descending=_Descending,
+                    numeric_sort_key=numeric_sort_key,
+                    sort_key_function=sort_key_function,
+                    input_lines=input_lines,
+                    merged_lines=merged_lines,
+                    input_chunks=input_chunks,
+                    key_hasher=key_hasher,
+                    record_task_assigner=record_task_assigner,
+                    records_sortable=records_sortable,
+                    binary_input=binary_input,
+                    record_batches=record_batches,
+                    keyed_outputs=keyed_outputs,
+                    MergeFeeder=MergeFeeder,
+                    write_sorted_run=write_sorted_run,
+                    timed_task=timed_task,
+                    spawned=spawned,
+                    _merge_readahead=_merge_readahead,
                     counter_cmd=counter_cmd
                 ))
             iface.step('Loaded dependencies on IPython Parallel engines.')
-            # Get host-to-engine and engine pids relations
-            current_hostname = socket.gethostname()
-            host_map = apply_async_with_errors(
-                                    pool, all_engines, socket.gethostname,
-                                    dict_format=True
-                                )
-            engine_map = defaultdict(list)
-            for engine in host_map:
-                engine_map[host_map[engine]].append(engine)
-            pid_map = apply_async_with_errors(
-                                    pool, all_engines, os.getpid,
-                                    dict_format=True
-                                )
-            def interrupt_engines(pool, iface):
-                """ Interrupts IPython Parallel engines spanned by view
+        elif workers:
+            iface.status('Connecting to worker daemons...')
+            try:
+                pool = SocketExecutor(workers)
+            except (socket.error, ValueError, EOFError,
+                    AuthenticationError) as e:
+                iface.fail(('Error "%s" encountered connecting to worker '
+                            'daemons at %s. Ensure that each is running '
+                            '"python executor.py --host <address> '
+                            '--port <port>" and that DOOPLICITY_AUTHKEY is '
+                            'the same here as there.')
+                            % (e, ', '.join(workers)))
+                failed = True
+                raise
+            iface.step('Connected to %s.'
+                        % dp_iface.inflected(len(pool), 'worker daemon'))
+        else:
+            pool = ProcessPoolExecutor(num_processes, init_worker)
+        # Use all slots
+        num_processes = len(pool)
+        all_engines = set(pool.ids)
+        distributed = ipy or bool(workers)
+        from tools import apply_async_with_errors
+        # Get host-to-engine and engine pids relations
+        current_hostname = socket.gethostname()
+        host_map, engine_map, pid_map = (
+                pool.host_map, pool.engine_map, pool.pid_map
+            )
+        import random
+        def execute_balanced_job_with_retries(pool, iface,
+            task_function, task_function_args,
+            status_message='Tasks completed',
+            finish_message='Completed tasks.', max_attempts=4,
+            phase='tasks', follow_up=None):
+            """ Executes parallel job over an executor's slots.
 
-                    Taken from:
-                    http://mail.scipy.org/pipermail/ipython-dev/
-                    2014-March/013426.html
+                Tasks are assigned to free slots as they become available,
+                largest input first. If a task fails on one slot, it is
+                retried on another slot and, after two failures, on another
+                host, unless it has failed on every slot or host, in which
+                case it is retried anywhere. max_attempts-1 failures are
+                permitted per task. When no task is waiting, a straggler may
+                be duplicated on an idle slot, preferably on another host;
+                see TaskQueue.
 
-                    pool: IPython Parallel Client object
-                    iface: instance of DooplicityInterface
+                pool: executor object; all slots it spans are used
+                iface: DooplicityInterface object for spewing log messages
+                    to console
+                task_function: name if function to execute
+                task_function_args: iterable of lists, each of whose
+                    items are task_function's arguments, WITH THE EXCEPTION
+                    OF A SINGLE KEYWORD ARGUMENT "attempt_count". This
+                    argument must be the final keyword argument of the
+                    function but _excluded_ from the arguments in any item
+                    of task_function_args.
+                status_message: status message about tasks completed
+                finish_message: message to output when all tasks are
+                    completed
+                max_attempts: max number of times to attempt any given
+                    task
+                phase: name of phase comprising the tasks in
+                    task_function_args; utilization is reported by phase
+                    when the job is complete
+                follow_up: None or function that takes the phase and
+                    task_function_arg of a task that just succeeded and
+                    returns a list of tuples (task function,
+                    task function arg, phase), one for each task to add to
+                    the job
 
-                    No return value.
-                """
-                iface.status('Interrupting IPython Parallel engines...')
-                for engine_id in pool.ids:
-                    host = host_map[engine_id]
-                    kill_command = (
-                          'CPIDS=$(pgrep -P {}); echo $CPIDS;'
-                          '(sleep 33 && kill -9 $CPIDS &); '
-                          'kill -9 $CPIDS'
-                        ).format(pid_map[engine_id])
-                    if host == socket.gethostname():
-                        pass
-                        # local
-                        #subprocess.Popen(kill_command,
-                        #        bufsize=-1, shell=True
-                        #    )
-                    else:
-                        #subprocess.Popen(
-                        #    ('ssh -oStrictHostKeyChecking=no '
-                        #     '-oBatchMode=yes {} \'{}\'').format(
-                        #        host, kill_command
-                        #    ), bufsize=-1, shell=True
-                        #)
-                        pass
-            import random
-            def execute_balanced_job_with_retries(pool, iface,
-                task_function, task_function_args,
-                status_message='Tasks completed',
-                finish_message='Completed tasks.', max_attempts=4):
-                """ Executes parallel job over IPython Parallel engines.
-
-                    Tasks are assigned to free engines as they become
-                    available. If a task fails on one engine, it is retried on
-                    another engine. If a task has been tried on all engines but
-                    fails before max_attempts is exceeded, the step is failed.
-
-                    pool: IPython Parallel Client object; all engines it spans
-                        are used
-                    iface: DooplicityInterface object for spewing log messages
-                        to console
-                    task_function: name if function to execute
-                    task_function_args: iterable of lists, each of whose
-                        items are task_function's arguments, WITH THE EXCEPTION
-                        OF A SINGLE KEYWORD ARGUMENT "attempt_count". This
-                        argument must be the final keyword argument of the
-                        function but _excluded_ from the arguments in any item
-                        of task_function_args.
-                    status_message: status message about tasks completed
-                    finish_message: message to output when all tasks are
-                        completed
-                    max_attempts: max number of times to attempt any given
-                        task
-
-                    No return value.
+                No return value.
+            """
+            global failed
+            random.seed(pool.ids[-1])
+            used_engines, free_engines = set(), set(pool.ids)
+            completed_tasks = 0
+            queue = TaskQueue(speculation_factor)
+            # Maps indexes of unfinished tasks to tasks
+            tasks = {}
+            for i, task_function_arg in enumerate(task_function_args):
+                tasks[i] = [task_function_arg, i, [], task_function, phase]
+                queue.push(tasks[i],
+                           task_input_size(task_function, task_function_arg))
+            task_count = len(tasks)
+            '''Maps (task index, attempt number) to [AsyncResult, start
+            time, attempt directory or None, task, engine] for running
+            attempts.'''
+            attempts = {}
+            speculated = set()
+            max_task_fails = 0
+            utilization = PhaseUtilization(num_processes)
+            def allowed_engines(task, spread=False):
+                """ Finds free engines on which a task may be attempted.
+
+                    task: task
+                    spread: True iff no engine on a host where task was
+                        attempted is allowed
+
+                    Return value: set of allowed engines
                 """
-                global failed
-                random.seed(pool.ids[-1])
-                used_engines, free_engines = set(), set(pool.ids)
-                completed_tasks = 0
-                tasks_to_assign = deque([
-                        [task_function_arg, i, []] for i, task_function_arg
-                        in enumerate(task_function_args)
-                    ])
-                task_count = len(tasks_to_assign)
-                assigned_tasks, asyncresults = {}, {}
-                max_task_fails = 0
-                iface.status(('    %s: '
-                              '%d/%d | \\max_i (task_i fails): %d/%d')
-                                % (status_message, completed_tasks,
-                                    task_count, max_task_fails,
-                                    max_attempts - 1))
-                while completed_tasks < task_count:
-                    if tasks_to_assign:
-                        task_to_assign = tasks_to_assign.popleft()
-                        forbidden_engines = set(task_to_assign[2])
-                        if len(forbidden_engines) >= 2:
-                            # After two fails, do not allow reused nodes
-                            for forbidden_engine in task_to_assign[2]:
-                                forbidden_engines.update(
-                                    engine_map[host_map[forbidden_engine]]
+                forbidden = set(task[2])
+                if spread or len(forbidden) >= 2:
+                    # After two fails, do not allow reused nodes
+                    for forbidden_engine in task[2]:
+                        forbidden.update(
+                            engine_map[host_map[forbidden_engine]]
+                        )
+                if not spread and all_engines <= forbidden:
+                    # Task was tried everywhere; try it anywhere
+                    return set(free_engines)
+                return free_engines - forbidden
+            def launch(task, engine):
+                """ Starts an attempt at a task on an engine. """
+                attempt_number = len(task[2])
+                task[2].append(engine)
+                task_function_arg, attempt_dir = task[0], None
+                if speculation_factor \
+                    and task[3] is step_runner_with_error_return:
+                    task_function_arg, attempt_dir = attempt_task_arg(
+                            task_function_arg, attempt_number
+                        )
+                attempts[(task[1], attempt_number)] = [
+                        pool.apply_async(
+                                engine, timed_task, task[3],
+                                *(task_function_arg + [attempt_number])
+                            ), time.time(), attempt_dir, task, engine
+                    ]
+                used_engines.add(engine)
+                free_engines.remove(engine)
+            def report_status():
+                iface.status(('    %s: %d/%d%s')
+                                % (status_message, completed_tasks, task_count,
+                                     (' | \\max_i (task_i fails): %d/%d'
+                                       % (max_task_fails,
+                                            max_attempts - 1)
+                                       if max_attempts > 1 else '')))
+            report_status()
+            while completed_tasks < task_count:
+                while free_engines:
+                    # Free engines take largest tasks they may run
+                    task = queue.pop(allowed_engines)
+                    if task is None:
+                        break
+                    launch(task, random.choice(list(allowed_engines(task))))
+                if not queue and free_engines:
+                    # An engine is idle; duplicate a straggler
+                    candidates = {}
+                    for (task, _), (_, start_time, attempt_dir, _, _) \
+                            in attempts.items():
+                        if attempt_dir is not None \
+                            and task not in speculated \
+                            and len(tasks[task][2]) < max_attempts:
+                            candidates[task] = (tasks[task][4], start_time)
+                    straggler = queue.straggler(candidates, time.time())
+                    if straggler is not None:
+                        # Prefer a host other than the straggler's
+                        engines = (allowed_engines(tasks[straggler],
+                                                   spread=True)
+                                    or allowed_engines(tasks[straggler]))
+                        if engines:
+                            speculated.add(straggler)
+                            launch(tasks[straggler],
+                                    random.choice(list(engines)))
+                for attempt in attempts.keys():
+                    if not attempts[attempt][0].ready():
+                        continue
+                    asyncresult, start_time, attempt_dir, task, engine \
+                        = attempts.pop(attempt)
+                    # Free engine
+                    used_engines.remove(engine)
+                    free_engines.add(engine)
+                    try:
+                        return_value, start_time, end_time \
+                            = asyncresult.get()
+                    except Exception as e:
+                        # Attempt never ran to completion, e.g. worker died
+                        return_value = ('Error "%s" encountered running '
+                                        'task on engine %d.') % (e, engine)
+                        end_time = time.time()
+                    utilization.add(task[4], start_time, end_time,
+                                    return_value is None)
+                    if task[1] not in tasks:
+                        # Another copy of the task won
+                        if attempt_dir is not None:
+                            discarded_attempt(attempt_dir)
+                        continue
+                    other_copies = [other for other in attempts
+                                        if other[0] == task[1]]
+                    if return_value is not None:
+                        if attempt_dir is not None:
+                            discarded_attempt(attempt_dir)
+                        if other_copies:
+                            # Another copy of the task is still running
+                            continue
+                        if max_attempts > len(task[2]):
+                            # Add to queue for reattempt
+                            queue.push(task,
+                                       task_input_size(task[3], task[0]))
+                            max_task_fails = max(
+                                    len(task[2]),
+                                    max_task_fails
                                 )
-                        if all_engines <= forbidden_engines:
-                            iface.fail(('No more running IPython Parallel '
-                                        'engines and/or nodes on which '
-                                        'function-arg combo (%s, %s) has not '
-                                        'failed attempt to execute. Check the '
-                                        'IPython Parallel cluster\'s '
-                                        'integrity and resource availability.')
-                                         % (task_function, task_to_assign[0]),
-                                         steps=(job_flow[step_number:]
-                                            if step_number != 0 else None))
+                        else:
+                            # Bail if max_attempts is saturated
+                            iface.fail(return_value,
+                            steps=(job_flow[step_number:]
+                                    if step_number != 0 else None))
                             failed = True
                             raise RuntimeError
-                        try:
-                            assigned_engine = random.choice(
-                                    list(free_engines - forbidden_engines)
-                                )
-                        except IndexError:
-                            # No engine to assign yet; add back to queue
-                            tasks_to_assign.append(task_to_assign)
-                        else:
-                            asyncresults[task_to_assign[1]] = (
-                                pool[assigned_engine].apply_async(
-                                    task_function,
-                                    *(task_to_assign[0] +
-                                      [len(task_to_assign[2])])
-                                )
-                            )
-                            assigned_tasks[task_to_assign[1]] = [
-                                    task_to_assign[0], task_to_assign[1],
-                                    task_to_assign[2] + [assigned_engine]
-                                ]
-                            used_engines.add(assigned_engine)
-                            free_engines.remove(assigned_engine)
-                    asyncresults_to_remove = []
-                    for task in asyncresults:
-                        if asyncresults[task].ready():
-                            return_value = asyncresults[task].get()
-                            if return_value is not None:
-                                if max_attempts > len(assigned_tasks[task][2]):
-                                    # Add to queue for reattempt
-                                    tasks_to_assign.append(
-                                            assigned_tasks[task]
-                                        )
-                                    max_task_fails = max(
-                                            len(assigned_tasks[task][2]),
-                                            max_task_fails
-                                        )
-                                    asyncresults_to_remove.append(task)
-                                else:
-                                    # Bail if max_attempts is saturated
-                                    iface.fail(return_value,
-                                    steps=(job_flow[step_number:]
-                                            if step_number != 0 else None))
-                                    failed = True
-                                    raise RuntimeError
-                            else:
-                                # Success
-                                completed_tasks += 1
-                                asyncresults_to_remove.append(task)
-                            iface.status(('    %s: '
-                                          '%d/%d | '
-                                          '\\max_i (task_i fails): '
-                                          '%d/%d')
-                                % (status_message, completed_tasks,
-                                    task_count, max_task_fails,
-                                    max_attempts - 1))
-                            assert assigned_tasks[task][-1][-1] == \
-                                asyncresults[task].engine_id
-                            # Free engine
-                            used_engines.remove(
-                                    assigned_tasks[task][-1][-1]
-                                )
-                            free_engines.add(assigned_tasks[task][-1][-1])
-                    for task in asyncresults_to_remove:
-                        del asyncresults[task]
-                        del assigned_tasks[task]
-                    time.sleep(0.1)
-                assert not used_engines
-                iface.step(finish_message)
+                    else:
+                        # Success; first copy to finish wins
+                        if attempt_dir is not None:
+                            published_attempt(attempt_dir, task[0][2])
+                        for other in other_copies:
+                            # Losing copy is discarded once it's stopped
+                            pool.kill(attempts[other][4])
+                        del tasks[task[1]]
+                        completed_tasks += 1
+                        queue.record(task[4], end_time - start_time)
+                        if follow_up is not None:
+                            for (new_function, new_arg,
+                                    new_phase) in follow_up(
+                                        task[4], task[0]
+                                    ):
+                                tasks[task_count] = [
+                                        new_arg, task_count, [],
+                                        new_function, new_phase
+                                    ]
+                                queue.push(tasks[task_count],
+                                           task_input_size(new_function,
+                                                           new_arg))
+                                task_count += 1
+                    report_status()
+                pool.wait(0.1)
+            while attempts:
+                # Wait for losing copies, which were killed, to stop
+                for attempt in attempts.keys():
+                    if not attempts[attempt][0].ready():
+                        continue
+                    asyncresult, _, attempt_dir, task, engine \
+                        = attempts.pop(attempt)
+                    used_engines.remove(engine)
+                    free_engines.add(engine)
+                    if attempt_dir is not None:
+                        discarded_attempt(attempt_dir)
+                if attempts:
+                    pool.wait(0.1)
+            iface.step(finish_message)
+            for message in utilization.messages():
+                iface.step(message)
+        if distributed:
             @contextlib.contextmanager
             def cache(pool=None, file_or_archive=None, archive=True):
                 """ Places X.[tar.gz/tgz]#Y in dir Y, unpacked if archive
 
-                    pool: IPython Parallel Client object; all engines it spans
-                        are used
+                    pool: executor object; all slots it spans are used
                     archive: file in format X.tar.gz#Y; None if nothing should
                         be done
 
@@ -1208,7 +2392,7 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                         )
                 )
                 apply_async_with_errors(
-                    pool, engines_for_copying, subprocess.Popen,
+                    pool, engines_for_copying, spawned,
                     '/usr/bin/env bash %s/delscript.sh' % temp_dir, shell=True,
                     executable='/bin/bash',
                     message=(
@@ -1299,107 +2483,11 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                                      'directories.')
                         )
         else:
-            import multiprocessing
-            def execute_balanced_job_with_retries(pool, iface,
-                task_function, task_function_args,
-                status_message='Tasks completed',
-                finish_message='Completed tasks.', max_attempts=4):
-                """ Executes parallel job locally with multiprocessing module.
-
-                    Tasks are added to queue if they fail, and max_attempts-1
-                    failures are permitted per task. 
-
-                    pool: multiprocessing.Pool object
-                    iface: DooplicityInterface object for spewing log messages
-                        to console
-                    task_function: name if function to execute
-                    task_function_args: iterable of lists, each of whose
-                        items are task_function's arguments, WITH THE EXCEPTION
-                        OF A SINGLE KEYWORD ARGUMENT "attempt_count". This
-                        argument must be the final keyword argument of the
-                        function but _excluded_ from the arguments in any item
-                        of task_function_args.
-                    status_message: status message about tasks completed
-                    finish_message: message to output when all tasks are
-                        completed
-                    max_attempts: max number of times to attempt any given
-                        task
-
-                    No return value.
-                """
-                global failed
-                completed_tasks = 0
-                tasks_to_assign = deque([
-                        [task_function_arg, i, 0] for i, task_function_arg
-                        in enumerate(task_function_args)
-                    ])
-                task_count = len(tasks_to_assign)
-                assigned_tasks, asyncresults = {}, {}
-                max_task_fails = 0
-                iface.status(('    %s: %d/%d%s')
-                                % (status_message, completed_tasks, task_count,
-                                     (' | \\max_i (task_i fails): %d/%d'
-                                       % (max_task_fails,
-                                            max_attempts - 1)
-                                       if max_attempts > 1 else '')))
-                while completed_tasks < task_count:
-                    if tasks_to_assign:
-                        task_to_assign = tasks_to_assign.popleft()
-                        asyncresults[task_to_assign[1]] = (
-                                pool.apply_async(
-                                    task_function,
-                                    args=(task_to_assign[0] +
-                                            [task_to_assign[2]])
-                                )
-                            )
-                        assigned_tasks[task_to_assign[1]] = [
-                                task_to_assign[0], task_to_assign[1],
-                                task_to_assign[2] + 1
-                            ]
-                    asyncresults_to_remove = []
-                    for task in asyncresults:
-                        if asyncresults[task].ready():
-                            return_value = asyncresults[task].get()
-                            if return_value is not None:
-                                if max_attempts > assigned_tasks[task][2]:
-                                    # Add to queue for reattempt
-                                    tasks_to_assign.append(
-                                            assigned_tasks[task]
-                                        )
-                                    max_task_fails = max(
-                                            assigned_tasks[task][2],
-                                            max_task_fails
-                                        )
-                                    asyncresults_to_remove.append(task)
-                                else:
-                                    # Bail if max_attempts is saturated
-                                    iface.fail(return_value,
-                                    steps=(job_flow[step_number:]
-                                            if step_number != 0 else None))
-                                    failed = True
-                                    raise RuntimeError
-                            else:
-                                # Success
-                                completed_tasks += 1
-                                asyncresults_to_remove.append(task)
-                            iface.status(('    %s: %d/%d%s')
-                                    % (status_message, completed_tasks,
-                                        task_count,
-                                        (' | \\max_i (task_i fails): %d/%d'
-                                            % (max_task_fails,
-                                                max_attempts - 1)
-                                            if max_attempts > 1 else '')))
-                    for task in asyncresults_to_remove:
-                        del asyncresults[task]
-                        del assigned_tasks[task]
-                    time.sleep(0.1)
-                iface.step(finish_message)
             @contextlib.contextmanager
             def cache(pool=None, file_or_archive=None, archive=True):
                 """ Places X.[tar.gz/tgz]#Y in dir Y, unpacked if archive
 
-                    pool: IPython Parallel Client object; all engines it spans
-                        are used
+                    pool: executor object; all slots it spans are used
                     archive: file in format X.tar.gz#Y; False if nothing should
                         be done
 
@@ -1672,25 +2760,13 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
         # Run steps
         step_number = 0
         total_steps = len(steps)
-        if not ipy:
-            # Pool's only for if we're in local mode
-            try:
-                pool = multiprocessing.Pool(num_processes, init_worker,
-                                                maxtasksperchild=5)
-            except Exception:
-                # maxtasksperchild doesn't work, somehow? Supported only in 2.7
-                pool = multiprocessing.Pool(num_processes, init_worker)
+        '''Determine each step's phases and where its tasks write. A step
+        whose input is exactly the output of the step before it is pipelined
+        with that step: its map and partition phases are started as tasks of
+        the step before it complete rather than after they all complete.'''
+        step_plans = []
         for step in steps:
             step_data = steps[step]
-            step_inputs = []
-            # Handle multiple input files/directories
-            for input_file_or_dir in step_data['input'].split(','):
-                if os.path.isfile(input_file_or_dir):
-                    step_inputs.append(input_file_or_dir)
-                elif os.path.isdir(input_file_or_dir):
-                    step_inputs.extend(
-                            glob.glob(os.path.join(input_file_or_dir, '*'))
-                        )
             # TODO: support cacheArchives and cacheFile simultaneously
             if 'archives' in step_data or 'cacheArchive' in step_data:
                 # Prefer archives to cacheArchives
@@ -1705,222 +2781,398 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                     to_cache = step_data['cacheFile']
             else:
                 to_cache = None
-            with cache(pool if to_cache else None, to_cache,
-                        True if 'archives'
-                        in step_data else False) as dir_to_path:
-                if step_data['mapper'] not in identity_mappers:
-                    # Perform map step only if mapper isn't identity
-                    try:
-                        if ('multiple_outputs' in step_data) or \
-                            step_data['outputformat'] \
+            has_reducer = step_data['reducer'] not in identity_reducers
+            step_plans.append(dict(
+                    name=step,
+                    to_cache=to_cache,
+                    archive=('archives' in step_data),
+                    has_mapper=(step_data['mapper'] not in identity_mappers),
+                    has_reducer=has_reducer,
+                    nline_input=(
+                            step_data.get('inputformat')
+                            == 'org.apache.hadoop.mapred.lib.NLineInputFormat'
+                        ),
+                    multiple_outputs=(
+                            ('multiple_outputs' in step_data) or
+                            step_data.get('outputformat')
                             in ['edu.jhu.cs.MultipleOutputFormat',
                                 'edu.jhu.cs.'
-                                'MultipleIndexedLzoTextOutputFormat']:
-                            multiple_outputs = True
-                        else:
-                            multiple_outputs = False
-                    except KeyError:
-                        # No multiple outputs
-                        multiple_outputs = False
-                    try:
-                        if step_data['inputformat'] \
-                            == 'org.apache.hadoop.mapred.lib.NLineInputFormat':
-                            nline_input = True
-                        else:
-                            nline_input = False
-                    except KeyError:
-                        # Don't assign one line per mapper
-                        nline_input = False
-                    output_dir = step_data['output']
-                    if step_data['reducer'] not in identity_reducers:
-                        '''There's a reducer parameter, so input to reducer is
-                        output of mapper. Change output directory.'''
-                        output_dir = os.path.join(output_dir, 'dp.map')
-                        try:
-                            os.makedirs(output_dir)
-                        except OSError:
-                            if os.path.exists(output_dir):
-                                pass
-                            else:
-                                iface.fail(('Problem encountered trying to '
-                                            'create directory %s.')
-                                            % output_dir,
-                                            steps=(job_flow[step_number:]
-                                                       if step_number != 0
-                                                       else None))
-                                failed = True
-                                raise
-                        try:
-                            if ('multiple_outputs' in step_data) or \
-                                step_data['outputformat'] \
-                                in ['edu.jhu.cs.MultipleOutputFormat',
-                                    'edu.jhu.cs.'
-                                    'MultipleIndexedLzoTextOutputFormat']:
-                                # Multiple outputs apply AFTER reduce step
-                                multiple_outputs = False
-                        except KeyError:
-                            # No outputformat
-                            pass
-                    if nline_input:
-                        # Create temporary input files
-                        split_input_dir = make_temp_dir(common)
-                        input_files = []
-                        try:
-                            with open(step_inputs[0]) as nline_stream:
-                                for i, line in enumerate(nline_stream):
-                                    offset = str(i)
-                                    input_files.append(os.path.join(
+                                'MultipleIndexedLzoTextOutputFormat']
+                        ),
+                    mod_partition=(step_data.get('partitioner')
+                                    == 'edu.jhu.cs.ModPartitioner'),
+                    map_output_dir=(
+                            os.path.join(step_data['output'], 'dp.map')
+                            if has_reducer else step_data['output']
+                        ),
+                    tasks_dir=os.path.join(step_data['output'], 'dp.tasks'),
+                    inputs=[os.path.abspath(step_input) for step_input
+                                in step_data['input'].split(',')],
+                    output=os.path.abspath(step_data['output']),
+                    pipelined=False
+                ))
+        for i in xrange(1, len(step_plans)):
+            plan, previous_plan = step_plans[i], step_plans[i-1]
+            '''Tasks of the previous step's final phase must run in its own
+            job, and their output must not be divided among directories.'''
+            plan['pipelined'] = (
+                    pipelining
+                    and (plan['has_mapper'] or plan['has_reducer'])
+                    and not plan['nline_input']
+                    and plan['inputs'] == [previous_plan['output']]
+                    and (previous_plan['has_mapper']
+                            or previous_plan['has_reducer'])
+                    and (previous_plan['has_reducer']
+                            or not previous_plan['pipelined'])
+                    and not previous_plan['multiple_outputs']
+                    and plan['to_cache'] == previous_plan['to_cache']
+                    and plan['archive'] == previous_plan['archive']
+                )
+        def created_dir(path):
+            """ Creates a directory if it doesn't already exist.
+
+                path: directory to create
+
+                Return value: path
+            """
+            global failed
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.exists(path):
+                    iface.fail(('Problem encountered trying to '
+                                'create directory %s.') % path,
+                                steps=(job_flow[step_number:]
+                                        if step_number != 0 else None))
+                    failed = True
+                    raise
+            return path
+        def task_output_files(output_dir, task_id):
+            """ Lists files a successful task wrote to its output directory.
+
+                output_dir: output directory of task
+                task_id: task's numerical identifier
+
+                Return value: list of output files; empty if task wrote no
+                    output
+            """
+            return [output_file for output_file in
+                        [os.path.join(output_dir, str(task_id)),
+                         os.path.join(output_dir, str(task_id) + '.gz')]
+                        if os.path.isfile(output_file)]
+        def phase_name(step_index, kind):
+            """ Names a phase of a step.
+
+                step_index: index of step
+                kind: 'map', 'partition', or 'reduce'
+
+                Return value: phase name
+            """
+            return 'step %d %s' % (step_index + 1, kind)
+        def map_task_arg(step_index, input_file, task_id, dir_to_path):
+            """ Return value: step_runner_with_error_return() args for a map
+                task of step with index step_index """
+            plan = step_plans[step_index]
+            step_data = steps[plan['name']]
+            return [step_data['mapper'], input_file, plan['map_output_dir'],
+                    os.path.join(step_data['output'], 'dp.map.log'),
+                    os.path.join(step_data['output'], 'dp.map.counters'),
+                    task_id,
+                    # Multiple outputs apply AFTER reduce step
+                    plan['multiple_outputs'] and not plan['has_reducer'],
+                    separator, None, None, gzip, gzip_level, scratch,
+                    direct_write, sort, dir_to_path, merge]
+        def partition_task_arg(step_index, group_number, input_files):
+            """ Return value: presorted_tasks() args for partitioning
+                input_files among reduce tasks of step with index
+                step_index """
+            plan = step_plans[step_index]
+            step_data = steps[plan['name']]
+            return [input_files, group_number, step_data['sort_options'],
+                    plan['tasks_dir'], step_data['key_fields'], separator,
+                    step_data['partition_options'], step_data['task_count'],
+                    memcap, gzip, gzip_level, scratch, direct_write, sort,
+                    plan['mod_partition'], partition_hash, sorted_runs]
+        def reduce_task_arg(step_index, input_glob, task_id, dir_to_path):
+            """ Return value: step_runner_with_error_return() args for a
+                reduce task of step with index step_index """
+            plan = step_plans[step_index]
+            step_data = steps[plan['name']]
+            return [step_data['reducer'], input_glob, step_data['output'],
+                    os.path.join(step_data['output'], 'dp.reduce.log'),
+                    os.path.join(step_data['output'], 'dp.reduce.counters'),
+                    task_id, plan['multiple_outputs'], separator,
+                    step_data['sort_options'], memcap, gzip, gzip_level,
+                    scratch, direct_write, sort, dir_to_path, merge]
+        def partition_tasks(step_index, groups):
+            """ Return value: list of follow-up tuples (task function, task
+                function arg, phase), one for each group of input files in
+                groups, a list of tuples (group number, files) """
+            return [(presorted_tasks,
+                     partition_task_arg(step_index, group_number,
+                                        input_files),
+                     phase_name(step_index, 'partition'))
+                    for group_number, input_files in groups]
+        def pipeline(step_index, groupers, dir_to_path):
+            """ Creates function that schedules tasks downstream of a task
+                that just completed.
+
+                A map task's output is grouped for partitioning. If the next
+                step is pipelined with the step with index step_index, output
+                of the step's final phase becomes input to map tasks of the
+                next step or, if the next step has no mapper, is grouped for
+                partitioning.
+
+                step_index: index of step whose job is running
+                groupers: dictionary mapping indexes of steps to objects of
+                    type InputGrouper that group their map output (or input if
+                    they have no mapper) for partitioning
+                dir_to_path: path to add to PATH for tasks
+
+                Return value: function suitable as follow_up parameter of
+                    execute_balanced_job_with_retries()
+            """
+            next_map_task_ids = defaultdict(int)
+            def downstream_tasks(next_index, output_files):
+                if next_index >= len(step_plans) \
+                    or not step_plans[next_index]['pipelined']:
+                    return []
+                plan = step_plans[next_index]
+                if not plan['has_mapper']:
+                    return partition_tasks(
+                            next_index,
+                            groupers[next_index].add(output_files, 1)
+                        )
+                if plan['has_reducer']:
+                    if not output_files:
+                        return partition_tasks(
+                                next_index, groupers[next_index].add([], 1)
+                            )
+                    groupers[next_index].expect(len(output_files) - 1)
+                tasks = []
+                for output_file in output_files:
+                    tasks.append((step_runner_with_error_return,
+                                  map_task_arg(next_index, output_file,
+                                               next_map_task_ids[next_index],
+                                               dir_to_path),
+                                  phase_name(next_index, 'map')))
+                    next_map_task_ids[next_index] += 1
+                return tasks
+            def follow_up(phase, task_function_arg):
+                task_step_index, kind = phase.split(' ')[1:]
+                task_step_index = int(task_step_index) - 1
+                plan = step_plans[task_step_index]
+                if kind == 'partition':
+                    # Reduce phase waits for all partitioning
+                    return []
+                if kind == 'map':
+                    output_files = task_output_files(
+                            plan['map_output_dir'], task_function_arg[5]
+                        )
+                    if plan['has_reducer']:
+                        return partition_tasks(
+                                task_step_index,
+                                groupers[task_step_index].add(output_files, 1)
+                            )
+                else:
+                    output_files = task_output_files(
+                            steps[plan['name']]['output'],
+                            task_function_arg[5]
+                        )
+                if task_step_index != step_index:
+                    return []
+                return downstream_tasks(step_index + 1, output_files)
+            return follow_up
+        def partition_remaining(step_index, groupers, status_message,
+                                groups=[]):
+            """ Partitions input files of a step that haven't been
+                partitioned yet.
+
+                step_index: index of step
+                groupers: dictionary mapping indexes of steps to objects of
+                    type InputGrouper
+                status_message: how to describe partitioning to the user
+                groups: groups of input files already formed but not
+                    partitioned; files that haven't been placed in a group
+                    are added
+
+                No return value.
+            """
+            groups = groups + groupers[step_index].remaining()
+            if not groups:
+                return
+            execute_balanced_job_with_retries(
+                    pool, iface, presorted_tasks,
+                    [task_function_arg for _, task_function_arg, _
+                        in partition_tasks(step_index, groups)],
+                    status_message=status_message,
+                    finish_message=(
+                        '    Partitioned %s into tasks.'
+                        % dp_iface.inflected(len(groups), 'input')
+                    ),
+                    max_attempts=max_attempts,
+                    phase=phase_name(step_index, 'partition')
+                )
+        for step in steps:
+            step_data = steps[step]
+            plan = step_plans[step_number]
+            next_plan = (step_plans[step_number+1]
+                            if step_number + 1 < total_steps else None)
+            pipelined_next = next_plan is not None and next_plan['pipelined']
+            with cache(pool if plan['to_cache'] else None, plan['to_cache'],
+                        plan['archive']) as dir_to_path:
+                iface.step('Step %d/%d: %s' %
+                            (step_number + 1, total_steps, step))
+                groupers = {}
+                follow_up = (pipeline(step_number, groupers, dir_to_path)
+                                if pipelining else None)
+                def expect_downstream(task_count):
+                    ''' Prepares to start next step as tasks of this step's
+                    final phase complete. '''
+                    if not pipelined_next:
+                        return
+                    if next_plan['has_mapper'] and next_plan['has_reducer']:
+                        created_dir(next_plan['map_output_dir'])
+                    if next_plan['has_reducer']:
+                        created_dir(next_plan['tasks_dir'])
+                        groupers[step_number+1] = InputGrouper(
+                                task_count, num_processes
+                            )
+                if plan['pipelined']:
+                    iface.step(
+                            '    Started step while step %d/%d was running.'
+                            % (step_number, total_steps)
+                        )
+                elif plan['has_mapper'] or plan['has_reducer']:
+                    step_inputs = []
+                    # Handle multiple input files/directories
+                    for input_file_or_dir in step_data['input'].split(','):
+                        if os.path.isfile(input_file_or_dir):
+                            step_inputs.append(input_file_or_dir)
+                        elif os.path.isdir(input_file_or_dir):
+                            step_inputs.extend(
+                                    glob.glob(os.path.join(input_file_or_dir,
+                                                            '*'))
+                                )
+                    groups = []
+                    if plan['has_reducer']:
+                        created_dir(plan['tasks_dir'])
+                    if plan['has_mapper']:
+                        # Perform map step only if mapper isn't identity
+                        if plan['has_reducer']:
+                            '''There's a reducer parameter, so input to
+                            reducer is output of mapper.'''
+                            created_dir(plan['map_output_dir'])
+                        if plan['nline_input']:
+                            # Create temporary input files
+                            split_input_dir = make_temp_dir(common)
+                            input_files = []
+                            try:
+                                with open(step_inputs[0]) as nline_stream:
+                                    for i, line in enumerate(nline_stream):
+                                        offset = str(i)
+                                        input_files.append(os.path.join(
                                                             split_input_dir,
                                                             offset
                                                         )
                                                     )
-                                    with open(input_files[-1], 'w') \
-                                        as output_stream:
-                                        print >>output_stream, separator.join([
-                                                                offset, line
-                                                            ])
-                        except IndexError:
-                            raise RuntimeError('No NLineInputFormat input to '
-                                               'step "%s".' % step)
-                    else:
-                        input_files = [input_file for input_file in step_inputs
-                                        if os.path.isfile(input_file)]
-                    input_file_count = len(input_files)
-                    if not input_file_count:
-                        iface.step('No input found; skipping step.')
-                    err_dir = os.path.join(steps[step]['output'], 'dp.map.log')
-                    counter_dir = os.path.join(steps[step]['output'], 'dp.map.counters')
-                    iface.step('Step %d/%d: %s' %
-                                (step_number + 1, total_steps, step))
-                    iface.status('    Starting step runner...')
-                    execute_balanced_job_with_retries(
-                            pool, iface, step_runner_with_error_return,
-                                       [[step_data['mapper'], input_file,
-                                         output_dir, err_dir,
-                                         counter_dir,
-                                         i, multiple_outputs,
-                                         separator, None, None, gzip,
-                                         gzip_level, scratch, direct_write,
-                                         sort, dir_to_path]
-                                         for i, input_file
-                                         in enumerate(input_files)
-                                         if os.path.isfile(input_file)],
-                            status_message='Tasks completed',
-                            finish_message=(
-                                '    Completed %s.'
-                                % dp_iface.inflected(input_file_count, 'task')
-                            ),
-                            max_attempts=max_attempts
-                        )
-                    # Adjust step inputs in case a reducer follows
-                    step_inputs = [input_file for input_file 
-                                    in glob.glob(output_dir)
-                                    if os.path.isfile(input_file)]
-                if step_data['reducer'] not in identity_reducers:
-                    '''Determine whether to use "mod" partitioner that uses
-                    product of key fields % reducer count to assign tasks.'''
-                    try:
-                        if (step_data['partitioner']
-                                == 'edu.jhu.cs.ModPartitioner'):
-                            mod_partition = True
+                                        with open(input_files[-1], 'w') \
+                                            as output_stream:
+                                            print >>output_stream, \
+                                                separator.join([offset, line])
+                            except IndexError:
+                                raise RuntimeError('No NLineInputFormat '
+                                                   'input to step "%s".'
+                                                   % step)
                         else:
-                            mod_partition = False
-                    except KeyError:
-                        # Default to no mod partition
-                        mod_partition = False
-                    # Partition inputs into tasks, presorting
-                    output_dir = os.path.join(step_data['output'], 'dp.tasks')
-                    try:
-                        os.makedirs(output_dir)
-                    except OSError:
-                        if os.path.exists(output_dir):
-                            pass
+                            input_files = [input_file for input_file
+                                            in step_inputs
+                                            if os.path.isfile(input_file)]
+                        input_file_count = len(input_files)
+                        if not input_file_count:
+                            iface.step('No input found; skipping step.')
+                        if plan['has_reducer']:
+                            groupers[step_number] = InputGrouper(
+                                    input_file_count, num_processes
+                                )
                         else:
-                            iface.fail(('Problem encountered trying to '
-                                        'create directory %s.') % output_dir,
-                                        steps=(job_flow[step_number:]
-                                                if step_number != 0 else None))
-                            failed = True
-                            raise
-                    input_files = [input_file for input_file in step_inputs
-                                    if os.path.isfile(input_file)]
-                    input_file_count = len(input_files)
-                    if input_file_count > num_processes:
-                        file_count_per_group = input_file_count / num_processes
-                        input_file_groups = [
-                                input_files[k:k+file_count_per_group]
-                                for k in
-                                xrange(0, input_file_count,
-                                        file_count_per_group)
-                            ]
+                            expect_downstream(input_file_count)
+                        iface.status('    Starting step runner...')
+                        execute_balanced_job_with_retries(
+                                pool, iface, step_runner_with_error_return,
+                                [map_task_arg(step_number, input_file, i,
+                                              dir_to_path)
+                                    for i, input_file
+                                    in enumerate(input_files)],
+                                status_message='Tasks completed',
+                                finish_message=(
+                                    '    Completed %s%s.' % (
+                                        dp_iface.inflected(input_file_count,
+                                                           'task'),
+                                        ' and the tasks they fed'
+                                        if pipelining and (
+                                            plan['has_reducer']
+                                            or pipelined_next
+                                        ) else ''
+                                    )
+                                ),
+                                max_attempts=max_attempts,
+                                phase=phase_name(step_number, 'map'),
+                                follow_up=follow_up
+                            )
+                        if plan['has_reducer'] and not pipelining:
+                            for i in xrange(input_file_count):
+                                groups.extend(groupers[step_number].add(
+                                        task_output_files(
+                                            plan['map_output_dir'], i
+                                        ), 1
+                                    ))
                     else:
-                        input_file_groups = [[input_file]
-                                                for input_file in input_files]
-                    input_file_group_count = len(input_file_groups)
-                    iface.step('Step %d/%d: %s'
-                                 % (step_number + 1, total_steps, step))
-                    execute_balanced_job_with_retries(
-                            pool, iface, presorted_tasks,
-                            [[input_file_group, i,
-                                step_data['sort_options'], output_dir,
-                                step_data['key_fields'], separator,
-                                step_data['partition_options'],
-                                step_data['task_count'], memcap, gzip,
-                                gzip_level, scratch, direct_write,
-                                sort, mod_partition]
-                                    for i, input_file_group
-                                    in enumerate(input_file_groups)],
-                            status_message='Inputs partitioned',
-                            finish_message=(
-                                '    Partitioned %s into tasks.'
-                                % dp_iface.inflected(input_file_group_count,
-                                                     'input')
-                            ),
-                            max_attempts=max_attempts
-                        )
+                        input_files = [input_file for input_file
+                                        in step_inputs
+                                        if os.path.isfile(input_file)]
+                        groupers[step_number] = InputGrouper(
+                                len(input_files), num_processes
+                            )
+                        groups = groupers[step_number].add(input_files)
+                    if plan['has_reducer']:
+                        # Partition inputs into tasks, presorting
+                        partition_remaining(step_number, groupers,
+                                            'Inputs partitioned', groups)
+                    elif pipelined_next and next_plan['has_reducer']:
+                        partition_remaining(step_number + 1, groupers,
+                                            'Inputs to next step partitioned')
+                if plan['has_reducer']:
                     iface.status('    Starting step runner...')
-                    input_files = [os.path.join(output_dir, '%d.*' % i) 
+                    input_files = [os.path.join(plan['tasks_dir'], '%d.*' % i)
                                    for i in xrange(step_data['task_count'])]
                     # Filter out bad globs
                     input_files = [input_file for input_file in input_files
                                     if glob.glob(input_file)]
                     input_file_count = len(input_files)
-                    try:
-                        multiple_outputs = (
-                                ('multiple_outputs' in step_data) or
-                                    step_data['outputformat']
-                                    in ['edu.jhu.cs.MultipleOutputFormat',
-                                        'edu.jhu.cs.'
-                                        'MultipleIndexedLzoTextOutputFormat']
-                            )
-                    except KeyError:
-                        multiple_outputs = False
-                    err_dir = os.path.join(
-                                    steps[step]['output'],
-                                    'dp.reduce.log'
-                                )
-                    counter_dir = os.path.join(
-                                    steps[step]['output'],
-                                    'dp.reduce.counters'
-                                )
-                    output_dir = step_data['output']
-                    return_values = []
+                    expect_downstream(input_file_count)
                     execute_balanced_job_with_retries(
                             pool, iface, step_runner_with_error_return,
-                                [[step_data['reducer'], input_file, output_dir, 
-                                err_dir, counter_dir, i, multiple_outputs, separator,
-                                step_data['sort_options'], memcap, gzip,
-                                gzip_level, scratch, direct_write,
-                                sort, dir_to_path]
-                                    for i, input_file
-                                    in enumerate(input_files)],
+                            [reduce_task_arg(step_number, input_file, i,
+                                             dir_to_path)
+                                for i, input_file
+                                in enumerate(input_files)],
                             status_message='Tasks completed',
                             finish_message=(
-                                '    Completed %s.'
-                                % dp_iface.inflected(input_file_count, 'task')
+                                '    Completed %s%s.' % (
+                                    dp_iface.inflected(input_file_count,
+                                                       'task'),
+                                    ' and the tasks they fed'
+                                    if pipelined_next else ''
+                                )
                             ),
-                            max_attempts=max_attempts
+                            max_attempts=max_attempts,
+                            phase=phase_name(step_number, 'reduce'),
+                            follow_up=follow_up
                         )
+                    if pipelined_next and next_plan['has_reducer']:
+                        partition_remaining(step_number + 1, groupers,
+                                            'Inputs to next step partitioned')
             # Really close open file handles in PyPy
             gc.collect()
             if not keep_intermediates:
@@ -1975,8 +3227,7 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                                 pass
                 iface.step('    Deleted temporary files.')
             step_number += 1
-        if not ipy:
-            pool.close()
+        pool.close()
         if not keep_last_output and not keep_intermediates:
             try:
                 os.remove(step_data['output'])
@@ -2018,8 +3269,9 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
         iface.done()
     except (Exception, GeneratorExit):
         # GeneratorExit added just in case this happens on modifying code
-        if 'interrupt_engines' in locals():
-            interrupt_engines(pool, iface)
+        if 'pool' in locals():
+            iface.status('Interrupting workers...')
+            pool.interrupt()
         if not failed:
             time.sleep(0.2)
             if 'step_number' in locals():
@@ -2034,17 +3286,15 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                 shutil.rmtree(split_input_dir)
         raise
     except (KeyboardInterrupt, SystemExit):
-        if 'interrupt_engines' in locals():
-            interrupt_engines(pool, iface)
+        if 'pool' in locals():
+            iface.status('Interrupting workers...')
+            pool.interrupt()
         if 'step_number' in locals():
             iface.fail(steps=(job_flow[step_number:]
                         if step_number != 0 else None),
                         opener='*****Terminated*****')
         else:
             iface.fail()
-        if 'pool' in locals() and 'interrupt_engines' not in locals():
-            pool.terminate()
-            pool.join()
         if 'split_input_dir' in locals():
             try:
                 shutil.rmtree(split_input_dir)
@@ -2052,6 +3302,649 @@ def run_simulation(branding, json_config, force, memcap, num_processes,
                 pass
 
 if __name__ == '__main__':
+    if '--test' in sys.argv:
+        import unittest
+
+        class TestPartitioning(unittest.TestCase):
+            """ Tests key extraction and task assignment. """
+            def setUp(self):
+                self.lines = [
+                        '\t'.join(['chr%d' % (i % 7), '%012d' % (i * 37),
+                                   str(i % 3), 'ACGT' * (i % 5), '\n'])
+                        for i in xrange(500)
+                    ] + ['1\n', '\n', '-4\tx\n', 'a\t\t\n']
+                self.temp_dir_path = tempfile.mkdtemp()
+
+            def test_key_options(self):
+                """ Fails if -k options are parsed improperly. """
+                self.assertEqual(
+                        parsed_key_options('-k1,1 -k3 -k3,4r -k 4 -k2,2n'),
+                        [(0, 0, ''), (2, None, ''), (2, 3, 'r'),
+                         (3, None, ''), (1, 1, 'n')]
+                    )
+
+            def test_key_extraction(self):
+                """ Fails if extracted keys disagree with parsed_keys(). """
+                for options in ['-k1', '-k1,1', '-k1,2', '-k1,3 -k2,2',
+                                '-k2,3', '-k2 -k1,1']:
+                    partitioned_key = parsed_keys(options, '\t')
+                    partition_key = partition_key_extractor(options, '\t')
+                    for line in self.lines:
+                        self.assertEqual(
+                                partition_key(line),
+                                '\t'.join(partitioned_key(line, '\t'))
+                            )
+
+            def test_md5_assignment(self):
+                """ Fails if md5 assignment disagrees with original formula.
+                """
+                for mod_partition in [False, True]:
+                    assigned_tasks = task_assigner('-k1,2', '\t', 11,
+                                                    mod_partition, 'md5')
+                    partitioned_key = parsed_keys('-k1,2', '\t')
+                    expected_tasks = []
+                    for line in self.lines:
+                        key = partitioned_key(line, '\t')
+                        if mod_partition and len(key) <= 1:
+                            try:
+                                expected_tasks.append(abs(int(key[0])) % 11)
+                                continue
+                            except (IndexError, ValueError):
+                                pass
+                        expected_tasks.append(int(
+                                hashlib.md5('\t'.join(key)).hexdigest(), 16
+                            ) % 11)
+                    self.assertEqual(assigned_tasks(self.lines),
+                                        expected_tasks)
+
+            def test_crc32_assignment(self):
+                """ Fails if lines with the same key land in different tasks.
+                """
+                assigned_tasks = task_assigner('-k1,1', '\t', 5)
+                key_tasks = defaultdict(set)
+                for task, line in zip(assigned_tasks(self.lines), self.lines):
+                    key_tasks[line.strip().split('\t')[0]].add(task)
+                    self.assertTrue(0 <= task < 5)
+                self.assertTrue(all([len(tasks) == 1
+                                        for tasks in key_tasks.values()]))
+                self.assertTrue(len(set.union(*key_tasks.values())) > 1)
+
+            def test_presorted_tasks(self):
+                """ Fails if partitioned and presorted output is wrong. """
+                input_file = os.path.join(self.temp_dir_path, 'input')
+                output_dir = os.path.join(self.temp_dir_path, 'tasks')
+                os.makedirs(output_dir)
+                with open(input_file, 'w') as input_stream:
+                    input_stream.write(''.join(self.lines[:500]))
+                for partition_hash in ['crc32', 'md5']:
+                    self.assertEqual(presorted_tasks(
+                            [input_file], 0, '-k1,2', output_dir, 2, '\t',
+                            '-k1,1', 4, 1024 * 300,
+                            partition_hash=partition_hash
+                        ), None)
+                    assigned_tasks = task_assigner('-k1,1', '\t', 4, False,
+                                                    partition_hash)
+                    for task in xrange(4):
+                        expected_lines = sorted(
+                                [line for line, line_task
+                                 in zip(self.lines[:500],
+                                        assigned_tasks(self.lines[:500]))
+                                 if line_task == task],
+                                key=lambda line: line.split('\t')[:2]
+                            )
+                        task_file = os.path.join(output_dir, '%d.0' % task)
+                        if not expected_lines:
+                            self.assertFalse(os.path.exists(task_file))
+                            continue
+                        with open(task_file) as task_stream:
+                            self.assertEqual(
+                                    [line.split('\t')[:2]
+                                        for line in task_stream],
+                                    [line.split('\t')[:2]
+                                        for line in expected_lines]
+                                )
+                        os.remove(task_file)
+
+            def tearDown(self):
+                # Kill temporary directory
+                shutil.rmtree(self.temp_dir_path)
+
+        class TestMerge(unittest.TestCase):
+            """ Tests native k-way merge of presorted inputs. """
+            def setUp(self):
+                import random
+                random.seed(5)
+                self.temp_dir_path = tempfile.mkdtemp()
+                self.input_files = []
+                for i in xrange(5):
+                    input_file = os.path.join(self.temp_dir_path, str(i))
+                    with open(input_file, 'w') as input_stream:
+                        for _ in xrange(300):
+                            print >>input_stream, '\t'.join([
+                                    random.choice(['chr1', 'chr10', 'chr2',
+                                                   'chr1_x', '']),
+                                    str(random.randint(-50, 5000)),
+                                    random.choice(['a', 'b', 'ab', 'a\x1d'])
+                                ])
+                    self.input_files.append(input_file)
+
+            def sorted_files(self, sort_options, gzipped=False):
+                """ Presorts input files with UNIX sort. """
+                sorted_files = []
+                for input_file in self.input_files:
+                    sorted_file = input_file + '.sorted'
+                    subprocess.check_call(
+                            ('LC_ALL=C sort %s -t$\'\\t\' %s %s >%s')
+                            % (sort_options, input_file,
+                                '| gzip -c' if gzipped else '',
+                                sorted_file),
+                            shell=True, executable='/bin/bash'
+                        )
+                    sorted_files.append(sorted_file)
+                return sorted_files
+
+            def test_merge_consistency(self):
+                """ Fails if native merge disagrees with sort -m. """
+                for sort_options in ['-k1,1', '-k1,2', '-k1,1 -k2,2n',
+                                     '-k1,1 -k2,2nr', '-k2,2n -k3,3r',
+                                     '-k1,1 -k3']:
+                    for gzipped in [False, True]:
+                        sorted_files = self.sorted_files(sort_options,
+                                                            gzipped)
+                        expected = subprocess.check_output(
+                                ('LC_ALL=C sort %s -t$\'\\t\' -m %s')
+                                % (sort_options, ' '.join([
+                                        ('<(gzip -cd %s)' if gzipped
+                                            else '%s') % sorted_file
+                                        for sorted_file in sorted_files
+                                    ])), shell=True, executable='/bin/bash'
+                            )
+                        self.assertEqual(''.join(merged_lines(
+                                sorted_files, sort_options, '\t'
+                            )), expected)
+
+            def test_gzip_members_and_readahead(self):
+                """ Fails if gzip'd input isn't read back properly. """
+                import gzip
+                input_file = os.path.join(self.temp_dir_path, 'members.gz')
+                lines = ['%d\t%s\n' % (i, 'x' * (i % 50))
+                            for i in xrange(2000)]
+                for i in xrange(0, 2000, 700):
+                    stream = gzip.GzipFile(input_file, 'ab')
+                    stream.write(''.join(lines[i:i+700]))
+                    stream.close()
+                with open(input_file, 'ab') as input_stream:
+                    input_stream.write('')
+                for readahead in [7, 100, 1024 * 1024]:
+                    self.assertEqual(list(input_lines(input_file, readahead)),
+                                        lines)
+
+            def test_reducer_merge(self):
+                """ Fails if reducer output differs between merge modes. """
+                sort_options = '-k1,1 -k2,2n'
+                self.sorted_files(sort_options, True)
+                input_glob = os.path.join(self.temp_dir_path, '*.sorted')
+                outputs = []
+                for merge in ['native', 'sort']:
+                    output_dir = os.path.join(self.temp_dir_path, merge)
+                    os.makedirs(output_dir)
+                    self.assertEqual(step_runner_with_error_return(
+                            'cut -f1,2', input_glob, output_dir,
+                            self.temp_dir_path, self.temp_dir_path, 0, False,
+                            '\t', sort_options, 1024 * 300, True,
+                            merge=merge
+                        ), None)
+                    outputs.append(subprocess.check_output(
+                            'gzip -cd %s' % os.path.join(output_dir, '0.gz'),
+                            shell=True
+                        ))
+                self.assertEqual(outputs[0], outputs[1])
+                self.assertEqual(len(outputs[0].split('\n')), 1501)
+
+            def test_sorted_runs(self):
+                """ Fails if sorted runs don't merge into sorted task files.
+                """
+                sort_options = '-k1,1 -k2,2n'
+                for gzipped in [False, True]:
+                    output_dirs = []
+                    for sorted_runs in [False, True]:
+                        output_dir = os.path.join(
+                                self.temp_dir_path,
+                                'tasks.%s.%s' % (gzipped, sorted_runs)
+                            )
+                        os.makedirs(output_dir)
+                        self.assertEqual(presorted_tasks(
+                                self.input_files, 0, sort_options,
+                                output_dir, 2, '\t', '-k1,1', 3,
+                                # Runs of at most 4 KB
+                                4, gzipped, sorted_runs=sorted_runs
+                            ), None)
+                        output_dirs.append(output_dir)
+                    run_files = glob.glob(os.path.join(output_dirs[1], '*'))
+                    self.assertTrue(len(run_files) > 3)
+                    for task in xrange(3):
+                        task_glob = '%d.*' % task
+                        self.assertEqual(
+                                ''.join(merged_lines(glob.glob(
+                                    os.path.join(output_dirs[1], task_glob)
+                                ), sort_options, '\t')),
+                                ''.join(merged_lines(glob.glob(
+                                    os.path.join(output_dirs[0], task_glob)
+                                ), sort_options, '\t'))
+                            )
+
+            def test_binary_records(self):
+                """ Fails if binary records aren't partitioned and merged.
+                """
+                import random
+                import records
+                random.seed(9)
+                values = [(random.choice(['chr1', 'chr10', 'chr2',
+                                          'chr1_x']),
+                           random.randint(-50, 5000),
+                           random.choice(['a', 'b', 'ab', 'a\x00']))
+                            for _ in xrange(1500)]
+                input_files = []
+                for i in xrange(3):
+                    input_file = os.path.join(self.temp_dir_path,
+                                                'records.%d' % i)
+                    with open(input_file, 'w') as input_stream:
+                        record_writer = records.RecordWriter(input_stream)
+                        for value in values[i*500:(i+1)*500]:
+                            record_writer.write(value)
+                    input_files.append(input_file)
+                self.assertTrue(binary_input(input_files))
+                self.assertFalse(binary_input(self.input_files))
+                self.assertEqual(presorted_tasks(
+                        input_files, 0, '-k1,1r', self.temp_dir_path, 2, '\t',
+                        '-k1,1', 3, 4
+                    ), 'Sort options "-k1,1r" are incompatible with binary '
+                       'records, which sort on leading fields in order.')
+                for gzipped in [False, True]:
+                    output_dir = os.path.join(self.temp_dir_path,
+                                                'records.%s' % gzipped)
+                    os.makedirs(output_dir)
+                    self.assertEqual(presorted_tasks(
+                            input_files, 0, '-k1,1 -k2,2n', output_dir, 2,
+                            '\t', '-k1,1', 3, 4, gzipped
+                        ), None)
+                    self.assertTrue(len(os.listdir(output_dir)) > 3)
+                    assigned_tasks = record_task_assigner('-k1,1', 3)
+                    for task in xrange(3):
+                        merged = ''.join(merged_lines(glob.glob(
+                                os.path.join(output_dir, '%d.*' % task)
+                            ), '-k1,1 -k2,2n', '\t'))
+                        self.assertEqual(
+                                [records.decoded(body) for body in
+                                    records.record_bodies([merged])],
+                                sorted([value for value, value_task in zip(
+                                        values, assigned_tasks(
+                                            map(records.encoded, values)
+                                        )) if value_task == task])
+                            )
+                # Reducers divide records among outputs by first field
+                keys = set()
+                for task in xrange(3):
+                    output_dir = os.path.join(self.temp_dir_path,
+                                                'outputs.%d' % task)
+                    os.makedirs(output_dir)
+                    self.assertEqual(step_runner_with_error_return(
+                            'cat', os.path.join(self.temp_dir_path,
+                                                'records.True', '%d.*' % task),
+                            output_dir, self.temp_dir_path,
+                            self.temp_dir_path, task, True, '\t',
+                            '-k1,1 -k2,2n', 1024 * 300, True, merge='sort'
+                        ), None)
+                    for key in os.listdir(output_dir):
+                        keys.add(key)
+                        self.assertEqual(
+                                [records.decoded(body) for body in
+                                    records.record_bodies(input_chunks(
+                                        os.path.join(output_dir, key,
+                                                        '%d.gz' % task)
+                                    ))],
+                                sorted([value[1:] for value, value_task
+                                        in zip(values, assigned_tasks(
+                                                map(records.encoded, values)
+                                            )) if value_task == task
+                                        and value[0] == key])
+                            )
+                self.assertEqual(keys, set([value[0] for value in values]))
+
+            def tearDown(self):
+                # Kill temporary directory
+                shutil.rmtree(self.temp_dir_path)
+
+        class TestJobFlow(unittest.TestCase):
+            """ Tests running job flows with and without pipelining. """
+            def setUp(self):
+                self.temp_dir_path = tempfile.mkdtemp()
+                self.input_dir = os.path.join(self.temp_dir_path, 'input')
+                os.makedirs(self.input_dir)
+                for i in xrange(5):
+                    with open(os.path.join(self.input_dir, str(i)), 'w') \
+                        as input_stream:
+                        for j in xrange(40):
+                            print >>input_stream, '%d\t%d' % (j % 9, i * j)
+                self.job_flow = os.path.join(self.temp_dir_path, 'job.json')
+
+            def run_job_flow(self, output_prefix, pipelining, workers=None):
+                """ Runs a four-step job flow.
+
+                    The first step is map-only, the second has only a reducer,
+                    the third has a mapper and a reducer, and the fourth is
+                    map-only, so every phase of the last three can be
+                    pipelined with the step before it.
+
+                    output_prefix: prefix of output directories of steps
+                    pipelining: True iff pipelining should be enabled
+                    workers: list of worker daemon addresses or None
+
+                    Return value: sorted list of lines output by last step
+                """
+                step_args = [
+                        ('sed s/^/a/', 'cat', 1),
+                        ('cat', 'sed s/$/b/', 3),
+                        ('sed s/^/c/', 'sed s/$/d/', 2),
+                        ('sed s/^/e/', 'cat', 1)
+                    ]
+                steps, step_input = [], self.input_dir
+                for i, (mapper, reducer, task_count) in enumerate(step_args):
+                    step_output = os.path.join(
+                            self.temp_dir_path, '%s.%d' % (output_prefix, i)
+                        )
+                    steps.append({
+                            'Name' : 'Step %d' % i,
+                            'HadoopJarStep' : { 'Args' : [
+                                    '-D', 'mapred.reduce.tasks=%d'
+                                            % task_count,
+                                    '-input', step_input,
+                                    '-output', step_output,
+                                    '-mapper', mapper,
+                                    '-reducer', reducer
+                                ]}
+                        })
+                    step_input = step_output
+                with open(self.job_flow, 'w') as job_flow_stream:
+                    json.dump({'Steps' : steps}, job_flow_stream)
+                run_simulation(None, self.job_flow, True, 1024, 3, '\t',
+                                True, True, None, pipelining=pipelining,
+                                workers=workers)
+                output_lines = []
+                for output_file in glob.glob(os.path.join(step_input, '*')):
+                    if os.path.isfile(output_file):
+                        with open(output_file) as output_stream:
+                            output_lines.extend(output_stream.readlines())
+                return sorted(output_lines)
+
+            def test_pipelining(self):
+                """ Fails if pipelining changes output of job flow. """
+                expected_lines = []
+                for i in xrange(5):
+                    for j in xrange(40):
+                        expected_lines.append(
+                                'eca%d\t%dbd\n' % (j % 9, i * j)
+                            )
+                expected_lines.sort()
+                self.assertEqual(self.run_job_flow('barrier', False),
+                                 expected_lines)
+                self.assertEqual(self.run_job_flow('pipelined', True),
+                                 expected_lines)
+
+            def test_workers(self):
+                """ Fails if job flow run by worker daemons has wrong
+                    output. """
+                daemons, workers = [], []
+                try:
+                    for _ in xrange(2):
+                        daemons.append(subprocess.Popen(
+                                [sys.executable,
+                                 os.path.join(os.path.dirname(
+                                        os.path.abspath(__file__)
+                                    ), 'executor.py'),
+                                 '--host', '127.0.0.1', '--port', '0'],
+                                stdout=subprocess.PIPE
+                            ))
+                        workers.append('127.0.0.1:%s'
+                                        % daemons[-1].stdout.readline().strip())
+                    self.assertEqual(
+                            self.run_job_flow('workers', True, workers),
+                            self.run_job_flow('local', True)
+                        )
+                finally:
+                    for daemon in daemons:
+                        daemon.kill()
+                        daemon.wait()
+
+            def run_straggler(self, label, workers=None):
+                """ Runs a job flow in which one task's first attempt
+                    straggles.
+
+                    The straggling attempt records the PID of the process it
+                    sleeps in. A second step follows, so slots freed by the
+                    first step are reused.
+
+                    label: label of this run, used to name directories
+                    workers: list of worker daemon addresses or None
+
+                    Return value: tuple (PID of straggler's process, output
+                        directory of first step)
+                """
+                global _speculation_min_seconds
+                mapper = os.path.join(self.temp_dir_path, 'mapper.sh')
+                with open(mapper, 'w') as mapper_stream:
+                    # Only first attempt at task with "slow" input straggles
+                    mapper_stream.write('input=$(cat)\n'
+                                        'if [[ "$input" == *slow* ]] '
+                                        '&& mkdir "$1" 2>/dev/null; then '
+                                        'sleep 5 & echo $! >"$1/pid"; '
+                                        'wait; fi\n'
+                                        'printf "%s\\n" "$input"\n')
+                with open(os.path.join(self.input_dir, '5'), 'w') \
+                    as input_stream:
+                    print >>input_stream, 'slow\t0'
+                output_dir = os.path.join(self.temp_dir_path,
+                                            label + '.speculated')
+                started_dir = os.path.join(self.temp_dir_path,
+                                            label + '.started')
+                with open(self.job_flow, 'w') as job_flow_stream:
+                    json.dump({'Steps' : [{
+                            'Name' : 'Straggler',
+                            'HadoopJarStep' : { 'Args' : [
+                                    '-input', self.input_dir,
+                                    '-output', output_dir,
+                                    '-mapper', 'bash %s %s' % (
+                                        mapper, started_dir
+                                    ),
+                                    '-reducer', 'cat'
+                                ]}
+                        }, {
+                            'Name' : 'Next',
+                            'HadoopJarStep' : { 'Args' : [
+                                    '-input', output_dir,
+                                    '-output', output_dir + '.next',
+                                    '-mapper', 'sed s/^/n/',
+                                    '-reducer', 'cat'
+                                ]}
+                        }]}, job_flow_stream)
+                speculation_min_seconds = _speculation_min_seconds
+                _speculation_min_seconds = 0.5
+                try:
+                    run_simulation(None, self.job_flow, True, 1024, 2, '\t',
+                                    True, True, None, speculation_factor=2.0,
+                                    workers=workers)
+                finally:
+                    _speculation_min_seconds = speculation_min_seconds
+                with open(os.path.join(started_dir, 'pid')) as pid_stream:
+                    return int(pid_stream.read()), output_dir
+
+            def test_speculation(self):
+                """ Fails if a straggler isn't duplicated, its output is
+                    wrong or the losing attempt outlives the job. """
+                daemons, workers = [], []
+                try:
+                    for _ in xrange(2):
+                        daemons.append(subprocess.Popen(
+                                [sys.executable,
+                                 os.path.join(os.path.dirname(
+                                        os.path.abspath(__file__)
+                                    ), 'executor.py'),
+                                 '--host', '127.0.0.1', '--port', '0'],
+                                stdout=subprocess.PIPE
+                            ))
+                        workers.append('127.0.0.1:%s'
+                                        % daemons[-1].stdout.readline().strip())
+                    for label, run_workers in [('local', None),
+                                               ('workers', workers)]:
+                        start_time = time.time()
+                        pid, output_dir = self.run_straggler(label,
+                                                                run_workers)
+                        self.assertLess(time.time() - start_time, 4)
+                        # Straggler's sleep was killed; it's gone or a zombie
+                        try:
+                            with open('/proc/%d/stat' % pid) as stat_stream:
+                                self.assertEqual(
+                                        stat_stream.read().split()[2], 'Z'
+                                    )
+                        except IOError:
+                            pass
+                        self.assertEqual(
+                                sorted([os.path.basename(output_file)
+                                        for output_file in glob.glob(
+                                                os.path.join(output_dir, '*')
+                                            ) if os.path.isfile(output_file)]),
+                                map(str, range(6))
+                            )
+                        output_lines = []
+                        for output_file in glob.glob(
+                                os.path.join(output_dir + '.next', '*')
+                            ):
+                            if os.path.isfile(output_file):
+                                with open(output_file) as output_stream:
+                                    output_lines.extend(
+                                            output_stream.readlines()
+                                        )
+                        self.assertEqual(len(output_lines), 201)
+                        self.assertEqual(output_lines.count('nslow\t0\n'), 1)
+                        self.assertEqual(
+                                glob.glob(os.path.join(output_dir,
+                                                        'dp.attempt.*')),
+                                []
+                            )
+                finally:
+                    for daemon in daemons:
+                        daemon.kill()
+                        daemon.wait()
+
+            def test_side_output(self):
+                """ Fails if a reducer that writes a file of its own is
+                    speculated by default. """
+                global _speculation_min_seconds
+                reducer = os.path.join(self.temp_dir_path, 'reducer.sh')
+                side_dir = os.path.join(self.temp_dir_path, 'side')
+                os.makedirs(side_dir)
+                with open(reducer, 'w') as reducer_stream:
+                    '''Task with "slow" input straggles while writing a file
+                    outside its output directory, as Rail-RNA-coverage
+                    writes bigWigs.'''
+                    reducer_stream.write('input=$(cat)\n'
+                                         'if [[ "$input" == *slow* ]]; then '
+                                         'echo >>"$1/attempts"; '
+                                         'printf first >"$1/slow.bw"; '
+                                         'sleep 2; '
+                                         'printf second >>"$1/slow.bw"; fi\n'
+                                         'printf "%s\\n" "$input"\n')
+                with open(os.path.join(self.input_dir, '5'), 'w') \
+                    as input_stream:
+                    print >>input_stream, 'slow\t0'
+                speculation_min_seconds = _speculation_min_seconds
+                _speculation_min_seconds = 0.5
+                try:
+                    for label, speculation_factor in [('default', None),
+                                                      ('speculated', 2.0)]:
+                        with open(self.job_flow, 'w') as job_flow_stream:
+                            json.dump({'Steps' : [{
+                                'Name' : 'Side output',
+                                'HadoopJarStep' : { 'Args' : [
+                                        '-D', 'mapred.reduce.tasks=3',
+                                        '-input', self.input_dir,
+                                        '-output', os.path.join(
+                                                self.temp_dir_path, label
+                                            ),
+                                        '-mapper', 'cat',
+                                        '-reducer', 'bash %s %s' % (
+                                            reducer, side_dir
+                                        )
+                                    ]}
+                            }]}, job_flow_stream)
+                        if speculation_factor is None:
+                            run_simulation(None, self.job_flow, True, 1024,
+                                            2, '\t', True, True, None)
+                            with open(os.path.join(side_dir, 'slow.bw')) \
+                                as side_stream:
+                                self.assertEqual(side_stream.read(),
+                                                 'firstsecond')
+                        else:
+                            run_simulation(None, self.job_flow, True, 1024,
+                                            2, '\t', True, True, None,
+                                            speculation_factor=\
+                                                speculation_factor)
+                        with open(os.path.join(side_dir, 'attempts')) \
+                            as attempts_stream:
+                            attempts = len(attempts_stream.readlines())
+                        os.remove(os.path.join(side_dir, 'attempts'))
+                        '''A duplicate attempt would truncate the file the
+                        first is writing.'''
+                        self.assertEqual(attempts,
+                                         1 if speculation_factor is None
+                                         else 2)
+                finally:
+                    _speculation_min_seconds = speculation_min_seconds
+
+            def test_dead_worker(self):
+                """ Fails if a task whose worker process dies isn't
+                    reattempted. """
+                mapper = os.path.join(self.temp_dir_path, 'mapper.sh')
+                killed_dir = os.path.join(self.temp_dir_path, 'killed')
+                with open(mapper, 'w') as mapper_stream:
+                    # First attempt kills nearest Python ancestor: its worker
+                    mapper_stream.write('input=$(cat)\n'
+                                        'if mkdir "$1" 2>/dev/null; then '
+                                        'pid=$$; '
+                                        'until [[ "$(ps -o comm= -p $pid)" '
+                                        '== python* ]]; do '
+                                        'pid=$(ps -o ppid= -p $pid); done; '
+                                        'kill -9 $pid; fi\n'
+                                        'printf "%s\\n" "$input"\n')
+                output_dir = os.path.join(self.temp_dir_path, 'output')
+                with open(self.job_flow, 'w') as job_flow_stream:
+                    json.dump({'Steps' : [{
+                            'Name' : 'Dead worker',
+                            'HadoopJarStep' : { 'Args' : [
+                                    '-input', self.input_dir,
+                                    '-output', output_dir,
+                                    '-mapper', 'bash %s %s' % (
+                                        mapper, killed_dir
+                                    ),
+                                    '-reducer', 'cat'
+                                ]}
+                        }]}, job_flow_stream)
+                run_simulation(None, self.job_flow, True, 1024, 2, '\t',
+                                True, True, None)
+                self.assertTrue(os.path.isdir(killed_dir))
+                output_lines = []
+                for output_file in glob.glob(os.path.join(output_dir, '*')):
+                    if os.path.isfile(output_file):
+                        with open(output_file) as output_stream:
+                            output_lines.extend(output_stream.readlines())
+                self.assertEqual(len(output_lines), 200)
+
+            def tearDown(self):
+                # Kill temporary directory
+                shutil.rmtree(self.temp_dir_path)
+
+        unittest.main(argv=[sys.argv[0]])
+        sys.exit(0)
     parser = argparse.ArgumentParser(description=__doc__, 
                     formatter_class=argparse.RawDescriptionHelpFormatter)
     add_args(parser)
@@ -2063,4 +3956,7 @@ if __name__ == '__main__':
                     args.log, args.gzip_outputs, args.gzip_level,
                     args.ipy, args.ipcontroller_json, args.ipy_profile,
                     args.scratch, args.common, args.sort, args.max_attempts,
-                    args.direct_write)
+                    args.direct_write, args.partition_hash, args.merge,
+                    args.sorted_runs, not args.no_pipelining,
+                    args.speculation_factor,
+                    args.workers.split(',') if args.workers else None)
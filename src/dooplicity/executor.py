@@ -0,0 +1,835 @@
+#!/usr/bin/env python
+"""
+executor.py
+Part of Dooplicity framework
+
+Backends on which Dooplicity's EMR simulator executes tasks. Every executor
+divides its workers into slots, each identified by an integer ID and each
+running at most one task at a time, and exposes the same interface:
+
+  ids: list of slot IDs
+  host_map, engine_map, pid_map: slot ID -> hostname, hostname -> list of slot
+      IDs, and slot ID -> PID of the process running the slot's tasks
+  apply_async(slot, function, *args, **kwargs): starts function on a slot and
+      returns an object with ready() and get() methods
+  wait(timeout): sleeps until some task may have finished
+  kill(slot): kills processes started by the task running on a slot, so the
+      task fails soon after
+  interrupt(): kills processes started by running tasks and stops workers
+  close(): releases workers once all tasks are done
+
+executor[slot].apply_async(...) is also supported, and results carry
+IPython Parallel's metadata['engine_id'] and get_dict(), so
+tools.apply_async_with_errors() works with any executor. The simulator's
+scheduler -- ordering, retries on engines and hosts where a task hasn't
+failed, speculative duplicates -- is written against this interface alone.
+
+Backends:
+
+  ProcessPoolExecutor: a pool of processes on the local host, from
+      concurrent.futures when it's available and otherwise from
+      multiprocessing
+  SocketExecutor: lightweight worker daemons, each started with
+
+          python executor.py --host <address> --port <port>
+
+      on any host that shares the simulator's filesystem. A daemon serves one
+      slot; run several on different ports to give a host more slots. Tasks
+      and results are pickled, so a daemon runs whatever a client sends it.
+      Master and daemons therefore authenticate each other with a shared
+      key, the value of the environment variable DOOPLICITY_AUTHKEY, by
+      HMAC challenge and response on connecting. A daemon refuses to listen
+      on an address other than loopback unless a key is set.
+  IPythonExecutor: IPython Parallel engines
+
+Licensed under the MIT License:
+
+Copyright (c) 2014 Abhi Nellore and Ben Langmead.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import sys
+import os
+import socket
+import subprocess
+import threading
+import importlib
+import types
+import pickle
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+from cStringIO import StringIO
+from collections import defaultdict
+from traceback import format_exc
+
+class RemoteError(Exception):
+    """ Raised by get() when a task raised an exception on its worker. """
+    pass
+
+class AsyncResult(object):
+    """ Result of a task that may not have finished.
+
+        Mirrors the parts of IPython Parallel's AsyncResult used by
+        Dooplicity.
+    """
+    def __init__(self, slot, finished=None):
+        """
+            slot: ID of slot running task
+            finished: threading.Event to set when task finishes, or None
+        """
+        self.engine_id = slot
+        self.metadata = {'engine_id' : slot}
+        self._done = threading.Event()
+        self._finished = finished
+        self._value = None
+        self._error = None
+
+    def _set(self, value=None, error=None):
+        """ Records outcome of task if it isn't already recorded.
+
+            value: return value of task
+            error: None, or string describing exception raised by task
+
+            No return value.
+        """
+        if self._done.is_set():
+            return
+        self._value, self._error = value, error
+        self._done.set()
+        if self._finished is not None:
+            self._finished.set()
+
+    def ready(self):
+        return self._done.is_set()
+
+    def get(self):
+        """ Waits for task to finish.
+
+            Return value: return value of task; RemoteError is raised if
+                task raised an exception
+        """
+        while not self._done.wait(0.1):
+            pass
+        if self._error is not None:
+            raise RemoteError(self._error)
+        return self._value
+
+    def get_dict(self):
+        return {self.engine_id : self.get()}
+
+class _SlotView(object):
+    """ executor[slot]; permits executor[slot].apply_async(...) """
+    def __init__(self, executor, slot):
+        self._executor, self._slot = executor, slot
+
+    def apply_async(self, function, *args, **kwargs):
+        return self._executor.apply_async(self._slot, function,
+                                            *args, **kwargs)
+
+def _kill_descendants_command(pid):
+    """ Builds a command that kills all descendants of a process, forcibly.
+
+        Each generation of descendants is stopped as it's found, so none can
+        start processes that escape before the whole tree is killed.
+
+        pid: PID of ancestor process
+
+        Return value: bash command
+    """
+    return ('PIDS=; NEW={0}; '
+            'while NEW=$(pgrep -d, -P "$NEW"); do '
+            'kill -STOP ${{NEW//,/ }} 2>/dev/null; PIDS="$PIDS,$NEW"; done; '
+            '[[ -n "$PIDS" ]] && kill -9 ${{PIDS//,/ }} 2>/dev/null; '
+            'true').format(pid)
+
+def _kill_children(pid, host=None):
+    """ Kills all descendants of a process, forcibly.
+
+        pid: PID of ancestor process
+        host: hostname of process if it's not on this host, in which case
+            descendants are killed over SSH; otherwise None
+
+        No return value.
+    """
+    command = _kill_descendants_command(pid)
+    if host is not None:
+        import pipes
+        command = ('ssh -oStrictHostKeyChecking=no -oBatchMode=yes '
+                   '{0} {1}').format(host, pipes.quote(
+                                        'bash -c %s' % pipes.quote(command)
+                                    ))
+    subprocess.call(command, shell=True, executable='/bin/bash')
+
+class Executor(object):
+    """ Base class of backends on which tasks are executed. """
+    def __init__(self):
+        self.ids = []
+        self.host_map, self.pid_map = {}, {}
+        self.engine_map = defaultdict(list)
+        self._finished = threading.Event()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, slot):
+        return _SlotView(self, slot)
+
+    def _map_slots(self):
+        """ Finds the host and PID of each slot.
+
+            No return value.
+        """
+        from tools import apply_async_with_errors
+        self.host_map = apply_async_with_errors(
+                            self, self.ids, socket.gethostname,
+                            dict_format=True
+                        )
+        self.pid_map = apply_async_with_errors(
+                            self, self.ids, os.getpid, dict_format=True
+                        )
+        self.engine_map = defaultdict(list)
+        for slot in sorted(self.host_map):
+            self.engine_map[self.host_map[slot]].append(slot)
+
+    def apply_async(self, slot, function, *args, **kwargs):
+        """ Starts a function on a slot.
+
+            slot: slot ID
+            function: function to run; it must be importable by name where
+                the slot runs
+            *args, **kwargs: arguments of function
+
+            Return value: object with methods ready() and get()
+        """
+        raise NotImplementedError
+
+    def push(self, namespace):
+        """ Makes objects available to functions run on every slot.
+
+            Only engines that don't import functions by name need this.
+
+            namespace: dictionary mapping names to objects
+
+            No return value.
+        """
+        pass
+
+    def wait(self, timeout):
+        """ Sleeps until a task may have finished.
+
+            timeout: maximum number of seconds to sleep
+
+            No return value.
+        """
+        self._finished.wait(timeout)
+        self._finished.clear()
+
+    def kill(self, slot):
+        """ Kills processes started by the task running on a slot.
+
+            A task that runs a command, as a streaming step does, then fails
+            soon after; a task running only Python code is unaffected.
+            Processes on a host other than this one are killed over SSH.
+
+            slot: slot ID
+
+            No return value.
+        """
+        try:
+            host, pid = self.host_map[slot], self.pid_map[slot]
+        except KeyError:
+            return
+        _kill_children(pid, None if host == socket.gethostname() else host)
+
+    def interrupt(self):
+        """ Kills processes started by tasks on every slot.
+
+            No return value.
+        """
+        for slot in self.ids:
+            self.kill(slot)
+
+    def close(self):
+        """ Releases workers. No return value. """
+        pass
+
+# Queue on which a ProcessPoolExecutor's worker reports tasks it starts
+_task_starts = None
+
+def _pool_initializer(task_starts, initializer):
+    """ Initializes a worker of a ProcessPoolExecutor.
+
+        task_starts: SimpleQueue on which to report tasks started
+        initializer: function to run, or None
+
+        No return value.
+    """
+    global _task_starts
+    _task_starts = task_starts
+    if initializer is not None:
+        initializer()
+
+def _pool_task(task_id, function, args, kwargs):
+    """ Runs a task in a worker of a ProcessPoolExecutor.
+
+        The worker's PID is first reported with task_id on _task_starts, so
+        the task's processes can be killed.
+
+        Return value: tuple (True, return value of function) or, if function
+            raised an exception, (False, traceback)
+    """
+    if _task_starts is not None:
+        _task_starts.put((task_id, os.getpid()))
+    try:
+        return True, function(*args, **kwargs)
+    except Exception:
+        return False, format_exc()
+
+class ProcessPoolExecutor(Executor):
+    """ Runs tasks in a pool of processes on the local host.
+
+        Slots are not tied to particular processes: a task on any slot runs
+        in whichever worker is free. Callers must therefore keep no more
+        tasks running than there are slots. Uses concurrent.futures'
+        ProcessPoolExecutor if it's available and multiprocessing.Pool
+        otherwise.
+    """
+    def __init__(self, slot_count, initializer=None):
+        """
+            slot_count: number of processes
+            initializer: function each worker runs when it starts, or None
+        """
+        super(ProcessPoolExecutor, self).__init__()
+        import multiprocessing
+        from multiprocessing.queues import SimpleQueue
+        self.ids = range(slot_count)
+        '''Tasks report the PIDs of the workers that run them on this queue.
+        Unlike a Queue's, a SimpleQueue's put() writes before it returns, so
+        a report isn't lost if the worker then dies.'''
+        self._task_starts = SimpleQueue()
+        # Maps slots to tuples (task ID, AsyncResult) of running tasks
+        self._running = {}
+        # Maps IDs of running tasks to PIDs of workers running them
+        self._task_pids = {}
+        # Maps IDs of tasks whose workers are gone to when that was seen
+        self._orphaned = {}
+        self._task_count = 0
+        initargs = (self._task_starts, initializer)
+        try:
+            from concurrent.futures import ProcessPoolExecutor as Pool
+        except ImportError:
+            self._futures = False
+            try:
+                self._pool = multiprocessing.Pool(slot_count,
+                                                    _pool_initializer,
+                                                    initargs,
+                                                    maxtasksperchild=5)
+            except Exception:
+                # maxtasksperchild is supported only in 2.7
+                self._pool = multiprocessing.Pool(slot_count,
+                                                    _pool_initializer,
+                                                    initargs)
+        else:
+            self._futures = True
+            try:
+                self._pool = Pool(slot_count, initializer=_pool_initializer,
+                                    initargs=initargs)
+            except TypeError:
+                # Initializers are supported only in Python 3.7+, so tasks
+                # can't be killed one at a time
+                self._pool = Pool(slot_count)
+        current_hostname = socket.gethostname()
+        for slot in self.ids:
+            self.host_map[slot] = current_hostname
+            self.engine_map[current_hostname].append(slot)
+
+    def apply_async(self, slot, function, *args, **kwargs):
+        result = AsyncResult(slot, self._finished)
+        task_id = self._task_count
+        self._task_count += 1
+        self._running[slot] = (task_id, result)
+        def finished(outcome):
+            succeeded, value = outcome
+            if succeeded:
+                result._set(value)
+            else:
+                result._set(error=value)
+        if self._futures:
+            def future_finished(future):
+                try:
+                    finished(future.result())
+                except Exception:
+                    # Worker died
+                    result._set(error=format_exc())
+            self._pool.submit(
+                    _pool_task, task_id, function, args, kwargs
+                ).add_done_callback(future_finished)
+        else:
+            self._pool.apply_async(_pool_task,
+                                   (task_id, function, args, kwargs),
+                                   callback=finished)
+        return result
+
+    def _update_task_pids(self):
+        """ Records which workers started which tasks.
+
+            Tasks that have finished are forgotten.
+
+            No return value.
+        """
+        while not self._task_starts.empty():
+            task_id, pid = self._task_starts.get()
+            self._task_pids[task_id] = pid
+        for slot, (task_id, result) in self._running.items():
+            if result.ready():
+                del self._running[slot]
+                self._task_pids.pop(task_id, None)
+                self._orphaned.pop(task_id, None)
+
+    def wait(self, timeout, grace_period=2):
+        """ Sleeps until a task may have finished.
+
+            multiprocessing.Pool replaces a worker that dies but never
+            finishes the task it was running, so a task whose worker has
+            been gone for grace_period seconds without a result is failed
+            here. The grace period covers a worker that exits normally
+            just before its result is delivered.
+
+            timeout: maximum number of seconds to sleep
+            grace_period: number of seconds after which a task whose worker
+                is gone fails
+
+            No return value.
+        """
+        import time
+        super(ProcessPoolExecutor, self).wait(timeout)
+        if self._futures:
+            # concurrent.futures fails tasks of dead workers itself
+            return
+        self._update_task_pids()
+        worker_pids = set(self._worker_pids())
+        for slot, (task_id, result) in self._running.items():
+            pid = self._task_pids.get(task_id)
+            if pid is None or pid in worker_pids:
+                continue
+            orphaned_time = self._orphaned.setdefault(task_id, time.time())
+            if time.time() - orphaned_time >= grace_period:
+                result._set(error=('Worker process %d died while running '
+                                   'a task on slot %d.') % (pid, slot))
+
+    def kill(self, slot, timeout=5):
+        """ Kills processes started by the task running on a slot.
+
+            If the task hasn't reported which worker runs it yet, waits up
+            to timeout seconds for it to.
+
+            slot: slot ID
+            timeout: maximum number of seconds to wait for task to start
+
+            No return value.
+        """
+        import time
+        deadline = time.time() + timeout
+        while True:
+            self._update_task_pids()
+            try:
+                task_id, result = self._running[slot]
+            except KeyError:
+                # Task is done
+                return
+            if task_id in self._task_pids:
+                _kill_children(self._task_pids[task_id])
+                return
+            if time.time() > deadline:
+                return
+            time.sleep(0.05)
+
+    def _worker_pids(self):
+        if self._futures:
+            return list(getattr(self._pool, '_processes', None) or [])
+        return [process.pid for process in self._pool._pool]
+
+    def interrupt(self):
+        """ Kills processes started by tasks, then the workers themselves.
+
+            No return value.
+        """
+        for pid in self._worker_pids():
+            _kill_children(pid)
+        if self._futures:
+            for process in (getattr(self._pool, '_processes', None)
+                                or {}).values():
+                process.terminate()
+            self._pool.shutdown(wait=False)
+        else:
+            self._pool.terminate()
+            self._pool.join()
+
+    def close(self):
+        if self._futures:
+            self._pool.shutdown(wait=False)
+        else:
+            self._pool.close()
+
+def _module_name(module):
+    """ Finds the name under which a worker should import a module.
+
+        module: name of a function's module
+
+        Return value: tuple (module name, directory to add to sys.path or
+            None)
+    """
+    if module == '__main__':
+        main_file = os.path.abspath(sys.modules['__main__'].__file__)
+        return (os.path.splitext(os.path.basename(main_file))[0],
+                    os.path.dirname(main_file))
+    return module, None
+
+class _Pickler(pickle.Pickler):
+    """ Pickles functions and classes by module and name.
+
+        A function defined in the master's __main__ module is pickled under
+        the name of the file defining it, which the worker imports.
+    """
+    def persistent_id(self, obj):
+        if isinstance(obj, (types.FunctionType, types.BuiltinFunctionType,
+                            types.ClassType, type)) \
+            and getattr(obj, '__module__', None) is not None:
+            module, path = _module_name(obj.__module__)
+            return '\t'.join([module, obj.__name__, path or ''])
+        return None
+
+class _Unpickler(pickle.Unpickler):
+    """ Unpickles what _Pickler pickles. """
+    def persistent_load(self, persistent_id):
+        module, name, path = persistent_id.split('\t')
+        if path and path not in sys.path:
+            sys.path.insert(0, path)
+        return getattr(importlib.import_module(module), name)
+
+def _send(connection, obj):
+    """ Sends a pickle over a connection. No return value. """
+    buf = StringIO()
+    _Pickler(buf, pickle.HIGHEST_PROTOCOL).dump(obj)
+    connection.send_bytes(buf.getvalue())
+
+def _received(connection):
+    """ Receives a pickle from a connection.
+
+        Return value: unpickled object; EOFError is raised if connection was
+            closed
+    """
+    return _Unpickler(StringIO(connection.recv_bytes())).load()
+
+def authkey():
+    """ Gets key with which master and worker daemons authenticate each other.
+
+        Return value: value of environment variable DOOPLICITY_AUTHKEY, or
+            None if it's unset or empty
+    """
+    return os.environ.get('DOOPLICITY_AUTHKEY') or None
+
+def _is_loopback(host):
+    """ Checks whether an address is reachable only from this host.
+
+        host: hostname or IP address
+
+        Return value: True iff host resolves to a loopback address
+    """
+    try:
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+class SocketExecutor(Executor):
+    """ Runs tasks on worker daemons over TCP; each daemon is a slot. """
+    def __init__(self, addresses, key=None):
+        """
+            addresses: list of addresses of worker daemons, each in the
+                format host:port
+            key: key shared with daemons, or None to use authkey(); a
+                daemon that has a different key refuses the connection with
+                AuthenticationError
+        """
+        super(SocketExecutor, self).__init__()
+        if key is None:
+            key = authkey()
+        self._connections = {}
+        self._locks = {}
+        for slot, address in enumerate(addresses):
+            host, _, port = address.rpartition(':')
+            self._connections[slot] = Client((host, int(port)),
+                                             authkey=key)
+            self._locks[slot] = threading.Lock()
+        self.ids = sorted(self._connections)
+        self._map_slots()
+
+    def apply_async(self, slot, function, *args, **kwargs):
+        result = AsyncResult(slot, self._finished)
+        lock = self._locks[slot]
+        if not lock.acquire(False):
+            raise RuntimeError('Slot %d is already running a task.' % slot)
+        connection = self._connections[slot]
+        def run():
+            try:
+                _send(connection, (function, args, kwargs))
+                succeeded, value = _received(connection)
+            except Exception:
+                result._set(error=('Lost connection to worker %d.\n%s'
+                                    % (slot, format_exc())))
+            else:
+                if succeeded:
+                    result._set(value)
+                else:
+                    result._set(error=value)
+            finally:
+                lock.release()
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return result
+
+    def close(self):
+        for connection in self._connections.values():
+            try:
+                connection.close()
+            except IOError:
+                pass
+
+def serve(host, port, ready_stream=None, key=None):
+    """ Runs a worker daemon for SocketExecutor.
+
+        Tasks from a connected master are run one after another in this
+        process, so the processes they start are its children; a master
+        interrupts them by killing those children. When the master
+        disconnects, the daemon waits for another. Clients that don't have
+        the daemon's key are disconnected before anything they send is
+        unpickled.
+
+        host: address on which to listen
+        port: port on which to listen; if 0, a free port is chosen
+        ready_stream: stream to which to write port once listening, or None
+        key: key shared with master, or None to use authkey()
+
+        No return value.
+    """
+    if key is None:
+        key = authkey()
+    if key is None and not _is_loopback(host):
+        raise RuntimeError(('Worker daemon would run tasks sent by any '
+                            'client that can reach %s. Set the environment '
+                            'variable DOOPLICITY_AUTHKEY to a secret shared '
+                            'with the master, or listen on 127.0.0.1.')
+                            % host)
+    listener = Listener((host, port), 'AF_INET', authkey=key)
+    if ready_stream is not None:
+        print >>ready_stream, listener.address[1]
+        ready_stream.flush()
+    while True:
+        try:
+            connection = listener.accept()
+        except (AuthenticationError, EOFError, IOError):
+            # Client didn't authenticate
+            continue
+        try:
+            while True:
+                try:
+                    function, args, kwargs = _received(connection)
+                except EOFError:
+                    break
+                except Exception:
+                    _send(connection, (False, format_exc()))
+                    continue
+                try:
+                    outcome = (True, function(*args, **kwargs))
+                except Exception:
+                    outcome = (False, format_exc())
+                try:
+                    _send(connection, outcome)
+                except pickle.PicklingError:
+                    _send(connection, (False, format_exc()))
+        except IOError:
+            pass
+        finally:
+            connection.close()
+
+class IPythonExecutor(Executor):
+    """ Runs tasks on IPython Parallel engines; each engine is a slot. """
+    def __init__(self, client, namespace=None):
+        """
+            client: IPython Parallel Client object; all engines it spans are
+                used
+            namespace: dictionary of objects to push to every engine, or
+                None
+        """
+        super(IPythonExecutor, self).__init__()
+        self._client = client
+        self.ids = list(client.ids)
+        direct_view = client[:]
+        # Use Dill to permit general serializing
+        try:
+            import dill
+        except ImportError:
+            raise RuntimeError(
+                    'Dooplicity requires Dill. Install it by running '
+                    '"pip install dill", or see the StackOverflow '
+                    'question http://stackoverflow.com/questions/23576969/'
+                    'how-to-install-dill-in-ipython for other leads.'
+                )
+        else:
+            direct_view.use_dill()
+        with direct_view.sync_imports(quiet=True):
+            import subprocess
+            import glob
+            import hashlib
+            import zlib
+            import threading
+            import tempfile
+            import shutil
+            import os
+            import heapq
+            import bisect
+        if namespace:
+            self.push(namespace)
+        self._map_slots()
+
+    def apply_async(self, slot, function, *args, **kwargs):
+        return self._client[slot].apply_async(function, *args, **kwargs)
+
+    def push(self, namespace):
+        self._client[:].push(namespace)
+
+if __name__ == '__main__':
+    if '--test' in sys.argv:
+        import unittest
+        import time
+
+        class TestExecutors(unittest.TestCase):
+            """ Tests that backends behave the same way. """
+            def setUp(self):
+                self.daemons = []
+                self.addresses = []
+                env = dict(os.environ, DOOPLICITY_AUTHKEY='test key')
+                for _ in xrange(2):
+                    daemon = subprocess.Popen(
+                            [sys.executable, os.path.abspath(__file__),
+                             '--host', '127.0.0.1', '--port', '0'],
+                            stdout=subprocess.PIPE, env=env
+                        )
+                    self.daemons.append(daemon)
+                    self.addresses.append(
+                            '127.0.0.1:%s' % daemon.stdout.readline().strip()
+                        )
+                self.executors = [ProcessPoolExecutor(2),
+                                  SocketExecutor(self.addresses, 'test key')]
+
+            def test_apply_async(self):
+                """ Fails if results or errors aren't returned. """
+                for executor in self.executors:
+                    results = [executor.apply_async(slot, divmod, 7, slot + 1)
+                                for slot in executor.ids]
+                    self.assertEqual([result.get() for result in results],
+                                     [(7, 0), (3, 1)])
+                    result = executor[0].apply_async(divmod, 1, 0)
+                    while not result.ready():
+                        executor.wait(0.1)
+                    self.assertRaises(RemoteError, result.get)
+
+            def test_dead_worker(self):
+                """ Fails if a task whose worker dies never finishes. """
+                executor = self.executors[0]
+                result = executor.apply_async(0, os._exit, 1)
+                start_time = time.time()
+                while not result.ready() and time.time() - start_time < 10:
+                    executor.wait(0.1)
+                self.assertRaises(RemoteError, result.get)
+                # Pool replaced the worker
+                self.assertEqual(
+                        executor.apply_async(0, divmod, 7, 2).get(),
+                        (3, 1)
+                    )
+
+            def test_host_map(self):
+                """ Fails if slots aren't mapped to this host. """
+                for executor in self.executors:
+                    self.assertEqual(set(executor.host_map.values()),
+                                     set([socket.gethostname()]))
+                    self.assertEqual(
+                            executor.engine_map[socket.gethostname()],
+                            executor.ids
+                        )
+
+            def test_interrupt(self):
+                """ Fails if processes started by tasks aren't killed. """
+                executor = self.executors[1]
+                result = executor.apply_async(0, subprocess.call,
+                                                'sleep 30', shell=True)
+                time.sleep(0.5)
+                start_time = time.time()
+                executor.interrupt()
+                self.assertNotEqual(result.get(), 0)
+                self.assertLess(time.time() - start_time, 10)
+
+            def test_authentication(self):
+                """ Fails if a daemon accepts a client without its key or
+                    listens beyond loopback without a key. """
+                # Daemons serve one master at a time, so use an idle one
+                self.executors[1].close()
+                self.assertRaises(AuthenticationError, SocketExecutor,
+                                  self.addresses[:1], 'wrong key')
+                # Daemon still serves a master after refusing a client
+                executor = SocketExecutor(self.addresses[:1], 'test key')
+                try:
+                    self.assertEqual(
+                            executor.apply_async(0, divmod, 7, 2).get(),
+                            (3, 1)
+                        )
+                finally:
+                    executor.close()
+                key = os.environ.pop('DOOPLICITY_AUTHKEY', None)
+                try:
+                    self.assertRaises(RuntimeError, serve, '0.0.0.0', 0)
+                finally:
+                    if key is not None:
+                        os.environ['DOOPLICITY_AUTHKEY'] = key
+
+            def tearDown(self):
+                for executor in self.executors:
+                    executor.close()
+                for daemon in self.daemons:
+                    daemon.kill()
+                    daemon.wait()
+
+        unittest.main(argv=[sys.argv[0]])
+        sys.exit(0)
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', type=str, required=False,
+            default='127.0.0.1',
+            help=('address on which worker daemon should listen; unless it is '
+                  'a loopback address, the environment variable '
+                  'DOOPLICITY_AUTHKEY must be set to a key shared with the '
+                  'master'))
+    parser.add_argument('--port', type=int, required=True,
+            help=('port on which worker daemon should listen; 0 picks a free '
+                  'port, which is written to stdout'))
+    args = parser.parse_args(sys.argv[1:])
+    serve(args.host, args.port, sys.stdout if args.port == 0 else None)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+
+"""
+records.py
+Part of Dooplicity framework
+
+Binary record format for intermediate data passed between steps. A record is
+a length followed by a body of typed fields, each encoded so that comparing
+two bodies bytewise orders them as their fields would be ordered one at a
+time: ints and floats numerically, strings bytewise. So the simulator can
+partition, sort and merge records by comparing raw bytes without parsing
+them, and positions need no zero padding to sort numerically. Every stream
+of records begins with a magic marker that is skipped wherever it occurs, so
+record files may be concatenated with cat.
+
+A length below 0xfe is one byte; a longer length is 0xfe followed by four
+bytes, big-endian. The magic marker is 0xff followed by "DREC".
+
+Field encodings, each starting with a one-byte type tag:
+    str: tag 0x02, then bytes with each NUL escaped as NUL 0xff, then NUL
+    int: for a value whose magnitude fits in n bytes, tag 0x14 + n for a
+        positive value or 0x14 - n for a negative value, then n bytes,
+        big-endian, of the value, offset by 256^n - 1 if negative; zero is
+        tag 0x14 alone. At most 8 bytes.
+    float: tag 0x21, then 8 bytes of IEEE 754 big-endian with the sign bit
+        flipped for nonnegative values and all bits flipped for negative
+        values; -0.0 is written as 0.0
+
+Licensed under the MIT License:
+
+Copyright (c) 2014 Abhi Nellore and Ben Langmead.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import struct
+
+_long_length = struct.Struct('>I')
+_uint64 = struct.Struct('>Q')
+_double = struct.Struct('>d')
+# Written at the start of every record stream; text never starts with 0xff
+magic = '\xffDREC'
+_str_tag, _zero_tag, _float_tag = '\x02', '\x14', '\x21'
+_sign_bit = 1 << 63
+_all_bits = (1 << 64) - 1
+# Zero bytes that pad n big-endian bytes to 8, indexed by n
+_int_padding = ['\x00' * (8 - size) for size in xrange(9)]
+# Largest value of n bytes, indexed by n
+_int_max = [(1 << (8 * size)) - 1 for size in xrange(9)]
+# Number of bytes after each tag, indexed by ord(tag); None if no fixed size
+_tag_sizes = [None] * 256
+for _size in xrange(9):
+    _tag_sizes[0x14 + _size] = _tag_sizes[0x14 - _size] = _size
+_tag_sizes[ord(_float_tag)] = 8
+# Tuples (encoded size, padding, offset) for decoding ints, keyed by tag
+_int_decoding = {}
+for _size in xrange(9):
+    _int_decoding[chr(0x14 + _size)] = (_size + 1, _int_padding[_size], 0)
+    _int_decoding[chr(0x14 - _size)] = (_size + 1, _int_padding[_size],
+                                        _int_max[_size])
+
+def encoded_field(field):
+    """ Encodes a field so its bytes sort as the field does.
+
+        field: int, long, float or str
+
+        Return value: encoded field, including type tag
+    """
+    if isinstance(field, str):
+        if '\x00' in field:
+            field = field.replace('\x00', '\x00\xff')
+        return _str_tag + field + '\x00'
+    if isinstance(field, (int, long)):
+        if not field:
+            return _zero_tag
+        magnitude = abs(field)
+        if magnitude > _all_bits:
+            raise ValueError('Int field %d does not fit in 8 bytes.' % field)
+        size = (magnitude.bit_length() + 7) // 8
+        if field > 0:
+            return chr(0x14 + size) + _uint64.pack(field)[8-size:]
+        return chr(0x14 - size) + _uint64.pack(
+                _int_max[size] + field
+            )[8-size:]
+    if isinstance(field, float):
+        # -0.0 would sort before 0.0, which compares equal to it
+        bits = _uint64.unpack(_double.pack(field or 0.0))[0]
+        return _float_tag + _uint64.pack(
+                bits ^ _all_bits if bits & _sign_bit else bits | _sign_bit
+            )
+    raise TypeError('Field %r is not an int, float or str.' % (field,))
+
+def encoded(fields):
+    """ Encodes fields as a record body.
+
+        fields: iterable of ints, longs, floats and strs
+
+        Return value: record body
+    """
+    return ''.join([encoded_field(field) for field in fields])
+
+def framed(body):
+    """ Prefixes a record body with its length.
+
+        body: record body
+
+        Return value: record as written to a stream
+    """
+    length = len(body)
+    if length < 0xfe:
+        return chr(length) + body
+    return '\xfe' + _long_length.pack(length) + body
+
+def field_offsets(body, field_count=None):
+    """ Finds where fields begin in a record body without decoding them.
+
+        body: record body
+        field_count: number of leading fields to find, or None for all
+
+        Return value: list of offsets at which successive fields start,
+            followed by the offset just past the last field found
+    """
+    offsets = [0]
+    position, body_length = 0, len(body)
+    if field_count is None:
+        field_count = body_length
+    while position < body_length and len(offsets) <= field_count:
+        tag = body[position]
+        if tag == _str_tag:
+            position = body.find('\x00', position + 1)
+            while body[position+1:position+2] == '\xff':
+                position = body.find('\x00', position + 2)
+            position += 1
+        else:
+            position += 1 + _tag_sizes[ord(tag)]
+        offsets.append(position)
+    return offsets
+
+def decoded(body):
+    """ Decodes a record body into fields.
+
+        body: record body
+
+        Return value: tuple of fields
+    """
+    fields = []
+    append = fields.append
+    position, body_length = 0, len(body)
+    find = body.find
+    unpack = _uint64.unpack
+    str_tag, int_decoding = _str_tag, _int_decoding
+    while position < body_length:
+        tag = body[position]
+        if tag == str_tag:
+            end = find('\x00', position + 1)
+            if body[end+1:end+2] == '\xff':
+                while body[end+1:end+2] == '\xff':
+                    end = find('\x00', end + 2)
+                append(body[position+1:end].replace('\x00\xff', '\x00'))
+            else:
+                append(body[position+1:end])
+            position = end + 1
+        elif tag in int_decoding:
+            end, padding, offset = int_decoding[tag]
+            end += position
+            append(unpack(padding + body[position+1:end])[0] - offset)
+            position = end
+        elif tag == _float_tag:
+            end = position + 9
+            bits = unpack(body[position+1:end])[0]
+            append(_double.unpack(_uint64.pack(
+                    bits ^ _sign_bit if bits & _sign_bit else bits ^ _all_bits
+                ))[0])
+            position = end
+        else:
+            raise ValueError('Field type tag %r is invalid.' % tag)
+    return tuple(fields)
+
+def record_bodies(chunks):
+    """ Splits a stream of records into record bodies.
+
+        Magic markers are skipped wherever they fall between records.
+
+        chunks: iterable of successive strings from the stream, cut anywhere
+
+        Yield value: record body
+    """
+    unpack_from = _long_length.unpack_from
+    magic_length = len(magic)
+    data, position = '', 0
+    for chunk in chunks:
+        data = data[position:] + chunk
+        position, data_length = 0, len(data)
+        while position < data_length:
+            length = ord(data[position])
+            if length < 0xfe:
+                start = position + 1
+            elif length == 0xfe:
+                if data_length - position < 5:
+                    break
+                length = unpack_from(data, position + 1)[0]
+                start = position + 5
+            else:
+                if data_length - position < magic_length:
+                    break
+                if data[position:position+magic_length] != magic:
+                    raise ValueError('Record stream is corrupt.')
+                position += magic_length
+                continue
+            end = start + length
+            if end > data_length:
+                break
+            yield data[start:end]
+            position = end
+    if position != len(data):
+        raise ValueError('Record stream is truncated.')
+
+def stream_bodies(input_stream, readahead=262144):
+    """ Reads record bodies from a file object.
+
+        input_stream: file object
+        readahead: number of bytes to read at once
+
+        Yield value: record body
+    """
+    return record_bodies(iter(lambda: input_stream.read(readahead), ''))
+
+def is_record_stream(start):
+    """ Checks whether data is the start of a record stream.
+
+        start: first len(magic) bytes of a file or stream
+
+        Return value: True iff start is the magic marker
+    """
+    return start == magic
+
+class RecordWriter(object):
+    """ Writes records to a stream, starting with the magic marker. """
+    def __init__(self, output_stream):
+        """
+            output_stream: file object to write to
+        """
+        self.output_stream = output_stream
+        self._write = output_stream.write
+        self._write(magic)
+
+    def write(self, fields):
+        """ Writes a record.
+
+            fields: iterable of ints, longs, floats and strs
+
+            No return value.
+        """
+        self._write(framed(''.join([encoded_field(field)
+                                        for field in fields])))
+
+    def write_body(self, body):
+        """ Writes an encoded record body.
+
+            body: record body
+
+            No return value.
+        """
+        self._write(framed(body))
+
+    def flush(self):
+        """ Flushes output stream.
+
+            No return value.
+        """
+        self.output_stream.flush()
+
+if __name__ == '__main__':
+    import unittest
+    import random
+    from cStringIO import StringIO
+
+    class TestRecords(unittest.TestCase):
+        """ Tests encoding, decoding and ordering of records. """
+        def setUp(self):
+            random.seed(3)
+            self.records = [
+                    (random.choice(['chr1', 'chr10', 'chr2', '', 'a\x00',
+                                    'a\x00\x00b', 'a\x01', '\xff']),
+                     random.choice([0, 1, -1, 255, 256, -256, -257,
+                                    random.randint(-10 ** 12, 10 ** 12)]),
+                     random.choice([0.0, -0.0, 1.5, -1.5, 1e300, -1e-300,
+                                    float('inf'), float('-inf')]),
+                     random.choice(['x', 'xy', '', '\x00']))
+                    for _ in xrange(2000)
+                ]
+
+        def test_round_trip(self):
+            """ Fails if decoded records differ from encoded records. """
+            for record in self.records:
+                self.assertEqual(decoded(encoded(record)), record)
+            self.assertEqual(decoded(encoded([-2 ** 64 + 1, 2 ** 64 - 1])),
+                             (-2 ** 64 + 1, 2 ** 64 - 1))
+            self.assertRaises(ValueError, encoded_field, 2 ** 64)
+            self.assertRaises(TypeError, encoded_field, None)
+
+        def test_order(self):
+            """ Fails if bodies don't sort as their fields do. """
+            self.assertEqual(
+                    [decoded(body) for body in
+                        sorted([encoded(record) for record in self.records])],
+                    sorted(self.records)
+                )
+
+        def test_field_offsets(self):
+            """ Fails if field offsets don't delimit encoded fields. """
+            for record in self.records[:200]:
+                body = encoded(record)
+                offsets = field_offsets(body)
+                self.assertEqual(
+                        [body[offsets[i]:offsets[i+1]]
+                            for i in xrange(len(record))],
+                        [encoded_field(field) for field in record]
+                    )
+                self.assertEqual(field_offsets(body, 2), offsets[:3])
+
+        def test_stream(self):
+            """ Fails if concatenated streams aren't read back. """
+            streams = []
+            for i in xrange(0, 2000, 700):
+                output_stream = StringIO()
+                record_writer = RecordWriter(output_stream)
+                for record in self.records[i:i+700]:
+                    record_writer.write(record)
+                # Long record
+                record_writer.write(('x' * 300,))
+                streams.append(output_stream.getvalue())
+            data = ''.join(streams)
+            self.assertTrue(is_record_stream(data[:len(magic)]))
+            for readahead in [1, 7, 1024 * 1024]:
+                self.assertEqual(
+                        [decoded(body) for body in
+                            stream_bodies(StringIO(data), readahead)
+                            if body != encoded(('x' * 300,))],
+                        self.records
+                    )
+            self.assertRaises(ValueError, list,
+                              stream_bodies(StringIO(data[:-1])))
+
+    unittest.main()
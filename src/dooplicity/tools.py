@@ -43,6 +43,7 @@ import time
 from traceback import format_exc
 import os
 import tempfile
+import records
 
 @contextlib.contextmanager
 def cd(dir_name):
@@ -291,6 +292,36 @@ def make_temp_dir_and_register_cleanup(scratch=None):
                         ignore_errors=True)
     return dir_to_cleanup
 
+def resident_memory():
+    """ Measures how much memory this process holds.
+
+        Pages of a file memory-mapped by several processes count toward each
+        one's resident set size but toward none's private memory, so the
+        latter shows what sharing saves.
+
+        Return value: tuple (resident set size in bytes, private resident
+            bytes or None if /proc/self/smaps_rollup is unavailable)
+    """
+    fields = {}
+    for status_file in ['/proc/self/status', '/proc/self/smaps_rollup']:
+        try:
+            with open(status_file) as status_stream:
+                for line in status_stream:
+                    tokens = line.split()
+                    if len(tokens) == 3 and tokens[2] == 'kB':
+                        fields[tokens[0]] = int(tokens[1]) * 1024
+        except IOError:
+            pass
+    if 'VmRSS:' in fields:
+        resident = fields['VmRSS:']
+    else:
+        import resource
+        # ru_maxrss is in kilobytes on Linux; this is the peak
+        resident = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    if 'Private_Clean:' in fields and 'Private_Dirty:' in fields:
+        return resident, fields['Private_Clean:'] + fields['Private_Dirty:']
+    return resident, None
+
 def engine_string_from_list(id_list):
     """ Pretty-prints list of engine IDs.
 
@@ -548,13 +579,24 @@ class xstream(object):
             considered the key denoting a partition
         separator: delimiter separating fields from each input line
         skip_duplicates: skip any duplicate lines that may follow a line
+        binary: True iff input is a stream of binary records written by
+            xwriter; then fields are typed, so ints and floats are not
+            strings. See records.py.
     """
     @staticmethod
     def stream_iterator(
             input_stream,
             separator='\t',
-            skip_duplicates=False
+            skip_duplicates=False,
+            binary=False
         ):
+        if binary:
+            bodies = records.stream_bodies(input_stream)
+            if skip_duplicates:
+                bodies = (body for body, _ in groupby(bodies))
+            for body in bodies:
+                yield records.decoded(body)
+            return
         if skip_duplicates:
             for line, _ in groupby(input_stream):
                 yield tuple(line.strip().split(separator))
@@ -567,13 +609,15 @@ class xstream(object):
             input_stream,
             key_fields=1,
             separator='\t',
-            skip_duplicates=False
+            skip_duplicates=False,
+            binary=False
         ):
         self._key_fields = key_fields
         self.it = self.stream_iterator(
                         input_stream,
                         separator=separator,
-                        skip_duplicates=skip_duplicates
+                        skip_duplicates=skip_duplicates,
+                        binary=binary
                     )
         self.tgtkey = self.currkey = self.currvalue = object()
 
@@ -593,6 +637,42 @@ class xstream(object):
             self.currvalue = next(self.it)    # Exit on StopIteration
             self.currkey = self.currvalue[:self._key_fields]
 
+class xwriter(object):
+    """ Writes output lines or binary records an xstream can read back.
+
+        Usage: output = xwriter(sys.stdout, binary=True)
+               output.write(('exon_diff', 'chr1', 1000, 1))
+
+        Text output is fields converted with str() joined by separator, one
+        line per write. Binary output is records from records.py, in which
+        ints and floats keep their types and sort numerically without
+        padding; it should be read with xstream(..., binary=True) and is
+        understood by the EMR simulator but not by Hadoop Streaming.
+
+        Init vars
+        -------------
+        output_stream: where to write output
+        binary: True iff binary records should be written
+        separator: delimiter separating fields of text output
+    """
+    def __init__(self, output_stream, binary=False, separator='\t'):
+        self.output_stream = output_stream
+        self.binary = binary
+        self.separator = separator
+        if binary:
+            self._record_writer = records.RecordWriter(output_stream)
+
+    def write(self, fields):
+        if self.binary:
+            self._record_writer.write(fields)
+        else:
+            self.output_stream.write(
+                    self.separator.join(map(str, fields)) + '\n'
+                )
+
+    def flush(self):
+        self.output_stream.flush()
+
 if __name__ == '__main__':
     # Run unit tests
     import unittest
@@ -704,6 +784,27 @@ if __name__ == '__main__':
                      (('chr1', '2'), ('i', '91', '101'))]
                 )
 
+        def test_binary_records(self):
+            """ Fails if xwriter's binary records aren't read back. """
+            values = [('chr1', 5, 'a', 20), ('chr1', 5, 'i\t\n', -1),
+                      ('chr10', 2, 'i', 0), ('chr10', 2, 'i', 0),
+                      ('chr2', 1, '', 1.5)]
+            with open(self.input_file, 'w') as output_stream:
+                output = xwriter(output_stream, binary=True)
+                for value in values:
+                    output.write(value)
+            with open(self.input_file) as input_stream:
+                output = [(key, value) for key, xpartition
+                            in xstream(input_stream, 2, skip_duplicates=True,
+                                       binary=True)
+                            for value in xpartition]
+            self.assertEqual(output,
+                    [(('chr1', 5), ('a', 20)),
+                     (('chr1', 5), ('i\t\n', -1)),
+                     (('chr10', 2), ('i', 0)),
+                     (('chr2', 1), ('', 1.5))]
+                )
+
         def test_empty_input(self):
             """ Fails if it fails. """
             with open(self.input_file, 'w') as input_stream:
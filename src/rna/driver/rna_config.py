@@ -3991,6 +3991,7 @@ class RailRnaAlign(object):
         motif_radius=5, genome_bowtie1_args='-v 0 -a -m 80',
         transcriptome_bowtie2_args='-k 30', experimental=False,
         count_multiplier=15, max_refs_per_strand=300,
+        coalesce_bytes=0, index_cache=None,
         junction_criteria='0.5,5', indel_criteria='0.5,5', tie_margin=6,
         normalize_percentile=0.75, transcriptome_indexes_per_sample=500,
         drop_deletions=False, do_not_output_bam_by_chr=False,
@@ -4046,6 +4047,34 @@ class RailRnaAlign(object):
                                             entered_exe=bowtie2_build_exe,
                                             is_exe=is_exe,
                                             which=which)
+            bowtie2_build_version_command = [base.bowtie2_build_exe,
+                                                '--version']
+            base.bowtie2_build_threads = False
+            try:
+                bowtie2_build_version = subprocess.check_output(
+                        bowtie2_build_version_command
+                    ).split('\n', 1)[0].split(' ')[-1]
+            except Exception as e:
+                base.errors.append(('Error "{0}" encountered attempting to '
+                                    'execute "{1}".').format(
+                                                e.message,
+                                                ' '.join(
+                                                bowtie2_build_version_command
+                                               )
+                                            ))
+            else:
+                '''bowtie2-build accepts --threads as of v2.2.7; earlier
+                versions, and versions that can't be read, build on one
+                thread.'''
+                bowtie2_build_version = re.match(
+                        r'\d+(\.\d+)*', bowtie2_build_version
+                    )
+                base.bowtie2_build_threads = (
+                        bowtie2_build_version is not None
+                        and tuple(int(part) for part in
+                                    bowtie2_build_version.group().split('.'))
+                            >= (2, 2, 7)
+                    )
             bowtie_idx = ','.join(bowtie_idx)
             if ',' in bowtie_idx:
                 bowtie1_idx, _, bowtie2_idx = bowtie_idx.partition(',')
@@ -4182,6 +4211,8 @@ class RailRnaAlign(object):
             base.bowtie2_exe = _elastic_bowtie2_exe
             base.bowtie1_build_exe = _elastic_bowtie1_build_exe
             base.bowtie2_build_exe = _elastic_bowtie2_build_exe
+            # Bundled bowtie2-build is v2.3.4.1
+            base.bowtie2_build_threads = True
         if '--mp' in bowtie2_args:
             print_to_screen('Warning: --mp parameter in specified in Bowtie 2 '
                             'arguments (--bowtie2-args) will be ignored.',
@@ -4356,6 +4387,19 @@ class RailRnaAlign(object):
                                                     count_multiplier
                                                 ))
         base.count_multiplier = count_multiplier
+        if not (float(coalesce_bytes).is_integer() and
+                    coalesce_bytes >= 0):
+            base.errors.append('Bytes of transcript fragments to coalesce '
+                               '(--coalesce-bytes) must be an integer >= 0, '
+                               'but {0} was entered.'.format(
+                                                    coalesce_bytes
+                                                ))
+        base.coalesce_bytes = coalesce_bytes
+        if index_cache is not None and not elastic:
+            index_cache = os.path.abspath(
+                    os.path.expandvars(os.path.expanduser(index_cache))
+                )
+        base.index_cache = index_cache
         base.experimental = experimental
         if not (float(max_refs_per_strand).is_integer() and
                     max_refs_per_strand >= 1):
@@ -4796,6 +4840,16 @@ class RailRnaAlign(object):
             default=15,
             help=argparse.SUPPRESS
         )
+        algo_parser.add_argument(
+            '--coalesce-bytes', type=int, required=False,
+            default=0,
+            help=argparse.SUPPRESS
+        )
+        algo_parser.add_argument(
+            '--index-cache', type=str, required=False,
+            default=None,
+            help=argparse.SUPPRESS
+        )
         algo_parser.add_argument(
             '--max-refs-per-strand', type=int, required=False,
             default=300,
@@ -5163,12 +5217,17 @@ class RailRnaAlign(object):
             {
                 'name' : 'Build isofrag index',
                 'reducer' : ('junction_index.py --bowtie2-build-exe={0} '
-                             '--out={1} --basename {2} {3} {4}').format(
+                             '--out={1} --basename {2} --threads {3} {4} '
+                             '{5} {6}').format(
                                             base.bowtie2_build_exe,
                                             base.transcript_out,
                                             _transcript_fragment_idx_basename,
+                                            max_tasks if elastic
+                                            else base.num_processes,
                                             keep_alive,
-                                            scratch
+                                            scratch,
+                                            '' if base.bowtie2_build_threads
+                                            else '--bowtie2-build-threads 1'
                                         ),
                 'inputs' : ['junction_fasta',
                                 path_join(elastic, 'align_reads', 'dummy')],
@@ -5249,6 +5308,7 @@ class RailRnaAlign(object):
                 'reducer' : ('realign_reads.py --bowtie2-exe={0} '
                              '--bowtie2-build-exe={1} '
                              '--gzip-level {2} --count-multiplier {3} '
+                             '--coalesce-bytes {9} {10}'
                              '--tie-margin {4} {5} {6} {7} -- {8}').format(
                                             base.bowtie2_exe,
                                             base.bowtie2_build_exe,
@@ -5260,7 +5320,12 @@ class RailRnaAlign(object):
                                             verbose,
                                             keep_alive,
                                             scratch,
-                                            base.bowtie2_args
+                                            base.bowtie2_args,
+                                            base.coalesce_bytes,
+                                            ('--index-cache %s '
+                                                % base.index_cache)
+                                            if base.index_cache is not None
+                                            else ''
                                         ),
                 'inputs' : [path_join(elastic, 'align_reads', 'unmapped'),
                             'cojunction_fasta'],
@@ -5510,8 +5575,8 @@ class RailRnaAlign(object):
                 'name' : 'Write bigWigs with exome coverage by sample',
                 'reducer' : (
                          'coverage.py --bowtie-idx={0} --percentile={1} '
-                         '--out={2} --bigwig-exe={3} '
-                         '--manifest={4} {5} {6} {7}').format(base.bowtie1_idx,
+                         '--out={2} '
+                         '--manifest={3} {4} {5} {6}').format(base.bowtie1_idx,
                                                      base.normalize_percentile,
                                                      ab.Url(
                                                         path_join(elastic,
@@ -5522,7 +5587,6 @@ class RailRnaAlign(object):
                                                      else path_join(elastic,
                                                         base.output_dir,
                                                         'coverage_bigwigs'),
-                                                     base.bedgraphtobigwig_exe,
                                                      manifest,
                                                      verbose,
                                                      scratch,
@@ -5954,6 +6018,7 @@ class RailRnaLocalAlignJson(object):
         motif_radius=5, genome_bowtie1_args='-v 0 -a -m 80',
         transcriptome_bowtie2_args='-k 30', experimental=False,
         count_multiplier=15, max_refs_per_strand=300,
+        coalesce_bytes=0, index_cache=None,
         junction_criteria='0.5,5', indel_criteria='0.5,5', tie_margin=6,
         transcriptome_indexes_per_sample=500, normalize_percentile=0.75,
         drop_deletions=False, do_not_output_bam_by_chr=False,
@@ -6000,6 +6065,8 @@ class RailRnaLocalAlignJson(object):
             indel_criteria=indel_criteria,
             transcriptome_bowtie2_args=transcriptome_bowtie2_args,
             count_multiplier=count_multiplier,
+            coalesce_bytes=coalesce_bytes,
+            index_cache=index_cache,
             experimental=experimental,
             max_refs_per_strand=max_refs_per_strand,
             tie_margin=tie_margin,
@@ -6044,6 +6111,7 @@ class RailRnaParallelAlignJson(object):
         motif_radius=5, genome_bowtie1_args='-v 0 -a -m 80',
         transcriptome_bowtie2_args='-k 30', experimental=False,
         count_multiplier=15, max_refs_per_strand=300,
+        coalesce_bytes=0, index_cache=None,
         junction_criteria='0.5,5', indel_criteria='0.5,5', tie_margin=6,
         transcriptome_indexes_per_sample=500, normalize_percentile=0.75,
         drop_deletions=False, do_not_output_bam_by_chr=False,
@@ -6102,6 +6170,8 @@ class RailRnaParallelAlignJson(object):
             transcriptome_bowtie2_args=transcriptome_bowtie2_args,
             experimental=experimental,
             count_multiplier=count_multiplier,
+            coalesce_bytes=coalesce_bytes,
+            index_cache=index_cache,
             max_refs_per_strand=max_refs_per_strand,
             tie_margin=tie_margin,
             normalize_percentile=normalize_percentile,
@@ -6157,6 +6227,8 @@ class RailRnaParallelAlignJson(object):
             transcriptome_bowtie2_args=transcriptome_bowtie2_args,
             experimental=experimental,
             count_multiplier=count_multiplier,
+            coalesce_bytes=coalesce_bytes,
+            index_cache=index_cache,
             max_refs_per_strand=max_refs_per_strand,
             tie_margin=tie_margin,
             normalize_percentile=normalize_percentile,
@@ -6214,6 +6286,7 @@ class RailRnaElasticAlignJson(object):
         motif_radius=5, genome_bowtie1_args='-v 0 -a -m 80',
         transcriptome_bowtie2_args='-k 30', experimental=False,
         count_multiplier=15, max_refs_per_strand=300,
+        coalesce_bytes=0, index_cache=None,
         junction_criteria='0.5,5', indel_criteria='0.5,5', tie_margin=6,
         transcriptome_indexes_per_sample=500, normalize_percentile=0.75,
         drop_deletions=False, do_not_output_bam_by_chr=False,
@@ -6294,6 +6367,8 @@ class RailRnaElasticAlignJson(object):
             transcriptome_bowtie2_args=transcriptome_bowtie2_args,
             experimental=experimental,
             count_multiplier=count_multiplier,
+            coalesce_bytes=coalesce_bytes,
+            index_cache=index_cache,
             max_refs_per_strand=max_refs_per_strand,
             tie_margin=tie_margin,
             normalize_percentile=normalize_percentile,
@@ -6372,6 +6447,7 @@ class RailRnaLocalAllJson(object):
         junction_criteria='0.5,5', indel_criteria='0.5,5',
         transcriptome_bowtie2_args='-k 30', tie_margin=6,
         max_refs_per_strand=300, experimental=False, count_multiplier=15,
+        coalesce_bytes=0, index_cache=None,
         transcriptome_indexes_per_sample=500, normalize_percentile=0.75,
         drop_deletions=False, do_not_output_bam_by_chr=False,
         do_not_output_ave_bw_by_chr=False,
@@ -6423,6 +6499,8 @@ class RailRnaLocalAllJson(object):
             transcriptome_bowtie2_args=transcriptome_bowtie2_args,
             experimental=experimental,
             count_multiplier=count_multiplier,
+            coalesce_bytes=coalesce_bytes,
+            index_cache=index_cache,
             max_refs_per_strand=max_refs_per_strand,
             junction_criteria=junction_criteria,
             indel_criteria=indel_criteria,
@@ -6480,6 +6558,7 @@ class RailRnaParallelAllJson(object):
         junction_criteria='0.5,5', indel_criteria='0.5,5',
         transcriptome_bowtie2_args='-k 30', tie_margin=6,
         max_refs_per_strand=300, experimental=False, count_multiplier=15,
+        coalesce_bytes=0, index_cache=None,
         transcriptome_indexes_per_sample=500, normalize_percentile=0.75,
         drop_deletions=False, do_not_output_bam_by_chr=False,
         do_not_output_ave_bw_by_chr=False,
@@ -6540,6 +6619,8 @@ class RailRnaParallelAllJson(object):
             transcriptome_bowtie2_args=transcriptome_bowtie2_args,
             experimental=experimental,
             count_multiplier=count_multiplier,
+            coalesce_bytes=coalesce_bytes,
+            index_cache=index_cache,
             max_refs_per_strand=max_refs_per_strand,
             junction_criteria=junction_criteria,
             indel_criteria=indel_criteria,
@@ -6597,6 +6678,8 @@ class RailRnaParallelAllJson(object):
             transcriptome_bowtie2_args=transcriptome_bowtie2_args,
             experimental=experimental,
             count_multiplier=count_multiplier,
+            coalesce_bytes=coalesce_bytes,
+            index_cache=index_cache,
             max_refs_per_strand=max_refs_per_strand,
             junction_criteria=junction_criteria,
             indel_criteria=indel_criteria,
@@ -6667,6 +6750,7 @@ class RailRnaElasticAllJson(object):
         motif_radius=5, genome_bowtie1_args='-v 0 -a -m 80',
         transcriptome_bowtie2_args='-k 30', tie_margin=6,
         max_refs_per_strand=300, experimental=False, count_multiplier=15,
+        coalesce_bytes=0, index_cache=None,
         junction_criteria='0.5,5', indel_criteria='0.5,5',
         normalize_percentile=0.75, transcriptome_indexes_per_sample=500,
         drop_deletions=False, do_not_output_bam_by_chr=False,
@@ -6749,6 +6833,8 @@ class RailRnaElasticAllJson(object):
             transcriptome_bowtie2_args=transcriptome_bowtie2_args,
             experimental=experimental,
             count_multiplier=count_multiplier,
+            coalesce_bytes=coalesce_bytes,
+            index_cache=index_cache,
             max_refs_per_strand=max_refs_per_strand,
             junction_criteria=junction_criteria,
             indel_criteria=indel_criteria,
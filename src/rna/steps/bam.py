@@ -54,7 +54,9 @@ BAM or SAM files, at least one for each sample, with valid header
 consolidating end-to-end SAM output lines of Rail-RNA-align and spliced
 alignments of Rail-RNA-realign. If --output-by-chromosome is True, each output
 file for a given sample corresponds to a different RNAME. Otherwise, there is
-only one output file consolidating all SAM input.
+only one output file consolidating all SAM input. Small BAMs and their
+indexes are written directly, and larger BAMs are written with samtools; see
+bam_writer.py.
 """
 import os
 import sys
@@ -82,10 +84,10 @@ import manifest
 import version
 import filemover
 from dooplicity.ansibles import Url
-from dooplicity.tools import register_cleanup, make_temp_dir, xstream
+from dooplicity.tools import register_cleanup, make_temp_dir, xstream, which
 from dooplicity.counters import Counter
 from alignment_handlers import SampleAndRnameIndexes
-import subprocess
+from bam_writer import SizedBamWriter
 import tempdel
 
 # Print file's docstring if -h is invoked
@@ -115,7 +117,18 @@ parser.add_argument(\
 parser.add_argument(\
     '--samtools-exe', metavar='EXE', type=str, required=False,
     default='samtools',
-    help='Path to executable for samtools')
+    help='Path to executable for samtools, which writes and indexes BAMs '
+         'with more records than --in-process-bam-records')
+parser.add_argument(\
+    '--in-process-bam-records', metavar='<int>', type=int, required=False,
+    default=300,
+    help='BAMs with at most this many records are written and indexed '
+         'without starting samtools, which is faster for small BAMs')
+parser.add_argument(\
+    '--compression-threads', metavar='<int>', type=int, required=False,
+    default=1,
+    help='Number of threads that compress blocks of each BAM written '
+         'without samtools')
 parser.add_argument(\
     '--keep-alive', action='store_const', const=True, default=False,
     help='Prints reporter:status:alive messages to stderr to keep EMR '
@@ -203,10 +216,16 @@ if args.suppress_bam:
                                                  total_count, unique_count)
 else:
     # Grab stats _and_ output SAM/BAMs
-    if not args.output_sam:
-        # Only need subprocess to start samtools if outputting bam
-        import subprocess
-
+    if args.output_sam:
+        samtools_exe = None
+    else:
+        samtools_exe = which(os.path.expandvars(args.samtools_exe))
+        if samtools_exe is None:
+            print >>sys.stderr, (
+                    'Warning: samtools executable "%s" was not found, so '
+                    'every BAM is written without it, which is slower for '
+                    'large BAMs.' % args.samtools_exe
+                )
     # Get RNAMEs in order of descending length
     sorted_rnames = [reference_index.string_to_rname['%012d' % i]
                         for i in xrange(
@@ -231,11 +250,29 @@ else:
                                 [temp_dir_path])
             output_dir = temp_dir_path
 
+    class SamWriter(object):
+        """ Writes SAM fields as lines to a stream; mirrors BamWriter. """
+        def __init__(self, output_stream):
+            """
+                output_stream: where to write SAM
+            """
+            self.output_stream = output_stream
+
+        def write(self, fields):
+            """ Writes one record.
+
+                fields: list of SAM fields
+
+                No return value.
+            """
+            print >>self.output_stream, '\t'.join(fields)
+
     from contextlib import contextmanager
     @contextmanager
     def stream_and_upload(rnames, filename=None, mover=None, output_url=None,
-                            sam=False, samtools_exe=None):
-        """ Yields output stream to write to and uploads as necessary
+                            sam=False, samtools_exe=None,
+                            compression_threads=1):
+        """ Yields writer of SAM fields and uploads as necessary
 
             sorted_rnames: list of rnames in order of descending length
             filename: full path to file to write or None if writing to stdout
@@ -243,9 +280,11 @@ else:
             output_url: url to which to write or None if no moving should be
                 performed
             sam: True iff sam should be output
-            samtools_exe: path to samtools exe if necessary; else None
+            samtools_exe: path to samtools exe, or None if BAMs should be
+                written without it
+            compression_threads: number of threads that compress BAM blocks
 
-            Yield value: stream
+            Yield value: SamWriter or SizedBamWriter
         """
         '''Write SAM header; always include all reference sequences to
         avoid confusing users.'''
@@ -265,14 +304,14 @@ else:
         if filename is None:
             try:
                 print header
-                yield sys.stdout
+                yield SamWriter(sys.stdout)
             finally:
                 pass
         elif sam:
             try:
                 output_stream = open(filename, 'w')
                 print >>output_stream, header
-                yield output_stream
+                yield SamWriter(output_stream)
             finally:
                 output_stream.close()
                 if not output_url.is_local:
@@ -280,38 +319,26 @@ else:
                               output_url.plus(os.path.basename(filename)))
                     os.remove(filename)
         else:
+            unmapped = filename.endswith('.unmapped.bam')
+            bam_writer = SizedBamWriter(
+                    filename, header,
+                    [(header_rname,
+                        reference_index.rname_lengths[header_rname])
+                        for header_rname in sorted_rnames],
+                    samtools_exe, max_records=args.in_process_bam_records,
+                    index=(not unmapped), threads=compression_threads
+                )
             try:
-                samtools_stream = open(filename, 'wb')
-                samtools_process = subprocess.Popen(
-                            [samtools_exe, 'view', '-bS', '-'],
-                            stdin=subprocess.PIPE,
-                            stdout=samtools_stream
-                        )
-                output_stream = samtools_process.stdin
-                print >>output_stream, header
-                yield output_stream
+                yield bam_writer
             finally:
-                output_stream.close()
-                samtools_return = samtools_process.wait()
-                if samtools_return:
-                    raise RuntimeError(
-                            'samtools returned exit code %d' 
-                                % samtools_return
-                        )
-                samtools_stream.close()
-                # Index bam
-                unmapped = filename.endswith('.unmapped.bam')
-                if not unmapped:
-                    subprocess.check_call([samtools_exe, 'index',
-                                            filename],
-                                            bufsize=-1)
+                bam_writer.close()
                 if not output_url.is_local:
                     mover.put(filename, 
                               output_url.plus(os.path.basename(filename)))
                     if not unmapped:
                         bai = filename + '.bai'
                         mover.put(
-                                filename, 
+                                bai, 
                                 output_url.plus(os.path.basename(bai))
                             )
                         os.remove(bai)
@@ -343,8 +370,9 @@ else:
                                else None),
                         output_url=(None if args.out is None else output_url),
                         sam=args.output_sam,
-                        samtools_exe=args.samtools_exe
-                    ) as output_stream:
+                        samtools_exe=samtools_exe,
+                        compression_threads=args.compression_threads
+                    ) as alignment_writer:
                 for record in xpartition:
                     sam_line_to_print = [record[1][:254], record[2], rname,
                                          str(int(record[0]))] + [
@@ -353,7 +381,7 @@ else:
                                                 else token)
                                                 for token in record[3:]]
                     try:
-                        print >>output_stream, '\t'.join(sam_line_to_print)
+                        alignment_writer.write(sam_line_to_print)
                         counter.add('sam_line')
                     except IOError:
                         raise IOError(
@@ -392,8 +420,9 @@ else:
                                else None),
                         output_url=(None if args.out is None else output_url),
                         sam=args.output_sam,
-                        samtools_exe=args.samtools_exe
-                    ) as output_stream:
+                        samtools_exe=samtools_exe,
+                        compression_threads=args.compression_threads
+                    ) as alignment_writer:
                 for record in xpartition:
                     sam_line_to_print = [record[1][:254], record[2], rname,
                                          str(int(record[0]))] + [
@@ -402,7 +431,7 @@ else:
                                                 else token)
                                                 for token in record[3:]]
                     try:
-                        print >>output_stream, '\t'.join(sam_line_to_print)
+                        alignment_writer.write(sam_line_to_print)
                         counter.add('sam_line')
                     except IOError:
                         raise IOError(
@@ -97,29 +97,22 @@ for (rname, poses, end_poses), xpartition in xstream(sys.stdin, 3,
     assert max_left_extend_size is not None
     assert max_right_extend_size is not None
     reference_length = reference_index.length[rname]
-    subseqs = []
     left_start = max(junction_combo[0][0] - max_left_extend_size, 1)
-    # Add sequence before first junction
-    subseqs.append(
-            reference_index.get_stretch(rname, left_start - 1, 
-                junction_combo[0][0] - left_start)
-        )
-    # Add sequences between junctions
+    # Sequence before first junction
+    stretches = [(rname, left_start - 1, junction_combo[0][0] - left_start)]
+    # Sequences between junctions
     for i in xrange(1, len(junction_combo)):
-        subseqs.append(
-                reference_index.get_stretch(rname, 
-                    junction_combo[i-1][1] - 1,
-                    junction_combo[i][0]
-                    - junction_combo[i-1][1]
-                )
+        stretches.append(
+                (rname, junction_combo[i-1][1] - 1,
+                    junction_combo[i][0] - junction_combo[i-1][1])
             )
-    # Add final sequence
-    subseqs.append(
-            reference_index.get_stretch(rname,
-                junction_combo[-1][1] - 1,
-                min(max_right_extend_size, reference_length - 
-                                    junction_combo[-1][1] + 1))
+    # Final sequence
+    stretches.append(
+            (rname, junction_combo[-1][1] - 1,
+                min(max_right_extend_size,
+                        reference_length - junction_combo[-1][1] + 1))
         )
+    subseqs = reference_index.get_stretches(stretches)
     counter.add('get_stretch', len(junction_combo)+1)
     counter.add('ref_bases_extracted', reference_length)
     '''A given reference name in the index will be in the following format:
@@ -151,6 +144,8 @@ for (rname, poses, end_poses), xpartition in xstream(sys.stdin, 3,
             print '\t'.join([group_reads_object.index_group(read_seq),
                                 read_seq, fasta_info])
 
+counter.add('stretch_cache_hits', reference_index.cache_hits)
+counter.add('stretch_cache_misses', reference_index.cache_misses)
 print >>sys.stderr, 'DONE with cojunction_fasta.py; in=%d; ' \
                     'time=%0.3f s' % (input_line_count,
                                         time.time() - start_time)
@@ -44,14 +44,13 @@ Other output (written to directory specified by command-line parameter --out)
 ----------------------------
 Two bigWig files per sample: one encodes coverage of genome by exonic parts of
 primary alignments, and the other encodes coverage of genome by uniquely
-mapping reads
+mapping reads. bigWigs are written directly from runs of constant coverage;
+see bigwig.py.
 """
 import os
 import sys
 import site
 import argparse
-import subprocess
-import threading
 
 if '--test' in sys.argv:
     print("No unit tests")
@@ -72,7 +71,8 @@ import bowtie
 import bowtie_index
 import filemover
 import itertools
-from collections import defaultdict
+from bigwig import BigWigWriter
+from coverage_histogram import CoverageHistogram
 from dooplicity.tools import xstream, register_cleanup, make_temp_dir
 from dooplicity.counters import Counter
 from dooplicity.ansibles import Url
@@ -96,7 +96,8 @@ parser.add_argument('--manifest', type=str, required=False,
         help='Path to manifest file')
 parser.add_argument(
     '--bigwig-exe', type=str, required=False, default='bedGraphToBigWig',
-    help='Location of the Kent Tools bedGraphToBigWig executable')
+    help='DEPRECATED and ignored; bigWigs are now written without the Kent '
+         'Tools bedGraphToBigWig executable')
 parser.add_argument('--bigwig-basename', type=str, required=False, default='',
     help='The basename (excluding path) of all bigwig output. Basename is'
          'followed by ".[sample label].bw"; if basename is an empty string, '
@@ -118,58 +119,25 @@ bowtie.add_args(parser)
 tempdel.add_args(parser)
 args = parser.parse_args()
 
+if args.bigwig_exe != parser.get_default('bigwig_exe'):
+    print >>sys.stderr, (
+            'Warning: --bigwig-exe is deprecated and ignored; bigWigs are '
+            'written without bedGraphToBigWig, so "%s" is not run.'
+            % args.bigwig_exe
+        )
+
 # Start keep_alive thread immediately
 if args.keep_alive:
     from dooplicity.tools import KeepAlive
     keep_alive_thread = KeepAlive(sys.stderr)
     keep_alive_thread.start()
 
-if args.keep_alive:
-    class BedTobigwigThread(threading.Thread):
-        """ Wrapper class for bedtobigwig that permits polling for completion.
-        """
-        def __init__(self, command_list):
-            super(BedTobigwigThread, self).__init__()
-            self.command_list = command_list
-            self.bedtobigwig_process = None
-        def run(self):
-            self.bedtobigwig_process = subprocess.Popen(self.command_list,
-                                            stdout=sys.stderr,
-                                            stderr=sys.stderr).wait()
-
-def percentile(histogram, percentile=0.75):
-    """ Given histogram, computes desired percentile.
-
-        histogram: a dictionary whose keys are integers
-            and whose values are frequencies.
-        percentile: a value k on [0, 100] specifying that the (k*100)-th
-            percentile should be returned
-
-        Return value: Integer key closest to desired percentile.
-    """
-    covered = 0
-    normalization = sum(histogram.values())
-    for key, frequency in sorted(histogram.items(), reverse=True):
-        covered += frequency
-        assert covered <= normalization
-        if covered > ((1.0 - percentile) * normalization):
-            return key
-    raise RuntimeError('Percentile computation should have terminated '
-                       'mid-loop.')
-
 import time
 start_time = time.time()
 
 temp_dir_path = make_temp_dir(tempdel.silentexpandvars(args.scratch))
 # Clean up after script
 register_cleanup(tempdel.remove_temporary_directories, [temp_dir_path])
-bed_filename = os.path.join(temp_dir_path, 'temp.bed')
-unique_bed_filename = os.path.join(temp_dir_path, 'temp.unique.bed')
-if args.verbose:
-    print >>sys.stderr, 'Writing to temporary beds %s and %s.' % (
-            bed_filename,
-            unique_bed_filename
-        )
 output_filename, output_url = None, None
 
 '''Make RNAME lengths available from reference FASTA so SAM header can be
@@ -181,25 +149,17 @@ reference_index = bowtie_index.BowtieIndexReference(
 manifest_object = manifest.LabelsAndIndices(
                         os.path.expandvars(args.manifest)
                     )
-# Create file with chromosome sizes for bedTobigwig
-sizes_filename = os.path.join(temp_dir_path, 'chrom.sizes')
-if args.verbose:
-    print >>sys.stderr, 'Sizes file: %s .' % sizes_filename
-with open(sizes_filename, 'w') as sizes_stream:
-    for rname in reference_index.rname_lengths:
-        print >>sizes_stream, '%s %d' % (rname, 
-            reference_index.rname_lengths[rname])
 
 input_line_count, output_line_count = 0, 0
+coverage_histogram, unique_coverage_histogram = (
+        CoverageHistogram(), CoverageHistogram()
+    )
 output_url = Url(args.out)
 if output_url.is_local:
     # Set up destination directory
     try: os.makedirs(output_url.to_url())
     except: pass
 mover = filemover.FileMover(args=args)
-track_line = ('track type=bedGraph name="{name}" '
-         'description="{description}" visibility=full '
-         'color=227,29,118 altColor=0,179,220 priority=400')
 for (sample_index,), xpartition in xstream(sys.stdin, 1):
     counter.add('partitions')
     real_sample = True
@@ -222,100 +182,6 @@ for (sample_index,), xpartition in xstream(sys.stdin, 1):
         else:
             raise RuntimeError('Sample label index "%s" was not recorded.'
                                 % sample_index)
-    '''Dictionary for which each key is a coverage (i.e., number of ECs
-    covering a given base). Its corresponding value is the number of bases with
-    that coverage.'''
-    coverage_histogram, unique_coverage_histogram = (
-            defaultdict(int),
-            defaultdict(int)
-        )
-    with open(bed_filename, 'w') as bed_stream, \
-        open(unique_bed_filename, 'w') as unique_bed_stream:
-        print >>bed_stream, track_line.format(name=sample_label,
-                                              description=(
-                                                    'base coverage by '
-                                                    'primary alignments'
-                                                ))
-        print >>unique_bed_stream, track_line.format(name=sample_label,
-                                                     description=(
-                                                        'base coverage by '
-                                                        'uniquely mapping '
-                                                        'reads')
-                                                     )
-        for rname, coverages in itertools.groupby(xpartition, 
-                                                    key=lambda val: val[0]):
-            try:
-                rname = reference_index.l_string_to_rname[rname]
-            except KeyError:
-                raise RuntimeError(
-                        'RNAME number string "%s" not in Bowtie index.' 
-                        % rname
-                    )
-            (last_pos, last_coverage,
-                last_unique_pos, last_unique_coverage) = 0, 0, 0, 0
-            for _, pos, coverage, unique_coverage in coverages:
-                # BED is zero-indexed, while input is 1-indexed
-                pos, coverage, unique_coverage = (
-                        int(pos) - 1, float(coverage), float(unique_coverage)
-                    )
-                input_line_count += 1
-                if coverage != last_coverage:
-                    counter.add('bed_lines')
-                    print >>bed_stream, '%s\t%d\t%d\t%08f' % (rname,
-                        last_pos, pos, last_coverage)
-                    if last_coverage != 0:
-                        # Only care about nonzero-coverage regions
-                        coverage_histogram[last_coverage] += pos - last_pos
-                    last_pos, last_coverage = pos, coverage
-                if unique_coverage != last_unique_coverage:
-                    counter.add('unique_bed_lines')
-                    print >>unique_bed_stream, '%s\t%d\t%d\t%08f' % (rname,
-                        last_unique_pos, pos, last_unique_coverage)
-                    if last_unique_coverage != 0:
-                        # Only care about nonzero-coverage regions
-                        unique_coverage_histogram[last_unique_coverage] \
-                            += pos - last_unique_pos
-                    last_unique_pos, last_unique_coverage = (
-                            pos,
-                            unique_coverage
-                        )
-            if last_pos != reference_index.rname_lengths[rname]:
-                # Print coverage up to end of strand
-                counter.add('bed_lines')
-                print >>bed_stream, '%s\t%d\t%d\t%08f' % (
-                        rname,
-                        last_pos,
-                        reference_index.rname_lengths[rname],
-                        coverage
-                    )
-            if last_unique_pos != reference_index.rname_lengths[rname]:
-                # Print unique coverage up to end of strand
-                counter.add('unique_bed_lines')
-                print >>unique_bed_stream, '%s\t%d\t%d\t%08f' % (
-                        rname,
-                        last_unique_pos,
-                        reference_index.rname_lengths[rname],
-                        unique_coverage
-                    )
-    '''Output normalization factors iff working with real sample'''
-    if real_sample:
-        auc = sum(coverage_value * coverage_histogram[coverage_value]
-                    for coverage_value in coverage_histogram)
-        unique_auc = sum(coverage_value
-                            * unique_coverage_histogram[coverage_value]
-                        for coverage_value in unique_coverage_histogram)
-        print '4\t%s\t\x1c\t\x1c\t\x1c\t%d\t%d\t%d\t%d' % (sample_index,
-                                                percentile(coverage_histogram,
-                                                            args.percentile),
-                                                percentile(
-                                                    unique_coverage_histogram,
-                                                    args.percentile),
-                                                auc,
-                                                unique_auc
-                                            )
-    output_line_count += 1
-    # Write bigwigs
-    assert os.path.exists(sizes_filename)
     bigwig_filenames = [((args.bigwig_basename + '.') 
                         if args.bigwig_basename != '' else '')
                         + sample_label]*2
@@ -329,35 +195,89 @@ for (sample_index,), xpartition in xstream(sys.stdin, 1):
         # Write to temporary directory, and later upload to URL
         bigwig_file_paths = [os.path.join(temp_dir_path, bigwig_filename)
                                 for bigwig_filename in bigwig_filenames]
-    bigwig_commands = [[args.bigwig_exe, bed_filename, sizes_filename,
-                        bigwig_file_paths[0]], 
-                       [args.bigwig_exe, unique_bed_filename, sizes_filename,
-                        bigwig_file_paths[1]]]
-    for i, bigwig_command in enumerate(bigwig_commands):
-        if args.verbose:
-            print >>sys.stderr, 'Writing bigwig with command %s .' \
-                % ' '.join(bigwig_command)
-        counter.add('call_bedgraphtobigwig')
-        bedtobigwig_process = subprocess.Popen(
-                                    bigwig_command,
-                                    stderr=sys.stderr,
-                                    stdout=sys.stderr,
-                                    bufsize=-1
-                                )
-        bedtobigwig_process.wait()
-        if bedtobigwig_process.returncode:
-            raise RuntimeError('bedgraphtobigwig process failed w/ '
-                               'exitlevel %d.'
-                                % bedtobigwig_process.returncode)
-        if args.verbose:
-            print >>sys.stderr, ('bedTobigwig command %s succeeded .'
-                                  % ' '.join(bigwig_command))
-        if not output_url.is_local:
-            # bigwig must be uploaded to URL and deleted
+    if args.verbose:
+        print >>sys.stderr, 'Writing bigwigs %s and %s .' % (
+                bigwig_file_paths[0], bigwig_file_paths[1]
+            )
+    bigwig_writer, unique_bigwig_writer = [
+            BigWigWriter(bigwig_file_path, reference_index.rname_lengths)
+            for bigwig_file_path in bigwig_file_paths
+        ]
+    '''Histograms of numbers of bases by coverage (i.e., number of ECs
+    covering a given base).'''
+    coverage_histogram.reset()
+    unique_coverage_histogram.reset()
+    for rname, coverages in itertools.groupby(xpartition, 
+                                                key=lambda val: val[0]):
+        try:
+            rname = reference_index.l_string_to_rname[rname]
+        except KeyError:
+            raise RuntimeError(
+                    'RNAME number string "%s" not in Bowtie index.' 
+                    % rname
+                )
+        (last_pos, last_coverage,
+            last_unique_pos, last_unique_coverage) = 0, 0, 0, 0
+        for _, pos, coverage, unique_coverage in coverages:
+            # BED is zero-indexed, while input is 1-indexed
+            pos, coverage, unique_coverage = (
+                    int(pos) - 1, float(coverage), float(unique_coverage)
+                )
+            input_line_count += 1
+            if coverage != last_coverage:
+                counter.add('bed_lines')
+                # Rounded as bedGraph output was
+                bigwig_writer.add(rname, last_pos, pos,
+                                    round(last_coverage, 6))
+                if last_coverage != 0:
+                    # Only care about nonzero-coverage regions
+                    coverage_histogram.add(last_coverage, pos - last_pos)
+                last_pos, last_coverage = pos, coverage
+            if unique_coverage != last_unique_coverage:
+                counter.add('unique_bed_lines')
+                unique_bigwig_writer.add(rname, last_unique_pos, pos,
+                                            round(last_unique_coverage, 6))
+                if last_unique_coverage != 0:
+                    # Only care about nonzero-coverage regions
+                    unique_coverage_histogram.add(last_unique_coverage,
+                                                    pos - last_unique_pos)
+                last_unique_pos, last_unique_coverage = (
+                        pos,
+                        unique_coverage
+                    )
+        if last_pos != reference_index.rname_lengths[rname]:
+            # Add coverage up to end of strand
+            counter.add('bed_lines')
+            bigwig_writer.add(rname, last_pos,
+                                reference_index.rname_lengths[rname],
+                                round(coverage, 6))
+        if last_unique_pos != reference_index.rname_lengths[rname]:
+            # Add unique coverage up to end of strand
+            counter.add('unique_bed_lines')
+            unique_bigwig_writer.add(rname, last_unique_pos,
+                                        reference_index.rname_lengths[rname],
+                                        round(unique_coverage, 6))
+    bigwig_writer.close()
+    unique_bigwig_writer.close()
+    '''Output normalization factors iff working with real sample'''
+    if real_sample:
+        print '4\t%s\t\x1c\t\x1c\t\x1c\t%d\t%d\t%d\t%d' % (sample_index,
+                                coverage_histogram.percentile(
+                                                    args.percentile),
+                                unique_coverage_histogram.percentile(
+                                                    args.percentile),
+                                coverage_histogram.auc(),
+                                unique_coverage_histogram.auc()
+                            )
+    output_line_count += 1
+    counter.add('bigwigs_written', 2)
+    if not output_url.is_local:
+        # bigwigs must be uploaded to URL and deleted
+        for bigwig_file_path, bigwig_filename in zip(bigwig_file_paths,
+                                                     bigwig_filenames):
             counter.add('files_moved')
-            mover.put(bigwig_file_paths[i],
-                        output_url.plus(bigwig_filenames[i]))
-            os.remove(bigwig_file_paths[i])
+            mover.put(bigwig_file_path, output_url.plus(bigwig_filename))
+            os.remove(bigwig_file_path)
 
 print >>sys.stderr, 'DONE with coverage.py; in/out=%d/%d; time=%0.3f s' \
                         % (input_line_count, output_line_count,
@@ -90,10 +90,9 @@ site.addsitedir(base_path)
 import bowtie
 import bowtie_index
 import manifest
+from coverage_accumulator import SampleCoverageAccumulator
 from dooplicity.tools import xstream, xopen, register_cleanup
 from dooplicity.counters import Counter
-from collections import defaultdict
-from re import search
 
 parser = argparse.ArgumentParser(description=__doc__, 
             formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -127,23 +126,6 @@ bowtie.add_args(parser)
 manifest.add_args(parser)
 args = parser.parse_args()
 
-def median(a_list):
-    """ Finds canonically defined median of list.
-
-        a_list: a list
-
-        Return value: median
-    """
-    if not a_list:
-        # Median's nothing for empty input in this case
-        return 0
-    sorted_list = sorted(a_list)
-    list_size = len(a_list)
-    index = (list_size - 1) // 2
-    if (list_size % 2):
-        return sorted_list[index]
-    return (sorted_list[index] + sorted_list[index + 1]) / 2.0
-
 library_size = args.library_size * 1000000
 start_time = time.time()
 input_line_count, output_line_count = 0, 0
@@ -169,16 +151,13 @@ with xopen(None, args.read_counts) as read_count_stream:
                                         int(token) for token
                                         in tokens[-2].split(',')
                                     ]
-try:
-    mean_weight = 1. / len([_ for _ in mapped_read_counts.values() if _])
-except ZeroDivisionError:
-    mean_weight = 0.0
-try:
-    unique_mean_weight = 1. / len(
-                        [_ for _ in unique_mapped_read_counts.values() if _]
-                    )
-except ZeroDivisionError:
-    unique_mean_weight = 0.0
+sample_count = len(manifest_object.index_to_label)
+accumulator = SampleCoverageAccumulator(
+        sample_count,
+        [mapped_read_counts[str(i)] for i in xrange(sample_count)],
+        [unique_mapped_read_counts[str(i)] for i in xrange(sample_count)],
+        library_size
+    )
 
 for (partition_id,), xpartition in xstream(sys.stdin, 1):
     counter.add('partitions')
@@ -190,10 +169,7 @@ for (partition_id,), xpartition in xstream(sys.stdin, 1):
     coverage_tsv_rname = (('.' + rname)
                             if args.output_coverage_tsv_by_chr else '')
     rname_index = reference_index.l_rname_to_string[rname]
-    coverages, unique_coverages = defaultdict(int), defaultdict(int)
-    nonref_coverages, unique_nonref_coverages = (
-            defaultdict(int), defaultdict(int)
-        )
+    accumulator.reset()
     for (pos, sample_indexes_and_diffs) in itertools.groupby(
                                             xpartition, lambda val: val[0]
                                         ):
@@ -204,57 +180,21 @@ for (partition_id,), xpartition in xstream(sys.stdin, 1):
         for sample_index, diffs in itertools.groupby(
                                 sample_indexes_and_diffs, lambda val: val[1]
                             ):
-            try:
-                int(sample_index)
-            except ValueError:
-                # Not a sample index to be written to coverage TSV
-                pass
-            else:
+            if accumulator.parsed(sample_index)[0] < sample_count:
+                # A sample index to be written to coverage TSV
                 sample_indexes.append(sample_index)
-            for _, _, uniqueness, diff in diffs:
-                diff = int(diff)
-                coverages[sample_index] += diff
-                if uniqueness == '1':
-                    unique_coverages[sample_index] += diff
-                if search('\.[ATCG]', sample_index):
-                    # All non-N nonreference bases go here
-                    real_sample_index = sample_index[:-2]
-                    nonref_coverages[real_sample_index] += diff
-                    if uniqueness == '1':
-                        unique_nonref_coverages[real_sample_index] += diff
-                bin_diff_count += 1
+            diffs = list(diffs)
+            bin_diff_count += len(diffs)
+            coverage, unique_coverage = accumulator.add(sample_index, diffs)
             counter.add('coverage_lines')
             print 'coverage\t%s\t%s\t%012d\t%d\t%d' % (
                         sample_index, 
-                        rname_index, pos, coverages[sample_index],
-                        unique_coverages[sample_index]
+                        rname_index, pos, coverage, unique_coverage
                     )
             output_line_count += 1
-        # Now output measures of center
-        coverage_row = [float(coverages[sample_index])
-                         / mapped_read_counts[sample_index]
-                         * library_size
-                        for sample_index in manifest_object.index_to_label
-                        if mapped_read_counts[sample_index]]
-        unique_coverage_row = [float(unique_coverages[sample_index])
-                                / unique_mapped_read_counts[sample_index]
-                                * library_size
-                               for sample_index
-                               in manifest_object.index_to_label
-                               if unique_mapped_read_counts[sample_index]]
-        nonref_coverage_row = [float(nonref_coverages[sample_index])
-                                / mapped_read_counts[sample_index]
-                                * library_size
-                                for sample_index
-                                in manifest_object.index_to_label
-                                if mapped_read_counts[sample_index]]
-        unique_nonref_coverage_row = [
-                    float(unique_nonref_coverages[sample_index])
-                        / unique_mapped_read_counts[sample_index]
-                        * library_size
-                        for sample_index in manifest_object.index_to_label
-                        if unique_mapped_read_counts[sample_index]
-                ]
+        (mean, unique_mean, median, unique_median,
+            nonref_mean, unique_nonref_mean,
+            nonref_median, unique_nonref_median) = accumulator.centers()
         # Print TSV coverage line
         if sample_indexes:
             # Print TSV coverage line
@@ -265,34 +205,25 @@ for (partition_id,), xpartition in xstream(sys.stdin, 1):
                             pos='%012d' % pos,
                             sample_indexes=','.join(sample_indexes),
                             sample_coverages=','.join([
-                                        str(coverages[sample_index])
+                                        str(accumulator.coverage(sample_index))
                                         for sample_index in sample_indexes
                                     ])
                         )
         print 'coverage\t%s\t%s\t%012d\t%08f\t%08f' % (
                 'mean' + ave_bigwig_rname, 
-                rname_index, pos,
-                sum([cov * mean_weight for cov in coverage_row]),
-                sum([cov * unique_mean_weight for cov in unique_coverage_row])
+                rname_index, pos, mean, unique_mean
             )
         print 'coverage\t%s\t%s\t%012d\t%08f\t%08f' % (
                 'median' + ave_bigwig_rname, 
-                rname_index, pos,
-                median(coverage_row),
-                median(unique_coverage_row)
+                rname_index, pos, median, unique_median
             )
         print 'coverage\t%s\t%s\t%012d\t%08f\t%08f' % (
                 'mean.nonref' + ave_bigwig_rname, 
-                rname_index, pos,
-                sum([cov * mean_weight for cov in nonref_coverage_row]),
-                sum([cov * unique_mean_weight for cov
-                        in unique_nonref_coverage_row])
+                rname_index, pos, nonref_mean, unique_nonref_mean
             )
         print 'coverage\t%s\t%s\t%012d\t%08f\t%08f' % (
                 'median.nonref' + ave_bigwig_rname, 
-                rname_index, pos,
-                median(nonref_coverage_row),
-                median(unique_nonref_coverage_row)
+                rname_index, pos, nonref_median, unique_nonref_median
             )
 
     if args.partition_stats:
@@ -44,8 +44,13 @@ import argparse
 import time
 from collections import defaultdict
 from collections import deque
+from bisect import bisect_left, bisect_right
 import os
 import site
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 base_path = os.path.abspath(
                     os.path.dirname(os.path.dirname(os.path.dirname(
@@ -62,6 +67,29 @@ _input_line_count, _output_line_count = 0, 0
 counter = Counter('junction_collect')
 register_cleanup(counter.flush)
 
+def sorted_introns(input_stream):
+    """ Collects unique introns from each strand/sample partition.
+
+        input_stream: where to find sorted introns; see
+            edges_from_input_stream()
+
+        Yield value: tuple (key, introns), where key is the tuple
+            (strand, sample index), and introns is a list of unique
+            tuples (intron start, intron end) sorted by start and then end
+            position
+    """
+    global _input_line_count
+    for key, xpartition in xstream(input_stream, 2, skip_duplicates=True):
+        counter.add('partitions')
+        introns = set()
+        for value in xpartition:
+            counter.add('inputs')
+            assert len(value) == 2
+            _input_line_count += 1
+            introns.add((int(value[0]), int(value[1])))
+        counter.add('introns', len(introns))
+        yield key, sorted(introns)
+
 def edges_from_input_stream(input_stream, readlet_size=20,
     min_overlap_exon_size=1):
     """ Generates edges of directed acyclic graph (DAG) of introns.
@@ -110,27 +138,12 @@ def edges_from_input_stream(input_stream, readlet_size=20,
         The input is partitioned by strand/sample index (fields 1-2) and sorted
         by the remaining fields. INPUT COORDINATES ARE ASSUMED TO BE 1-INDEXED.
 
-        Introns are sorted by start position. To begin, the first set of
-        mutually overlapping introns are connected to their new sources. Two
-        data structures encode the graph as it is constructed [1]: the set
-        unlinked_nodes, containing introns that do not yet have any children,
-        and linked_nodes, a dictionary that, where possible, maps each intron A
-        to its corresponding successive nonoverlapping intron B with the
-        smallest end position read so far. With each new intron N read, the
-        nodes in unlinked_nodes and linked_nodes are checked for whether N is
-        their child, and these edges are yielded. (Note that by construction,
-        nodes are streamed in topological order.) Nodes from unlinked_nodes may
-        thus be promoted to linked_nodes. Each value node in linked_nodes is
-        also replaced with N if N has a smaller end position. Then every node A
-        in linked_nodes is checked for a path A -> B -> N. If such a path
-        exists, an edge can NEVER connect A with any successive introns, and A
-        is removed from linked_nodes. The algorithm continues until the end of
-        the strand is reached, when the edges connecting remaining
-        unlinked_nodes and their new sinks are yielded.
-
-        [1] Technically, there are three data structures. unlinked_nodes and
-        linked_nodes contain only indices of introns, and "introns" is
-        a dictionary that maps indices to tuples (intron_start, intron_end).
+        Introns from a partition are collected and sorted by start position,
+        and intron_dag() finds the children and parents of every intron by
+        binary search over the sorted arrays. The edges from the fake source
+        and the edges into each intron are yielded in order of the intron's
+        start position, so nodes are streamed in topological order, and the
+        edges into the fake sinks are yielded at the end of the strand.
 
         input_stream: where to find sorted introns of the form specified above.
         fudge: by how much a readlet_size should be extended.
@@ -143,72 +156,30 @@ def edges_from_input_stream(input_stream, readlet_size=20,
                                     (intron B start, intron B end)) or None
                      at the beginning of a new partition.
     """
-    global _input_line_count
-    for key, xpartition in xstream(input_stream, 2, skip_duplicates=True):
-        counter.add('partitions')
-        unlinked_nodes = set()
-        for q, value in enumerate(xpartition):
-            counter.add('inputs')
-            assert len(value) == 2
-            _input_line_count += 1
-            if not q:
-                # Denote start of new partition
-                counter.add('new_partition')
-                counter.add('introns')
-                yield None
-                # Handle first intron from partition
-                intron_start, intron_end = int(value[0]), int(value[1])
-                # Create fake source before first intron
-                fake_source = (
-                        None,
-                        max(intron_start - (readlet_size - 1), 1)
-                    )
-                introns = {
-                        0 : fake_source,
-                        1 : (intron_start, intron_end)
-                    }
-                linked_nodes = { 0 : 1 }
-                unlinked_nodes = set([1])
-                index = 2
-                # Yield first edge for strand (before first intron)
+    for key, introns in sorted_introns(input_stream):
+        starts = [intron[0] for intron in introns]
+        ends = [intron[1] for intron in introns]
+        (child_indptr, _, parent_indptr,
+            parent_indices) = intron_dag(starts, ends, min_overlap_exon_size)
+        # Denote start of new partition
+        counter.add('new_partition')
+        yield None
+        # Create fake source before first intron
+        fake_source = (None, max(starts[0] - (readlet_size - 1), 1))
+        for j, intron in enumerate(introns):
+            if parent_indptr[j] == parent_indptr[j+1]:
                 counter.add('yielded_edges')
-                yield key + (fake_source,
-                                (intron_start, intron_end))
-            else:
-                # Handle next introns from partition
-                counter.add('introns')
-                intron_start, intron_end = int(value[0]), int(value[1])
-                introns[index] = (intron_start, intron_end)
-                nodes_to_trash = []
-                for node in unlinked_nodes:
-                    if intron_start >= introns[node][1] + \
-                        min_overlap_exon_size:
-                        nodes_to_trash.append(node)
-                for node in nodes_to_trash:
-                    linked_nodes[node] = index
-                    unlinked_nodes.remove(node)
-                unlinked_nodes.add(index)
-                nodes_to_trash = []
-                for node in linked_nodes:
-                    intermediate_node = linked_nodes[node]
-                    if intermediate_node in linked_nodes:
-                        nodes_to_trash.append(node)
-                    else:
-                        counter.add('yielded_edges')
-                        yield key + (introns[node],
-                                            (intron_start, intron_end))
-                        if introns[intermediate_node][1] > intron_end:
-                            linked_nodes[node] = index
-                for node in nodes_to_trash:
-                    del linked_nodes[node]
-                    del introns[node]
-                index += 1
+                yield key + (fake_source, intron)
+                continue
+            counter.add('yielded_edges',
+                        parent_indptr[j+1] - parent_indptr[j])
+            for i in parent_indices[parent_indptr[j]:parent_indptr[j+1]]:
+                yield key + (introns[i], intron)
         # Yield final edges for strand
-        for node in unlinked_nodes:
-            current_intron = introns[node]
-            counter.add('yielded_edges')
-            yield key + (current_intron, (current_intron[1]
-                                            + readlet_size - 1, None))
+        for i, intron in enumerate(introns):
+            if child_indptr[i] == child_indptr[i+1]:
+                counter.add('yielded_edges')
+                yield key + (intron, (intron[1] + readlet_size - 1, None))
 
 def paths(graph, source, in_node, readlet_size, last_node, edge_span=2,
     min_edge_span_size=25, can_yield=False):
@@ -441,9 +412,312 @@ def consume_graph_and_print_combos(DAG, reverse_DAG, readlet_size, strand,
             # Edges from source are no longer needed to construct extensions
             del DAG[source]
 
+class WorkBudgetExhausted(Exception):
+    """ Raised when enumerating combos of a partition takes too much work. """
+    pass
+
+def _csr_from_ranges(los, his):
+    """ Compresses a contiguous range of node indexes per node into CSR form.
+
+        los, his: NumPy arrays; the neighbors of node i are nodes los[i]
+            (inclusive) through his[i] (exclusive)
+
+        Return value: tuple (indptr, indices); the neighbors of node i are
+            indices[indptr[i]:indptr[i+1]]
+    """
+    counts = his - los
+    indptr = numpy.zeros(len(los) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=indptr[1:])
+    indices = (numpy.arange(indptr[-1], dtype=numpy.int64)
+                - numpy.repeat(indptr[:-1] - los, counts))
+    return indptr, indices
+
+def intron_dag(starts, ends, min_overlap_exon_size=1):
+    """ Builds the DAG of introns on a strand in compressed sparse row form.
+
+        See edges_from_input_stream()'s docstring for a description of the
+        DAG. Let E be the smallest end position of the introns that start
+        at least min_overlap_exon_size bases after intron A ends. The children
+        of A are the introns that start at least min_overlap_exon_size
+        bases after A ends but fewer than min_overlap_exon_size bases after E,
+        since any intron starting later is preceded by the intron ending at E.
+        With introns sorted by start position, the children of each intron
+        are thus a contiguous range of indexes, whose bounds are found by
+        binary search after a sweep from right to left computes E for every
+        start position. Both bounds can only grow with A's end position, so
+        with introns sorted by end position, the parents of each intron are
+        also a contiguous range, found by binary search over the bounds.
+
+        The adjacency lists of all introns are laid end to end in a single
+        array of indices, and a second array of pointers marks where each
+        intron's list begins (compressed sparse row form). NumPy is used to
+        build the arrays if it is available.
+
+        starts: list of intron start positions sorted in ascending order; ties
+            are broken by end position. There should be no duplicate introns.
+        ends: list of corresponding intron end positions
+        min_overlap_exon_size: if two junctions are separated by
+            min_overlap_exon_size bases, they are regarded as overlapping
+
+        Return value: tuple (child_indptr, child_indices, parent_indptr,
+            parent_indices). The children of intron i are
+            child_indices[child_indptr[i]:child_indptr[i+1]], sorted by start
+            position; the parents of intron i are
+            parent_indices[parent_indptr[i]:parent_indptr[i+1]], sorted by end
+            position. Introns without children are sinks, and introns without
+            parents are children of the fake source preceding the strand.
+            All are lists.
+    """
+    intron_count = len(starts)
+    if numpy is not None:
+        start_array = numpy.array(starts, dtype=numpy.int64)
+        end_array = numpy.array(ends, dtype=numpy.int64)
+        suffix_min_ends = numpy.minimum.accumulate(end_array[::-1])[::-1]
+        los = numpy.searchsorted(start_array,
+                                    end_array + min_overlap_exon_size)
+        his = los.copy()
+        linked = los < intron_count
+        his[linked] = numpy.searchsorted(
+                start_array,
+                suffix_min_ends[los[linked]] + min_overlap_exon_size
+            )
+        child_indptr, child_indices = _csr_from_ranges(los, his)
+        by_end = numpy.argsort(end_array, kind='mergesort')
+        nodes = numpy.arange(intron_count)
+        parent_los = numpy.searchsorted(his[by_end], nodes, side='right')
+        parent_his = numpy.maximum(
+                numpy.searchsorted(los[by_end], nodes, side='right'),
+                parent_los
+            )
+        parent_indptr, parent_positions = _csr_from_ranges(parent_los,
+                                                            parent_his)
+        return (child_indptr.tolist(), child_indices.tolist(),
+                parent_indptr.tolist(), by_end[parent_positions].tolist())
+    suffix_min_ends = list(ends)
+    for i in xrange(intron_count - 2, -1, -1):
+        if suffix_min_ends[i + 1] < suffix_min_ends[i]:
+            suffix_min_ends[i] = suffix_min_ends[i + 1]
+    los, his = [], []
+    for end in ends:
+        lo = bisect_left(starts, end + min_overlap_exon_size)
+        los.append(lo)
+        if lo == intron_count:
+            his.append(lo)
+        else:
+            his.append(bisect_left(starts,
+                                    suffix_min_ends[lo]
+                                    + min_overlap_exon_size, lo))
+    child_indptr, child_indices = [0], []
+    for lo, hi in zip(los, his):
+        child_indices.extend(xrange(lo, hi))
+        child_indptr.append(len(child_indices))
+    by_end = sorted(xrange(intron_count), key=ends.__getitem__)
+    sorted_los = [los[i] for i in by_end]
+    sorted_his = [his[i] for i in by_end]
+    parent_indptr, parent_indices = [0], []
+    for j in xrange(intron_count):
+        parent_indices.extend(by_end[bisect_right(sorted_his, j):
+                                        bisect_right(sorted_los, j)])
+        parent_indptr.append(len(parent_indices))
+    return child_indptr, child_indices, parent_indptr, parent_indices
+
+def junction_combos(starts, ends, readlet_size=20, min_overlap_exon_size=1,
+    edge_span=2, min_edge_span_size=25, work_budget=None):
+    """ Enumerates junction combos on a strand by dynamic programming.
+
+        Yields the same junction combos as paths() and
+        consume_graph_and_print_combos(), but each combo is yielded exactly
+        once, with the largest left and right extensions any of the paths
+        giving rise to it would have. (Rail-RNA-junction_fasta keeps only
+        these.) The combos beginning with an intron are obtained from the
+        combos beginning with its children; since only the number of exonic
+        bases left for a readlet to span and the weights of the last
+        edge_span - 1 edges determine how a combo can be continued, the
+        suffix set of each such state of a node is computed once and
+        memoised. Nodes are visited in order of start position, and because
+        edges point to introns with larger start positions, the suffix sets
+        of a node are dropped as soon as the node's own combos are yielded.
+
+        Each suffix set computed and each combo built counts toward
+        work_budget, which is spread evenly across introns: the combos
+        beginning with an intron may take up the intron's share of the budget
+        plus whatever earlier introns left unspent. If they would take more,
+        the intron is yielded only as a single-junction combo, extended up to
+        its nearest neighboring introns on either side, and enumeration moves
+        on. So the work spent on a strand is bounded, and only introns in hot
+        spots lose their multi-junction combos.
+
+        starts: list of intron start positions sorted in ascending order; ties
+            are broken by end position. There should be no duplicate introns.
+        ends: list of corresponding intron end positions
+        readlet_size: maximum readlet size
+        min_overlap_exon_size: if two junctions are separated by
+            min_overlap_exon_size bases, they are regarded as overlapping
+        edge_span, min_edge_span_size: see paths()
+        work_budget: maximum number of work units to spend on the strand, or
+            None for no limit
+
+        Yield value: tuple (indexes of introns in combo, left_extend_size,
+            right_extend_size, left_size, right_size); see
+            consume_graph_and_print_combos() for definitions of the last four
+            fields. left_size or right_size is None at the beginning or end of
+            the strand.
+    """
+    assert isinstance(edge_span, int) and edge_span >= 1, \
+        'Edge span must be integer >= 1; was %d' % edge_span
+    intron_count = len(starts)
+    if not intron_count: return
+    max_extend_size = readlet_size - 1
+    (child_indptr, child_indices,
+        parent_indptr, parent_indices) = intron_dag(starts, ends,
+                                                    min_overlap_exon_size)
+    '''Left sizes. Parents are sorted by end position, so the first is the
+    farthest from intron j.'''
+    fake_source_end = max(starts[0] - max_extend_size, 1)
+    left_sizes = [None] * intron_count
+    left_extend_sizes = [None] * intron_count
+    for j in xrange(intron_count):
+        if parent_indptr[j] != parent_indptr[j+1]:
+            left_sizes[j] = starts[j] - ends[parent_indices[parent_indptr[j]]]
+            left_extend_sizes[j] = min(left_sizes[j], max_extend_size)
+        else:
+            left_extend_sizes[j] = min(starts[j] - fake_source_end,
+                                        max_extend_size)
+    # Right sizes: children are sorted by start position
+    right_sizes = [(starts[child_indices[child_indptr[i+1] - 1]] - ends[i])
+                    if child_indptr[i] != child_indptr[i+1] else None
+                    for i in xrange(intron_count)]
+    window_size = edge_span - 1
+    memo = [{} for _ in xrange(intron_count)]
+    work, work_limit = [0], [None]
+    def suffixes(i, bases_left, window):
+        """ Finds all maximal combos beginning with intron i.
+
+            i: index of intron
+            bases_left: number of exonic bases a readlet can still span
+            window: weights of last edge_span - 1 edges before i
+
+            Return value: list of tuples (indexes of introns in combo,
+                index of last intron in combo)
+        """
+        try:
+            return memo[i][(bases_left, window)]
+        except KeyError:
+            pass
+        combos = []
+        right_size = right_sizes[i]
+        if right_size is None or right_size >= bases_left:
+            # A readlet can overlap no intron after i
+            combos.append(((i,), i))
+        end = ends[i]
+        for j in child_indices[child_indptr[i]:child_indptr[i+1]]:
+            weight = starts[j] - end
+            if weight >= bases_left:
+                # Children are sorted by weight
+                break
+            next_window = window + (weight,)
+            if len(next_window) >= edge_span and \
+                sum(next_window[-edge_span:]) < min_edge_span_size:
+                # Suppress combo; see paths()
+                continue
+            child_combos = suffixes(
+                        j, bases_left - weight,
+                        next_window[-window_size:] if window_size else ()
+                    )
+            # Charge for combos before building them
+            work[0] += len(child_combos) + 1
+            if work_limit[0] is not None and work[0] > work_limit[0]:
+                raise WorkBudgetExhausted
+            combos.extend([((i,) + combo, last)
+                            for combo, last in child_combos])
+        work[0] += 1
+        memo[i][(bases_left, window)] = combos
+        counter.add('memoised_suffix_sets')
+        return combos
+    if work_budget is not None:
+        work_share = float(work_budget) / intron_count
+    fallback_count = 0
+    for i in xrange(intron_count):
+        if work_budget is not None:
+            # Unspent shares of earlier introns carry over
+            work_limit[0] = int(work_share * (i + 1))
+        try:
+            combos = suffixes(i, max_extend_size, ())
+        except WorkBudgetExhausted:
+            fallback_count += 1
+            combos = [((i,), i)]
+        memo[i] = None
+        for combo, last in combos:
+            right_size = right_sizes[last]
+            yield (combo, left_extend_sizes[i],
+                    min(right_size, max_extend_size)
+                    if right_size is not None else max_extend_size,
+                    left_sizes[i], right_size)
+    counter.add('work_units', work[0])
+    if fallback_count:
+        counter.add('exhausted_work_budgets')
+        counter.add('single_junction_fallbacks', fallback_count)
+        print >>sys.stderr, (
+                'Work budget of %d units exhausted; yielded only '
+                'single-junction combos for %d of %d introns.'
+            ) % (work_budget, fallback_count, intron_count)
+
+def print_combos(input_stream, output_stream, readlet_size=20,
+    min_overlap_exon_size=1, edge_span=2, min_edge_span_size=25,
+    work_budget=None, verbose=False):
+    """ Prints junction combos strand by strand using junction_combos().
+
+        input_stream: where to find sorted introns; see
+            edges_from_input_stream()
+        output_stream: where to write junction combos; see
+            consume_graph_and_print_combos() for output format
+        readlet_size: maximum readlet size
+        min_overlap_exon_size: if two junctions are separated by
+            min_overlap_exon_size bases, they are regarded as overlapping
+        edge_span, min_edge_span_size: see paths()
+        work_budget: maximum number of work units to spend on each strand;
+            see junction_combos()
+        verbose: True iff extra debugging messages should be written to stderr
+
+        No return value.
+    """
+    global _output_line_count
+    for key, introns in sorted_introns(input_stream):
+        starts = [intron[0] for intron in introns]
+        ends = [intron[1] for intron in introns]
+        strand = key[0]
+        if verbose:
+            print >>sys.stderr, \
+                'Enumerating combos of %d introns on strand %s for ' \
+                'sample %s' % (len(introns), strand, key[1])
+            enumerate_start_time = time.time()
+        for (combo, left_extend_size, right_extend_size,
+                left_size, right_size) in junction_combos(
+                        starts, ends, readlet_size=readlet_size,
+                        min_overlap_exon_size=min_overlap_exon_size,
+                        edge_span=edge_span,
+                        min_edge_span_size=min_edge_span_size,
+                        work_budget=work_budget
+                    ):
+            print >>output_stream, '%s\t%s\t%s\t%d\t%d\t%s\t%s' % (
+                    strand,
+                    ','.join([str(starts[k]) for k in combo]),
+                    ','.join([str(ends[k]) for k in combo]),
+                    left_extend_size,
+                    right_extend_size,
+                    str(left_size) if left_size is not None else 'NA',
+                    str(right_size) if right_size is not None else 'NA'
+                )
+            counter.add('outputs')
+            _output_line_count += 1
+        if verbose:
+            print >>sys.stderr, 'Time taken: %0.3f s' \
+                % (time.time() - enumerate_start_time)
+
 def go(input_stream=sys.stdin, output_stream=sys.stdout, readlet_size=20,
         min_overlap_exon_size=1, edge_span=2, min_edge_span_size=25, 
-        verbose=False, fudge=0, flush_base_count=10000000):
+        verbose=False, fudge=0, flush_base_count=10000000,
+        work_budget=10000000, legacy=False):
     """ Runs Rail-RNA-junction_config.
 
         Reduce step in MapReduce pipelines that outputs all possible
@@ -501,11 +775,28 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout, readlet_size=20,
             strand). These extensions are extended further by the number of
             bases fudge to accommodate possible small insertions
         flush_base_count: algorithm switches between generating and consuming
-            the graph every flush_base_count bases along the strand.
+            the graph every flush_base_count bases along the strand; used
+            only if legacy is True
+        work_budget: maximum number of work units to spend enumerating combos
+            on each strand; see junction_combos(). None means no limit.
+            Ignored if legacy is True.
+        legacy: True iff combos should be enumerated by consuming the DAG with
+            consume_graph_and_print_combos() rather than with
+            junction_combos(). The legacy algorithm has no work budget and
+            prints a combo once for every path giving rise to it.
 
         No return value.
     """
     effective_readlet_size = readlet_size + fudge
+    if not legacy:
+        print_combos(input_stream, output_stream,
+                        readlet_size=effective_readlet_size,
+                        min_overlap_exon_size=min_overlap_exon_size,
+                        edge_span=edge_span,
+                        min_edge_span_size=min_edge_span_size,
+                        work_budget=work_budget,
+                        verbose=verbose)
+        return
     for edge in edges_from_input_stream(
                         input_stream, 
                         readlet_size=effective_readlet_size,
@@ -637,6 +928,17 @@ if __name__ == '__main__':
              'the forward strand). These extensions are extended further by '
              'the number of bases --fudge to accommodate possible small '
              'insertions.')
+    parser.add_argument('--work-budget', type=int, required=False,
+        default=10000000,
+        help='Maximum number of work units to spend enumerating junction '
+             'combinations for a strand/sample. It is spread across introns; '
+             'an intron whose combinations would take more than its share '
+             'is output only as a single-junction combination. Use 0 for no '
+             'limit')
+    parser.add_argument('--legacy', action='store_const', const=True,
+        default=False,
+        help='Enumerate junction combinations with the original graph '
+             'consumption algorithm, which has no work budget')
     
     args = parser.parse_args(sys.argv[1:])
 
@@ -648,7 +950,9 @@ if __name__ == '__main__' and not args.test:
         min_edge_span_size=args.min_edge_span_size,
         readlet_size=args.readlet_size,
         verbose=args.verbose,
-        fudge=args.fudge)
+        fudge=args.fudge,
+        work_budget=(args.work_budget or None),
+        legacy=args.legacy)
     print >>sys.stderr, 'DONE with junction_config.py; in/out=%d/%d; ' \
                         'time=%0.3f s' % (_input_line_count, 
                                             _output_line_count,
@@ -749,6 +1053,96 @@ elif __name__ == '__main__':
                     ]), junction_configs['chr2']
                 )
 
+        def test_intron_dag(self):
+            """ Fails if DAG of introns is not built properly. """
+            global numpy
+            starts, ends = [10, 30, 75, 90, 91], [50, 70, 101, 1300, 101]
+            expected = ([0, 3, 6, 6, 6, 6], [2, 3, 4, 2, 3, 4],
+                        [0, 0, 0, 2, 4, 6], [0, 1, 0, 1, 0, 1])
+            self.assertEqual(intron_dag(starts, ends), expected)
+            self.assertEqual(intron_dag(starts, ends, 10),
+                             ([0, 3, 5, 5, 5, 5], [2, 3, 4, 3, 4],
+                              [0, 0, 0, 1, 3, 5], [0, 0, 1, 0, 1]))
+            if numpy is not None:
+                numpy_module, numpy = numpy, None
+                try:
+                    self.assertEqual(intron_dag(starts, ends), expected)
+                finally:
+                    numpy = numpy_module
+
+        def extensions(self, **kwargs):
+            """ Runs go() and collapses output as junction_fasta does.
+
+                Return value: dictionary mapping each junction combo to
+                    [left_extend_size, right_extend_size, whether left_size
+                    is NA, right_size]
+            """
+            with open(self.output_file, 'w') as output_stream:
+                with open(self.input_file) as input_stream:
+                    go(input_stream=input_stream, output_stream=output_stream,
+                        **kwargs)
+            combos = {}
+            with open(self.output_file) as result_stream:
+                for line in result_stream:
+                    tokens = line.strip().split('\t')
+                    extensions = [int(tokens[3]), int(tokens[4]),
+                                    tokens[5] == 'NA', tokens[6]]
+                    if tokens[6] != 'NA':
+                        extensions[3] = int(tokens[6])
+                    combo = tuple(tokens[:3])
+                    if combo in combos:
+                        combos[combo] = map(max, combos[combo], extensions)
+                    else:
+                        combos[combo] = extensions
+            return combos
+
+        def test_legacy_agreement(self):
+            """ Fails if combos differ from those of legacy algorithm. """
+            import random
+            random.seed(11)
+            for _ in xrange(50):
+                with open(self.input_file, 'w') as input_stream:
+                    for strand in ['chr1+', 'chr2-']:
+                        introns = set()
+                        for _ in xrange(random.randint(1, 30)):
+                            intron_start = random.randint(1, 1000)
+                            introns.add((intron_start,
+                                         intron_start
+                                         + random.randint(1, 300)))
+                        for intron in sorted(introns):
+                            input_stream.write('%s\t1\t%d\t%d\n'
+                                                % ((strand,) + intron))
+                parameters = {
+                        'readlet_size' : random.choice([10, 20, 32]),
+                        'fudge' : random.choice([0, 1, 5]),
+                        'min_overlap_exon_size' : random.choice([1, 3, 9]),
+                        'edge_span' : random.choice([1, 2, 3]),
+                        'min_edge_span_size' : random.choice([1, 10, 25])
+                    }
+                self.assertEqual(self.extensions(legacy=True, **parameters),
+                                 self.extensions(**parameters))
+
+        def test_work_budget(self):
+            """ Fails if exhausted work budget drops any introns. """
+            with open(self.input_file, 'w') as input_stream:
+                for intron_start in xrange(100, 250, 5):
+                    for intron_end in xrange(intron_start + 50,
+                                                intron_start + 55):
+                        input_stream.write('chr1+\t1\t%d\t%d\n'
+                                            % (intron_start, intron_end))
+            unlimited = self.extensions(readlet_size=32, work_budget=None)
+            limited = self.extensions(readlet_size=32, work_budget=1000)
+            self.assertTrue(len(limited) < len(unlimited))
+            introns = set()
+            for strand, intron_starts, intron_ends in unlimited:
+                introns.update(zip(intron_starts.split(','),
+                                    intron_ends.split(',')))
+            self.assertEqual(
+                    set([(strand, intron_start, intron_end)
+                            for intron_start, intron_end in introns]),
+                    set([combo for combo in limited if ',' not in combo[1]])
+                )
+
         def tearDown(self):
             # Kill temporary directory
             shutil.rmtree(self.temp_dir_path)
@@ -65,6 +65,8 @@ from dooplicity.tools import register_cleanup, make_temp_dir
 from dooplicity.counters import Counter
 import filemover
 import tempdel
+from fasta_writer import FastaWriter
+from parallel_gzip import ParallelGzipWriter
 
 counter = Counter('junction_index')
 register_cleanup(counter.flush)
@@ -81,6 +83,17 @@ parser.add_argument(\
     '--basename', type=str, required=False,
     default='junction',
     help='Basename for index to be written')
+parser.add_argument(\
+    '--threads', type=int, required=False,
+    default=1,
+    help='Number of threads that compress the index archive and, unless '
+         '--bowtie2-build-threads is set, that bowtie2-build uses')
+parser.add_argument(\
+    '--bowtie2-build-threads', type=int, required=False,
+    default=None,
+    help='Number of threads bowtie2-build uses; 1 leaves off its --threads '
+         'option, which bowtie2-build accepts only as of v2.2.7. DEFAULT IS '
+         '--threads.')
 parser.add_argument(\
     '--keep-alive', action='store_const', const=True, default=False,
     help='Prints reporter:status:alive messages to stderr to keep EMR '
@@ -109,8 +122,10 @@ except: pass
 index_basename = os.path.join(temp_dir_path, 'index/' + args.basename)
 fasta_file = os.path.join(temp_dir_path, 'temp.fa')
 print >>sys.stderr, 'Opened %s for writing....' % fasta_file
-with open(fasta_file, 'w') as fasta_stream:
+with open(fasta_file, 'w', 1048576) as fasta_stream:
+    fasta_writer = FastaWriter(fasta_stream)
     input_line_count = 0
+    last_record = None
     for line in sys.stdin:
         counter.add('inputs')
         if args.keep_alive and not (input_line_count % 1000):
@@ -121,18 +136,20 @@ with open(fasta_file, 'w') as fasta_stream:
             continue
         assert len(tokens) == 3
         rname, seq = tokens[1:]
+        if (rname, seq) == last_record:
+            # Input is sorted, so duplicates are adjacent
+            counter.add('duplicate_fasta_records')
+            continue
+        last_record = (rname, seq)
         '''A given reference name in the index will be in the following
         format:
         original RNAME + '+' or '-' indicating which strand is the
         sense strand + '\x1d' + start position of sequence + '\x1d' +
         comma-separated list of subsequence sizes framing introns + '\x1d'
         + comma-separated list of intron sizes.'''
-        print >>fasta_stream, rname
-        fasta_stream.write(
-                '\n'.join([seq[i:i+80] for i 
-                            in xrange(0, len(seq), 80)]) + '\n'
-            )
+        fasta_writer.write(rname, seq)
         input_line_count += 1
+    fasta_writer.close()
     if not input_line_count:
         '''There were no input FASTA files. Write one bum line so the
         pipeline doesn't fail.'''
@@ -140,9 +157,19 @@ with open(fasta_file, 'w') as fasta_stream:
         print >>fasta_stream, '>bum\nNA'
         print >>sys.stderr, ('Wrote bum index because no transcripts were '
                              'passed.')
+    counter.add('fasta_bytes', fasta_stream.tell())
+
+fasta_time = time.time()
+counter.add('fasta_ms', int((fasta_time - start_time) * 1000))
 
 # Build index
 print >>sys.stderr, 'Running bowtie2-build....'
+bowtie_build_command = [args.bowtie2_build_exe]
+build_threads = (args.threads if args.bowtie2_build_threads is None
+                    else args.bowtie2_build_threads)
+if build_threads > 1:
+    bowtie_build_command.extend(['--threads', str(build_threads)])
+bowtie_build_command.extend([fasta_file, index_basename])
 
 if args.keep_alive:
     class BowtieBuildThread(threading.Thread):
@@ -156,9 +183,7 @@ if args.keep_alive:
             self.bowtie_build_process = subprocess.Popen(self.command_list,
                                             stdout=sys.stderr).wait()
     counter.add('bowtie_build_threads')
-    bowtie_build_thread = BowtieBuildThread([args.bowtie2_build_exe,
-                                                fasta_file,
-                                                index_basename])
+    bowtie_build_thread = BowtieBuildThread(bowtie_build_command)
     bowtie_build_thread.start()
     while bowtie_build_thread.is_alive():
         print >>sys.stderr, 'reporter:status:alive'
@@ -170,9 +195,7 @@ if args.keep_alive:
 else:
     counter.add('bowtie_build_processes')
     bowtie_build_process = subprocess.Popen(
-                                [args.bowtie2_build_exe,
-                                    fasta_file,
-                                    index_basename],
+                                bowtie_build_command,
                                 stderr=sys.stderr,
                                 stdout=sys.stderr
                             )
@@ -181,21 +204,28 @@ else:
         raise RuntimeError('Bowtie index construction failed w/ exitlevel %d.'
                                 % bowtie_build_process.returncode)
 
-# Compress index files
-print >>sys.stderr, 'Compressing isofrag index...'
+bowtie_build_time = time.time()
+counter.add('bowtie2_build_ms', int((bowtie_build_time - fasta_time) * 1000))
+
+'''Compress index files, uploading or copying compressed blocks as they're
+written.'''
+print >>sys.stderr, 'Compressing and uploading or copying isofrag index...'
 junction_index_filename = args.basename + '.tar.gz'
-junction_index_path = os.path.join(temp_dir_path, junction_index_filename)
 index_path = os.path.join(temp_dir_path, 'index')
-tar = tarfile.TarFile.gzopen(junction_index_path, mode='w', compresslevel=3)
-for index_file in os.listdir(index_path):
-    tar.add(os.path.join(index_path, index_file), arcname=index_file)
-tar.close()
-counter.add('junction_index_archive_bytes', os.path.getsize(junction_index_path))
-# Upload compressed index
-print >>sys.stderr, 'Uploading or copying compressed index...'
-counter.add('files_moved')
 mover = filemover.FileMover(args=args)
-mover.put(junction_index_path, output_url.plus(junction_index_filename))
+with mover.put_stream(output_url.plus(junction_index_filename),
+                        temp_dir=temp_dir_path) as upload_stream:
+    gzip_stream = ParallelGzipWriter(upload_stream, level=3,
+                                        threads=args.threads)
+    tar = tarfile.open(fileobj=gzip_stream, mode='w|')
+    for index_file in os.listdir(index_path):
+        tar.add(os.path.join(index_path, index_file), arcname=index_file)
+    tar.close()
+    gzip_stream.close()
+counter.add('files_moved')
+counter.add('junction_index_archive_bytes', gzip_stream.compressed_bytes)
+counter.add('archive_and_upload_ms',
+                int((time.time() - bowtie_build_time) * 1000))
 
 print >>sys.stderr, 'DONE with junction_index.py; in=%d; time=%0.3f s' \
                         % (input_line_count, time.time() - start_time)
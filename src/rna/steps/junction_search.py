@@ -49,7 +49,9 @@ import subprocess
 import re
 import random
 import itertools
-from collections import defaultdict
+import time
+from bisect import bisect_left
+from collections import defaultdict, OrderedDict
 
 base_path = os.path.abspath(
                     os.path.dirname(os.path.dirname(os.path.dirname(
@@ -66,6 +68,7 @@ import partition
 from dooplicity.tools import xstream, register_cleanup
 from dooplicity.counters import Counter
 from alignment_handlers import pairwise
+from global_alignment import GlobalAlignment
 
 _reversed_complement_translation_table = string.maketrans('ATCG', 'TAGC')
 
@@ -74,6 +77,9 @@ _input_line_count = 0
 _output_line_count = 0
 counter = Counter('junction_search')
 register_cleanup(counter.flush)
+'''A read is counted as having slow suffix searches if they take longer than
+this in total.'''
+_slow_suffix_search_microseconds = 1000
 
 # Initialize forward- and reverse-strand motifs
 
@@ -89,228 +95,67 @@ _right_forward_elements = set(['AG', 'AC'])
 _left_elements = _left_reverse_elements | _left_forward_elements
 _right_elements = _right_reverse_elements | _right_forward_elements
 
-if 'pypy' not in sys.version.lower():
-    # For fast global alignment without PyPy
-    try:
-        from scipy import weave
-    except ImportError:
-        '''Weave is now standalone and may not be included in recent
-        versions of scipy. Try importing weave directly; the user 
-        should have "pip install weave"'d for this to work.'''
-        import weave
-    class GlobalAlignment(object):
-        """ Invokes Weave to obtain alignment score matrix with C. """
-
-        def __init__(self, substitution_matrix=[[ 0,-1,-1,-1,-1,-1],
-                                                [-1, 0,-1,-1,-1,-1],
-                                                [-1,-1, 0,-1,-1,-1],
-                                                [-1,-1,-1, 0,-1,-1],
-                                                [-1,-1,-1,-1,-1,-1],
-                                                [-1,-1,-1,-1,-1,-1]]):
-            """ Constructor for GlobalAlignment.
-
-                Places substitution_matrix directly in string containing C code
-                that obtains score matrix for global alignment. Executes C with
-                Weave on trivial case (two sequences, each one character) to 
-                ensure code is precompiled.
-
-                substitution_matrix: 6 x 6 substitution matrix (list of
-                    lists); rows and columns correspond to ACGTN-, where N is
-                    aNy and - is a gap. Default: +1 for match, -5 for gap,
-                    -1 for everything else.
-            """
-            '''Set supporting code including libraries and the function 
-            integer_sequence(), which converts a sequence of nucleotides to
-            an array of indices that correspond to indices of the substitution
-            matrix---also set in the constructor.'''
-            self.support_code = """ 
-                        int* integer_sequence(const char* seq, int length) {
-                            int i;
-                            int* int_seq = (int *)malloc(sizeof(int)*length);
-                            for (i = 0; seq[i]; i++) {
-                                switch (seq[i]) {
-                                    case 'A':
-                                    case 'a':
-                                        int_seq[i] = 0;
-                                        break;
-                                    case 'C':
-                                    case 'c':
-                                        int_seq[i] = 1;
-                                        break;
-                                    case 'G':
-                                    case 'g':
-                                        int_seq[i] = 2;
-                                        break;
-                                    case 'T':
-                                    case 't':
-                                        int_seq[i] = 3;
-                                        break;
-                                    case 'N':
-                                        int_seq[i] = 4;
-                                        break;
-                                    case '-':
-                                        int_seq[i] = 5;
-                                        break;
-                                    default:
-                                        int_seq[i] = 4;
-                                }
-                            }
-                            return int_seq;
-                        }
-                        """
-            '''Score matrix code is written in C/C++; see self.support_code
-            above for dependencies. substitution_matrix is embedded in code
-            below.'''
-            self.score_matrix_code = """
-                const char* c_first_seq = first_seq.c_str();
-                const char* c_second_seq = second_seq.c_str();
-                int row_count = first_seq.length() + 1;
-                int column_count = second_seq.length() + 1;
-                npy_intp dims[2] = {row_count, column_count};
-                PyObject* to_return = PyArray_SimpleNew(2, dims, NPY_INT);
-                int* score_matrix = (int *)((PyArrayObject*) to_return)->data;
-                int* substitution_matrix = (int *)malloc(sizeof(int)*6*6);
-                int* int_first_seq = integer_sequence(c_first_seq,
-                                                        row_count - 1);
-                int* int_second_seq = integer_sequence(c_second_seq,
-                                                        column_count - 1);
-            """ + """""".join(
-                            [("""substitution_matrix[%d] = %d;""" % ((i*6 + j), 
-                                substitution_matrix[i][j])) 
-                                for i in xrange(6) for j in xrange(6)]
-                        ) \
-            + """
-                int i, j;
-                score_matrix[0] = 0;
-                for (i = 1; i < row_count; i++) {
-                    score_matrix[i*column_count] = i 
-                        * substitution_matrix[int_first_seq[i-1]*6+5];
-                }
-                for (j = 1; j < column_count; j++) {
-                    score_matrix[j] = j 
-                        * substitution_matrix[5*6+int_second_seq[j-1]];
-                }
-                int diagonal, vertical, horizontal;
-                for (i = 1; i < row_count; i++) {
-                    for (j = 1; j < column_count; j++) {
-                        diagonal = score_matrix[(i-1)*column_count + j-1]
-                            + substitution_matrix[int_first_seq[i-1]*6
-                                                    +int_second_seq[j-1]];
-                        vertical = score_matrix[(i-1)*column_count + j]
-                            + substitution_matrix[int_first_seq[i-1]*6+5];
-                        horizontal = score_matrix[i*column_count + j-1]
-                            + substitution_matrix[5*6+int_second_seq[j-1]];
-                        score_matrix[i*column_count + j] = std::max(
-                                horizontal, std::max(diagonal, vertical)
-                            );
-                    }
-                }
-                free(int_first_seq);
-                free(int_second_seq);
-                free(substitution_matrix);
-                return_val = to_return;
-            """
-            stdout_holder = os.dup(sys.stdout.fileno())
-            try:
-                # Suppress compiler output by redirecting stdout temporarily
-                devnull = open(os.devnull, 'w')
-                os.dup2(devnull.fileno(), sys.stdout.fileno())
-                self.score_matrix('N', 'N')
-            except Exception as e:
-                print >>sys.stderr, 'C code for computing score matrix ' \
-                                    'failed to compile. Get Python\'s ' \
-                                    'distutils to use g++, and try again.'
-                raise
-            finally:
-                # Turn the tap back on
-                os.dup2(stdout_holder, sys.stdout.fileno())
-
-        def score_matrix(self, first_seq, second_seq):
-            """ Computes score matrix for global alignment of two sequences.
-
-                The substitution matrix is specified when the GlobalAlignment
-                class is instantiated.
-
-                first_seq: first sequence (string).
-                second_seq: second sequence (string).
-
-                Return value: score_matrix, a numpy array whose dimensions are
-                    (len(first_seq) + 1) x (len(second_seq) + 1). It can be
-                    used to trace back the best global alignment.
-            """
-            return weave.inline(
-                                    self.score_matrix_code,
-                                    ['first_seq', 'second_seq'], 
-                                    support_code=self.support_code,
-                                    verbose=0
-                                )
-else:
-    # Use Python version of class
-    class GlobalAlignment(object):
-        """ Uses Python to obtain alignment score matrix. """
-
-        def __init__(self, substitution_matrix=[[ 0,-1,-1,-1,-1,-1],
-                                                [-1, 0,-1,-1,-1,-1],
-                                                [-1,-1, 0,-1,-1,-1],
-                                                [-1,-1,-1, 0,-1,-1],
-                                                [-1,-1,-1,-1,-1,-1],
-                                                [-1,-1,-1,-1,-1,-1]]):
-            """ Constructor for GlobalAlignment.
-
-                substitution_matrix: 6 x 6 substitution matrix (list of
-                    lists); rows and columns correspond to ACGTN-, where N is
-                    aNy and - is a gap. Default: +1 for match, -5 for gap,
-                    -1 for everything else.
-            """
-            self.substitution_matrix = substitution_matrix
+class WindowKmerIndex(object):
+    """ Indexes k-mers of search windows so repeated queries share one pass.
 
-        def score_matrix(self, first_seq, second_seq):
-            """ Computes score matrix for global alignment of two sequences.
+        The same search window is often searched many times: for both strands
+        of a stranded read, for each read whose readlets align to the same
+        place, and for both ends of every exonic chunk. An index of a window
+        maps each k-mer to the ascending list of its start positions in the
+        window; the cache_size most recently used indexes are kept. Counts of
+        index cache hits and misses, queries and time spent on queries are
+        kept so they can be reported as counters.
+    """
 
-                The substitution matrix is specified when the GlobalAlignment
-                class is instantiated.
+    def __init__(self, cache_size=64):
+        """ Constructor for WindowKmerIndex.
 
-                first_seq: first sequence (string).
-                second_seq: second sequence (string).
+            cache_size: maximum number of window indexes to keep
+        """
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits, self.cache_misses = 0, 0
+        self.query_count, self.seconds = 0, 0.0
 
-                Return value: score_matrix, a numpy array whose dimensions are
-                    (len(first_seq) + 1) x (len(second_seq) + 1). It can be
-                    used to trace back the best global alignment.
-            """
-            first_seq = ['ACGTN-'.index(char) for char in first_seq]
-            second_seq = ['ACGTN-'.index(char) for char in second_seq]
-            row_count = len(first_seq) + 1
-            column_count = len(second_seq) + 1
-            score_matrix = [[0 for i in xrange(column_count)]
-                                for j in xrange(row_count)]
-            for j in xrange(1, column_count):
-                score_matrix[0][j] = j \
-                    * self.substitution_matrix[5][second_seq[j-1]]
-            for i in xrange(1, row_count):
-                score_matrix[i][0] = i \
-                    * self.substitution_matrix[first_seq[i-1]][5]
-            for i in xrange(1, row_count):
-                for j in xrange(1, column_count):
-                    score_matrix[i][j] = max(score_matrix[i-1][j-1] 
-                                                + self.substitution_matrix[
-                                                        first_seq[i-1]]
-                                                        [second_seq[j-1]
-                                                    ], # diagonal
-                                             score_matrix[i-1][j]
-                                                + self.substitution_matrix[
-                                                        first_seq[i-1]][5
-                                                    ], # vertical
-                                             score_matrix[i][j-1]
-                                                + self.substitution_matrix[
-                                                        5][second_seq[j-1]
-                                                    ] # horizontal
-                                            )
-            return score_matrix
+    def positions(self, search_window, kmer_size):
+        """ Gets k-mer index of a search window, building it if necessary.
+
+            search_window: sequence to index
+            kmer_size: length of k-mers to index
+
+            Return value: dictionary mapping each k-mer to the list of its
+                start positions in search_window, in ascending order
+        """
+        key = (kmer_size, search_window)
+        try:
+            kmer_positions = self.cache[key] = self.cache.pop(key)
+            self.cache_hits += 1
+            return kmer_positions
+        except KeyError:
+            self.cache_misses += 1
+        kmer_positions = {}
+        for i in xrange(len(search_window) - kmer_size + 1):
+            kmer = search_window[i:i+kmer_size]
+            try:
+                kmer_positions[kmer].append(i)
+            except KeyError:
+                kmer_positions[kmer] = [i]
+        self.cache[key] = kmer_positions
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return kmer_positions
 
 def maximal_suffix_match(query_seq, search_window,
-                            min_cap_size=8, max_cap_count=5):
+                            min_cap_size=8, max_cap_count=5,
+                            window_index=None):
     """ Finds maximum matching suffix of query_seq closest to start of window.
 
+        Initial possible matches are the occurrences of the min_cap_size-length
+        suffix of query_seq that start no fewer than
+        len(query_seq) - min_cap_size bases into search_window; they are
+        looked up in a k-mer index of search_window and each is extended
+        leftward as far as it matches query_seq.
+
         query_seq: sequence to search for.
         search_window: sequence to search in.
         min_cap_size: minimum size of sequence to search for; this is used to
@@ -318,6 +163,9 @@ def maximal_suffix_match(query_seq, search_window,
             of the min_cap_size-length suffix of query_seq)
         max_cap_count: initial list of initial possible matches is barred from
             exceeding this value.
+        window_index: object of class WindowKmerIndex whose cached index of
+            search_window is used, or None to index search_window only for
+            this query
 
         Return value: tuple (offset of match from beginning of search_window, 
                                 length of maximum matching suffix of query_seq)
@@ -327,41 +175,43 @@ def maximal_suffix_match(query_seq, search_window,
                         last min_cap_size characters of first len(query_seq)
                         characters of search_window)
     """
-    query_seq_size = len(query_seq)
-    offset = query_seq_size - min_cap_size
-    suffix_seq = query_seq[offset:]
-    suffixes = []
-    first_search = True
-    while len(suffixes) <= max_cap_count:
-        suffix = re.search(suffix_seq, search_window[offset:])
-        if suffix is None:
-            break
-        elif first_search and not suffix.start():
-            '''Suffix was found on first search at very beginning of window;
-            it's VERY likely just an extension.'''
+    if window_index is None:
+        window_index = WindowKmerIndex(cache_size=0)
+    start_time = time.time()
+    window_index.query_count += 1
+    try:
+        query_seq_size = len(query_seq)
+        offset = query_seq_size - min_cap_size
+        if offset < 0:
             return None
-        else:
+        positions = window_index.positions(search_window, min_cap_size).get(
+                query_seq[offset:], []
+            )
+        first_match = bisect_left(positions, offset)
+        match_count = len(positions) - first_match
+        if not match_count or match_count > max_cap_count:
+            return None
+        if positions[first_match] == offset:
+            '''Suffix was found at very beginning of window; it's VERY likely
+            just an extension.'''
+            return None
+        best_suffix = None
+        for i in xrange(first_match, len(positions)):
+            pos = positions[i]
             extra_base_count = 0
-            offset += suffix.start()
             while min_cap_size + extra_base_count < query_seq_size:
                 if query_seq[-min_cap_size-extra_base_count-1] \
-                    == search_window[offset-extra_base_count-1]:
+                    == search_window[pos-extra_base_count-1]:
                     extra_base_count += 1
                 else:
                     break
-            suffixes.append((-(extra_base_count + min_cap_size),
-                                offset - extra_base_count))
-            offset += 1
-        first_search = False
-    try:
-        if len(suffixes) <= max_cap_count:
-            suffix = min(suffixes)
-            return (suffix[1], -suffix[0])
-        else:
-            return None
-    except ValueError:
-        # No suffixes found
-        return None
+            suffix = (-(extra_base_count + min_cap_size),
+                        pos - extra_base_count)
+            if best_suffix is None or suffix < best_suffix:
+                best_suffix = suffix
+        return (best_suffix[1], -best_suffix[0])
+    finally:
+        window_index.seconds += time.time() - start_time
 
 def alignment_adjacencies(alignments):
     """ Generates adjacency matrix for graph described below.
@@ -741,11 +591,119 @@ def selected_readlet_alignments_by_clustering(readlets, experimental=False):
         counter.add('largest_maximum_clique_tie')
         return [[], []]
 
+def selected_readlet_alignments_by_chaining(readlets,
+                                            max_intron_size=500000):
+    """ Selects multireadlet alignments forming the longest consistent chain.
+
+        See selected_readlet_alignments_by_clustering() for a description of
+        readlets. Two alignments on the same strand are order-consistent if
+        the displacement of one along the read is greater than the other's
+        iff its position along the reference is also greater, and equal
+        displacements imply equal positions. A set of mutually
+        order-consistent alignments -- a clique in the graph of
+        maximum_clique() -- is a chain whose positions and displacements
+        both increase. Alignments with the same position and displacement are
+        merged into a single weighted point, so at most one alignment of a
+        given multireadlet is on any chain.
+
+        Alignments are grouped by rname and strand, sorted by position and
+        split into loci wherever successive positions are more than
+        max_intron_size bases apart. In each locus, the best chain ending at
+        each point extends the best chain among earlier points with smaller
+        displacements; a Fenwick tree indexed by displacement rank answers
+        this prefix query in logarithmic time, so a read with n alignments
+        takes O(n log n) time. The best chain has the most alignments and
+        then spans the fewest bases. If several chains are best, the read is
+        too repetitive, and no alignments are selected, as when
+        selected_readlet_alignments_by_clustering() finds a tie.
+
+        readlets: a list whose items {R_i} correspond to the aligned readlets
+            from a given read. Each R_i is itself a list of the possible
+            alignments {R_ij} of a readlet. Each R_ij is a tuple
+            (rname, reverse_strand, pos, end_pos, displacement).
+        max_intron_size: alignments more than this many bases apart are
+            never on the same chain
+
+        Return value: a list [selected alignment tuples, []]; the second
+            item is where selected_readlet_alignments_by_clustering() places
+            alignments for fishing, which chaining doesn't do.
+    """
+    groups = defaultdict(lambda: defaultdict(list))
+    for multireadlet in readlets:
+        for alignment in multireadlet:
+            groups[alignment[:2]][(alignment[2], alignment[4])].append(
+                    alignment
+                )
+    loci = []
+    for group in groups.itervalues():
+        points = sorted(group)
+        locus_start = 0
+        for i in xrange(1, len(points)):
+            if points[i][0] - points[i-1][0] > max_intron_size:
+                loci.append((group, points[locus_start:i]))
+                locus_start = i
+        loci.append((group, points[locus_start:]))
+    best, best_count, best_chain = (0,), 0, []
+    for group, points in loci:
+        ranks = dict((displacement, rank) for rank, displacement
+                        in enumerate(sorted(set([point[1]
+                                                 for point in points])),
+                                     1))
+        tree_size = len(ranks)
+        '''Each node of the Fenwick tree stores the best chain ending at
+        a point in its range as a tuple ((number of alignments, position of
+        first point, position of last point), index of last point). So among
+        chains with the same number of alignments, a chain is extended by the
+        one starting closest to it and then the one ending closest to it.'''
+        tree = [((0, None, None), None)] * (tree_size + 1)
+        chains, predecessors = [], []
+        i = 0
+        point_count = len(points)
+        while i < point_count:
+            # Points with the same position can't be on the same chain
+            j = i
+            while j < point_count and points[j][0] == points[i][0]:
+                j += 1
+            for k in xrange(i, j):
+                pos = points[k][0]
+                chain, predecessor = (0, pos, pos), None
+                rank = ranks[points[k][1]] - 1
+                while rank:
+                    if tree[rank][0] > chain:
+                        chain, predecessor = tree[rank]
+                    rank &= rank - 1
+                chains.append((chain[0] + len(group[points[k]]), chain[1],
+                                pos))
+                predecessors.append(predecessor)
+            for k in xrange(i, j):
+                rank = ranks[points[k][1]]
+                while rank <= tree_size:
+                    if chains[k] > tree[rank][0]:
+                        tree[rank] = (chains[k], k)
+                    rank += rank & -rank
+            i = j
+        for k, (size, first_pos, last_pos) in enumerate(chains):
+            chain = (size, first_pos - last_pos)
+            if chain > best:
+                best, best_count = chain, 1
+                best_chain = []
+                while k is not None:
+                    best_chain.extend(group[points[k]])
+                    k = predecessors[k]
+            elif chain == best:
+                best_count += 1
+    if best_count > 1:
+        '''Alignment is in general too repetitive; postpone treatment until
+        a nice systematic way to handle this case is found.'''
+        counter.add('longest_readlet_chain_tie')
+        return [[], []]
+    return [best_chain, []]
+
 def junctions_from_clique(clique, read_seq, reference_index,
         min_exon_size=8, min_intron_size=10, max_intron_size=500000,
         search_window_size=1000, stranded=False, motif_radius=1,
         reverse_reverse_strand=False, global_alignment=GlobalAlignment(),
-        max_gaps_mismatches=5, sign=1):
+        max_gaps_mismatches=5, sign=1, max_cap_count=5, window_index=None):
     """ 
         NOTE THAT clique LIST IS SORTED ASSUMING THE ONLY READLETS WHOSE
         DISPLACEMENTS ARE THE SAME ARE CAPPING READLETS. IF THE READLETIZING
@@ -775,6 +733,11 @@ def junctions_from_clique(clique, read_seq, reference_index,
             in realignments to reference minus intron per 100 bp or None if
             unlimited
         sign: '+' for standard; '-' for nonstandard
+        max_cap_count: maximum number of possible caps of size
+            min_exon_size to consider when searching for caps
+        window_index: object of class WindowKmerIndex for finding maximal
+            matching suffixes in search windows or None to index each search
+            window anew
     """
     if not clique:
         return
@@ -822,7 +785,9 @@ def junctions_from_clique(clique, read_seq, reference_index,
                 = maximal_suffix_match(
                         read_seq[:prefix_displacement][::-1],
                         search_window[::-1],
-                        min_cap_size=min_exon_size
+                        min_cap_size=min_exon_size,
+                        max_cap_count=max_cap_count,
+                        window_index=window_index
                     )
             new_prefix = [(rname, reverse_strand, 
                             prefix_pos - new_prefix_offset
@@ -853,7 +818,9 @@ def junctions_from_clique(clique, read_seq, reference_index,
                 = maximal_suffix_match(
                         read_seq[-unmapped_base_count:],
                         search_window,
-                        min_cap_size=min_exon_size
+                        min_cap_size=min_exon_size,
+                        max_cap_count=max_cap_count,
+                        window_index=window_index
                     )
             new_suffix = [(rname, reverse_strand,
                             suffix_end_pos + new_suffix_offset,
@@ -921,6 +888,10 @@ def junctions_from_clique(clique, read_seq, reference_index,
         product_offsets = list(itertools.product(left_offsets, right_offsets))
         product_motifs = list(itertools.product(left_motifs, right_motifs))
         candidate_junctions = []
+        '''Realignments to reference without intron are scored together once
+        all candidates are found; this holds tuples (index of candidate in
+        candidate_junctions, read segment, reference minus intron)'''
+        unscored = []
         for i in xrange(len(product_motifs)):
             if product_motifs[i] in search_motifs:
                 '''Appropriate motif combo found! Compute intron size
@@ -962,12 +933,14 @@ def junctions_from_clique(clique, read_seq, reference_index,
                                                         - intron_end_pos
                                                     )
                         reference_minus_intron = left_stretch + right_stretch
-                        alignment_score = global_alignment.score_matrix(
-                                                read_seq[
-                                                    left_displacement:
-                                                    left_displacement+read_span
-                                                ],
-                                                reference_minus_intron)[-1][-1]
+                        unscored.append(
+                                (len(candidate_junctions),
+                                    read_seq[
+                                        left_displacement:
+                                        left_displacement+read_span
+                                    ],
+                                    reference_minus_intron)
+                            )
                         counter.add('candidate_without_small_exon')
                         tmpmotif = product_motifs[i][0] + '_' + product_motifs[i][1]
                         counter.add('candidate_with_motif_' + tmpmotif)
@@ -978,7 +951,7 @@ def junctions_from_clique(clique, read_seq, reference_index,
                                     _reverse_strand_motifs else False,
                                     intron_pos,
                                     intron_end_pos,
-                                    alignment_score
+                                    None
                                 )
                             )
                     elif small_exon_size >= min_exon_size \
@@ -1111,6 +1084,14 @@ def junctions_from_clique(clique, read_seq, reference_index,
                                                   intron_end_pos,
                                                   alignment_score)
                                             )
+        for (i, _, _), alignment_score in zip(unscored,
+                global_alignment.scores(
+                        [(read_segment, reference_minus_intron)
+                            for _, read_segment, reference_minus_intron
+                            in unscored]
+                    )):
+            candidate_junctions[i] = \
+                candidate_junctions[i][:-1] + (alignment_score,)
         try:
             max_score = max([junction[-1] for junction in candidate_junctions])
             if max_gaps_mismatches is None \
@@ -1129,7 +1110,7 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
     bowtie_index_base='genome', verbose=False, stranded=False, min_exon_size=8,
     min_intron_size=15, max_intron_size=500000, motif_radius=1,
     search_window_size=1000, global_alignment=GlobalAlignment(),
-    max_gaps_mismatches=5, experimental=False):
+    max_gaps_mismatches=5, experimental=False, max_cap_count=5):
     """ Runs Rail-RNA-junction_search.
 
         Input (read from stdin)
@@ -1200,25 +1181,29 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
         search_window_size: the size (in bp) of the reference subsequence
             in which to search for an exon.
         max_cap_count: maximum number of possible caps of size
-            min_cap_size to consider when searching for caps.
+            min_exon_size to consider when searching for caps.
         global_alignment: instance of GlobalAlignment class used for fast
-                realignment via Weave or Pypy.
+                realignment; see global_alignment.py.
         max_gaps_mismatches: maximum number of gaps/mismatches to permit in
             a realignment to reference without intron per 100 bp
             or None if unlimited
         report_multiplier: if verbose is True, the line number of an alignment,
             read, or first readlet of a read written to stderr increases
             exponentially with base report_multiplier.
-        experimental: True iff experimental algos should be run
+        experimental: True iff experimental algos should be run; these
+            include selecting multireadlet alignments by correlation
+            clustering and finding maximum cliques rather than by chaining
 
         No return value.
     """
     global _input_line_count, _output_line_count
     reference_index = bowtie_index.BowtieIndexReference(bowtie_index_base)
+    window_index = WindowKmerIndex()
     '''Input is readletized, and readlets must be composed.'''
     for (seq_id,), xpartition in xstream(input_stream, 1):
         readlet_displacements, collected_readlets = [], []
         seq_info_captured = False
+        query_count, seconds = window_index.query_count, window_index.seconds
         for seq_info, rnames, flags, poses in xpartition:
             _input_line_count += 1
             seq_info = seq_info.split('\x1e')
@@ -1259,12 +1244,19 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
                                 for rname, reverse_strand, pos in multireadlet]
                                 for i, multireadlet
                                 in enumerate(collected_readlets)]
-            # Set seed for each read so results for read are reproducible
-            random.seed(seq)
-            selected_readlets = selected_readlet_alignments_by_clustering(
+            if experimental:
+                # Set seed for each read so results for read are reproducible
+                random.seed(seq)
+                selected_readlets = \
+                    selected_readlet_alignments_by_clustering(
                                             multireadlets,
                                             experimental=experimental
                                         )
+            else:
+                selected_readlets = selected_readlet_alignments_by_chaining(
+                                            multireadlets,
+                                            max_intron_size=max_intron_size
+                                        )
             fake_junctions = []
             if stranded:
                 if sample_indexes:
@@ -1280,7 +1272,9 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
                             motif_radius=motif_radius,
                             reverse_reverse_strand=False,
                             global_alignment=global_alignment,
-                            max_gaps_mismatches=max_gaps_mismatches
+                            max_gaps_mismatches=max_gaps_mismatches,
+                            max_cap_count=max_cap_count,
+                            window_index=window_index
                         ))
                     if experimental and selected_readlets[1]:
                         fake_junctions = list(junctions_from_clique(
@@ -1296,7 +1290,9 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
                                 reverse_reverse_strand=False,
                                 global_alignment=global_alignment,
                                 max_gaps_mismatches=max_gaps_mismatches,
-                                sign=-1
+                                sign=-1,
+                                max_cap_count=max_cap_count,
+                                window_index=window_index
                             ))
                     for (junction_rname, junction_reverse_strand,
                             intron_pos, intron_end_pos) in itertools.chain(
@@ -1324,7 +1320,9 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
                             motif_radius=motif_radius,
                             reverse_reverse_strand=True,
                             global_alignment=global_alignment,
-                            max_gaps_mismatches=max_gaps_mismatches
+                            max_gaps_mismatches=max_gaps_mismatches,
+                            max_cap_count=max_cap_count,
+                            window_index=window_index
                         )
                     if experimental and selected_readlets[1]:
                         fake_junctions = list(junctions_from_clique(
@@ -1340,7 +1338,9 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
                                 reverse_reverse_strand=False,
                                 global_alignment=global_alignment,
                                 max_gaps_mismatches=max_gaps_mismatches,
-                                sign=-1
+                                sign=-1,
+                                max_cap_count=max_cap_count,
+                                window_index=window_index
                             ))
                     for (junction_rname, junction_reverse_strand,
                              intron_pos, intron_end_pos) in itertools.chain(
@@ -1384,7 +1384,9 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
                         motif_radius=motif_radius,
                         stranded=stranded,
                         global_alignment=global_alignment,
-                        max_gaps_mismatches=max_gaps_mismatches
+                        max_gaps_mismatches=max_gaps_mismatches,
+                        max_cap_count=max_cap_count,
+                        window_index=window_index
                     )
                 if experimental and selected_readlets[1]:
                     fake_junctions = list(junctions_from_clique(
@@ -1400,7 +1402,9 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
                                 reverse_reverse_strand=False,
                                 global_alignment=global_alignment,
                                 max_gaps_mismatches=max_gaps_mismatches,
-                                sign=-1
+                                sign=-1,
+                                max_cap_count=max_cap_count,
+                                window_index=window_index
                             ))
                 for (junction_rname, junction_reverse_strand,
                             intron_pos, intron_end_pos) in itertools.chain(
@@ -1417,6 +1421,21 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout,
                             )
                         )
                     _output_line_count += 1
+        if window_index.query_count > query_count:
+            # Time suffix searches for each read
+            read_microseconds = int(
+                    (window_index.seconds - seconds) * 1000000
+                )
+            counter.add('reads_with_suffix_searches')
+            counter.add('suffix_searches',
+                        window_index.query_count - query_count)
+            counter.add('suffix_search_microseconds', read_microseconds)
+            if read_microseconds > _slow_suffix_search_microseconds:
+                counter.add('reads_with_slow_suffix_searches')
+    counter.add('stretch_cache_hits', reference_index.cache_hits)
+    counter.add('stretch_cache_misses', reference_index.cache_misses)
+    counter.add('window_index_cache_hits', window_index.cache_hits)
+    counter.add('window_index_cache_misses', window_index.cache_misses)
 
 if __name__ == '__main__':
     import argparse
@@ -1437,7 +1456,13 @@ if __name__ == '__main__':
              'WRITE EXONS AND JUNCTIONS TO STDOUT')
     parser.add_argument('--experimental', action='store_const', const=True,
         default=False,
-        help='includes experimental algorithms')
+        help='includes experimental algorithms, among them selection of '
+             'readlet alignments by correlation clustering and maximum '
+             'cliques rather than by chaining')
+    parser.add_argument('--global-alignment-backend', type=str,
+        required=False, default=None, choices=['numpy', 'python'],
+        help=('Backend for realigning reads to reference without introns; '
+              'by default, numpy if it is installed, else python'))
     parser.add_argument('--min-intron-size', type=int, required=False,
         default=5,
         help='Filters introns of length smaller than this value')
@@ -1472,7 +1497,9 @@ if __name__ == '__main__':
 if __name__ == '__main__' and not args.test:
     import time
     start_time = time.time()
-    global_alignment = GlobalAlignment()
+    global_alignment = GlobalAlignment(
+            backend=args.global_alignment_backend
+        )
     go(bowtie_index_base=os.path.expandvars(args.bowtie_idx),
         verbose=args.verbose, 
         stranded=args.stranded,
@@ -1549,6 +1576,136 @@ elif __name__ == '__main__':
                     None
                 )
 
+        def test_agreement_with_regex_search(self):
+            """ Fails if k-mer index lookups find different suffixes than
+                searching each window with a regex repeatedly.
+            """
+            def regex_suffix_match(query_seq, search_window, min_cap_size,
+                                    max_cap_count):
+                offset = len(query_seq) - min_cap_size
+                suffix_seq, suffixes = query_seq[offset:], []
+                while len(suffixes) <= max_cap_count:
+                    suffix = re.search(suffix_seq, search_window[offset:])
+                    if suffix is None:
+                        break
+                    if not suffixes and not suffix.start():
+                        return None
+                    offset += suffix.start()
+                    size = min_cap_size
+                    while size < len(query_seq) and query_seq[-size-1] \
+                        == search_window[offset-size+min_cap_size-1]:
+                        size += 1
+                    suffixes.append((-size, offset - size + min_cap_size))
+                    offset += 1
+                if suffixes and len(suffixes) <= max_cap_count:
+                    return (min(suffixes)[1], -min(suffixes)[0])
+                return None
+            random.seed(3)
+            window_index = WindowKmerIndex(cache_size=4)
+            windows = [''.join([random.choice('AC')
+                                for _ in xrange(random.randint(0, 200))])
+                        for _ in xrange(8)]
+            for _ in xrange(500):
+                search_window = random.choice(windows)
+                query_seq = ''.join([random.choice('AC')
+                                        for _ in xrange(
+                                            random.randint(4, 20)
+                                        )])
+                min_cap_size = random.randint(3, 4)
+                max_cap_count = random.randint(1, 30)
+                self.assertEqual(
+                        maximal_suffix_match(query_seq, search_window,
+                                                min_cap_size, max_cap_count,
+                                                window_index=window_index),
+                        regex_suffix_match(query_seq, search_window,
+                                            min_cap_size, max_cap_count)
+                    )
+            self.assertEqual(window_index.query_count, 500)
+            self.assertTrue(window_index.cache_hits > 0)
+            self.assertTrue(len(window_index.cache) <= 4)
+
+    class TestSelectedReadletAlignmentsByChaining(unittest.TestCase):
+        """ Tests selected_readlet_alignments_by_chaining(). """
+        def test_agreement_with_clustering(self):
+            """ Fails if chaining and clustering select different alignments
+                of readlets spanning an intron with a few multialignments.
+            """
+            readlets = [[('chr1', False, 101, 126, 0),
+                         ('chr2', False, 5000, 5025, 0)],
+                        [('chr1', False, 111, 136, 10)],
+                        [('chr1', False, 1021, 1046, 30),
+                         ('chr1', True, 1021, 1046, 30)],
+                        [('chr1', False, 1031, 1056, 40),
+                         ('chr1', False, 70000, 70025, 40)]]
+            random.seed(0)
+            self.assertEquals(
+                    sorted(selected_readlet_alignments_by_chaining(
+                            readlets
+                        )[0]),
+                    sorted(selected_readlet_alignments_by_clustering(
+                            readlets
+                        )[0])
+                )
+            self.assertEquals(
+                    sorted(selected_readlet_alignments_by_chaining(
+                            readlets
+                        )[0]),
+                    [('chr1', False, 101, 126, 0),
+                     ('chr1', False, 111, 136, 10),
+                     ('chr1', False, 1021, 1046, 30),
+                     ('chr1', False, 1031, 1056, 40)]
+                )
+
+        def test_order_inconsistent_alignment(self):
+            """ Fails if alignment out of order along reference is chained. """
+            readlets = [[('chr1', False, 101, 126, 0)],
+                        [('chr1', False, 111, 136, 10),
+                         ('chr1', False, 90, 115, 10)],
+                        [('chr1', False, 121, 146, 20)]]
+            self.assertEquals(
+                    sorted(selected_readlet_alignments_by_chaining(
+                            readlets
+                        )[0]),
+                    [('chr1', False, 101, 126, 0),
+                     ('chr1', False, 111, 136, 10),
+                     ('chr1', False, 121, 146, 20)]
+                )
+
+        def test_distant_alignments(self):
+            """ Fails if alignments farther apart than max_intron_size are
+                chained.
+            """
+            readlets = [[('chr1', False, 101, 126, 0)],
+                        [('chr1', False, 111, 136, 10)],
+                        [('chr1', False, 2000, 2025, 20)],
+                        [('chr1', False, 2010, 2035, 30)],
+                        [('chr1', False, 2020, 2045, 40)]]
+            self.assertEquals(
+                    sorted(selected_readlet_alignments_by_chaining(
+                            readlets
+                        )[0]),
+                    sorted([readlet[0] for readlet in readlets])
+                )
+            self.assertEquals(
+                    sorted(selected_readlet_alignments_by_chaining(
+                            readlets, max_intron_size=1000
+                        )[0]),
+                    sorted([readlet[0] for readlet in readlets[2:]])
+                )
+
+        def test_tie(self):
+            """ Fails if no alignments are selected when repetitive read has
+                more than one best chain.
+            """
+            readlets = [[('chr1', False, 101, 126, 0),
+                         ('chr1', False, 501, 526, 0)],
+                        [('chr1', False, 111, 136, 10),
+                         ('chr1', False, 511, 536, 10)]]
+            self.assertEquals(
+                    selected_readlet_alignments_by_chaining(readlets),
+                    [[], []]
+                )
+
     class TestJunctionsFromClique(unittest.TestCase):
         """ Tests junctions_from_clique(). """
         def setUp(self):
@@ -12,7 +12,9 @@ input reads (specified by first field below) is associated with a distinct
 set of transcript fragments to which they are aligned. Reference names in
 the index encode intron sizes and locations in the (presmably) exonic
 sequences it records. Exonic chunks and junctions are inferred from alignments
-in the next step.
+in the next step. If --index-cache is specified, indexes are cached there by
+the content of their FASTA files (see index_cache.py), so each distinct set of
+transcript fragments is indexed once.
 
 Input (read from stdin)
 ----------------------------
@@ -53,6 +55,7 @@ import sys
 import os
 import site
 import tempfile
+import shutil
 import subprocess
 import time
 import string
@@ -72,6 +75,8 @@ from dooplicity.counters import Counter
 import bowtie
 import argparse
 import tempdel
+from index_cache import IndexCache
+from fasta_writer import UniqueRecords, FastaWriter
 import itertools
 from copy import copy
 
@@ -86,116 +91,193 @@ def input_files_from_input_stream(input_stream,
                                     output_stream,
                                     temp_dir_path=None,
                                     verbose=False,
-                                    gzip_level=3):
+                                    gzip_level=3,
+                                    coalesce_bytes=0,
+                                    fasta_memory_bytes=268435456):
     """ Generates FASTA reference to index and file with reads.
 
         Each line of the read file is in the following format:
 
         read number <TAB> SEQ <TAB> QUAL
 
+        If coalesce_bytes is nonzero, consecutive index groups are coalesced
+        into one FASTA and read file until the FASTA lines of the groups
+        total at least coalesce_bytes; a group whose own FASTA lines total at
+        least coalesce_bytes is never coalesced with other groups. Each QNAME is then prefixed with
+        its group number + '\x1e', and each reference name is prefixed with
+        the '\x1f'-separated list of groups whose transcript fragments
+        include it + '\x1e'; a transcript fragment shared by several groups
+        appears only once in the FASTA. Rail-RNA-realign_reads_delegate
+        removes the prefixes and alignments to other groups' fragments.
+
         input_stream: where to find Hadoop input
         output_stream: where to write unmapped reads
         temp_dir_path: where to store files
         verbose: output extra debugging messages
         gzip_level: gzip compression level (0-9)
+        coalesce_bytes: groups are coalesced until their FASTA lines total
+            this many bytes; 0 means groups are never coalesced
+        fasta_memory_bytes: estimated memory FASTA lines may use while they
+            are deduplicated before they are spilled to disk
 
-        Yield value: tuple (path to FASTA reference file, path to read file)
+        Yield value: tuple (path to FASTA reference file, path to read file,
+            number of groups whose reads are in read file)
     """
     global _input_line_count
     if temp_dir_path is None: temp_dir_path = tempfile.mkdtemp()
-    prefasta_filename = os.path.join(temp_dir_path, 'temp.prefa')
-    deduped_fasta_filename = os.path.join(temp_dir_path, 'temp.deduped.prefa')
     final_fasta_filename = os.path.join(temp_dir_path, 'temp.fa')
     reads_filename = os.path.join(temp_dir_path, 'reads.temp.gz')
-    for (group_counter, ((index_group,), xpartition)) in enumerate(
-                                                    xstream(input_stream, 1)
-                                                ):
-        counter.add('partitions')
-        if verbose:
-            print >>sys.stderr, (
-                        'Group %d: Writing prefasta and input reads...'
-                        % group_counter
-                    )
-        with open(prefasta_filename, 'w') as fasta_stream:
-            with xopen(True, reads_filename, 'w') as read_stream:
-                for read_seq, values in itertools.groupby(xpartition, 
-                                                    key=lambda val: val[0]):
-                    fasta_printed = False
-                    counter.add('inputs')
-                    for value in values:
-                        _input_line_count += 1
-                        if value[1][0] == '0':
-                            # Print FASTA line
-                            print >>fasta_stream, '\t'.join([value[1][1:-2],
-                                                                value[2]])
-                            fasta_printed = True
-                        elif fasta_printed:
-                            '''Add to temporary seq stream only if an
-                            associated FASTA line was found.'''
-                            if value[1] == '1':
-                                print >>read_stream, '\t'.join([value[2],
-                                                                    read_seq,
-                                                                    value[3]])
-                            else:
-                                print >>read_stream, '\t'.join([
-                                            value[2],
-                                            read_seq[::-1].translate(
-                                        _reversed_complement_translation_table
-                                    ),
-                                            value[3][::-1]])
-                        else:
-                            # Print unmapped read
-                            if value[1] == '1':
-                                seq_to_write = read_seq
-                                qual_to_write = value[3]
-                            else:
-                                seq_to_write = read_seq[::-1].translate(
-                                        _reversed_complement_translation_table
-                                    )
-                                qual_to_write = value[3][::-1]
-                            '''Write only essentials; handle "formal" writing
-                            in next step.'''
-                            output_stream.write(
-                                        '%s\t4\t\x1c\t\x1c\t\x1c\t\x1c'
-                                        '\t\x1c\t\x1c\t\x1c\t%s\t%s\n' % (
-                                                                value[2],
-                                                                seq_to_write,
-                                                                qual_to_write
-                                                            )
-                                    )
+    group_reads_filename = os.path.join(temp_dir_path, 'group_reads.temp.gz')
+    fasta_lines = UniqueRecords(memory_bytes=fasta_memory_bytes,
+                                temp_dir=temp_dir_path, counter=counter)
+    group_fasta_lines = UniqueRecords(memory_bytes=fasta_memory_bytes,
+                                        temp_dir=temp_dir_path,
+                                        counter=counter)
+    batch_group_count, batch_bytes = 0, 0
+    def final_files():
+        """ Writes final FASTA of open batch.
+
+            Return value: tuple (path to FASTA reference file, path to read
+                file, number of groups whose reads are in read file)
+        """
+        if coalesce_bytes:
+            counter.add('coalesced_batches')
+            counter.add('coalesced_groups', batch_group_count)
         if verbose:
             print >>sys.stderr, (
-                        'Group %d: Done! Sorting and deduplicating prefasta...'
-                        % group_counter
-                    )
-        # Sort prefasta and eliminate duplicate lines
-        dedup_process_return = subprocess.call(
-                r'''sort %s | uniq >%s'''
-                % (prefasta_filename, deduped_fasta_filename), shell=True,
-                executable='/bin/bash'
-            )
-        if dedup_process_return != 0:
-            raise RuntimeError(
-                    'Problem encountered deduplicating FASTA reference'
+                    'Group %d Done! Writing final FASTA.' % last_group_counter
                 )
+        with open(final_fasta_filename, 'w', 1048576) as final_fasta_stream:
+            fasta_writer = FastaWriter(final_fasta_stream)
+            if coalesce_bytes:
+                '''Lines with the same transcript fragment are adjacent;
+                they differ only in group.'''
+                for (rname, seq), lines in itertools.groupby(
+                                fasta_lines, key=lambda line: line[:2]
+                            ):
+                    fasta_writer.write(
+                            rname[0] + '\x1f'.join(
+                                    [line[2] for line in lines]
+                                ) + '\x1e' + rname[1:], seq
+                        )
+            else:
+                for rname, seq in fasta_lines:
+                    fasta_writer.write(rname, seq)
+            fasta_writer.close()
+            counter.add('fasta_bytes', final_fasta_stream.tell())
+        output_stream.flush()
+        return final_fasta_filename, reads_filename, batch_group_count
+    for (group_counter, ((index_group,), xpartition)) \
+        in enumerate(xstream(input_stream, 1)):
+        counter.add('partitions')
         if verbose:
             print >>sys.stderr, (
-                    'Group %d Done! Writing final FASTA.' % group_counter
-                )
-        with open(final_fasta_filename, 'w') as final_fasta_stream:
-            with open(deduped_fasta_filename) as fasta_stream:
-                for line in fasta_stream:
-                    rname, seq = line.strip().split('\t')
-                    print >>final_fasta_stream, rname
-                    final_fasta_stream.write(
-                        '\n'.join([seq[i:i+80] for i 
-                                    in xrange(0, len(seq), 80)])
+                        'Group %d: Deduplicating FASTA lines and '
+                        'writing input reads...'
+                        % group_counter
                     )
-                    final_fasta_stream.write('\n')
-        os.remove(deduped_fasta_filename)
-        os.remove(prefasta_filename)
-        output_stream.flush()
-        yield final_fasta_filename, reads_filename
+        if coalesce_bytes:
+            qname_prefix = index_group + '\x1e'
+            fasta_suffix = (index_group,)
+        else:
+            qname_prefix, fasta_suffix = '', ()
+        '''Group's reads and FASTA lines are held apart until its size is
+        known.'''
+        group_bytes = 0
+        with xopen(True, group_reads_filename, 'w') as read_stream:
+            for read_seq, values in itertools.groupby(xpartition, 
+                                            key=lambda val: val[0]):
+                fasta_printed = False
+                counter.add('inputs')
+                for value in values:
+                    _input_line_count += 1
+                    if value[1][0] == '0':
+                        # Add FASTA line
+                        rname = value[1][1:-2]
+                        group_fasta_lines.add((rname, value[2])
+                                                + fasta_suffix)
+                        group_bytes += len(rname) + len(value[2]) + 1
+                        fasta_printed = True
+                    elif fasta_printed:
+                        '''Add to temporary seq stream only if an
+                        associated FASTA line was found.'''
+                        if value[1] == '1':
+                            print >>read_stream, '\t'.join([
+                                        qname_prefix + value[2],
+                                        read_seq,
+                                        value[3]])
+                        else:
+                            print >>read_stream, '\t'.join([
+                                    qname_prefix + value[2],
+                                    read_seq[::-1].translate(
+                                _reversed_complement_translation_table
+                            ),
+                                    value[3][::-1]])
+                    else:
+                        # Print unmapped read
+                        if value[1] == '1':
+                            seq_to_write = read_seq
+                            qual_to_write = value[3]
+                        else:
+                            seq_to_write = read_seq[::-1].translate(
+                                _reversed_complement_translation_table
+                            )
+                            qual_to_write = value[3][::-1]
+                        '''Write only essentials; handle "formal"
+                        writing in next step.'''
+                        output_stream.write(
+                                '%s\t4\t\x1c\t\x1c\t\x1c\t\x1c'
+                                '\t\x1c\t\x1c\t\x1c\t%s\t%s\n' % (
+                                                        value[2],
+                                                        seq_to_write,
+                                                        qual_to_write
+                                                    )
+                            )
+        if batch_group_count and group_bytes >= coalesce_bytes:
+            # Group is too big to coalesce; run open batch first
+            yield final_files()
+            batch_group_count, batch_bytes = 0, 0
+        if batch_group_count:
+            # Coalesce with open batch; gzip members can be concatenated
+            with open(reads_filename, 'ab') as read_stream:
+                with open(group_reads_filename, 'rb') as group_read_stream:
+                    shutil.copyfileobj(group_read_stream, read_stream)
+            for fasta_line in group_fasta_lines:
+                fasta_lines.add(fasta_line)
+        else:
+            os.rename(group_reads_filename, reads_filename)
+            fasta_lines, group_fasta_lines = group_fasta_lines, fasta_lines
+        last_group_counter = group_counter
+        batch_group_count += 1
+        batch_bytes += group_bytes
+        if batch_bytes >= coalesce_bytes:
+            yield final_files()
+            batch_group_count, batch_bytes = 0, 0
+    if batch_group_count:
+        yield final_files()
+
+def group_fasta(fasta_file, group, group_fasta_file):
+    """ Writes the records of a group from a coalesced FASTA reference.
+
+        fasta_file: FASTA reference written when groups are coalesced, whose
+            reference names are prefixed with the '\x1f'-separated list of
+            groups whose transcript fragments include them + '\x1e'
+        group: index group
+        group_fasta_file: where to write FASTA records of group's transcript
+            fragments; reference names keep their prefixes
+
+        No return value.
+    """
+    with open(fasta_file) as fasta_stream:
+        with open(group_fasta_file, 'w') as group_fasta_stream:
+            in_group = False
+            for line in fasta_stream:
+                if line[0] == '>':
+                    in_group = group in line[1:line.index('\x1e')].split(
+                                                                        '\x1f'
+                                                                    )
+                if in_group:
+                    group_fasta_stream.write(line)
 
 def create_index_from_reference_fasta(bowtie2_build_exe, fasta_file,
         index_basename):
@@ -220,6 +302,28 @@ def create_index_from_reference_fasta(bowtie2_build_exe, fasta_file,
     bowtie_build_process.wait()
     return bowtie_build_process.returncode
 
+def bowtie2_build_version(bowtie2_build_exe):
+    """ Gets version information of bowtie2-build.
+
+        Indexes built by different versions of bowtie2-build may differ, so
+        the version is part of what index cache keys are salted with.
+
+        bowtie2_build_exe: path to bowtie2-build executable
+
+        Return value: output of bowtie2-build --version, or '' if it can't be
+            run
+    """
+    try:
+        version_process = subprocess.Popen([bowtie2_build_exe, '--version'],
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT)
+    except OSError:
+        return ''
+    version = version_process.communicate()[0]
+    if version_process.returncode:
+        return ''
+    return version
+
 def handle_temporary_directory(archive, temp_dir_path):
     """ Archives or deletes temporary directory.
 
@@ -242,7 +346,8 @@ def handle_temporary_directory(archive, temp_dir_path):
 def go(input_stream=sys.stdin, output_stream=sys.stdout, bowtie2_exe='bowtie2',
     bowtie2_build_exe='bowtie2-build', bowtie2_args=None,
     temp_dir_path=None, verbose=False, report_multiplier=1.2, gzip_level=3,
-    count_multiplier=4, tie_margin=0):
+    count_multiplier=4, tie_margin=0, index_cache=None, coalesce_bytes=0,
+    fasta_memory_bytes=268435456):
     """ Runs Rail-RNA-realign.
 
         Realignment script for MapReduce pipelines that wraps Bowtie2. Creates
@@ -312,6 +417,18 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout, bowtie2_exe='bowtie2',
             alignment_count_to_report is the user-specified bowtie2 -k arg
         tie_margin: allowed score difference per 100 bases among ties in 
              max alignment score.
+        index_cache: IndexCache from which indexes are obtained, or None if
+            every index should be built in temp_dir_path
+        coalesce_bytes: consecutive index groups are coalesced into one
+            index until their FASTA lines total this many bytes; 0 means
+            groups are never coalesced. Since a read in a coalesced group
+            may align to other groups' transcript fragments, Bowtie 2's -k
+            is multiplied by the number of groups coalesced, and a read
+            whose alignments to its own group's fragments may still have
+            been crowded out is realigned to an index of those fragments
+            alone.
+        fasta_memory_bytes: estimated memory FASTA lines may use while they
+            are deduplicated before they are spilled to disk
 
         No return value.
     """
@@ -322,54 +439,136 @@ def go(input_stream=sys.stdin, output_stream=sys.stdout, bowtie2_exe='bowtie2',
             = bowtie.parsed_bowtie_args(bowtie2_args)
     reads_filename = os.path.join(temp_dir_path, 'reads.temp')
     input_command = 'gzip -cd %s' % reads_filename
-    bowtie_command = ' ' .join([bowtie2_exe,
-        bowtie2_args if bowtie2_args is not None else '',
-        '{0} --local -t --no-hd --mm -x'.format(
-                '-k {0}'.format(alignment_count_to_report * count_multiplier)
-            ),
-        bowtie2_index_base, '--12 -'])
-    delegate_command = ''.join(
+    rerun_filename = os.path.join(temp_dir_path, 'rerun.temp')
+    group_k = alignment_count_to_report * count_multiplier
+    def bowtie_command(alignment_count, index_base):
+        return ' ' .join([bowtie2_exe,
+            bowtie2_args if bowtie2_args is not None else '',
+            '-k {0} --local -t --no-hd --mm -x'.format(alignment_count),
+            index_base, '--12 -'])
+    def delegate_command(extra_args=''):
+        return ''.join(
             [sys.executable, ' ', os.path.realpath(__file__)[:-3],
                 ('_delegate.py --report-multiplier %08f '
                  '--alignment-count-to-report %d '
-                 '--tie-margin %d %s')
+                 '--tie-margin %d %s %s')
                     % (report_multiplier, alignment_count_to_report,
-                        tie_margin, '--verbose' if verbose else '')]
+                        tie_margin, '--verbose' if verbose else '',
+                        extra_args)]
+        )
+    def coalesced_args(bowtie_k):
+        return ('--coalesced --bowtie-k {0} --group-k {1} '
+                '--rerun-file {2}').format(bowtie_k, group_k, rerun_filename)
+    if coalesce_bytes:
+        bowtie_k = '<{0} x groups coalesced>'.format(group_k)
+    else:
+        bowtie_k = group_k
+    print >>sys.stderr, 'Bowtie2 command to execute: ' + ' | '.join(
+            [input_command, bowtie_command(bowtie_k, '<index>'),
+             delegate_command(coalesced_args(bowtie_k)
+                                if coalesce_bytes else '')]
         )
-    # Use grep to kill empty lines terminating python script
-    full_command = ' | '.join([input_command,
-                                bowtie_command, delegate_command])
-    print >>sys.stderr, 'Bowtie2 command to execute: ' + full_command
-    for fasta_file, reads_file in input_files_from_input_stream(
+    def build(fasta_file, index_base):
+        counter.add('bowtie_build_invocations')
+        return create_index_from_reference_fasta(bowtie2_build_exe,
+                                                    fasta_file,
+                                                    index_base)
+    def index(fasta_file):
+        if index_cache is None:
+            return build(fasta_file, bowtie2_index_base), bowtie2_index_base
+        return index_cache.index(fasta_file, build)
+    def align(reads_command, alignment_count, index_base, delegate_args=''):
+        # Use grep to kill empty lines terminating python script
+        full_command = ' | '.join([reads_command,
+                                    bowtie_command(alignment_count,
+                                                   index_base),
+                                    delegate_command(delegate_args)])
+        bowtie_process = subprocess.Popen(' '.join(
+                    ['set -exo pipefail;', full_command]
+                ), bufsize=-1,
+            stdout=sys.stdout, stderr=sys.stderr, shell=True,
+            executable='/bin/bash')
+        return_code = bowtie_process.wait()
+        if return_code:
+            raise RuntimeError(
+                        'Error occurred while reading Bowtie 2 output; '
+                        'exitlevel was %d.' % return_code
+                    )
+    def realign_crowded_reads(fasta_file):
+        """ Realigns reads crowded out of coalesced groups' output.
+
+            Each read the delegate wrote to rerun_filename is realigned to
+            an index of its own group's transcript fragments alone, as if
+            the groups had not been coalesced.
+
+            fasta_file: coalesced FASTA reference file
+
+            No return value.
+        """
+        if not os.path.getsize(rerun_filename):
+            return
+        sorted_rerun_filename = rerun_filename + '.sorted'
+        group_reads_filename = os.path.join(temp_dir_path, 'group_reads.temp')
+        group_fasta_filename = os.path.join(temp_dir_path, 'group.fa')
+        # Lines of a group are adjacent after sorting
+        sort_return = subprocess.call(
+                'LC_ALL=C sort %s >%s' % (rerun_filename,
+                                          sorted_rerun_filename),
+                shell=True, executable='/bin/bash'
+            )
+        if sort_return != 0:
+            raise RuntimeError(
+                    'Error encountered sorting reads to realign; exitlevel '
+                    'was %d.' % sort_return
+                )
+        with open(sorted_rerun_filename) as rerun_stream:
+            for group, lines in itertools.groupby(
+                        rerun_stream, key=lambda line: line.partition('\x1e')[0]
+                    ):
+                counter.add('crowded_groups')
+                with open(group_reads_filename, 'w') as group_reads_stream:
+                    group_reads_stream.writelines(lines)
+                group_fasta(fasta_file, group, group_fasta_filename)
+                bowtie_build_return_code, index_base = index(
+                                                        group_fasta_filename
+                                                    )
+                if bowtie_build_return_code:
+                    raise RuntimeError(
+                            'Bowtie build process failed with exitlevel %d.'
+                            % bowtie_build_return_code
+                        )
+                align('cat %s' % group_reads_filename, group_k, index_base,
+                        '--coalesced')
+        for filename in [sorted_rerun_filename, group_reads_filename,
+                            group_fasta_filename]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+    for fasta_file, reads_file, group_count in input_files_from_input_stream(
                                                 input_stream,
                                                 output_stream,
                                                 verbose=verbose,
                                                 temp_dir_path=temp_dir_path,
-                                                gzip_level=gzip_level
+                                                gzip_level=gzip_level,
+                                                coalesce_bytes=coalesce_bytes,
+                                                fasta_memory_bytes=\
+                                                    fasta_memory_bytes
                                             ):
-        bowtie_build_return_code = create_index_from_reference_fasta(
-                                        bowtie2_build_exe,
-                                        fasta_file,
-                                        bowtie2_index_base
-                                    )
-        counter.add('bowtie_build_invocations')
+        bowtie_build_return_code, index_base = index(fasta_file)
         counter.add('bowtie_build_return_%d' % bowtie_build_return_code)
         if bowtie_build_return_code == 0:
+            if coalesce_bytes:
+                bowtie_k = group_k * group_count
+                align(input_command, bowtie_k, index_base,
+                        coalesced_args(bowtie_k))
+                realign_crowded_reads(fasta_file)
+            else:
+                align(input_command, group_k, index_base)
             try:
                 os.remove(fasta_file)
             except OSError:
                 pass
-            bowtie_process = subprocess.Popen(' '.join(
-                        ['set -exo pipefail;', full_command]
-                    ), bufsize=-1,
-                stdout=sys.stdout, stderr=sys.stderr, shell=True,
-                executable='/bin/bash')
-            return_code = bowtie_process.wait()
-            if return_code:
-                raise RuntimeError(
-                            'Error occurred while reading Bowtie 2 output; '
-                            'exitlevel was %d.' % return_code
-                        )
         elif bowtie_build_return_code == 1:
             print >>sys.stderr, ('Bowtie build failed, but probably because '
                                  'FASTA file was empty. Continuing...')
@@ -416,6 +615,26 @@ if __name__ == '__main__':
     parser.add_argument('--gzip-level', type=int, required=False,
         default=3,
         help='Level of gzip compression to use, if applicable')
+    parser.add_argument('--index-cache', metavar='PATH', type=str,
+        required=False, default=None,
+        help='Directory in which transcript fragment indexes are cached; '
+             'may be shared across nodes. Indexes are not cached unless this '
+             'is specified; the directory is not cleaned up when the task '
+             'ends')
+    parser.add_argument('--coalesce-bytes', type=int, required=False,
+        default=0,
+        help='Consecutive index groups are coalesced into one Bowtie 2 '
+             'index and invocation until their transcript fragments total '
+             'at least this many bytes; 0 means groups are never coalesced')
+    parser.add_argument('--fasta-memory-bytes', type=int, required=False,
+        default=256 * 1024 ** 2,
+        help='Transcript fragments are deduplicated in memory until they '
+             'occupy about this many bytes, then sorted runs are spilled to '
+             'temporary files')
+    parser.add_argument('--index-cache-bytes', type=int, required=False,
+        default=4 * 1024 ** 3,
+        help='Maximum total size of indexes in --index-cache; 0 disables '
+             'the cache')
 
     # Add command-line arguments for dependencies
     bowtie.add_args(parser)
@@ -454,6 +673,16 @@ if __name__ == '__main__' and not args.test:
     if args.verbose:
         print >>sys.stderr, 'Creating temporary directory %s' \
             % temp_dir_path
+    if args.index_cache is not None and args.index_cache_bytes > 0:
+        bowtie2_build_exe = os.path.expandvars(args.bowtie2_build_exe)
+        index_cache = IndexCache(
+                os.path.expandvars(args.index_cache), args.index_cache_bytes,
+                salt='\n'.join([bowtie2_build_exe,
+                                bowtie2_build_version(bowtie2_build_exe)]),
+                counter=counter
+            )
+    else:
+        index_cache = None
     go(bowtie2_exe=os.path.expandvars(args.bowtie2_exe),
         bowtie2_build_exe=os.path.expandvars(args.bowtie2_build_exe),
         bowtie2_args=bowtie_args,
@@ -462,9 +691,93 @@ if __name__ == '__main__' and not args.test:
         report_multiplier=args.report_multiplier,
         gzip_level=args.gzip_level,
         count_multiplier=args.count_multiplier,
-        tie_margin=args.tie_margin)
+        tie_margin=args.tie_margin,
+        index_cache=index_cache,
+        coalesce_bytes=args.coalesce_bytes,
+        fasta_memory_bytes=args.fasta_memory_bytes)
 elif __name__ == '__main__':
     # Test units
     del sys.argv[1:] # Don't choke on extra command-line parameters
     import unittest
+    import shutil
+    import gzip
+    from cStringIO import StringIO
+
+    class TestCoalescedGroups(unittest.TestCase):
+        """ Tests input_files_from_input_stream() and group_fasta(). """
+        def setUp(self):
+            self.temp_dir_path = tempfile.mkdtemp()
+            # Groups 0 and 1 share a transcript fragment
+            self.input_lines = [
+                    '0\tAAAAC\t0>chr1+\x1d1\x1d6\x1d\x1dp\tAAAACG',
+                    '0\tAAAAC\t1\tr1\tIIIII',
+                    '1\tCCCCG\t0>chr1+\x1d1\x1d6\x1d\x1dp\tAAAACG',
+                    '1\tCCCCG\t0>chr2-\x1d9\x1d6\x1d\x1ds\tCCCCGT',
+                    '1\tCCCCG\t2\tr2\tABCDE',
+                    '1\tGGGGA\t1\tr3\tEDCBA'
+                ]
+
+        def files(self, coalesce_bytes):
+            """ Returns FASTA and reads from input_files_from_input_stream().
+
+                coalesce_bytes: argument of input_files_from_input_stream()
+
+                Return value: list of tuples (FASTA, reads, group count,
+                    {group : group's FASTA}), one per FASTA yielded
+            """
+            files = []
+            group_fasta_file = os.path.join(self.temp_dir_path, 'group.fa')
+            for fasta_file, reads_file, group_count \
+                in input_files_from_input_stream(
+                        StringIO('\n'.join(self.input_lines) + '\n'),
+                        StringIO(), temp_dir_path=self.temp_dir_path,
+                        coalesce_bytes=coalesce_bytes
+                    ):
+                group_fastas = {}
+                for group in ['0', '1']:
+                    if coalesce_bytes:
+                        group_fasta(fasta_file, group, group_fasta_file)
+                        with open(group_fasta_file) as fasta_stream:
+                            group_fastas[group] = fasta_stream.read()
+                with open(fasta_file) as fasta_stream:
+                    with gzip.open(reads_file) as reads_stream:
+                        files.append((fasta_stream.read(),
+                                        reads_stream.read(), group_count,
+                                        group_fastas))
+            return files
+
+        def test_coalesced_files(self):
+            """ Fails if coalesced groups' files differ from groups'. """
+            per_group = self.files(0)
+            self.assertEqual([group_count for _, _, group_count, _
+                                in per_group], [1, 1])
+            [(fasta, reads, group_count, group_fastas)] = self.files(1000)
+            self.assertEqual(group_count, 2)
+            self.assertEqual(fasta,
+                             '>0\x1f1\x1echr1+\x1d1\x1d6\x1d\nAAAACG\n'
+                             '>1\x1echr2-\x1d9\x1d6\x1d\nCCCCGT\n')
+            self.assertEqual(reads.replace('0\x1e', '').replace('1\x1e', ''),
+                             ''.join([group_reads for _, group_reads, _, _
+                                        in per_group]))
+            for group, (group_fasta, _, _, _) in zip(['0', '1'], per_group):
+                self.assertEqual(group_fastas[group].replace(
+                                        '0\x1f1\x1e', ''
+                                    ).replace('1\x1e', ''), group_fasta)
+
+        def test_batches(self):
+            """ Fails if groups aren't coalesced until coalesce_bytes. """
+            self.assertEqual([group_count for _, _, group_count, _
+                                in self.files(1)], [1, 1])
+
+        def test_small_then_large(self):
+            """ Fails if a group too big to coalesce joins an open batch. """
+            # Group 0's FASTA lines total 17 bytes, and group 1's total 34
+            self.assertEqual([group_count for _, _, group_count, _
+                                in self.files(20)], [1, 1])
+            self.assertEqual([group_count for _, _, group_count, _
+                                in self.files(52)], [2])
+
+        def tearDown(self):
+            shutil.rmtree(self.temp_dir_path)
+
     unittest.main()
@@ -2,18 +2,19 @@
 realign_reads_delegate.py 
 
 Output of Bowtie2 from realign_reads.py is streamed to this script to obtain
-final output. See realign_reads.py for output format information.
+final output. See realign_reads.py for output format information. When
+realign_reads.py coalesces index groups, QNAMEs and RNAMEs are prefixed with
+the groups they belong to; these prefixes are removed here, and alignments of
+a read to transcript fragments of other groups are dropped. Reads whose
+alignments to their own group's fragments may have been crowded out by
+alignments to other groups' fragments are written to a file so
+realign_reads.py can realign them to their own group's fragments alone.
 """
 
 import sys
 import os
 import site
 
-if '--test' in sys.argv:
-    print("No unit tests")
-    #unittest.main(argv=[sys.argv[0]])
-    sys.exit(0)
-
 base_path = os.path.abspath(
                     os.path.dirname(os.path.dirname(os.path.dirname(
                         os.path.realpath(__file__)))
@@ -30,9 +31,86 @@ register_cleanup(counter.flush)
 import string
 _reversed_complement_translation_table = string.maketrans('ATCG', 'TAGC')
 
+def read_seq_and_qual(alignment):
+    """ Recovers a read's SEQ and QUAL as they were before alignment.
+
+        alignment: tuple of SAM fields following QNAME
+
+        Return value: tuple (SEQ, QUAL)
+    """
+    if int(alignment[0]) & 16:
+        return (alignment[8][::-1].translate(
+                    _reversed_complement_translation_table
+                ), alignment[9][::-1])
+    return alignment[8], alignment[9]
+
+def group_alignments(group, alignments):
+    """ Keeps only a read's alignments to its group's transcript fragments.
+
+        Used when index groups are coalesced. Group prefixes are removed from
+        RNAMEs, and the first alignment kept is made primary, as it would be
+        if the group's fragments had been indexed alone. If alignments to
+        other groups' fragments are dropped, Bowtie 2's XS:i and MAPQ no
+        longer describe the alignments that are left: XS:i is recomputed from
+        the AS:i of the alignments kept as in
+        alignment_handlers.multiread_with_junctions(), and MAPQ is set to 255
+        (unavailable) as in alignment_handlers.multiread_to_report(). If no
+        alignment is kept, an unaligned record is returned.
+
+        group: index group of read
+        alignments: iterable of tuples of SAM fields following QNAME, with
+            each RNAME prefixed by a '\x1f'-separated list of groups +
+            '\x1e'
+
+        Return value: tuple (number of alignments Bowtie 2 reported, list of
+            tuples of SAM fields following QNAME to print)
+    """
+    kept, alignment_count, last_alignment = [], 0, None
+    for alignment in alignments:
+        flag = int(alignment[0])
+        if flag & 4:
+            return 0, [alignment]
+        alignment_count += 1
+        groups, _, rname = alignment[1].partition('\x1e')
+        if group not in groups.split('\x1f'):
+            counter.add('cross_group_alignments')
+            last_alignment = alignment
+            continue
+        if not kept:
+            flag &= ~256
+        kept.append([str(flag), rname] + list(alignment[2:]))
+    if not kept:
+        # Every alignment was to another group's fragments
+        return alignment_count, [
+                ('4', '*', '0', '0', '*', '*', '0', '0')
+                + read_seq_and_qual(last_alignment)
+            ]
+    if len(kept) == alignment_count:
+        # Bowtie 2's fields are the same as if the group were indexed alone
+        return alignment_count, [tuple(alignment) for alignment in kept]
+    alignment_scores = [[int(field[5:]) for field in alignment
+                            if field[:5] == 'AS:i:'][0]
+                            for alignment in kept]
+    if len(kept) == 1:
+        xs_field = None
+    else:
+        xs_field = 'XS:i:%d' % sorted(alignment_scores, reverse=True)[1]
+    for alignment in kept:
+        alignment[3] = '255'
+        for i in xrange(10, len(alignment)):
+            if alignment[i][:5] == 'XS:i:':
+                del alignment[i]
+                break
+        if xs_field is not None:
+            alignment.insert([i for i in xrange(10, len(alignment))
+                                if alignment[i][:5] == 'AS:i:'][0] + 1,
+                             xs_field)
+    return alignment_count, [tuple(alignment) for alignment in kept]
+
 def go(output_stream=sys.stdout, input_stream=sys.stdin,
         verbose=False, report_multiplier=1.2,
-        alignment_count_to_report=1, tie_margin=0):
+        alignment_count_to_report=1, tie_margin=0, coalesced=False,
+        bowtie_k=0, group_k=0, rerun_stream=None):
     """ Processes Bowtie 2 alignments, emitting filtered SAM output.
 
         Only max(# tied alignments, alignment_count_to_report) alignments
@@ -49,11 +127,32 @@ def go(output_stream=sys.stdout, input_stream=sys.stdin,
         alignment_count_to_report: argument of Bowtie 2's -k field
         tie_margin: allowed score difference per 100 bases among ties in 
              max alignment score.
+        coalesced: True iff realign_reads.py coalesced index groups, so
+            QNAMEs and RNAMEs have group prefixes
+        bowtie_k: argument of Bowtie 2's -k field for coalesced groups
+        group_k: argument of Bowtie 2's -k field for a group indexed alone
+        rerun_stream: where to write reads, in Bowtie 2's --12 format with
+            group-prefixed QNAMEs, for which Bowtie 2 reported bowtie_k
+            alignments but fewer than group_k to their own group's
+            fragments, so more of those may have been crowded out; these
+            are not otherwise printed. None if every read is printed.
     """
     output_line_count, next_report_line = 0, 0
     threshold_alignment_count = max(2, alignment_count_to_report)
     for (qname,), xpartition in xstream(input_stream, 1):
         counter.add('partitions')
+        if coalesced:
+            group, _, group_qname = qname.partition('\x1e')
+            alignment_count, xpartition = group_alignments(group, xpartition)
+            if rerun_stream is not None and alignment_count >= bowtie_k \
+                and (0 if int(xpartition[0][0]) & 4
+                        else len(xpartition)) < group_k:
+                counter.add('crowded_reads')
+                print >>rerun_stream, '\t'.join(
+                        (qname,) + read_seq_and_qual(xpartition[0])
+                    )
+                continue
+            qname = group_qname
         max_score, alignments_output, current_tie_margin = None, 0, None
         for rest_of_line in xpartition:
             counter.add('inputs')
@@ -110,11 +209,114 @@ if __name__ == '__main__':
     parser.add_argument('--alignment-count-to-report', type=int,
         required=False, default=1,
         help='Argument of Bowtie 2\'s -k parameter')
+    parser.add_argument('--coalesced', action='store_const', const=True,
+        default=False,
+        help='QNAMEs and RNAMEs have prefixes of coalesced index groups')
+    parser.add_argument('--bowtie-k', type=int, required=False,
+        default=0,
+        help='Argument of Bowtie 2\'s -k parameter for coalesced groups')
+    parser.add_argument('--group-k', type=int, required=False,
+        default=0,
+        help='Argument of Bowtie 2\'s -k parameter for a group indexed '
+             'alone')
+    parser.add_argument('--rerun-file', type=str, required=False,
+        default=None,
+        help='Where to write reads whose alignments to their own group\'s '
+             'transcript fragments may have been crowded out by other '
+             'groups\' when --coalesced is invoked')
+    parser.add_argument('--test', action='store_const', const=True,
+        default=False,
+        help='Run unit tests; DOES NOT NEED INPUT FROM STDIN')
     from alignment_handlers import add_args as alignment_handlers_add_args
     alignment_handlers_add_args(parser)
     args = parser.parse_args()
 
+if __name__ == '__main__' and not args.test:
+    if args.rerun_file is not None:
+        rerun_stream = open(args.rerun_file, 'w')
+    else:
+        rerun_stream = None
     go(verbose=args.verbose,
         report_multiplier=args.report_multiplier,
         alignment_count_to_report=args.alignment_count_to_report,
-        tie_margin=args.tie_margin)
+        tie_margin=args.tie_margin,
+        coalesced=args.coalesced,
+        bowtie_k=args.bowtie_k,
+        group_k=args.group_k,
+        rerun_stream=rerun_stream)
+    if rerun_stream is not None:
+        rerun_stream.close()
+elif __name__ == '__main__':
+    # Test units
+    del sys.argv[1:] # Don't choke on extra command-line parameters
+    import unittest
+    from cStringIO import StringIO
+
+    def sam(qname, flag, rname, pos, score, xs=None, mapq='1'):
+        """ Returns a line of Bowtie 2 SAM output for a 20-base read. """
+        fields = [qname, str(flag), rname, str(pos), mapq, '20M', '*', '0',
+                    '0', 'ACGTACGTACGTACGTAAAA', 'IIIIIIIIIIIIIIIIIIII',
+                    'AS:i:%d' % score]
+        if xs is not None:
+            fields.append('XS:i:%d' % xs)
+        fields.extend(['XN:i:0', 'NM:i:0', 'YT:Z:UU'])
+        return '\t'.join(fields) + '\n'
+
+    class TestCoalescedGroups(unittest.TestCase):
+        """ Tests go() on output for coalesced index groups. """
+        def setUp(self):
+            '''Bowtie 2 output when groups 1 and 2 are indexed alone. Read
+            r1 of group 1 aligns to fragments f1 and f2 and, were they in
+            its index, would align better to group 2's fragment f3;
+            read r2 of group 2 aligns to f3 alone, and read r3 of group 2
+            aligns nowhere.'''
+            self.per_group = [
+                    sam('r1', 0, 'f1', 1, 30, xs=28),
+                    sam('r1', 256, 'f2', 5, 28, xs=28),
+                    sam('r2', 16, 'f3', 2, 40),
+                    '\t'.join(['r3', '4', '*', '0', '0', '*', '*', '0',
+                                '0', 'ACGTACGTACGTACGTAAAA',
+                                'IIIIIIIIIIIIIIIIIIII', 'YT:Z:UU']) + '\n'
+                ]
+            '''Bowtie 2 output when the groups share an index. f2 is a
+            fragment of both groups.'''
+            self.coalesced = [
+                    sam('1\x1er1', 0, '2\x1ef3', 9, 36, xs=30, mapq='3'),
+                    sam('1\x1er1', 256, '1\x1ef1', 1, 30, xs=30, mapq='3'),
+                    sam('1\x1er1', 256, '1\x1f2\x1ef2', 5, 28, xs=30,
+                        mapq='3'),
+                    sam('2\x1er2', 16, '2\x1ef3', 2, 40),
+                    self.per_group[3].replace('r3', '2\x1er3')
+                ]
+
+        def go(self, lines, **kwargs):
+            """ Returns output of go() on lines of Bowtie 2 output. """
+            output_stream = StringIO()
+            go(input_stream=StringIO(''.join(lines)),
+                output_stream=output_stream, alignment_count_to_report=2,
+                **kwargs)
+            return output_stream.getvalue()
+
+        def test_same_output(self):
+            """ Fails if coalesced groups' output differs from groups'. """
+            per_group = self.go(self.per_group)
+            self.assertEqual(self.go(self.coalesced, coalesced=True),
+                             per_group.replace('\t1\t20M', '\t255\t20M', 2))
+
+        def test_rerun(self):
+            """ Fails if a crowded-out read isn't written for realignment. """
+            rerun_stream = StringIO()
+            self.assertEqual(self.go(self.coalesced[:2], coalesced=True,
+                                        bowtie_k=2, group_k=2,
+                                        rerun_stream=rerun_stream), '')
+            self.assertEqual(rerun_stream.getvalue(),
+                             '1\x1er1\tACGTACGTACGTACGTAAAA'
+                             '\tIIIIIIIIIIIIIIIIIIII\n')
+            rerun_stream = StringIO()
+            self.assertEqual(self.go(self.coalesced, coalesced=True,
+                                        bowtie_k=3, group_k=2,
+                                        rerun_stream=rerun_stream),
+                             self.go(self.coalesced, coalesced=True))
+            self.assertEqual(rerun_stream.getvalue(), '')
+
+    unittest.main()
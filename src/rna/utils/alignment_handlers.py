@@ -6,7 +6,8 @@ Part of Rail-RNA
 Includes various functions for handling alignments output by Bowtie2 -- most
 importantly:
 -a function that outputs indels, junctions, exons, and mismatches from a genome
-position, CIGAR string, and MD string (indels_junctions_exons_mismatches)
+position, CIGAR string, and MD string (indels_junctions_exons_mismatches); it
+walks integer tokens from cigar_tokens() and md_tokens()
 -a function that inserts junctions in a CIGAR string (multread_with_junctions).
 """
 
@@ -20,6 +21,47 @@ import string
 
 _reversed_complement_translation_table = string.maketrans('ATCG', 'TAGC')
 
+# BAM codes of CIGAR operations; an operation is coded as size << 4 | code
+_cigar_op_codes = dict((op, code) for code, op in enumerate('MIDNSHP=X'))
+_cigar_pattern = re.compile(r'(\d+)([MIDNSHP=X])')
+# MD tokens: run of matched bases, deleted bases, or a single mismatched base
+_md_pattern = re.compile(r'(\d+)|\^([A-Za-z]+)|([A-Za-z])')
+
+def cigar_tokens(cigar):
+    """ Tokenizes CIGAR string.
+
+        cigar: CIGAR string
+
+        Return value: list of integers, one per operation, each coded as
+            size << 4 | BAM op code; op codes are M=0, I=1, D=2, N=3, S=4,
+            H=5, P=6, '='=7, X=8
+    """
+    return [int(size) << 4 | _cigar_op_codes[op]
+                for size, op in _cigar_pattern.findall(cigar)]
+
+def md_tokens(md):
+    """ Tokenizes MD string.
+
+        md: MD:Z string (example: 33A^CC)
+
+        Return value: tuple (list of integers, list of deleted stretches).
+            Each integer is a token: n > 0 is a run of n matched bases, -1 is
+            a mismatched base, and -(n + 1) is a deletion of n bases, which
+            are the next string in the list of deleted stretches. Runs of 0
+            matched bases are omitted.
+    """
+    tokens, deleted = [], []
+    for run, deletion, _ in _md_pattern.findall(md):
+        if run:
+            if run != '0':
+                tokens.append(int(run))
+        elif deletion:
+            tokens.append(-len(deletion) - 1)
+            deleted.append(deletion)
+        else:
+            tokens.append(-1)
+    return tokens, deleted
+
 def add_args(parser):
     parser.add_argument('--tie-margin', type=int, required=False,
         default=6,
@@ -403,7 +445,8 @@ def reference_from_seq(cigar, seq, reference_index, rname, pos):
         soft-clipped bases from the reference. Cigar is used to account
         for indels.
 
-        cigar: CIGAR string; used to extract initial soft clip
+        cigar: CIGAR string or its tokens from cigar_tokens(); used to
+            extract initial soft clip
         seq: read sequence
         reference_index: object of class BowtieIndexReference
         rname: RNAME
@@ -411,13 +454,12 @@ def reference_from_seq(cigar, seq, reference_index, rname, pos):
 
         Return value: tuple start pos, reference sequence
     """
-    cigar = re.split(r'([MINDS])', cigar)[:-1]
-    del_count = sum([int(cigar[i-1]) for i in xrange(len(cigar))
-                        if cigar[i] == 'D'])
-    insert_count = sum([int(cigar[i-1]) for i in xrange(len(cigar))
-                        if cigar[i] == 'I'])
-    if cigar[1] == 'S':
-        preclip = int(cigar[0])
+    if isinstance(cigar, basestring):
+        cigar = cigar_tokens(cigar)
+    del_count = sum([token >> 4 for token in cigar if token & 15 == 2])
+    insert_count = sum([token >> 4 for token in cigar if token & 15 == 1])
+    if cigar[0] & 15 == 4:
+        preclip = cigar[0] >> 4
     else:
         preclip = 0
     base_count = len(seq) - insert_count + del_count
@@ -462,105 +504,113 @@ def indels_junctions_exons_mismatches(
                        exon end position (exclusive)). Mismatches is a list
             of tuples (genomic position of mismatch, read base)
     """
+    return indels_junctions_exons_mismatches_from_tokens(
+            cigar_tokens(cigar), md_tokens(md), pos, seq,
+            drop_deletions=drop_deletions, junctions_only=junctions_only
+        )
+
+def indels_junctions_exons_mismatches_from_tokens(
+            cigar, md, pos, seq, drop_deletions=False, junctions_only=False
+        ):
+    """ Finds indels, junctions, exons, mismatches from tokenized CIGAR/MD
+
+        Walks CIGAR operations and MD tokens together once. Neither list of
+        tokens is modified, so tokens may be shared among alignments.
+
+        cigar: CIGAR tokens from cigar_tokens()
+        md: MD tokens from md_tokens()
+        pos: position of first aligned base
+        seq: read sequence
+        drop_deletions: drops deletions from coverage vectors iff True
+        junctions_only: does not populate mismatch list
+
+        Return value: see indels_junctions_exons_mismatches()
+    """
     insertions, deletions, junctions, exons, mismatches = [], [], [], [], []
-    cigar = re.split(r'([MINDS])', cigar)[:-1]
-    md = parsed_md(md)
+    md, deleted = md
     seq_size = len(seq)
-    cigar_chars, cigar_sizes = [], []
-    cigar_index, md_index, seq_index = 0, 0, 0
-    max_cigar_index = len(cigar)
-    while cigar_index != max_cigar_index:
-        if cigar[cigar_index] == 0:
-            cigar_index += 2
-            continue
-        if cigar[cigar_index+1] == 'M':
-            aligned_base_cap = int(cigar[cigar_index])
+    seq_index = 0
+    # Current MD token and how much of it is left
+    md_index, md_left, deleted_index = 0, 0, 0
+    for token in cigar:
+        size, op = token >> 4, token & 15
+        if op == 0 or op == 7 or op == 8:
+            # Aligned bases; M, = or X
             aligned_bases = 0
-            while True:
-                try:
-                    aligned_bases += int(md[md_index])
-                    if aligned_bases <= aligned_base_cap:
+            while aligned_bases != size:
+                if not md_left:
+                    md_left = md[md_index]
+                if md_left > 0:
+                    # Run of matched bases
+                    if md_left > size - aligned_bases:
+                        md_left -= size - aligned_bases
+                        aligned_bases = size
+                    else:
+                        aligned_bases += md_left
+                        md_left = 0
                         md_index += 1
-                except ValueError:
-                    # Not an int, but should not have reached a deletion
-                    assert md[md_index] != '^', '\n'.join(
-                                                ['cigar and md:',
-                                                 ''.join(cigar), ''.join(md)]
-                                            )
+                else:
+                    assert md_left == -1, '\n'.join(
+                            ['cigar and md:', repr(cigar), repr(md)]
+                        )
                     if not junctions_only:
                         mismatches.append(
                                 (pos + aligned_bases,
                                     seq[seq_index + aligned_bases])
                             )
-                    correction_length = len(md[md_index])
-                    m_length = aligned_base_cap - aligned_bases
-                    if correction_length > m_length:
-                        md[md_index] = md[md_index][:m_length]
-                        aligned_bases = aligned_base_cap
-                    else:
-                        aligned_bases += correction_length
-                        md_index += 1
-                if aligned_bases > aligned_base_cap:
-                    md[md_index] = aligned_bases - aligned_base_cap
-                    break
-                elif aligned_bases == aligned_base_cap:
-                    break
-            # Add exon
-            exons.append((pos, pos + aligned_base_cap))
-            pos += aligned_base_cap
-            seq_index += aligned_base_cap
-        elif cigar[cigar_index+1] == 'N':
-            skip_increment = int(cigar[cigar_index])
+                    aligned_bases += 1
+                    md_left = 0
+                    md_index += 1
+            # Add exon, merging it with exonic chunk/deletion it abuts
+            if exons and exons[-1][1] == pos:
+                exons[-1] = (exons[-1][0], pos + size)
+            else:
+                exons.append((pos, pos + size))
+            pos += size
+            seq_index += size
+        elif op == 3:
             # Add junction
-            junctions.append((pos, pos + skip_increment,
+            junctions.append((pos, pos + size,
                             seq_index, seq_size - seq_index))
             # Skip region of reference
-            pos += skip_increment
-        elif cigar[cigar_index+1] == 'I':
+            pos += size
+        elif op == 1:
             # Insertion
-            insert_size = int(cigar[cigar_index])
-            insertions.append(
-                    (pos - 1, seq[seq_index:seq_index+insert_size])
-                )
-            seq_index += insert_size
-        elif cigar[cigar_index+1] == 'D':
-            assert md[md_index] == '^', '\n'.join(
-                                                ['cigar and md:',
-                                                 ''.join(cigar), ''.join(md)]
-                                            )
+            insertions.append((pos - 1, seq[seq_index:seq_index+size]))
+            seq_index += size
+        elif op == 2:
             # Deletion
-            delete_size = int(cigar[cigar_index])
-            md_delete_size = len(md[md_index+1])
-            assert md_delete_size >= delete_size
-            deletions.append((pos, md[md_index+1][:delete_size]))
-            if not drop_deletions: exons.append((pos, pos + delete_size))
-            if md_delete_size > delete_size:
+            if not md_left:
+                md_left = md[md_index]
+            assert md_left < -1, '\n'.join(
+                    ['cigar and md:', repr(cigar), repr(md)]
+                )
+            deletion = deleted[deleted_index]
+            md_delete_size = -md_left - 1
+            assert md_delete_size >= size
+            # Deleted bases not yet consumed start here
+            deletion_start = len(deletion) - md_delete_size
+            deletions.append(
+                    (pos, deletion[deletion_start:deletion_start+size])
+                )
+            if not drop_deletions:
+                if exons and exons[-1][1] == pos:
+                    exons[-1] = (exons[-1][0], pos + size)
+                else:
+                    exons.append((pos, pos + size))
+            if md_delete_size > size:
                 # Deletion contains a junction
-                md[md_index+1] = md[md_index+1][delete_size:]
+                md_left += size
             else:
-                md_index += 2
+                md_left = 0
+                md_index += 1
+                deleted_index += 1
             # Skip deleted part of reference
-            pos += delete_size
-        else:
-            # Soft clip
-            assert cigar[cigar_index+1] == 'S'
-            # Advance seq_index
-            seq_index += int(cigar[cigar_index])
-        cigar_index += 2
-    '''Merge exonic chunks/deletions; insertions/junctions could have chopped
-    them up.'''
-    new_exons = []
-    last_exon = exons[0]
-    for exon in exons[1:]:
-        if exon[0] == last_exon[1]:
-            # Merge ECs
-            last_exon = (last_exon[0], exon[1])
-        else:
-            # Push last exon to new exon list
-            new_exons.append(last_exon)
-            last_exon = exon
-    new_exons.append(last_exon)
-    return insertions, deletions, junctions, new_exons, mismatches
+            pos += size
+        elif op == 4:
+            # Soft clip; advance seq_index
+            seq_index += size
+    return insertions, deletions, junctions, exons, mismatches
 
 class SampleAndRnameIndexes(object):
     """ Assigns sample-RNAME combination to index to improve load balance.
@@ -1104,4 +1154,40 @@ if __name__ == '__main__':
                                 drop_deletions=False)
                     )
 
+        def test_deletion_containing_junction(self):
+            """ Fails if deleted bases from MD aren't split among D ops."""
+            self.assertEquals(([], [(1021, 'GG'), (1125, 'A')],
+                               [(1023, 1123, 20, 10), (1123, 1125, 20, 10)],
+                               [(1001, 1021), (1126, 1136)],
+                               [(1127, 'C')]),
+                         indels_junctions_exons_mismatches(
+                                '20M2D100N2N1D10M', '20^GGA1A8', 1001,
+                                'ACGTACGTACGTACGTACGTACGTACGTAC',
+                                drop_deletions=True)
+                    )
+
+    class TestTokens(unittest.TestCase):
+        """ Tests CIGAR/MD tokenizers and functions that consume tokens. """
+        def test_cigar_tokens(self):
+            """ Fails if CIGAR operations are coded incorrectly. """
+            self.assertEquals([5 << 4 | 4, 20 << 4, 151 << 4 | 3,
+                               2 << 4 | 2, 2 << 4 | 1, 3 << 4 | 4],
+                              cigar_tokens('5S20M151N2D2I3S'))
+
+        def test_md_tokens(self):
+            """ Fails if MD string is tokenized incorrectly. """
+            self.assertEquals(([67, -3, 3, -1, 2, -1, -1],
+                               ['GT']),
+                              md_tokens('67^GT3T2C0A0'))
+
+        def test_reference_from_seq(self):
+            """ Fails if reference stretch is wrong for CIGAR tokens. """
+            class Reference(object):
+                def get_stretch(self, rname, start, size):
+                    return ('NNACGTACGTACGTACGTNN')[start:start+size]
+            for cigar in ['3S5M2I5M1D', cigar_tokens('3S5M2I5M1D')]:
+                self.assertEquals((3, 'ACGTACGTACGTA'),
+                                  reference_from_seq(cigar, 'A' * 15,
+                                                     Reference(), 'chr1', 5))
+
     unittest.main()
@@ -0,0 +1,708 @@
+"""
+bam_writer.py
+Part of Rail-RNA
+
+Contains classes that write BAM files and their BAI indexes directly from
+SAM fields, so Rail-RNA-bam needn't pipe SAM through samtools view and then
+run samtools index on each small file. Blocks of BGZF, the blocked gzip
+format BAM is compressed in, may be compressed by several threads at once
+since zlib releases the GIL. The index is built as records are written and
+is written when the BAM is closed. Formats are described in the SAM/BAM
+specification at http://samtools.github.io/hts-specs/SAMv1.pdf .
+
+Encoding records in Python is many times slower per record than samtools, so
+BamWriter pays off only when starting samtools twice costs more than
+encoding the whole file, as for the per-RNAME files of
+--output-by-chromosome. SizedBamWriter holds records until it knows which
+side of that line a file falls on and then uses BamWriter or
+SamtoolsBamWriter; tests/benchmark_bam.py measures both.
+"""
+import struct
+import subprocess
+import zlib
+import string
+import binascii
+from collections import deque
+from alignment_handlers import cigar_tokens
+
+# Maximum uncompressed bytes per BGZF block, leaving room for deflate overhead
+_max_block_size = 0xff00
+# Standard empty block that marks end of BGZF file
+_bgzf_eof = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02'
+             '\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+_bgzf_header = struct.Struct('<4sIBBHccHH')
+_bgzf_footer = struct.Struct('<II')
+_bam_core = struct.Struct('<iiBBHHHiiii')
+# Bin whose chunks store metadata in BAI
+_meta_bin = 37450
+_linear_shift = 14
+# Bases are translated into hex digits of their 4-bit codes, and then pairs
+# of hex digits are packed into bytes by binascii.unhexlify()
+_seq_codes = '=ACMGRSVTWYHKDBN'
+_seq_table = string.maketrans(_seq_codes + _seq_codes.lower(),
+                              '0123456789abcdef' * 2)
+_qual_table = string.maketrans(
+        ''.join([chr(i) for i in xrange(33, 256)]),
+        ''.join([chr(i) for i in xrange(0, 223)])
+    )
+# BAM type of optional integer field -> struct format character
+_struct_formats = {'c' : 'b', 'C' : 'B', 's' : 'h', 'S' : 'H', 'i' : 'i',
+                   'I' : 'I', 'f' : 'f'}
+_integer_types = [('c', -0x80, 0x7f), ('C', 0, 0xff),
+                  ('s', -0x8000, 0x7fff), ('S', 0, 0xffff),
+                  ('i', -0x80000000, 0x7fffffff), ('I', 0, 0xffffffff)]
+
+def reg2bin(beg, end):
+    """ Computes smallest bin containing a region; from SAM specification.
+
+        beg: 0-based start of region
+        end: 0-based end of region, exclusive
+
+        Return value: bin number
+    """
+    end -= 1
+    if beg >> 14 == end >> 14: return ((1 << 15) - 1) // 7 + (beg >> 14)
+    if beg >> 17 == end >> 17: return ((1 << 12) - 1) // 7 + (beg >> 17)
+    if beg >> 20 == end >> 20: return ((1 << 9) - 1) // 7 + (beg >> 20)
+    if beg >> 23 == end >> 23: return ((1 << 6) - 1) // 7 + (beg >> 23)
+    if beg >> 26 == end >> 26: return ((1 << 3) - 1) // 7 + (beg >> 26)
+    return 0
+
+def _compressed_block(data, level):
+    """ Compresses data into one BGZF block.
+
+        data: at most _max_block_size bytes
+        level: zlib compression level
+
+        Return value: BGZF block
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return ''.join([
+            _bgzf_header.pack('\x1f\x8b\x08\x04', 0, 0, 0xff, 6, 'B', 'C', 2,
+                                len(compressed) + 25),
+            compressed,
+            _bgzf_footer.pack(zlib.crc32(data) & 0xffffffff, len(data))
+        ])
+
+class BgzfWriter(object):
+    """ Writes BGZF, optionally compressing blocks on a pool of threads.
+
+        Since compressed sizes of blocks aren't known until blocks are
+        compressed, tell() returns an offset encoded as block number << 16 |
+        offset within block; virtual_offset() converts it into a BGZF virtual
+        file offset after the block has been written.
+    """
+    def __init__(self, output_stream, level=6, threads=1):
+        """
+            output_stream: file object to write to
+            level: zlib compression level
+            threads: number of threads that compress blocks
+        """
+        self.output_stream = output_stream
+        self.level = level
+        self.buffer = []
+        self.buffer_size = 0
+        # Compressed offset of each block written
+        self.block_offsets = []
+        self.block_count = 0
+        self.compressed_offset = 0
+        self.threads = threads
+        # Started when there's more than one block, so small files are quick
+        self.pool = None
+        self.pending = deque()
+
+    def _write_block(self, block):
+        """ Writes compressed block and records its offset. """
+        self.block_offsets.append(self.compressed_offset)
+        self.output_stream.write(block)
+        self.compressed_offset += len(block)
+
+    def _flush_block(self, last=False):
+        """ Compresses buffer into a block or queues it for compression.
+
+            last: True iff no more blocks follow, so block is compressed on
+                this thread
+
+            No return value.
+        """
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.buffer_size = 0
+        self.block_count += 1
+        if last or self.threads <= 1:
+            while self.pending:
+                self._write_block(self.pending.popleft().get())
+            self._write_block(_compressed_block(data, self.level))
+            return
+        if self.pool is None:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(self.threads)
+        self.pending.append(
+                self.pool.apply_async(_compressed_block, (data, self.level))
+            )
+        while len(self.pending) > self.threads * 4:
+            self._write_block(self.pending.popleft().get())
+
+    def tell(self):
+        """ Gets encoded offset of next byte to be written.
+
+            Return value: block number << 16 | offset within block
+        """
+        return self.block_count << 16 | self.buffer_size
+
+    def reserve(self, size):
+        """ Starts a new block if data of a given size won't fit in this one.
+
+            size: number of bytes to be written
+
+            No return value.
+        """
+        if self.buffer_size and self.buffer_size + size > _max_block_size:
+            self._flush_block()
+
+    def write(self, data):
+        """ Writes data, splitting it across blocks if necessary.
+
+            data: string to write
+
+            No return value.
+        """
+        while self.buffer_size + len(data) > _max_block_size:
+            split = _max_block_size - self.buffer_size
+            self.buffer.append(data[:split])
+            self.buffer_size = _max_block_size
+            self._flush_block()
+            data = data[split:]
+        if data:
+            self.buffer.append(data)
+            self.buffer_size += len(data)
+
+    def virtual_offset(self, offset):
+        """ Converts encoded offset into BGZF virtual file offset.
+
+            offset: encoded offset from tell(); its block must be written
+
+            Return value: compressed offset of block << 16 | offset within
+                block
+        """
+        return self.block_offsets[offset >> 16] << 16 | (offset & 0xffff)
+
+    def close(self):
+        """ Flushes all blocks and writes EOF marker block.
+
+            Does not close output stream. No return value.
+        """
+        if self.buffer_size:
+            self._flush_block(last=True)
+        while self.pending:
+            self._write_block(self.pending.popleft().get())
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        # Offsets pointing just past the last block point to EOF block
+        self.block_offsets.append(self.compressed_offset)
+        self.output_stream.write(_bgzf_eof)
+
+class _ReferenceIndex(object):
+    """ Bins and linear index of records on one reference for BAI. """
+    def __init__(self):
+        # Bin -> list of [start offset, end offset] chunks
+        self.bins = {}
+        self.linear = []
+        self.first_offset = None
+        self.last_offset = None
+        self.mapped_count = 0
+        self.unmapped_count = 0
+
+    def add(self, beg, end, unmapped, start_offset, end_offset):
+        """ Adds record to index.
+
+            beg: 0-based start of alignment on reference
+            end: 0-based end of alignment on reference, exclusive
+            unmapped: True iff record is flagged as unmapped
+            start_offset: encoded offset of record in BGZF
+            end_offset: encoded offset past end of record in BGZF
+
+            No return value.
+        """
+        bin = reg2bin(beg, end)
+        try:
+            chunks = self.bins[bin]
+        except KeyError:
+            self.bins[bin] = [[start_offset, end_offset]]
+        else:
+            if chunks[-1][1] >> 16 == start_offset >> 16:
+                # Same block; merge chunks
+                chunks[-1][1] = end_offset
+            else:
+                chunks.append([start_offset, end_offset])
+        linear = self.linear
+        last_window = (end - 1) >> _linear_shift
+        if len(linear) <= last_window:
+            linear.extend([None] * (last_window + 1 - len(linear)))
+        for window in xrange(beg >> _linear_shift, last_window + 1):
+            if linear[window] is None:
+                linear[window] = start_offset
+        if self.first_offset is None:
+            self.first_offset = start_offset
+        self.last_offset = end_offset
+        if unmapped:
+            self.unmapped_count += 1
+        else:
+            self.mapped_count += 1
+
+    def serialized(self, virtual_offset):
+        """ Serializes index of reference for BAI.
+
+            virtual_offset: function that converts encoded offsets into
+                virtual file offsets
+
+            Return value: string
+        """
+        if self.first_offset is None:
+            return struct.pack('<ii', 0, 0)
+        serialized = [struct.pack('<i', len(self.bins) + 1)]
+        for bin in sorted(self.bins):
+            chunks = self.bins[bin]
+            serialized.append(struct.pack('<Ii', bin, len(chunks)))
+            serialized.append(struct.pack(
+                    '<%dQ' % (len(chunks) * 2),
+                    *[virtual_offset(offset)
+                        for chunk in chunks for offset in chunk]
+                ))
+        serialized.append(struct.pack(
+                '<IiQQQQ', _meta_bin, 2, virtual_offset(self.first_offset),
+                virtual_offset(self.last_offset), self.mapped_count,
+                self.unmapped_count
+            ))
+        # Empty windows take the offset of the window before them
+        linear = []
+        last = virtual_offset(self.first_offset)
+        for offset in self.linear:
+            if offset is not None:
+                last = virtual_offset(offset)
+            linear.append(last)
+        serialized.append(struct.pack('<i%dQ' % len(linear), len(linear),
+                                        *linear))
+        return ''.join(serialized)
+
+class BamWriter(object):
+    """ Writes coordinate-sorted BAM from SAM fields and, optionally, BAI.
+
+        Records must arrive sorted by reference, in the order references
+        appear in the header, and then by position; unplaced records come
+        last.
+    """
+    def __init__(self, filename, header, references, index=True, level=6,
+                    threads=1):
+        """
+            filename: path to BAM to write; BAI is written to filename +
+                '.bai'
+            header: SAM header text
+            references: list of tuples (RNAME, length) in header order
+            index: True iff BAI should be written
+            level: zlib compression level
+            threads: number of threads that compress BGZF blocks
+        """
+        self.filename = filename
+        self.output_stream = open(filename, 'wb')
+        self.bgzf = BgzfWriter(self.output_stream, level=level,
+                                threads=threads)
+        self.ref_ids = dict((rname, i)
+                            for i, (rname, _) in enumerate(references))
+        if not header.endswith('\n'):
+            header += '\n'
+        self.bgzf.write(''.join(
+                [struct.pack('<4si', 'BAM\1', len(header)), header,
+                 struct.pack('<i', len(references))]
+                + [struct.pack('<i', len(rname) + 1) + rname + '\0'
+                    + struct.pack('<i', length)
+                    for rname, length in references]
+            ))
+        if index:
+            self.reference_indexes = [_ReferenceIndex() for _ in references]
+        else:
+            self.reference_indexes = None
+        self.last_ref_id, self.last_pos = -1, -1
+        self.unplaced_count = 0
+
+    def _tags(self, fields):
+        """ Encodes SAM optional fields.
+
+            fields: list of optional fields like 'NM:i:2'
+
+            Return value: string
+        """
+        encoded = []
+        for field in fields:
+            tag, tag_type, value = field[:2], field[3], field[5:]
+            if tag_type == 'i':
+                value = int(value)
+                for integer_type, low, high in _integer_types:
+                    if low <= value <= high:
+                        break
+                encoded.append(tag + integer_type + struct.pack(
+                        '<' + _struct_formats[integer_type], value
+                    ))
+            elif tag_type == 'Z' or tag_type == 'H':
+                encoded.append(tag + tag_type + value + '\0')
+            elif tag_type == 'A':
+                encoded.append(tag + 'A' + value)
+            elif tag_type == 'f':
+                encoded.append(tag + 'f' + struct.pack('<f', float(value)))
+            elif tag_type == 'B':
+                values = value.split(',')
+                subtype = values[0]
+                if subtype == 'f':
+                    values = [float(item) for item in values[1:]]
+                else:
+                    values = [int(item) for item in values[1:]]
+                encoded.append(tag + 'B' + subtype
+                                + struct.pack(
+                                    '<i%d%s' % (len(values),
+                                                _struct_formats[subtype]),
+                                    len(values), *values
+                                ))
+            else:
+                raise RuntimeError('Optional field "%s" has unknown type.'
+                                    % field)
+        return ''.join(encoded)
+
+    def write(self, fields):
+        """ Writes one record.
+
+            fields: list of SAM fields QNAME, FLAG, RNAME, POS, MAPQ, CIGAR,
+                RNEXT, PNEXT, TLEN, SEQ, QUAL and optional fields
+
+            No return value.
+        """
+        (qname, flag, rname, pos, mapq, cigar,
+            rnext, pnext, tlen, seq, qual) = fields[:11]
+        flag = int(flag)
+        ref_id = self.ref_ids[rname] if rname != '*' else -1
+        pos = int(pos) - 1
+        if rnext == '=':
+            next_ref_id = ref_id
+        elif rnext == '*':
+            next_ref_id = -1
+        else:
+            next_ref_id = self.ref_ids[rnext]
+        if cigar == '*':
+            cigar = []
+            ref_length = 0
+        else:
+            cigar = cigar_tokens(cigar)
+            # M, D, N, = and X consume reference
+            ref_length = sum([op >> 4 for op in cigar
+                                if (op & 0xf) in (0, 2, 3, 7, 8)])
+        end = pos + (ref_length or 1)
+        bin = reg2bin(pos, end) if pos >= 0 else 4680
+        if seq == '*':
+            seq, encoded_seq, encoded_qual = '', '', ''
+        else:
+            if len(seq) % 2:
+                encoded_seq = binascii.unhexlify(
+                        seq.translate(_seq_table) + '0'
+                    )
+            else:
+                encoded_seq = binascii.unhexlify(seq.translate(_seq_table))
+            if qual == '*':
+                encoded_qual = '\xff' * len(seq)
+            else:
+                encoded_qual = qual.translate(_qual_table)
+        record = ''.join([
+                _bam_core.pack(ref_id, pos, len(qname) + 1, int(mapq), bin,
+                                len(cigar), flag, len(seq), next_ref_id,
+                                int(pnext) - 1, int(tlen)),
+                qname, '\0',
+                struct.pack('<%dI' % len(cigar), *cigar),
+                encoded_seq, encoded_qual, self._tags(fields[11:])
+            ])
+        record = struct.pack('<i', len(record)) + record
+        bgzf = self.bgzf
+        bgzf.reserve(len(record))
+        start_offset = bgzf.tell()
+        bgzf.write(record)
+        if self.reference_indexes is None:
+            return
+        if ref_id < 0:
+            self.unplaced_count += 1
+            self.last_ref_id = len(self.reference_indexes)
+            return
+        if (ref_id, pos) < (self.last_ref_id, self.last_pos):
+            raise RuntimeError('Record "%s" is out of order; BAM can\'t be '
+                               'indexed.' % qname)
+        self.last_ref_id, self.last_pos = ref_id, pos
+        self.reference_indexes[ref_id].add(pos, end, flag & 4,
+                                            start_offset, bgzf.tell())
+
+    def close(self):
+        """ Finishes BAM and writes BAI if requested.
+
+            No return value.
+        """
+        self.bgzf.close()
+        self.output_stream.close()
+        if self.reference_indexes is None:
+            return
+        with open(self.filename + '.bai', 'wb') as index_stream:
+            index_stream.write(struct.pack('<4si', 'BAI\1',
+                                            len(self.reference_indexes)))
+            for reference_index in self.reference_indexes:
+                index_stream.write(reference_index.serialized(
+                                            self.bgzf.virtual_offset
+                                        ))
+            index_stream.write(struct.pack('<Q', self.unplaced_count))
+
+class SamtoolsBamWriter(object):
+    """ Pipes SAM fields into samtools view and indexes the BAM with
+        samtools index once it's closed; mirrors BamWriter. """
+    def __init__(self, filename, header, samtools_exe, index=True):
+        """
+            filename: path to BAM to write; BAI is written to filename +
+                '.bai'
+            header: SAM header text
+            samtools_exe: path to samtools executable
+            index: True iff BAI should be written
+        """
+        self.filename = filename
+        self.samtools_exe = samtools_exe
+        self.index = index
+        self.bam_stream = open(filename, 'wb')
+        self.samtools_process = subprocess.Popen(
+                    [samtools_exe, 'view', '-bS', '-'],
+                    stdin=subprocess.PIPE,
+                    stdout=self.bam_stream
+                )
+        self.output_stream = self.samtools_process.stdin
+        print >>self.output_stream, header.rstrip('\n')
+
+    def write(self, fields):
+        """ Writes one record.
+
+            fields: list of SAM fields
+
+            No return value.
+        """
+        print >>self.output_stream, '\t'.join(fields)
+
+    def close(self):
+        """ Finishes BAM and writes BAI if requested.
+
+            No return value.
+        """
+        self.output_stream.close()
+        samtools_return = self.samtools_process.wait()
+        self.bam_stream.close()
+        if samtools_return:
+            raise RuntimeError(
+                    'samtools returned exit code %d' % samtools_return
+                )
+        if self.index:
+            subprocess.check_call([self.samtools_exe, 'index',
+                                    self.filename], bufsize=-1)
+
+class SizedBamWriter(object):
+    """ Writes BAM with BamWriter if it's small and with samtools otherwise.
+
+        Records are held in memory until there are more than max_records;
+        then samtools is started and they're passed to it. A file that
+        never grows that large is written with BamWriter when it's closed.
+    """
+    def __init__(self, filename, header, references, samtools_exe,
+                    max_records=300, index=True, threads=1):
+        """
+            filename: path to BAM to write; BAI is written to filename +
+                '.bai'
+            header: SAM header text
+            references: list of tuples (RNAME, length) in header order
+            samtools_exe: path to samtools executable, or None to write
+                every BAM with BamWriter
+            max_records: maximum number of records in a BAM written with
+                BamWriter
+            index: True iff BAI should be written
+            threads: number of threads that compress BGZF blocks of a BAM
+                written with BamWriter
+        """
+        self.filename = filename
+        self.header = header
+        self.references = references
+        self.samtools_exe = samtools_exe
+        self.max_records = max_records
+        self.index = index
+        self.threads = threads
+        if samtools_exe is None:
+            self.writer = BamWriter(filename, header, references,
+                                    index=index, threads=threads)
+            self.records = None
+        else:
+            self.writer = None
+            self.records = []
+
+    def write(self, fields):
+        """ Writes one record.
+
+            fields: list of SAM fields; it's held, so it mustn't be changed
+
+            No return value.
+        """
+        if self.writer is not None:
+            self.writer.write(fields)
+            return
+        self.records.append(fields)
+        if len(self.records) > self.max_records:
+            self.writer = SamtoolsBamWriter(self.filename, self.header,
+                                            self.samtools_exe,
+                                            index=self.index)
+            for record in self.records:
+                self.writer.write(record)
+            self.records = None
+
+    def close(self):
+        """ Finishes BAM and writes BAI if requested.
+
+            No return value.
+        """
+        if self.writer is None:
+            self.writer = BamWriter(self.filename, self.header,
+                                    self.references, index=self.index,
+                                    threads=self.threads)
+            for record in self.records:
+                self.writer.write(record)
+            self.records = None
+        self.writer.close()
+
+if __name__ == '__main__':
+    import unittest
+    import tempfile
+    import shutil
+    import os
+    import gzip
+
+    class TestBamWriter(unittest.TestCase):
+        """ Tests BamWriter by decoding what it writes. """
+        def setUp(self):
+            self.temp_dir_path = tempfile.mkdtemp()
+            self.filename = os.path.join(self.temp_dir_path, 'test.bam')
+
+        def test_record(self):
+            """ Fails if record isn't encoded as in SAM specification. """
+            bam_writer = BamWriter(self.filename, '@HD\tVN:1.0',
+                                    [('chr1', 1000), ('chr2', 2000)])
+            bam_writer.write(['read', '16', 'chr2', '101', '255', '2S3M1N2M',
+                              '=', '0', '0', 'ACGTNAC', 'ABCDEFG',
+                              'NM:i:-1', 'XS:A:+', 'MD:Z:5'])
+            bam_writer.close()
+            # Python's gzip module reads concatenated BGZF blocks
+            with open(self.filename, 'rb') as bam_stream:
+                data = gzip.GzipFile(fileobj=bam_stream).read()
+            self.assertEqual('BAM\1', data[:4])
+            header_size = struct.unpack_from('<i', data, 4)[0]
+            self.assertEqual('@HD\tVN:1.0\n', data[8:8 + header_size])
+            offset = 8 + header_size + 4
+            for rname, length in [('chr1', 1000), ('chr2', 2000)]:
+                self.assertEqual(
+                        struct.pack('<i', 5) + rname + '\0'
+                        + struct.pack('<i', length),
+                        data[offset:offset + 13]
+                    )
+                offset += 13
+            block_size = struct.unpack_from('<i', data, offset)[0]
+            self.assertEqual(len(data), offset + 4 + block_size)
+            core = _bam_core.unpack_from(data, offset + 4)
+            self.assertEqual((1, 100, 5, 255, reg2bin(100, 106), 4, 16, 7,
+                              1, -1, 0), core)
+            offset += 4 + _bam_core.size
+            self.assertEqual('read\0', data[offset:offset + 5])
+            offset += 5
+            self.assertEqual([2 << 4 | 4, 3 << 4, 1 << 4 | 3, 2 << 4],
+                list(struct.unpack_from('<4I', data, offset)))
+            offset += 16
+            self.assertEqual('\x12\x48\xf1\x20', data[offset:offset + 4])
+            self.assertEqual(''.join([chr(i) for i in xrange(32, 39)]),
+                                data[offset + 4:offset + 11])
+            self.assertEqual('NMc\xffXSA+MDZ5\0', data[offset + 11:])
+
+        def test_index(self):
+            """ Fails if BAI chunks don't locate records. """
+            bam_writer = BamWriter(self.filename, '@HD\tVN:1.0',
+                                    [('chr1', 1000000)], level=1, threads=2)
+            for pos in xrange(1, 1000000, 50):
+                bam_writer.write(['read%d' % pos, '0', 'chr1', str(pos),
+                                  '255', '100M', '*', '0', '0', 'A' * 100,
+                                  'I' * 100])
+            bam_writer.write(['unplaced', '4', '*', '0', '0', '*', '*', '0',
+                              '0', 'ACGT', '*'])
+            bam_writer.close()
+            with open(self.filename + '.bai', 'rb') as index_stream:
+                index = index_stream.read()
+            self.assertEqual('BAI\1', index[:4])
+            self.assertEqual(1, struct.unpack_from('<i', index, 4)[0])
+            self.assertEqual(1, struct.unpack_from('<Q', index,
+                                                    len(index) - 8)[0])
+            with open(self.filename, 'rb') as bam_stream:
+                bam = bam_stream.read()
+            # Every chunk should start at a record with a bin it's listed in
+            bin_count = struct.unpack_from('<i', index, 8)[0]
+            offset = 12
+            for _ in xrange(bin_count):
+                bin, chunk_count = struct.unpack_from('<Ii', index, offset)
+                offset += 8
+                for _ in xrange(chunk_count):
+                    start, end = struct.unpack_from('<QQ', index, offset)
+                    offset += 16
+                    if bin == _meta_bin:
+                        continue
+                    block_offset = start >> 16
+                    block_size = struct.unpack_from('<H', bam,
+                                                    block_offset + 16)[0]
+                    block = zlib.decompress(
+                            bam[block_offset + 18:block_offset + block_size
+                                - 7], -15
+                        )
+                    self.assertEqual(bin, struct.unpack_from(
+                            '<H', block, (start & 0xffff) + 14
+                        )[0])
+            interval_count = struct.unpack_from('<i', index, offset)[0]
+            self.assertEqual(1000000 >> _linear_shift, interval_count - 1)
+            self.assertTrue(bam.endswith(_bgzf_eof))
+
+        def test_sized(self):
+            """ Fails if a BAM isn't written by the writer its size calls
+                for. """
+            fake_samtools = os.path.join(self.temp_dir_path, 'samtools')
+            with open(fake_samtools, 'w') as samtools_stream:
+                # Writes SAM it's given; touches BAI when indexing
+                samtools_stream.write('#!/bin/sh\n'
+                                      'if [ "$1" = index ]; then '
+                                      'touch "$2.bai"; else cat; fi\n')
+            os.chmod(fake_samtools, 0755)
+            records = [['read%d' % pos, '0', 'chr1', str(pos), '255', '4M',
+                        '*', '0', '0', 'ACGT', 'IIII']
+                        for pos in xrange(1, 11)]
+            for record_count, via_samtools in [(5, False), (10, True)]:
+                bam_writer = SizedBamWriter(self.filename, '@HD\tVN:1.0',
+                                            [('chr1', 1000)], fake_samtools,
+                                            max_records=5)
+                for record in records[:record_count]:
+                    bam_writer.write(record)
+                bam_writer.close()
+                with open(self.filename, 'rb') as bam_stream:
+                    data = bam_stream.read()
+                if via_samtools:
+                    self.assertEqual(
+                            data, '\n'.join(['@HD\tVN:1.0']
+                                             + ['\t'.join(record)
+                                                for record in records])
+                                  + '\n'
+                        )
+                else:
+                    self.assertTrue(data.endswith(_bgzf_eof))
+                self.assertTrue(os.path.exists(self.filename + '.bai'))
+                os.remove(self.filename + '.bai')
+
+        def tearDown(self):
+            shutil.rmtree(self.temp_dir_path)
+
+    unittest.main()
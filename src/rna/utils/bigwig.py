@@ -0,0 +1,582 @@
+"""
+bigwig.py
+Part of Rail-RNA
+
+Contains a class that writes bigWig files directly from runs of constant
+coverage, so Rail-RNA-coverage needn't write bedGraphs and call
+bedGraphToBigWig. Full-resolution data is written as bedGraph-type sections,
+and zoom levels are summarized as runs arrive; compressed zoom blocks are
+spooled to temporary files and copied after the full data, so memory is
+bounded by the number of blocks rather than the number of runs. The format is
+described in Kent et al., "BigWig and BigBed: enabling browsing of large
+distributed datasets," Bioinformatics 26(17): 2204-2207 (2010).
+"""
+import struct
+import zlib
+import tempfile
+import shutil
+
+_bigwig_magic = 0x888FFC26
+_bpt_magic = 0x78CA8C91
+_cir_tree_magic = 0x2468ACE0
+_bigwig_version = 4
+# Room is always left in the header for this many zoom levels
+_max_zoom_levels = 10
+_header = struct.Struct('<IHHQQQHHQQIQ')
+_zoom_header = struct.Struct('<IIQQ')
+_total_summary = struct.Struct('<Qdddd')
+_section_header = struct.Struct('<IIIIIBBH')
+_bedgraph_item = struct.Struct('<IIf')
+_zoom_record = struct.Struct('<IIIIffff')
+_cir_tree_header = struct.Struct('<IIQIIIIQII')
+_cir_leaf_item = struct.Struct('<IIIIQQ')
+_cir_node_item = struct.Struct('<IIIIQ')
+_node_header = struct.Struct('<BBH')
+_bpt_header = struct.Struct('<IIIIQQ')
+
+class _ZoomLevel(object):
+    """ Summarizes runs at one resolution and spools compressed blocks.
+
+        Only the highest-resolution level summarizes runs; each other level
+        merges whole records of the level before it, as bedGraphToBigWig
+        does, so every record summarizes exactly the bases it spans.
+    """
+    def __init__(self, reduction, items_per_slot, next_level=None):
+        """
+            reduction: number of bases summarized by a record
+            items_per_slot: maximum number of records in a block
+            next_level: _ZoomLevel at next lower resolution, to which
+                finished records are passed, or None
+        """
+        self.reduction = reduction
+        self.items_per_slot = items_per_slot
+        self.next_level = next_level
+        self.spool = tempfile.TemporaryFile()
+        self.spool_size = 0
+        # (start chrom ID, start, end chrom ID, end, offset in spool, size)
+        self.blocks = []
+        self.block = []
+        self.record_count = 0
+        self.max_block_size = 0
+        # Record being built: [chrom ID, start, end, valid count, min, max,
+        # sum, sum of squares]
+        self.record = None
+
+    def _flush_record(self):
+        record = self.record
+        if record is None:
+            return
+        if self.block and self.block[-1][0] != record[0]:
+            # Blocks are confined to one chromosome
+            self._flush_block()
+        self.block.append(record)
+        self.record_count += 1
+        self.record = None
+        if self.next_level is not None:
+            self.next_level.add_record(record)
+        if len(self.block) == self.items_per_slot:
+            self._flush_block()
+
+    def _flush_block(self):
+        block = self.block
+        if not block:
+            return
+        data = ''.join([_zoom_record.pack(*record) for record in block])
+        self.max_block_size = max(self.max_block_size, len(data))
+        compressed = zlib.compress(data)
+        self.spool.write(compressed)
+        self.blocks.append((block[0][0], block[0][1], block[-1][0],
+                            block[-1][2], self.spool_size, len(compressed)))
+        self.spool_size += len(compressed)
+        self.block = []
+
+    def add(self, chrom_id, chrom_size, start, end, value):
+        """ Adds run [start, end) with constant value to summary.
+
+            A run that spans whole multiples of the reduction past the
+            record being built is summarized by a single record; because its
+            value is constant, readers that weight records by overlap still
+            get exact summaries.
+
+            No return value.
+        """
+        reduction = self.reduction
+        record = self.record
+        while start < end:
+            if (record is None or record[0] != chrom_id
+                    or start >= record[2]):
+                self._flush_record()
+                span = (end - start) // reduction * reduction
+                if span > reduction:
+                    self.record = [chrom_id, start, start + span, span,
+                                    value, value, value * span,
+                                    value * value * span]
+                    self._flush_record()
+                    start += span
+                    if start == end:
+                        record = None
+                        break
+                record = self.record = [chrom_id, start,
+                                        min(start + reduction, chrom_size),
+                                        0, value, value, 0.0, 0.0]
+            overlap_end = min(end, record[2])
+            size = overlap_end - start
+            record[3] += size
+            if value < record[4]:
+                record[4] = value
+            if value > record[5]:
+                record[5] = value
+            record[6] += value * size
+            record[7] += value * value * size
+            start = overlap_end
+
+    def add_record(self, record):
+        """ Merges record of level at higher resolution into summary.
+
+            No return value.
+        """
+        current = self.record
+        if (current is None or current[0] != record[0]
+                or record[2] > current[1] + self.reduction):
+            self._flush_record()
+            self.record = list(record)
+            return
+        current[2] = record[2]
+        current[3] += record[3]
+        if record[4] < current[4]:
+            current[4] = record[4]
+        if record[5] > current[5]:
+            current[5] = record[5]
+        current[6] += record[6]
+        current[7] += record[7]
+
+    def finish(self):
+        """ Flushes last record and block.
+
+            No return value.
+        """
+        self._flush_record()
+        self._flush_block()
+
+def _write_cir_tree(output_stream, entries, block_size, items_per_slot,
+                        end_file_offset):
+    """ Writes chromosome R-tree index of blocks of data.
+
+        output_stream: file to write to, positioned where index starts
+        entries: list of tuples (start chrom ID, start, end chrom ID, end,
+            offset of block in file, size of block) sorted by position
+        block_size: maximum number of children of a node
+        items_per_slot: number of items per block of data
+        end_file_offset: offset of end of data indexed
+
+        No return value.
+    """
+    if entries:
+        bounds = (entries[0][0], entries[0][1], entries[-1][2],
+                    entries[-1][3])
+    else:
+        bounds = (0, 0, 0, 0)
+    output_stream.write(_cir_tree_header.pack(
+            _cir_tree_magic, block_size, len(entries), bounds[0], bounds[1],
+            bounds[2], bounds[3], end_file_offset, items_per_slot, 0
+        ))
+    # Levels of nodes from leaves up; each node is a list of its items
+    levels = [[entries[i:i+block_size]
+                for i in xrange(0, len(entries), block_size)] or [[]]]
+    while len(levels[-1]) > 1:
+        children = levels[-1]
+        levels.append([children[i:i+block_size]
+                        for i in xrange(0, len(children), block_size)])
+    leaf_node_size = _node_header.size + block_size * _cir_leaf_item.size
+    node_size = _node_header.size + block_size * _cir_node_item.size
+    # Offsets of levels are computed from the root down
+    level_offsets = []
+    offset = output_stream.tell()
+    for i in xrange(len(levels) - 1, -1, -1):
+        level_offsets.append(offset)
+        offset += len(levels[i]) * (leaf_node_size if i == 0 else node_size)
+    level_offsets.reverse()
+    for i in xrange(len(levels) - 1, 0, -1):
+        child_offset = level_offsets[i - 1]
+        child_size = leaf_node_size if i == 1 else node_size
+        for node in levels[i]:
+            output_stream.write(_node_header.pack(0, 0, len(node)))
+            for child in node:
+                # First and last items of child give its bounds
+                first, last = child, child
+                for _ in xrange(i - 1):
+                    first, last = first[0], last[-1]
+                output_stream.write(_cir_node_item.pack(
+                        first[0][0], first[0][1], last[-1][2], last[-1][3],
+                        child_offset
+                    ))
+                child_offset += child_size
+            output_stream.write(
+                    '\x00' * ((block_size - len(node)) * _cir_node_item.size)
+                )
+    for node in levels[0]:
+        output_stream.write(_node_header.pack(1, 0, len(node)))
+        for entry in node:
+            output_stream.write(_cir_leaf_item.pack(*entry))
+        output_stream.write(
+                '\x00' * ((block_size - len(node)) * _cir_leaf_item.size)
+            )
+
+def _write_bpt(output_stream, chroms, block_size):
+    """ Writes B+ tree mapping chromosome names to IDs and sizes.
+
+        output_stream: file to write to, positioned where tree starts
+        chroms: list of tuples (name, chrom ID, size)
+        block_size: maximum number of children of a node
+
+        No return value.
+    """
+    chroms = sorted(chroms)
+    key_size = max([len(name) for name, _, _ in chroms] or [1])
+    block_size = max(1, min(block_size, len(chroms)))
+    output_stream.write(_bpt_header.pack(
+            _bpt_magic, block_size, key_size, 8, len(chroms), 0
+        ))
+    levels = [[chroms[i:i+block_size]
+                for i in xrange(0, len(chroms), block_size)] or [[]]]
+    while len(levels[-1]) > 1:
+        children = levels[-1]
+        levels.append([children[i:i+block_size]
+                        for i in xrange(0, len(children), block_size)])
+    node_size = _node_header.size + block_size * (key_size + 8)
+    level_offsets = []
+    offset = output_stream.tell()
+    for i in xrange(len(levels) - 1, -1, -1):
+        level_offsets.append(offset)
+        offset += len(levels[i]) * node_size
+    level_offsets.reverse()
+    padding = '\x00' * ((key_size + 8) * block_size)
+    for i in xrange(len(levels) - 1, 0, -1):
+        child_offset = level_offsets[i - 1]
+        for node in levels[i]:
+            output_stream.write(_node_header.pack(0, 0, len(node)))
+            for child in node:
+                first = child
+                for _ in xrange(i - 1):
+                    first = first[0]
+                output_stream.write(first[0][0].ljust(key_size, '\x00'))
+                output_stream.write(struct.pack('<Q', child_offset))
+                child_offset += node_size
+            output_stream.write(
+                    padding[:(block_size - len(node)) * (key_size + 8)]
+                )
+    for node in levels[0]:
+        output_stream.write(_node_header.pack(1, 0, len(node)))
+        for name, chrom_id, size in node:
+            output_stream.write(name.ljust(key_size, '\x00'))
+            output_stream.write(struct.pack('<II', chrom_id, size))
+        output_stream.write(
+                padding[:(block_size - len(node)) * (key_size + 8)]
+            )
+
+class BigWigWriter(object):
+    """ Writes bigWig file from runs of constant value.
+
+        Runs must be added in order of position within a chromosome, and all
+        runs on a chromosome must be added before runs on the next. Only
+        chromosomes with runs are recorded in the file.
+    """
+    def __init__(self, filename, chrom_sizes, items_per_slot=1024,
+                    block_size=256, initial_reduction=64, zoom_increment=4):
+        """
+            filename: path of bigWig to write
+            chrom_sizes: dictionary mapping chromosome names to sizes
+            items_per_slot: maximum number of items in a block of data
+            block_size: maximum number of children of an index node
+            initial_reduction: number of bases summarized by each record of
+                the highest-resolution zoom level
+            zoom_increment: factor by which resolution drops from one zoom
+                level to the next
+        """
+        self.chrom_sizes = chrom_sizes
+        self.items_per_slot = items_per_slot
+        self.block_size = block_size
+        self.output_stream = open(filename, 'wb')
+        self.zoom_levels = []
+        next_level = None
+        for i in xrange(_max_zoom_levels - 1, -1, -1):
+            next_level = _ZoomLevel(initial_reduction * zoom_increment ** i,
+                                    items_per_slot, next_level)
+            self.zoom_levels.append(next_level)
+        self.zoom_levels.reverse()
+        # (name, chrom ID, size) of each chromosome seen
+        self.chroms = []
+        self.chrom_id, self.chrom_size, self.last_end = None, None, 0
+        self.section = []
+        # Index entries of sections
+        self.sections = []
+        self.item_count = 0
+        self.max_block_size = 0
+        self.bases_covered, self.sum_data, self.sum_squares = 0, 0.0, 0.0
+        self.min_value, self.max_value = float('inf'), float('-inf')
+        # Header, zoom headers and total summary are filled in by close()
+        self.data_offset = (_header.size
+                            + _max_zoom_levels * _zoom_header.size
+                            + _total_summary.size)
+        self.output_stream.write('\x00' * self.data_offset)
+        # Number of sections; written as an 8-byte count
+        self.output_stream.write('\x00' * 8)
+
+    def _flush_section(self):
+        section = self.section
+        if not section:
+            return
+        data = _section_header.pack(
+                self.chrom_id, section[0][0], section[-1][1], 0, 0, 1, 0,
+                len(section)
+            ) + ''.join([_bedgraph_item.pack(*item) for item in section])
+        self.max_block_size = max(self.max_block_size, len(data))
+        compressed = zlib.compress(data)
+        offset = self.output_stream.tell()
+        self.output_stream.write(compressed)
+        self.sections.append((self.chrom_id, section[0][0], self.chrom_id,
+                                section[-1][1], offset, len(compressed)))
+        self.section = []
+
+    def add(self, chrom, start, end, value):
+        """ Adds run of constant value.
+
+            chrom: chromosome name
+            start: start of run (0-based, inclusive)
+            end: end of run (0-based, exclusive)
+            value: value of run
+
+            No return value.
+        """
+        if start >= end:
+            return
+        if self.chrom_id is None or chrom != self.chroms[-1][0]:
+            self._flush_section()
+            self.chrom_id = len(self.chroms)
+            self.chrom_size = self.chrom_sizes[chrom]
+            self.chroms.append((chrom, self.chrom_id, self.chrom_size))
+            self.last_end = 0
+        elif start < self.last_end:
+            raise RuntimeError('Run %s:%d-%d overlaps or precedes last run.'
+                                % (chrom, start, end))
+        self.last_end = end
+        self.section.append((start, end, value))
+        if len(self.section) == self.items_per_slot:
+            self._flush_section()
+        self.item_count += 1
+        size = end - start
+        self.bases_covered += size
+        self.sum_data += value * size
+        self.sum_squares += value * value * size
+        if value < self.min_value:
+            self.min_value = value
+        if value > self.max_value:
+            self.max_value = value
+        self.zoom_levels[0].add(self.chrom_id, self.chrom_size, start, end,
+                                value)
+
+    def close(self):
+        """ Writes indexes, zoom levels, chromosome tree and header.
+
+            No return value.
+        """
+        output_stream = self.output_stream
+        self._flush_section()
+        index_offset = output_stream.tell()
+        output_stream.seek(self.data_offset)
+        output_stream.write(struct.pack('<Q', len(self.sections)))
+        output_stream.seek(index_offset)
+        _write_cir_tree(output_stream, self.sections, self.block_size,
+                            self.items_per_slot, index_offset)
+        # Keep only zoom levels that at least halve the data
+        zoom_headers = []
+        last_count = self.item_count
+        for zoom_level in self.zoom_levels:
+            zoom_level.finish()
+            if zoom_level.record_count * 2 > last_count:
+                continue
+            last_count = zoom_level.record_count
+            zoom_data_offset = output_stream.tell()
+            output_stream.write(
+                    struct.pack('<I', zoom_level.record_count)
+                )
+            blocks_offset = output_stream.tell()
+            zoom_level.spool.seek(0)
+            shutil.copyfileobj(zoom_level.spool, output_stream)
+            zoom_index_offset = output_stream.tell()
+            _write_cir_tree(output_stream,
+                            [block[:4] + (block[4] + blocks_offset, block[5])
+                                for block in zoom_level.blocks],
+                            self.block_size, self.items_per_slot,
+                            zoom_index_offset)
+            zoom_headers.append(_zoom_header.pack(
+                    zoom_level.reduction, 0, zoom_data_offset,
+                    zoom_index_offset
+                ))
+            self.max_block_size = max(self.max_block_size,
+                                        zoom_level.max_block_size)
+        for zoom_level in self.zoom_levels:
+            zoom_level.spool.close()
+        chrom_tree_offset = output_stream.tell()
+        _write_bpt(output_stream, self.chroms, self.block_size)
+        output_stream.seek(0)
+        output_stream.write(_header.pack(
+                _bigwig_magic, _bigwig_version, len(zoom_headers),
+                chrom_tree_offset, self.data_offset, index_offset, 0, 0, 0,
+                _header.size + _max_zoom_levels * _zoom_header.size,
+                self.max_block_size, 0
+            ))
+        output_stream.write(''.join(zoom_headers))
+        output_stream.seek(_header.size + _max_zoom_levels
+                            * _zoom_header.size)
+        if self.item_count:
+            output_stream.write(_total_summary.pack(
+                    self.bases_covered, self.min_value, self.max_value,
+                    self.sum_data, self.sum_squares
+                ))
+        else:
+            output_stream.write(_total_summary.pack(0, 0.0, 0.0, 0.0, 0.0))
+        output_stream.close()
+
+if __name__ == '__main__':
+    import unittest
+    import os
+
+    def read_bigwig(filename):
+        """ Reads chromosomes, runs and zoom records from a bigWig.
+
+            filename: bigWig to read
+
+            Return value: tuple (dictionary mapping chromosome names to
+                sizes, list of runs (chrom, start, end, value), list of lists
+                of zoom records (chrom, start, end, bases covered, min, max,
+                sum, sum of squares), one for each zoom level)
+        """
+        with open(filename, 'rb') as input_stream:
+            data = input_stream.read()
+        header = _header.unpack_from(data, 0)
+        assert header[0] == _bigwig_magic
+        zoom_count, chrom_tree_offset, _, index_offset = header[2:6]
+        # Chromosome B+ tree
+        key_size, value_size = struct.unpack_from('<II', data,
+                                                    chrom_tree_offset + 8)
+        chrom_names, chrom_sizes = {}, {}
+        def read_bpt_node(offset):
+            is_leaf, _, count = _node_header.unpack_from(data, offset)
+            offset += _node_header.size
+            for _ in xrange(count):
+                key = data[offset:offset + key_size].rstrip('\x00')
+                offset += key_size
+                if is_leaf:
+                    chrom_id, chrom_size = struct.unpack_from(
+                                                    '<II', data, offset
+                                                )
+                    chrom_names[chrom_id] = key
+                    chrom_sizes[key] = chrom_size
+                    offset += value_size
+                else:
+                    read_bpt_node(struct.unpack_from('<Q', data, offset)[0])
+                    offset += 8
+        read_bpt_node(chrom_tree_offset + _bpt_header.size)
+        def read_cir_tree(offset):
+            """ Yields offsets and sizes of blocks in leaves """
+            assert _cir_tree_header.unpack_from(data, offset)[0] \
+                == _cir_tree_magic
+            nodes = [offset + _cir_tree_header.size]
+            while nodes:
+                offset = nodes.pop(0)
+                is_leaf, _, count = _node_header.unpack_from(data, offset)
+                offset += _node_header.size
+                for _ in xrange(count):
+                    if is_leaf:
+                        item = _cir_leaf_item.unpack_from(data, offset)
+                        yield item[4:]
+                        offset += _cir_leaf_item.size
+                    else:
+                        nodes.append(
+                            _cir_node_item.unpack_from(data, offset)[4]
+                        )
+                        offset += _cir_node_item.size
+        runs = []
+        for block_offset, block_size in read_cir_tree(index_offset):
+            block = zlib.decompress(data[block_offset:
+                                            block_offset + block_size])
+            section = _section_header.unpack_from(block, 0)
+            assert section[5] == 1
+            for i in xrange(section[7]):
+                start, end, value = _bedgraph_item.unpack_from(
+                        block, _section_header.size + i * _bedgraph_item.size
+                    )
+                runs.append((chrom_names[section[0]], start, end, value))
+        zoom_levels = []
+        for i in xrange(zoom_count):
+            _, _, _, zoom_index_offset = _zoom_header.unpack_from(
+                    data, _header.size + i * _zoom_header.size
+                )
+            records = []
+            for block_offset, block_size in read_cir_tree(zoom_index_offset):
+                block = zlib.decompress(data[block_offset:
+                                                block_offset + block_size])
+                for j in xrange(len(block) // _zoom_record.size):
+                    record = _zoom_record.unpack_from(
+                                        block, j * _zoom_record.size
+                                    )
+                    records.append((chrom_names[record[0]],) + record[1:])
+            zoom_levels.append(records)
+        return chrom_sizes, runs, zoom_levels
+
+    class TestBigWigWriter(unittest.TestCase):
+        """ Tests BigWigWriter by reading back what it writes. """
+        def setUp(self):
+            self.temp_dir_path = tempfile.mkdtemp()
+            self.filename = os.path.join(self.temp_dir_path, 'test.bw')
+
+        def test_runs_and_zoom_levels(self):
+            """ Fails if runs or zoom summaries aren't read back. """
+            import random
+            random.seed(3)
+            chrom_sizes = {'chr1' : 200000, 'chr2' : 50000, 'chrM' : 16569}
+            runs = []
+            for chrom in ['chr2', 'chr1', 'chrM']:
+                pos = 0
+                while pos < chrom_sizes[chrom]:
+                    end = min(pos + random.randint(1, 500),
+                                chrom_sizes[chrom])
+                    value = float(random.choice([0, 1, 2, 5, 30]))
+                    runs.append((chrom, pos, end, value))
+                    pos = end
+            # Small blocks so trees have more than one level
+            bigwig_writer = BigWigWriter(self.filename, chrom_sizes,
+                                            items_per_slot=16, block_size=4)
+            for run in runs:
+                bigwig_writer.add(*run)
+            bigwig_writer.close()
+            read_chrom_sizes, read_runs, zoom_levels = read_bigwig(
+                                                            self.filename
+                                                        )
+            self.assertEqual(chrom_sizes, read_chrom_sizes)
+            self.assertEqual(runs, read_runs)
+            self.assertTrue(zoom_levels)
+            for records in zoom_levels:
+                self.assertEqual(
+                        sum(chrom_sizes.values()),
+                        sum([record[3] for record in records])
+                    )
+                self.assertAlmostEqual(
+                        sum([(end - start) * value
+                                for _, start, end, value in runs]),
+                        sum([record[6] for record in records])
+                    )
+                self.assertEqual(30.0, max([record[5] for record in records]))
+
+        def test_overlap(self):
+            """ Fails if overlapping runs are accepted. """
+            bigwig_writer = BigWigWriter(self.filename, {'chr1' : 100})
+            bigwig_writer.add('chr1', 0, 50, 1.0)
+            self.assertRaises(RuntimeError, bigwig_writer.add,
+                                'chr1', 40, 60, 2.0)
+
+        def tearDown(self):
+            shutil.rmtree(self.temp_dir_path)
+
+    unittest.main()
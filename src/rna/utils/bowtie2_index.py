@@ -1,6 +1,44 @@
 import os
 import struct
 import mmap
+import marshal
+import tempfile
+from itertools import izip
+from bowtie_index import index_signature
+try:
+    import numpy
+except ImportError:
+    # Records are unpacked from the record file one at a time
+    numpy = None
+
+# Identifies record files written by Bowtie2IndexReference.save_records()
+_records_magic = 'RAILBT21'
+'''Flat arrays of a Bowtie2IndexReference: offsets, lengths and first flags of
+unambiguous stretches, then for each reference the number of unambiguous
+characters preceding it, its length and the index of its first stretch; the
+last array has an extra element holding the total number of stretches.'''
+_record_arrays = ['rec_offs', 'rec_lens', 'rec_firsts',
+                  'unambig_preceding', 'lengths', 'starting_offsets']
+
+
+class _MappedArray(object):
+    """
+    Read-only sequence of little-endian 8-byte integers in a buffer. Stands in
+    for a NumPy array over a memory map when NumPy is unavailable.
+    """
+
+    def __init__(self, buf, offset, count):
+        self.buf, self.offset, self.count = buf, offset, count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('index out of range')
+        return struct.unpack_from('<q', self.buf, self.offset + 8 * i)[0]
 
 
 class Bowtie2IndexReference(object):
@@ -10,25 +48,65 @@ class Bowtie2IndexReference(object):
     the unambiguous-stretch sequences.  get_stretch member function can
     retrieve stretches of characters from the reference, even if the stretch
     contains ambiguous characters.
+
+    Unless shared is False, the extents are stored as flat arrays in a record
+    file next to the index the first time it is parsed, and every instance,
+    in any process, memory-maps that file read-only, so concurrent tasks
+    share one copy of them rather than each holding its own lists.
     """
 
-    def __init__(self, idx_prefix):
+    def __init__(self, idx_prefix, shared=True):
 
-        # Open file handles
         if os.path.exists(idx_prefix + '.3.bt2'):
             # Small index (32-bit offsets)
-            fh1 = open(idx_prefix + '.1.bt2', 'rb')  # for ref names
-            fh3 = open(idx_prefix + '.3.bt2', 'rb')  # for stretch extents
-            fh4 = open(idx_prefix + '.4.bt2', 'rb')  # for unambiguous sequence
-            sz, struct_unsigned = 4, struct.Struct('I')
+            extension = '.bt2'
         elif os.path.exists(idx_prefix + '.3.bt2l'):
             # Large index (64-bit offsets)
-            fh1 = open(idx_prefix + '.1.bt2l', 'rb')  # for ref names
-            fh3 = open(idx_prefix + '.3.bt2l', 'rb')  # for stretch extents
-            fh4 = open(idx_prefix + '.4.bt2l', 'rb')  # for unambiguous sequence
-            sz, struct_unsigned = 8, struct.Struct('Q')
+            extension = '.bt2l'
         else:
             raise RuntimeError('No Bowtie 2 index files with prefix "%s"' % idx_prefix)
+        self.index_signature = index_signature(
+                [idx_prefix + '.%d' % i + extension for i in [1, 3, 4]]
+            )
+        # Offsets of flat arrays in record file once it's attached
+        self.array_offsets = None
+
+        records_path = idx_prefix + '.records'
+        if not (shared and self.attach_records(records_path)):
+            self.parse_index(idx_prefix, extension)
+            if shared:
+                try:
+                    self.save_records(records_path)
+                except (IOError, OSError):
+                    # Index directory need not be writable
+                    pass
+                else:
+                    # Drop parsed lists in favor of the shared file
+                    self.attach_records(records_path)
+
+        #
+        # Memory-map the .4.bt2 file
+        #
+        with open(idx_prefix + '.4' + extension, 'rb') as fh4:
+            ln_bytes = (self.tot_unambig_len + 3) // 4
+            self.fh4mm = mmap.mmap(fh4.fileno(), ln_bytes, flags=mmap.MAP_SHARED, prot=mmap.PROT_READ)
+
+        self.ref_id_to_offset = {self.refnames[i]: i for i in xrange(len(self.refnames))}
+
+    def parse_index(self, idx_prefix, extension):
+        """
+        Parse reference names and extents of unambiguous stretches from the
+        Bowtie 2 index into lists.
+
+        @param idx_prefix: prefix of Bowtie 2 index
+        @param extension: '.bt2' or '.bt2l'
+        """
+        fh1 = open(idx_prefix + '.1' + extension, 'rb')  # for ref names
+        fh3 = open(idx_prefix + '.3' + extension, 'rb')  # for stretch extents
+        if extension == '.bt2':
+            sz, struct_unsigned = 4, struct.Struct('I')
+        else:
+            sz, struct_unsigned = 8, struct.Struct('Q')
 
         #
         # Parse .1.bt2 file
@@ -114,44 +192,149 @@ class Bowtie2IndexReference(object):
         tot_unambig_len = running_unambig_preceding
         assert len(recs) == nrecs
 
-        #
-        # Memory-map the .4.bt2 file
-        #
-        ln_bytes = (tot_unambig_len + 3) // 4
-        self.fh4mm = mmap.mmap(fh4.fileno(), ln_bytes, flags=mmap.MAP_SHARED, prot=mmap.PROT_READ)
+        fh1.close()
+        fh3.close()
+        self.tot_unambig_len = tot_unambig_len
 
         # These are per-unambiguous-stretch
-        self.recs = recs
+        self.rec_offs = [rec[0] for rec in recs]
+        self.rec_lens = [rec[1] for rec in recs]
+        self.rec_firsts = [int(rec[2]) for rec in recs]
 
         # These are per-reference
         self.unambig_preceding = unambig_preceding
         self.lengths = lengths
         self.starting_offsets = starting_offsets
         self.refnames = refnames
-        self.ref_id_to_offset = {self.refnames[i]: i for i in xrange(len(self.refnames))}
+
+    def save_records(self, records_path):
+        """
+        Write the record file holding the flat arrays named in _record_arrays,
+        to a temporary file that is renamed so no process sees part of it.
+
+        The record file is _records_magic, the size of the header as an
+        8-byte little-endian integer, the header, which is marshal'd, and,
+        starting at the next multiple of 8 bytes, the arrays as little-endian
+        8-byte integers.
+
+        @param records_path: path to record file
+        """
+        header = {
+                'signature' : self.index_signature,
+                'refnames' : self.refnames,
+                'tot_unambig_len' : self.tot_unambig_len,
+                'arrays' : {}
+            }
+        body_size = 0
+        for name in _record_arrays:
+            header['arrays'][name] = (body_size, len(getattr(self, name)))
+            body_size += 8 * len(getattr(self, name))
+        header = marshal.dumps(header)
+        records_start = -(-(len(header) + 16) // 8) * 8
+        temp_stream = tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(os.path.abspath(records_path)),
+                prefix=os.path.basename(records_path) + '.', delete=False
+            )
+        try:
+            with temp_stream:
+                temp_stream.write(_records_magic)
+                temp_stream.write(struct.pack('<Q', len(header)))
+                temp_stream.write(header)
+                temp_stream.write(
+                        '\x00' * (records_start - len(header) - 16)
+                    )
+                for name in _record_arrays:
+                    array = getattr(self, name)
+                    temp_stream.write(struct.pack('<%dq' % len(array), *array))
+            os.rename(temp_stream.name, records_path)
+        except:
+            os.remove(temp_stream.name)
+            raise
+
+    def attach_records(self, records_path):
+        """
+        Memory-map the record file read-only if it exists and matches the
+        index, and point the flat arrays at it.
+
+        @param records_path: path to record file
+        @return: True iff the record file was attached
+        """
+        try:
+            with open(records_path, 'rb') as records_stream:
+                records_mm = mmap.mmap(records_stream.fileno(), 0,
+                                        flags=mmap.MAP_SHARED,
+                                        prot=mmap.PROT_READ)
+        except (IOError, OSError, ValueError, mmap.error):
+            return False
+        try:
+            header = None
+            if records_mm[:8] == _records_magic:
+                header_size = struct.unpack_from('<Q', records_mm, 8)[0]
+                header = marshal.loads(records_mm[16:16 + header_size])
+        except (struct.error, ValueError, EOFError, TypeError):
+            header = None
+        if header is None or (header.get('signature')
+                                != self.index_signature):
+            # Record file is from another version or another index
+            records_mm.close()
+            return False
+        records_start = -(-(header_size + 16) // 8) * 8
+        self.records_mm = records_mm
+        self.refnames = header['refnames']
+        self.tot_unambig_len = header['tot_unambig_len']
+        self.array_offsets = {}
+        for name in _record_arrays:
+            offset, count = header['arrays'][name]
+            self.array_offsets[name] = records_start + offset
+            if numpy is None:
+                array = _MappedArray(records_mm, records_start + offset,
+                                        count)
+            else:
+                array = numpy.frombuffer(records_mm, dtype='<i8',
+                                            count=count,
+                                            offset=records_start + offset)
+            setattr(self, name, array)
+        return True
+
+    def values(self, name, start, stop):
+        """
+        Get elements of a flat array as Python ints. Elements of an array in
+        the record file are unpacked with one call rather than converted
+        from NumPy scalars one at a time.
+
+        @param name: name of array from _record_arrays
+        @param start: index of first element
+        @param stop: index after last element
+        @return: sequence of ints
+        """
+        if self.array_offsets is None:
+            return getattr(self, name)[start:stop]
+        return struct.unpack_from('<%dq' % (stop - start), self.records_mm,
+                                    self.array_offsets[name] + 8 * start)
 
     def get_stretch(self, ref_id, ref_off, count):
         assert ref_id in self.ref_id_to_offset
         ref_idx = self.ref_id_to_offset[ref_id]
-        rec_i, rec_f = self.starting_offsets[ref_idx], self.starting_offsets[ref_idx + 1]
+        rec_i, rec_f = self.values('starting_offsets', ref_idx, ref_idx + 2)
+        buf_off = self.values('unambig_preceding', ref_idx, ref_idx + 1)[0]
         cur, off = 0, 0
-        buf_off = self.unambig_preceding[ref_idx]
         stretch = []
         # Naive to scan these records linearly; obvious speedup is binary search
-        for i in xrange(rec_i, rec_f):
-            off += self.recs[i][0]
+        for rec_off, rec_len in izip(self.values('rec_offs', rec_i, rec_f),
+                                     self.values('rec_lens', rec_i, rec_f)):
+            off += rec_off
             while ref_off < off and count > 0:
                 stretch.append('N')
                 count -= 1
                 ref_off += 1
             if count == 0:
                 break
-            if ref_off < off + self.recs[i][1]:
+            if ref_off < off + rec_len:
                 # stretch extends through part of the unambiguous stretch
                 buf_off += (ref_off - off)
             else:
-                buf_off += self.recs[i][1]
-            off += self.recs[i][1]
+                buf_off += rec_len
+            off += rec_len
             while ref_off < off and count > 0:
                 buf_elt = buf_off >> 2
                 shift_amt = (buf_off & 3) << 1
@@ -166,7 +349,6 @@ class Bowtie2IndexReference(object):
             stretch.append('N')
         return ''.join(stretch)
 
-
 def which(program):
     import os
 
@@ -263,4 +445,39 @@ CA
                 self.assertEqual('AAAA', ref.get_stretch('short_name4', 41, 4))
                 self.assertEqual('NNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNNTT', ref.get_stretch('short_name4', 240, 42))
 
+            def test_shared_records(self):
+                parsed = Bowtie2IndexReference(self.fa_fn_1, shared=False)
+                self.assertFalse(os.path.exists(self.fa_fn_1 + '.records'))
+                # First instance writes record file; second attaches to it
+                for _ in xrange(2):
+                    ref = Bowtie2IndexReference(self.fa_fn_1)
+                    self.assertTrue(hasattr(ref, 'records_mm'))
+                    self.assertEqual(ref.refnames, parsed.refnames)
+                    for ref_id in parsed.refnames:
+                        for ref_off in xrange(-2, 290, 7):
+                            self.assertEqual(
+                                    ref.get_stretch(ref_id, ref_off, 45),
+                                    parsed.get_stretch(ref_id, ref_off, 45)
+                                )
+
+            def test_rebuilt_index(self):
+                '''Index of a same-sized reference has files of the same
+                sizes, and copies may keep modification times; record file
+                of old index must not be used.'''
+                extensions = ['.%d.bt2' % i for i in [1, 3, 4]]
+                for extension in extensions:
+                    os.utime(self.fa_fn_1 + extension, (1e9, 1e9))
+                Bowtie2IndexReference(self.fa_fn_1)
+                with open(self.fa_fn_1) as fh:
+                    fasta = fh.read()
+                with open(self.fa_fn_1, 'w') as fh:
+                    fh.write(fasta.replace('short_name2', 'short_name5'))
+                os.system('bowtie2-build %s %s >/dev/null 2>/dev/null'
+                            % (self.fa_fn_1, self.fa_fn_1))
+                for extension in extensions:
+                    os.utime(self.fa_fn_1 + extension, (1e9, 1e9))
+                ref = Bowtie2IndexReference(self.fa_fn_1)
+                self.assertTrue('short_name5' in ref.ref_id_to_offset)
+                self.assertFalse('short_name2' in ref.ref_id_to_offset)
+
         unittest.main(argv=[sys.argv[0]])
@@ -1,9 +1,86 @@
 import os
 import struct
 import mmap
+import marshal
+import tempfile
+import hashlib
 from operator import itemgetter
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from bisect import bisect_right
+try:
+    import numpy
+except ImportError:
+    # Bases are decoded in pure Python
+    numpy = None
+
+'''Each byte of the unambiguous-stretch sequence packs four bases, the first in
+the least significant two bits; this maps a byte to its four bases.'''
+_byte_to_bases = [''.join(['ACGT'[(byte >> shift) & 3]
+                            for shift in (0, 2, 4, 6)])
+                    for byte in xrange(256)]
+if numpy is not None:
+    _base_table = numpy.frombuffer(''.join(_byte_to_bases),
+                                    dtype=numpy.uint8).reshape(256, 4)
+
+# Identifies sidecar files written by BowtieIndexReference.save_sidecar()
+_sidecar_magic = 'RAILREF1'
+# Number of bases decoded at a time when writing decoded sequence to sidecar
+_sidecar_chunk_size = 1 << 20
+
+# Number of bytes at the start of an index file hashed into its signature
+_signature_bytes = 65536
+
+def index_signature(paths):
+    """ Identifies the versions of index files something was derived from.
+
+        Index files are usually rebuilt or replaced rather than edited in
+        place, so their sizes, modification times and headers together tell
+        one version from another without reading the whole files.
+
+        paths: paths to index files
+
+        Return value: list with, per file, None if the file doesn't exist,
+            else a tuple (size, modification time, MD5 digest of its first
+            _signature_bytes bytes); what was derived from the files is
+            stale if it changes
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            with open(path, 'rb') as index_stream:
+                header = index_stream.read(_signature_bytes)
+        except (IOError, OSError):
+            signature.append(None)
+        else:
+            signature.append((stat.st_size, stat.st_mtime,
+                                hashlib.md5(header).hexdigest()))
+    return signature
+
+def _index_signature(idx_prefix):
+    """ Signature of Bowtie index files from which a sidecar is derived.
+
+        idx_prefix: prefix of Bowtie index
+
+        Return value: index_signature() of .1.ebwt, .3.ebwt and .4.ebwt
+            files
+    """
+    return index_signature([idx_prefix + extension for extension
+                                in ['.1.ebwt', '.3.ebwt', '.4.ebwt']])
+
+class _LazyTables(dict):
+    """ Dictionary of per-reference tables filled in on first access.
+
+        A missing reference's tables are filled in by a function that takes
+        the name of the reference.
+    """
+    def __init__(self, load):
+        dict.__init__(self)
+        self.load = load
+
+    def __missing__(self, ref_id):
+        self.load(ref_id)
+        return dict.__getitem__(self, ref_id)
 
 class BowtieIndexReference(object):
     """
@@ -11,17 +88,74 @@ class BowtieIndexReference(object):
     extents of the unambiguous stretches, and memory-maps the file containing
     the unambiguous-stretch sequences.  get_stretch member function can
     retrieve stretches of characters from the reference, even if the stretch
-    contains ambiguous characters.
+    contains ambiguous characters; get_stretches retrieves many at once.
+
+    Decoded reference is cached in aligned blocks of block_size characters,
+    the cache_size least recently used of which are kept, so overlapping
+    stretches are decoded once. cache_hits and cache_misses count block
+    lookups.
+
+    Unless sidecar is False, what is parsed from the index is saved to a
+    sidecar file next to it, which later instances memory-map instead of
+    parsing the index; see save_sidecar().
     """
 
-    def __init__(self, idx_prefix):
+    def __init__(self, idx_prefix, cache_size=1024, block_size=4096,
+                    sidecar=True):
+
+        self.cache_size, self.block_size = cache_size, block_size
+        self.cache = OrderedDict()
+        self.cache_hits, self.cache_misses = 0, 0
+        '''Per reference, records of the .3.ebwt file and for each its offset
+        in the reference and the number of unambiguous characters preceding
+        it'''
+        self.recs = _LazyTables(self.load_tables)
+        self.offset_in_ref = _LazyTables(self.load_tables)
+        self.unambig_preceding = _LazyTables(self.load_tables)
+        '''Per reference, starts and ends of nonempty unambiguous stretches
+        and offsets of their first characters in the .4.ebwt buffer, for
+        bisection'''
+        self.unambig_starts = _LazyTables(self.load_tables)
+        self.unambig_ends = _LazyTables(self.load_tables)
+        self.unambig_buf_offs = _LazyTables(self.load_tables)
+        # Sidecar mmap and header; see save_sidecar()
+        self.sidecar_mm, self.sidecar_header = None, None
+
+        sidecar_path = idx_prefix + '.sidecar'
+        if not (sidecar and self.load_sidecar(idx_prefix, sidecar_path)):
+            self.parse_index(idx_prefix)
+            if sidecar:
+                try:
+                    self.save_sidecar(idx_prefix, sidecar_path)
+                except (IOError, OSError):
+                    # Index directory need not be writable
+                    pass
+
+        #
+        # Memory-map the .4.bt2 file
+        #
+        with open(idx_prefix + '.4.ebwt', 'rb') as fh4:
+            ln_bytes = (self.unambig_count + 3) // 4
+            self.fh4mm = mmap.mmap(fh4.fileno(), ln_bytes, flags=mmap.MAP_SHARED, prot=mmap.PROT_READ)
+        if numpy is not None:
+            # Zero-copy view of the packed bases
+            self.packed = numpy.frombuffer(self.fh4mm, dtype=numpy.uint8)
+
+        # For compatibility
+        self.rname_lengths = self.length
+
+    def parse_index(self, idx_prefix):
+        """
+        Parse reference names, lengths and records from the Bowtie index.
+
+        @param idx_prefix: prefix of Bowtie index
+        """
 
         # Open file handles
         if os.path.exists(idx_prefix + '.3.ebwt'):
             # Small index (32-bit offsets)
             fh1 = open(idx_prefix + '.1.ebwt', 'rb')  # for ref names
             fh3 = open(idx_prefix + '.3.ebwt', 'rb')  # for stretch extents
-            fh4 = open(idx_prefix + '.4.ebwt', 'rb')  # for unambiguous sequence
             sz, struct_unsigned = 4, struct.Struct('I')
         else:
             raise RuntimeError('No Bowtie index files with prefix "%s"' % idx_prefix)
@@ -88,11 +222,10 @@ class BowtieIndexReference(object):
 
         nrecs = struct_unsigned.unpack(fh3.read(sz))[0]
 
-        running_unambig, running_length = 0, 0
-        self.recs = defaultdict(list)
-        self.offset_in_ref = defaultdict(list)
-        self.unambig_preceding = defaultdict(list)
-        length = {}
+        running_unambig = 0
+        recs = defaultdict(list)
+        # Number of unambiguous characters preceding each reference
+        self.unambig_before = {}
 
         ref_id, ref_namenrecs_added = 0, None
         for i in xrange(nrecs):
@@ -100,29 +233,24 @@ class BowtieIndexReference(object):
             ln = struct_unsigned.unpack(fh3.read(sz))[0]
             first_of_chromosome = ord(fh3.read(1)) != 0
             if first_of_chromosome:
-                if i > 0:
-                    length[ref_name] = running_length
                 ref_name = refnames[ref_id]
                 ref_id += 1
-                running_length = 0
+                self.unambig_before[ref_name] = running_unambig
             assert ref_name is not None
-            self.recs[ref_name].append((off, ln, first_of_chromosome))
-            self.offset_in_ref[ref_name].append(running_length)
-            self.unambig_preceding[ref_name].append(running_unambig)
-            running_length += (off + ln)
+            recs[ref_name].append((off, ln, first_of_chromosome))
             running_unambig += ln
+        assert nrecs == sum(map(len, recs.itervalues()))
+        fh1.close()
+        fh3.close()
 
-        length[ref_name] = running_length
-        assert nrecs == sum(map(len, self.recs.itervalues()))
-
-        #
-        # Memory-map the .4.bt2 file
-        #
-        ln_bytes = (running_unambig + 3) // 4
-        self.fh4mm = mmap.mmap(fh4.fileno(), ln_bytes, flags=mmap.MAP_SHARED, prot=mmap.PROT_READ)
+        self.length = {}
+        for ref_name in recs:
+            self.set_tables(ref_name, recs[ref_name])
+            self.length[ref_name] = (self.offset_in_ref[ref_name][-1]
+                                        + sum(recs[ref_name][-1][:2]))
+        self.unambig_count = running_unambig
 
         # These are per-reference
-        self.length = length
         self.refnames = refnames
 
         # To facilitate sorting reference names in order of descending length
@@ -149,8 +277,321 @@ class BowtieIndexReference(object):
         self.rname_to_string['*'] = unmapped_string
         self.string_to_rname[unmapped_string] = '*'
 
-        # For compatibility
-        self.rname_lengths = self.length
+    def set_tables(self, ref_id, recs):
+        """
+        Fill in per-reference tables from a reference's records.
+
+        @param ref_id: name of ref seq, up to & excluding whitespace
+        @param recs: list of (# of ambiguous characters preceding stretch,
+            # of characters in unambiguous stretch, True iff stretch is first
+            of reference), one per .3.ebwt record of reference
+        """
+        offset_in_ref, unambig_preceding = [], []
+        unambig_starts, unambig_ends, unambig_buf_offs = [], [], []
+        running_length, running_unambig = 0, self.unambig_before[ref_id]
+        for off, ln, _ in recs:
+            offset_in_ref.append(running_length)
+            unambig_preceding.append(running_unambig)
+            if ln:
+                unambig_starts.append(running_length + off)
+                unambig_ends.append(running_length + off + ln)
+                unambig_buf_offs.append(running_unambig)
+            running_length += (off + ln)
+            running_unambig += ln
+        for table, value in [(self.recs, recs),
+                             (self.offset_in_ref, offset_in_ref),
+                             (self.unambig_preceding, unambig_preceding),
+                             (self.unambig_starts, unambig_starts),
+                             (self.unambig_ends, unambig_ends),
+                             (self.unambig_buf_offs, unambig_buf_offs)]:
+            dict.__setitem__(table, ref_id, value)
+
+    def load_tables(self, ref_id):
+        """
+        Fill in per-reference tables from records stored in the sidecar, or
+        with empty lists if there are none.
+
+        @param ref_id: name of ref seq, up to & excluding whitespace
+        """
+        try:
+            offset, count = self.sidecar_header['tables'][ref_id]
+        except (TypeError, KeyError):
+            recs = []
+        else:
+            flat = struct.unpack_from('<%dQ' % (count * 3), self.sidecar_mm,
+                                        self.sidecar_start + offset)
+            recs = [(flat[i], flat[i+1], flat[i+2] != 0)
+                        for i in xrange(0, len(flat), 3)]
+        self.unambig_before.setdefault(ref_id, 0)
+        self.set_tables(ref_id, recs)
+
+    def save_sidecar(self, idx_prefix, sidecar_path, decoded=False):
+        """
+        Write the sidecar file, which holds everything parse_index() finds so
+        later instances can memory-map it rather than parse the index.
+        The file is written to a temporary file and renamed so tasks never
+        see part of it.
+
+        The sidecar is _sidecar_magic, the size of the header as an 8-byte
+        little-endian integer, the header, which is marshal'd, and, starting
+        at the next multiple of 8 bytes, each reference's records as
+        little-endian 8-byte integers (off, ln, first, off, ln, first, ...)
+        followed by, if decoded, each reference's sequence at a byte per
+        base.
+
+        @param idx_prefix: prefix of Bowtie index
+        @param sidecar_path: path to sidecar
+        @param decoded: True iff decoded sequence should be included
+        """
+        header = {
+                'signature' : _index_signature(idx_prefix),
+                'refnames' : self.refnames,
+                'length' : self.length,
+                'rname_to_string' : self.rname_to_string,
+                'l_rname_to_string' : self.l_rname_to_string,
+                'unambig_before' : self.unambig_before,
+                'unambig_count' : self.unambig_count,
+                'tables' : {},
+                'sequences' : None
+            }
+        body_size = 0
+        for ref_id in self.length:
+            header['tables'][ref_id] = (body_size, len(self.recs[ref_id]))
+            body_size += 24 * len(self.recs[ref_id])
+        if decoded:
+            header['sequences'] = {}
+            for ref_id in self.length:
+                header['sequences'][ref_id] = body_size
+                body_size += self.length[ref_id]
+        header = marshal.dumps(header)
+        sidecar_start = -(-(len(header) + 16) // 8) * 8
+        temp_stream = tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(os.path.abspath(sidecar_path)),
+                prefix=os.path.basename(sidecar_path) + '.', delete=False
+            )
+        try:
+            with temp_stream:
+                temp_stream.write(_sidecar_magic)
+                temp_stream.write(struct.pack('<Q', len(header)))
+                temp_stream.write(header)
+                temp_stream.write(
+                        '\x00' * (sidecar_start - len(header) - 16)
+                    )
+                for ref_id in self.length:
+                    flat = [int(field) for rec in self.recs[ref_id]
+                                for field in rec]
+                    temp_stream.write(struct.pack('<%dQ' % len(flat), *flat))
+                if decoded:
+                    for ref_id in self.length:
+                        for start in xrange(0, self.length[ref_id],
+                                                _sidecar_chunk_size):
+                            temp_stream.write(self.get_stretch(
+                                    ref_id, start,
+                                    min(_sidecar_chunk_size,
+                                        self.length[ref_id] - start)
+                                ))
+            os.rename(temp_stream.name, sidecar_path)
+        except:
+            os.remove(temp_stream.name)
+            raise
+
+    def load_sidecar(self, idx_prefix, sidecar_path):
+        """
+        Memory-map the sidecar if it exists and matches the index. Records
+        are unpacked from it only when a reference's tables are first used.
+
+        @param idx_prefix: prefix of Bowtie index
+        @param sidecar_path: path to sidecar
+        @return: True iff the sidecar was loaded
+        """
+        try:
+            with open(sidecar_path, 'rb') as sidecar_stream:
+                sidecar_mm = mmap.mmap(sidecar_stream.fileno(), 0,
+                                        flags=mmap.MAP_SHARED,
+                                        prot=mmap.PROT_READ)
+        except (IOError, OSError, ValueError, mmap.error):
+            return False
+        try:
+            header = None
+            if sidecar_mm[:8] == _sidecar_magic:
+                header_size = struct.unpack_from('<Q', sidecar_mm, 8)[0]
+                header = marshal.loads(sidecar_mm[16:16 + header_size])
+        except (struct.error, ValueError, EOFError, TypeError):
+            header = None
+        if header is None or (header.get('signature')
+                                != _index_signature(idx_prefix)):
+            # Sidecar is from another version or another index
+            sidecar_mm.close()
+            return False
+        self.sidecar_mm, self.sidecar_header = sidecar_mm, header
+        self.sidecar_start = -(-(header_size + 16) // 8) * 8
+        self.refnames = header['refnames']
+        self.length = header['length']
+        self.unambig_before = header['unambig_before']
+        self.unambig_count = header['unambig_count']
+        self.rname_to_string = header['rname_to_string']
+        self.l_rname_to_string = header['l_rname_to_string']
+        self.string_to_rname = dict(
+                (rname_string, rname) for rname, rname_string
+                in self.rname_to_string.iteritems()
+            )
+        self.l_string_to_rname = dict(
+                (rname_string, rname) for rname, rname_string
+                in self.l_rname_to_string.iteritems()
+            )
+        return True
+
+    def decoded(self, buf_ranges):
+        """
+        Decode runs of bases from the unambiguous-stretch buffer. With NumPy,
+        all runs are decoded with a single table lookup.
+
+        @param buf_ranges: list of (offset into buffer, # of bases)
+        @return: list of strings of bases, one per element of buf_ranges
+        """
+        byte_ranges = [(buf_off >> 2, (buf_off + count + 3) >> 2)
+                        for buf_off, count in buf_ranges]
+        if not byte_ranges:
+            return []
+        if numpy is None:
+            packed = [''.join([_byte_to_bases[ord(byte)]
+                                for byte in self.fh4mm[first:last]])
+                        for first, last in byte_ranges]
+        elif len(byte_ranges) == 1:
+            packed = [_base_table[
+                    self.packed[byte_ranges[0][0]:byte_ranges[0][1]]
+                ].tostring()]
+        else:
+            bases = _base_table[self.packed[numpy.concatenate(
+                    [numpy.arange(first, last) for first, last in byte_ranges]
+                )]].tostring()
+            packed, start = [], 0
+            for first, last in byte_ranges:
+                end = start + ((last - first) << 2)
+                packed.append(bases[start:end])
+                start = end
+        return [bases[buf_off & 3:(buf_off & 3) + count]
+                    for bases, (buf_off, count) in zip(packed, buf_ranges)]
+
+    def block_pieces(self, ref_id, block):
+        """
+        Find what a block of the reference is made of.
+
+        @param ref_id: name of ref seq, up to & excluding whitespace
+        @param block: index of block
+        @return: list of (offset into buffer or None for Ns, # of characters)
+        """
+        start = block * self.block_size
+        end = min(start + self.block_size, self.length[ref_id])
+        starts = self.unambig_starts[ref_id]
+        ends = self.unambig_ends[ref_id]
+        buf_offs = self.unambig_buf_offs[ref_id]
+        pieces = []
+        # First unambiguous stretch ending after start of block
+        i = bisect_right(ends, start)
+        while i < len(starts) and starts[i] < end and start < end:
+            if starts[i] > start:
+                pieces.append((None, starts[i] - start))
+                start = starts[i]
+            piece_end = min(ends[i], end)
+            pieces.append((buf_offs[i] + start - starts[i], piece_end - start))
+            start = piece_end
+            i += 1
+        if start < end:
+            pieces.append((None, end - start))
+        return pieces
+
+    def blocks(self, keys):
+        """
+        Retrieve decoded blocks, decoding those not in the cache together.
+
+        @param keys: iterable of (name of ref seq, index of block)
+        @return: dictionary mapping each key to its block
+        """
+        found, missing = {}, []
+        for key in set(keys):
+            try:
+                # Most recently used blocks are last
+                found[key] = self.cache[key] = self.cache.pop(key)
+            except KeyError:
+                missing.append(key)
+                self.cache_misses += 1
+            else:
+                self.cache_hits += 1
+        if missing:
+            pieces = [self.block_pieces(*key) for key in missing]
+            bases = iter(self.decoded(
+                    [piece for block_pieces in pieces
+                        for piece in block_pieces if piece[0] is not None]
+                ))
+            for key, block_pieces in zip(missing, pieces):
+                found[key] = self.cache[key] = ''.join(
+                        [('N' * count if buf_off is None else next(bases))
+                            for buf_off, count in block_pieces]
+                    )
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return found
+
+    def get_stretches(self, stretches):
+        """
+        Return many stretches of characters from the reference, decoding
+        the blocks they span that are not cached in one pass.
+
+        @param stretches: list of (name of ref seq, offset into reference,
+            # of characters); see get_stretch
+        @return: list of strings extracted from reference, one per element
+            of stretches
+        """
+        bounds, keys = [], []
+        for ref_id, ref_off, count in stretches:
+            assert ref_id in self.length
+            # Part of stretch that lies on the reference
+            start = max(ref_off, 0)
+            end = min(ref_off + count, self.length[ref_id])
+            bounds.append((start, end))
+            if start < end:
+                keys.extend([(ref_id, block) for block in
+                                xrange(start // self.block_size,
+                                        (end - 1) // self.block_size + 1)])
+        sequences = (self.sidecar_header['sequences']
+                        if self.sidecar_header is not None else None)
+        if sequences is None:
+            blocks = self.blocks(keys)
+        extracted = []
+        for (ref_id, ref_off, count), (start, end) in zip(stretches, bounds):
+            if start >= end:
+                # Account for stretches entirely off the reference
+                extracted.append('N' * count)
+                continue
+            if sequences is not None:
+                # Sidecar has decoded sequence
+                sequence_start = self.sidecar_start + sequences[ref_id]
+                extracted.append(
+                        ''.join(['N' * (start - ref_off),
+                                 self.sidecar_mm[sequence_start + start:
+                                                 sequence_start + end],
+                                 'N' * (ref_off + count - end)])
+                    )
+                continue
+            first_block = start // self.block_size
+            last_block = (end - 1) // self.block_size
+            block_start = first_block * self.block_size
+            if first_block == last_block:
+                stretch = blocks[(ref_id, first_block)][
+                        start - block_start:end - block_start
+                    ]
+            else:
+                stretch = ''.join(
+                        [blocks[(ref_id, block)] for block
+                            in xrange(first_block, last_block + 1)]
+                    )[start - block_start:end - block_start]
+            # Pad parts of stretch off either end of reference with Ns
+            extracted.append(
+                    ''.join(['N' * (start - ref_off), stretch,
+                                'N' * (ref_off + count - end)])
+                )
+        return extracted
 
     def get_stretch(self, ref_id, ref_off, count):
         """
@@ -162,7 +603,20 @@ class BowtieIndexReference(object):
         @param count: # of characters
         @return: string extracted from reference
         """
-        assert ref_id in self.recs
+        return self.get_stretches([(ref_id, ref_off, count)])[0]
+
+    def scanned_stretch(self, ref_id, ref_off, count):
+        """
+        Return a stretch of characters from the reference by scanning its
+        records and decoding one character at a time, bypassing the cache.
+        This is the original get_stretch, against which it is tested.
+
+        @param ref_id: name of ref seq, up to & excluding whitespace
+        @param ref_off: offset into reference, 0-based
+        @param count: # of characters
+        @return: string extracted from reference
+        """
+        assert ref_id in self.length
         # Account for negative reference offsets by padding with Ns
         N_count = min(abs(min(ref_off, 0)), count)
         stretch = ['N'] * N_count
@@ -234,10 +688,20 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--test', action='store_const', const=True, default=False, help='Do unit tests')
+    parser.add_argument('--sidecar', type=str, required=False, default=None,
+        help='Write sidecar for Bowtie index with this prefix')
+    parser.add_argument('--decoded', action='store_const', const=True,
+        default=False,
+        help=('Include decoded sequence at a byte per base in sidecar so '
+              'stretches are read straight from it'))
 
     args = parser.parse_args()
 
-    if args.test:
+    if args.sidecar is not None:
+        BowtieIndexReference(args.sidecar, sidecar=False).save_sidecar(
+                args.sidecar, args.sidecar + '.sidecar', decoded=args.decoded
+            )
+    elif args.test:
         import unittest
         class TestBowtieIndexReference(unittest.TestCase):
 
@@ -315,4 +779,78 @@ CA
                 self.assertEqual('NNNNNNNNN', ref.get_stretch('short_name1', 85, 9))
                 self.assertEqual('ANNNNNNNN', ref.get_stretch('short_name1', 80, 9))
 
+            def test_stretch_cache(self):
+                # Small blocks and cache so stretches span evicted blocks
+                ref = BowtieIndexReference(self.fa_fn_1, cache_size=2,
+                                                block_size=7)
+                stretches = [(ref_id, ref_off, count)
+                                for ref_id in ref.length
+                                for ref_off in xrange(-10, 300, 3)
+                                for count in xrange(0, 50, 7)]
+                expected = [ref.scanned_stretch(*stretch)
+                                for stretch in stretches]
+                self.assertEqual(ref.get_stretches(stretches), expected)
+                self.assertEqual([ref.get_stretch(*stretch)
+                                    for stretch in stretches], expected)
+                self.assertTrue(ref.cache_hits > 0)
+                self.assertTrue(len(ref.cache) <= 2)
+
+            def test_sidecar(self):
+                parsed = BowtieIndexReference(self.fa_fn_1, sidecar=False)
+                self.assertFalse(os.path.exists(self.fa_fn_1 + '.sidecar'))
+                # Writes sidecar
+                BowtieIndexReference(self.fa_fn_1)
+                for decoded in [False, True]:
+                    parsed.save_sidecar(self.fa_fn_1,
+                                        self.fa_fn_1 + '.sidecar',
+                                        decoded=decoded)
+                    ref = BowtieIndexReference(self.fa_fn_1)
+                    self.assertTrue(ref.sidecar_mm is not None)
+                    for attribute in ['length', 'refnames', 'rname_to_string',
+                                      'string_to_rname', 'l_rname_to_string',
+                                      'l_string_to_rname']:
+                        self.assertEqual(getattr(ref, attribute),
+                                         getattr(parsed, attribute))
+                    for ref_id in parsed.length:
+                        self.assertEqual(ref.recs[ref_id],
+                                         parsed.recs[ref_id])
+                        for ref_off in xrange(-5, parsed.length[ref_id] + 5):
+                            self.assertEqual(
+                                    ref.get_stretch(ref_id, ref_off, 17),
+                                    parsed.scanned_stretch(ref_id, ref_off, 17)
+                                )
+                # Stale sidecar is ignored
+                with open(self.fa_fn_1 + '.4.ebwt', 'ab') as fh:
+                    fh.write('\x00')
+                self.assertTrue(
+                        BowtieIndexReference(self.fa_fn_1).sidecar_mm is None
+                    )
+
+            def test_rebuilt_index(self):
+                '''Index of a same-sized reference has files of the same
+                sizes, and copies may keep modification times; sidecar of
+                old index must not be used.'''
+                extensions = ['.1.ebwt', '.3.ebwt', '.4.ebwt']
+                sizes = [os.path.getsize(self.fa_fn_1 + extension)
+                            for extension in extensions]
+                for extension in extensions:
+                    os.utime(self.fa_fn_1 + extension, (1e9, 1e9))
+                BowtieIndexReference(self.fa_fn_1)
+                self.assertTrue(
+                    BowtieIndexReference(self.fa_fn_1).sidecar_mm is not None
+                )
+                with open(self.fa_fn_1) as fh:
+                    fasta = fh.read()
+                with open(self.fa_fn_1, 'w') as fh:
+                    fh.write(fasta.replace('short_name2', 'short_name5'))
+                os.system('bowtie-build %s %s >/dev/null'
+                            % (self.fa_fn_1, self.fa_fn_1))
+                for extension in extensions:
+                    os.utime(self.fa_fn_1 + extension, (1e9, 1e9))
+                self.assertEqual([os.path.getsize(self.fa_fn_1 + extension)
+                                    for extension in extensions], sizes)
+                ref = BowtieIndexReference(self.fa_fn_1)
+                self.assertTrue('short_name5' in ref.length)
+                self.assertFalse('short_name2' in ref.length)
+
         unittest.main(argv=[sys.argv[0]])
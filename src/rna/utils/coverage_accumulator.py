@@ -0,0 +1,330 @@
+"""
+coverage_accumulator.py
+Part of Rail-RNA
+
+Contains a class that accumulates coverage diffs across samples for
+Rail-RNA-coverage_pre and keeps means and medians of normalized coverages
+across samples up to date as diffs arrive, so work per genomic position
+doesn't grow with the number of samples.
+"""
+from array import array
+from bisect import bisect_left, insort
+
+class CenterTracker(object):
+    """ Tracks mean and median of one value per sample as values change.
+
+        Values are kept in a sorted list, which is updated with two binary
+        searches when a value changes, and their sum is kept incrementally.
+    """
+    def __init__(self, sample_count):
+        """
+            sample_count: number of samples; every value starts at 0.0
+        """
+        self.sorted_values = [0.0] * sample_count
+        self.total = 0.0
+        # Number of nonzero values; total is reset when it drops to 0
+        self.nonzero_count = 0
+
+    def update(self, old_value, new_value):
+        """ Replaces one occurrence of a value with another.
+
+            old_value: value to replace; must be present
+            new_value: replacement value
+
+            No return value.
+        """
+        sorted_values = self.sorted_values
+        del sorted_values[bisect_left(sorted_values, old_value)]
+        insort(sorted_values, new_value)
+        if not old_value:
+            self.nonzero_count += 1
+        if not new_value:
+            self.nonzero_count -= 1
+        if self.nonzero_count:
+            self.total += new_value - old_value
+        else:
+            # Clear rounding error
+            self.total = 0.0
+
+    def mean(self, weight):
+        """ Gets weighted sum of values.
+
+            weight: weight of each value; 1 / number of samples gives the
+                mean
+
+            Return value: weighted sum
+        """
+        return self.total * weight
+
+    def median(self):
+        """ Finds canonically defined median of values.
+
+            Return value: median; 0 if there are no samples
+        """
+        sorted_values = self.sorted_values
+        list_size = len(sorted_values)
+        if not list_size:
+            return 0
+        index = (list_size - 1) // 2
+        if (list_size % 2):
+            return sorted_values[index]
+        return (sorted_values[index] + sorted_values[index + 1]) / 2.0
+
+class SampleCoverageAccumulator(object):
+    """ Accumulates coverages by sample index across one genome partition.
+
+        A sample index is either the index of a sample from the manifest or
+        the index followed by '.' and a read base, which tracks coverage by
+        mismatched bases. Each distinct sample index string is parsed once
+        and assigned a slot in arrays of coverages. Normalized coverages of
+        samples, both counting all primary alignments and counting only
+        unique alignments and both for all bases and for nonreference bases,
+        are tracked by CenterTrackers.
+    """
+    def __init__(self, sample_count, mapped_read_counts,
+                    unique_mapped_read_counts, library_size):
+        """
+            sample_count: number of samples in manifest
+            mapped_read_counts: list of numbers of mapped reads by sample
+                index
+            unique_mapped_read_counts: list of numbers of uniquely mapped
+                reads by sample index
+            library_size: number of reads to which coverage is normalized
+        """
+        self.sample_count = sample_count
+        self.library_size = library_size
+        # Read counts that normalize coverage; None if sample has no reads
+        self.read_counts = [(count or None) for count in mapped_read_counts]
+        self.unique_read_counts = [(count or None)
+                                    for count in unique_mapped_read_counts]
+        self.mean_weight = self._weight(self.read_counts)
+        self.unique_mean_weight = self._weight(self.unique_read_counts)
+        # Sample index string -> (slot, sample index or None, nonreference?)
+        self.parsed_sample_indexes = {}
+        self.reset()
+
+    @staticmethod
+    def _weight(read_counts):
+        """ Gets 1 / number of samples with reads, or 0.0 if there are none
+        """
+        try:
+            return 1. / len([_ for _ in read_counts if _ is not None])
+        except ZeroDivisionError:
+            return 0.0
+
+    def reset(self):
+        """ Zeroes coverages at start of genome partition.
+
+            No return value.
+        """
+        slot_count = self.sample_count + len(self.parsed_sample_indexes)
+        self.coverages = array('l', [0]) * slot_count
+        self.unique_coverages = array('l', [0]) * slot_count
+        self.nonref_coverages = array('l', [0]) * self.sample_count
+        self.unique_nonref_coverages = array('l', [0]) * self.sample_count
+        self.trackers = [
+                CenterTracker(len([_ for _ in read_counts if _ is not None]))
+                for read_counts in (self.read_counts, self.unique_read_counts,
+                                    self.read_counts, self.unique_read_counts)
+            ]
+
+    def parsed(self, sample_index):
+        """ Parses sample index string, assigning it a slot if it's new.
+
+            sample_index: sample index string like '5' or '5.A'
+
+            Return value: tuple (slot, index of sample from manifest or None
+                if there is none, True iff sample index records a
+                nonreference base A, C, G or T)
+        """
+        try:
+            return self.parsed_sample_indexes[sample_index]
+        except KeyError:
+            pass
+        prefix, dot, base = sample_index.partition('.')
+        try:
+            index = int(prefix)
+        except ValueError:
+            index = None
+        else:
+            if not 0 <= index < self.sample_count:
+                index = None
+        if not dot and index is not None:
+            slot = index
+        else:
+            slot = len(self.coverages)
+            self.coverages.append(0)
+            self.unique_coverages.append(0)
+        parsed = self.parsed_sample_indexes[sample_index] = (
+                slot, index, bool(dot) and base[:1] in 'ATCG' and base != ''
+            )
+        return parsed
+
+    def _update(self, tracker_index, read_counts, coverages, index, diff):
+        """ Adds to coverage of sample, updating its CenterTracker.
+
+            Normalized coverage is computed exactly as coverage_pre always
+            has, so medians don't change.
+
+            No return value.
+        """
+        old_coverage = coverages[index]
+        coverages[index] = old_coverage + diff
+        read_count = read_counts[index]
+        if read_count is not None:
+            self.trackers[tracker_index].update(
+                    float(old_coverage) / read_count * self.library_size,
+                    float(old_coverage + diff) / read_count
+                    * self.library_size
+                )
+
+    def add(self, sample_index, diffs):
+        """ Adds diffs for one sample index at one position.
+
+            sample_index: sample index string
+            diffs: iterable of tuples whose last two items are '1' if
+                alignment is unique else '0' and a diff string, e.g., '+2' or
+                '-1'
+
+            Return value: tuple (coverage, unique coverage) of sample index
+                after diffs are added
+        """
+        slot, index, nonref = self.parsed(sample_index)
+        diff_sum, unique_diff_sum = 0, 0
+        for row in diffs:
+            diff = int(row[-1])
+            diff_sum += diff
+            if row[-2] == '1':
+                unique_diff_sum += diff
+        if index is None:
+            self.coverages[slot] += diff_sum
+            self.unique_coverages[slot] += unique_diff_sum
+        else:
+            if slot == index:
+                if diff_sum:
+                    self._update(0, self.read_counts, self.coverages, index,
+                                    diff_sum)
+                if unique_diff_sum:
+                    self._update(1, self.unique_read_counts,
+                                    self.unique_coverages, index,
+                                    unique_diff_sum)
+            else:
+                self.coverages[slot] += diff_sum
+                self.unique_coverages[slot] += unique_diff_sum
+            if nonref:
+                if diff_sum:
+                    self._update(2, self.read_counts, self.nonref_coverages,
+                                    index, diff_sum)
+                if unique_diff_sum:
+                    self._update(3, self.unique_read_counts,
+                                    self.unique_nonref_coverages, index,
+                                    unique_diff_sum)
+        return self.coverages[slot], self.unique_coverages[slot]
+
+    def coverage(self, sample_index):
+        """ Gets coverage of sample index.
+
+            sample_index: sample index string
+
+            Return value: coverage counting all primary alignments
+        """
+        return self.coverages[self.parsed(sample_index)[0]]
+
+    def centers(self):
+        """ Gets means and medians of normalized coverages across samples.
+
+            Return value: tuple (mean, unique mean, median, unique median,
+                nonreference mean, unique nonreference mean, nonreference
+                median, unique nonreference median)
+        """
+        (tracker, unique_tracker,
+            nonref_tracker, unique_nonref_tracker) = self.trackers
+        return (tracker.mean(self.mean_weight),
+                unique_tracker.mean(self.unique_mean_weight),
+                tracker.median(), unique_tracker.median(),
+                nonref_tracker.mean(self.mean_weight),
+                unique_nonref_tracker.mean(self.unique_mean_weight),
+                nonref_tracker.median(), unique_nonref_tracker.median())
+
+if __name__ == '__main__':
+    import unittest
+
+    def median(a_list):
+        """ Original median() from Rail-RNA-coverage_pre. """
+        if not a_list:
+            return 0
+        sorted_list = sorted(a_list)
+        list_size = len(a_list)
+        index = (list_size - 1) // 2
+        if (list_size % 2):
+            return sorted_list[index]
+        return (sorted_list[index] + sorted_list[index + 1]) / 2.0
+
+    class TestSampleCoverageAccumulator(unittest.TestCase):
+        """ Tests SampleCoverageAccumulator against recomputing centers. """
+        def test_centers(self):
+            """ Fails if centers differ from those computed from scratch. """
+            import random
+            random.seed(0)
+            sample_count = 7
+            mapped = [random.choice([0, 1000, 2500, 40000])
+                        for _ in xrange(sample_count)]
+            unique_mapped = [count // 2 for count in mapped]
+            accumulator = SampleCoverageAccumulator(
+                    sample_count, mapped, unique_mapped, 1000000
+                )
+            coverages, unique_coverages = [0] * sample_count, \
+                [0] * sample_count
+            nonref = [0] * sample_count
+            for _ in xrange(500):
+                index = random.randrange(sample_count)
+                base = random.choice(['', '', '.A', '.N'])
+                diff = random.choice([1, 2, -1])
+                if (coverages if not base else nonref)[index] + diff < 0:
+                    diff = -diff
+                uniqueness = random.choice('01')
+                accumulator.add(str(index) + base,
+                                [(uniqueness, '%+d' % diff)])
+                if not base:
+                    coverages[index] += diff
+                    if uniqueness == '1':
+                        unique_coverages[index] += diff
+                elif base == '.A':
+                    nonref[index] += diff
+                row = [float(coverages[i]) / mapped[i] * 1000000
+                        for i in xrange(sample_count) if mapped[i]]
+                unique_row = [float(unique_coverages[i]) / unique_mapped[i]
+                                * 1000000
+                                for i in xrange(sample_count)
+                                if unique_mapped[i]]
+                centers = accumulator.centers()
+                self.assertAlmostEqual(
+                        sum(row) / len(row), centers[0], places=6
+                    )
+                self.assertAlmostEqual(
+                        sum(unique_row) / len(unique_row), centers[1],
+                        places=6
+                    )
+                self.assertEqual(median(row), centers[2])
+                self.assertEqual(median(unique_row), centers[3])
+                self.assertEqual(
+                        median([float(nonref[i]) / mapped[i] * 1000000
+                                for i in xrange(sample_count)
+                                if mapped[i]]),
+                        centers[6]
+                    )
+            self.assertEqual(accumulator.coverage('3'), coverages[3])
+
+        def test_reset(self):
+            """ Fails if reset doesn't zero coverages and centers. """
+            accumulator = SampleCoverageAccumulator(2, [10, 10], [10, 0], 10)
+            self.assertEqual((3, 3), accumulator.add('0', [('1', '+3')]))
+            self.assertEqual((2, 0), accumulator.add('1.C',
+                                                      [('0', '+2')]))
+            self.assertEqual((1.5, 3.0, 1.5, 3.0, 1.0, 0.0, 1.0, 0.0),
+                             accumulator.centers())
+            accumulator.reset()
+            self.assertEqual((0, 0), accumulator.add('1.C', [('0', '+0')]))
+            self.assertEqual((0.0,) * 8, accumulator.centers())
+
+    unittest.main()
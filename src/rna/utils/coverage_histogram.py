@@ -0,0 +1,238 @@
+"""
+coverage_histogram.py
+Part of Rail-RNA
+
+Contains a class that accumulates the histogram of base coverage of a sample
+for Rail-RNA-coverage as runs of constant coverage arrive, so a percentile of
+coverage (the sample's normalization factor) and area under the coverage
+curve (AUC) can be found without keeping or sorting every distinct coverage
+value.
+
+Error bounds: the AUC is exact when every coverage value is an integer and is
+otherwise subject only to floating-point rounding. A percentile is exact when every
+coverage value is an integer smaller than max_exact. Otherwise, the
+percentile returned is either a coverage value that is in the same unit
+interval [n, n + 1) as the exact percentile, when that's below max_exact, or
+else a coverage value observed within a factor of 1 + relative_error of the
+exact percentile.
+"""
+from array import array
+from math import floor, log
+
+class CoverageHistogram(object):
+    """ Histogram of numbers of bases by coverage with bounded memory.
+
+        Coverages below max_exact fall into bins [n, n + 1), one for each
+        integer n, that count bases. Larger coverages fall into log-spaced
+        bins [(1 + relative_error)^k, (1 + relative_error)^(k + 1)) that
+        count bases and remember the smallest coverage they've seen, so the
+        number of bins stays small however deep the sample is. Since bins
+        are ordered by coverage, the bin containing any percentile is found
+        exactly; only which value within the bin is returned is approximate.
+    """
+    def __init__(self, max_exact=65536, relative_error=0.001):
+        """
+            max_exact: coverages below this value are binned by integer
+            relative_error: ratio of bounds of larger coverages' bins minus 1
+        """
+        self.max_exact = max_exact
+        self.log_base = log(1.0 + relative_error)
+        self.reset()
+
+    def reset(self):
+        """ Empties histogram.
+
+            No return value.
+        """
+        # Numbers of bases by integral coverage below max_exact
+        self.exact_bins = array('l', [0]) * self.max_exact
+        # Integer bin index -> [number of bases, smallest coverage] for
+        # nonintegral coverages below max_exact; rarely used
+        self.fractional_bins = {}
+        # Log bin index -> [number of bases, smallest coverage]
+        self.log_bins = {}
+        # AUC of coverages outside exact_bins
+        self.exact_auc = 0
+        self.inexact_auc = 0.0
+
+    def add(self, coverage, bases):
+        """ Adds bases with the given coverage.
+
+            coverage: coverage value; nonnegative
+            bases: number of bases with that coverage
+
+            No return value.
+        """
+        index = int(coverage)
+        if index == coverage and index < self.max_exact:
+            # Common case; AUC is computed from bins later
+            self.exact_bins[index] += bases
+            return
+        if coverage < self.max_exact:
+            bins = self.fractional_bins
+        else:
+            bins = self.log_bins
+            index = int(floor(log(coverage) / self.log_base))
+        try:
+            bin = bins[index]
+        except KeyError:
+            bins[index] = [bases, coverage]
+        else:
+            bin[0] += bases
+            if coverage < bin[1]:
+                bin[1] = coverage
+        if coverage == int(coverage):
+            self.exact_auc += int(coverage) * bases
+        else:
+            self.inexact_auc += coverage * bases
+
+    def _descending_bins(self):
+        """ Iterates through nonempty bins from highest coverage to lowest.
+
+            Return value: generator of tuples (number of bases, smallest
+                coverage value in bin)
+        """
+        log_bins = self.log_bins
+        for index in sorted(log_bins, reverse=True):
+            yield log_bins[index]
+        exact_bins = self.exact_bins
+        fractional_bins = self.fractional_bins
+        for index in xrange(self.max_exact - 1, -1, -1):
+            if index in fractional_bins:
+                bases, coverage = fractional_bins[index]
+                if exact_bins[index]:
+                    yield bases + exact_bins[index], index
+                else:
+                    yield bases, coverage
+            elif exact_bins[index]:
+                yield exact_bins[index], index
+
+    def percentile(self, percentile=0.75):
+        """ Finds coverage at desired percentile of bases.
+
+            Gives the same result as Rail-RNA-coverage's original
+            percentile() within the bounds described in this module's
+            docstring.
+
+            percentile: a value k on [0, 1] specifying that the (k*100)-th
+                percentile should be returned
+
+            Return value: coverage at percentile
+        """
+        normalization = sum(self.exact_bins) + sum(
+                [bin[0] for bin in self.fractional_bins.itervalues()]
+            ) + sum([bin[0] for bin in self.log_bins.itervalues()])
+        threshold = (1.0 - percentile) * normalization
+        covered = 0
+        for bases, coverage in self._descending_bins():
+            covered += bases
+            if covered > threshold:
+                return coverage
+        raise RuntimeError('Percentile computation should have terminated '
+                           'mid-loop.')
+
+    def auc(self):
+        """ Computes area under coverage curve.
+
+            Return value: sum of coverage over bases; an int if every
+                coverage is integral
+        """
+        auc = self.exact_auc + sum([index * bases for index, bases
+                                    in enumerate(self.exact_bins) if bases])
+        if self.inexact_auc:
+            return auc + self.inexact_auc
+        return auc
+
+if __name__ == '__main__':
+    import unittest
+    import random
+
+    def percentile(histogram, percentile=0.75):
+        """ Original percentile() from Rail-RNA-coverage. """
+        covered = 0
+        normalization = sum(histogram.values())
+        for key, frequency in sorted(histogram.items(), reverse=True):
+            covered += frequency
+            assert covered <= normalization
+            if covered > ((1.0 - percentile) * normalization):
+                return key
+        raise RuntimeError('Percentile computation should have terminated '
+                           'mid-loop.')
+
+    class TestCoverageHistogram(unittest.TestCase):
+        """ Tests CoverageHistogram against original percentile(). """
+        def histograms(self, values, max_exact=65536, relative_error=0.001):
+            """ Fills both kinds of histograms with random runs. """
+            random.seed(values[0])
+            histogram = {}
+            coverage_histogram = CoverageHistogram(
+                    max_exact=max_exact, relative_error=relative_error
+                )
+            for _ in xrange(5000):
+                coverage, bases = random.choice(values), random.randint(1, 300)
+                histogram[coverage] = histogram.get(coverage, 0) + bases
+                coverage_histogram.add(coverage, bases)
+            return histogram, coverage_histogram
+
+        def test_integral_coverage(self):
+            """ Fails if percentiles or AUC of integer coverages differ. """
+            histogram, coverage_histogram = self.histograms(
+                    [float(value) for value in range(1, 400)
+                        + [1000, 5000, 65535]]
+                )
+            for fraction in [0.1, 0.5, 0.75, 0.9, 0.999, 1]:
+                self.assertEqual(percentile(histogram, fraction),
+                                 coverage_histogram.percentile(fraction))
+            self.assertEqual(
+                    sum([key * value for key, value in histogram.items()]),
+                    coverage_histogram.auc()
+                )
+            self.assertTrue(isinstance(coverage_histogram.auc(), int))
+
+        def test_overflow(self):
+            """ Fails if deep coverages exceed error bound. """
+            histogram, coverage_histogram = self.histograms(
+                    [random.randint(1, 10 ** 7) for _ in xrange(2000)],
+                    max_exact=1000, relative_error=0.01
+                )
+            self.assertTrue(len(coverage_histogram.log_bins) < 1000)
+            for fraction in [0.1, 0.5, 0.75, 0.9]:
+                expected = percentile(histogram, fraction)
+                returned = coverage_histogram.percentile(fraction)
+                self.assertTrue(returned in histogram)
+                if expected < 1000:
+                    self.assertEqual(expected, returned)
+                else:
+                    self.assertTrue(abs(returned - expected)
+                                        <= 0.01 * expected)
+            self.assertEqual(
+                    sum([key * value for key, value in histogram.items()]),
+                    coverage_histogram.auc()
+                )
+
+        def test_fractional_coverage(self):
+            """ Fails if nonintegral coverages exceed error bound. """
+            histogram, coverage_histogram = self.histograms(
+                    [random.random() * 50 for _ in xrange(100)]
+                )
+            for fraction in [0.1, 0.5, 0.75, 0.9]:
+                expected = percentile(histogram, fraction)
+                returned = coverage_histogram.percentile(fraction)
+                self.assertEqual(int(expected), int(returned))
+            auc = sum([key * value for key, value in histogram.items()])
+            self.assertAlmostEqual(auc, coverage_histogram.auc(),
+                                    delta=auc * 1e-12)
+
+        def test_reset(self):
+            """ Fails if reset doesn't empty histogram. """
+            coverage_histogram = CoverageHistogram(max_exact=10)
+            coverage_histogram.add(3, 5)
+            coverage_histogram.add(30, 5)
+            self.assertEqual(165, coverage_histogram.auc())
+            coverage_histogram.reset()
+            self.assertRaises(RuntimeError, coverage_histogram.percentile)
+            coverage_histogram.add(2, 1)
+            self.assertEqual(2, coverage_histogram.percentile())
+            self.assertEqual(2, coverage_histogram.auc())
+
+    unittest.main()
@@ -0,0 +1,227 @@
+"""
+fasta_writer.py
+Part of Rail-RNA
+
+Contains classes that write the FASTAs Rail-RNA-realign_reads and
+Rail-RNA-junction_index index without shelling out or rereading files.
+UniqueRecords deduplicates and sorts records in memory with a set, spilling
+sorted runs to disk when a memory budget is exceeded and merging them when
+records are read back, so the result is the same as that of
+"LC_ALL=C sort | uniq" on tab-separated records. FastaWriter wraps sequences
+at a fixed width, writing each record at once.
+"""
+import os
+import heapq
+import tempfile
+
+# Estimated bytes of memory used per record apart from its strings
+_record_overhead = 200
+
+class UniqueRecords(object):
+    """ Sorted set of records with bounded memory.
+
+        Records are tuples of strings without characters below tab or
+        newlines, so they sort in the same order as their tab-joined lines,
+        which are what's stored. Lines are kept in a set until their
+        estimated size exceeds memory_bytes, when they are sorted and written
+        to a run file in temp_dir. Iterating merges the runs with the lines
+        still in memory.
+    """
+    def __init__(self, memory_bytes=268435456, temp_dir=None,
+                    counter=None):
+        """
+            memory_bytes: estimated memory records may use before a run is
+                spilled to disk
+            temp_dir: where to write run files; None means default temporary
+                directory
+            counter: dooplicity.counters.Counter to which spills and bytes
+                spilled are reported, or None
+        """
+        self.memory_bytes = memory_bytes
+        self.temp_dir = temp_dir
+        self.counter = counter
+        self.records = set()
+        self.record_bytes = 0
+        self.run_filenames = []
+
+    def add(self, record):
+        """ Adds record.
+
+            record: tuple of strings
+
+            No return value.
+        """
+        line = '\t'.join(record)
+        if line in self.records:
+            return
+        self.records.add(line)
+        self.record_bytes += _record_overhead + len(line)
+        if self.record_bytes > self.memory_bytes:
+            self._spill()
+
+    def _spill(self):
+        """ Writes records in memory to a sorted run file.
+
+            No return value.
+        """
+        run_fd, run_filename = tempfile.mkstemp(dir=self.temp_dir,
+                                                suffix='.run')
+        with os.fdopen(run_fd, 'w', 1048576) as run_stream:
+            run_stream.write('\n'.join(sorted(self.records)))
+            run_stream.write('\n')
+            run_bytes = run_stream.tell()
+        self.run_filenames.append(run_filename)
+        if self.counter is not None:
+            self.counter.add('fasta_spills')
+            self.counter.add('fasta_spill_bytes', run_bytes)
+        self.records = set()
+        self.record_bytes = 0
+
+    def _run(self, run_filename):
+        """ Reads lines from run file.
+
+            run_filename: path to run file
+
+            Return value: generator of lines without newlines
+        """
+        with open(run_filename, 'r', 1048576) as run_stream:
+            for line in run_stream:
+                yield line[:-1]
+
+    def __iter__(self):
+        """ Yields unique records in sorted order, then empties the set.
+
+            Return value: generator of records
+        """
+        try:
+            if not self.run_filenames:
+                for line in sorted(self.records):
+                    yield tuple(line.split('\t'))
+                return
+            last_line = None
+            for line in heapq.merge(
+                    sorted(self.records),
+                    *[self._run(run_filename)
+                        for run_filename in self.run_filenames]
+                ):
+                if line != last_line:
+                    yield tuple(line.split('\t'))
+                    last_line = line
+        finally:
+            self.clear()
+
+    def clear(self):
+        """ Removes all records and run files.
+
+            No return value.
+        """
+        for run_filename in self.run_filenames:
+            try:
+                os.remove(run_filename)
+            except OSError:
+                pass
+        self.run_filenames = []
+        self.records = set()
+        self.record_bytes = 0
+
+class FastaWriter(object):
+    """ Writes FASTA records with sequences wrapped at a fixed width.
+
+        Each record is written with one call to the output stream's write(),
+        which should be buffered; a sequence that fits on one line, as most
+        transcript fragments do, is written without being split.
+    """
+    def __init__(self, output_stream, line_width=80):
+        """
+            output_stream: where to write FASTA
+            line_width: maximum number of bases per line
+        """
+        self.output_stream = output_stream
+        self._write = output_stream.write
+        self.line_width = line_width
+        self.record_count = 0
+
+    def write(self, name, seq):
+        """ Writes FASTA record.
+
+            name: reference name, including '>'
+            seq: sequence
+
+            No return value.
+        """
+        line_width = self.line_width
+        if len(seq) <= line_width:
+            self._write(name + '\n' + seq + '\n')
+        else:
+            self._write(name + '\n' + '\n'.join(
+                    [seq[i:i+line_width]
+                        for i in xrange(0, len(seq), line_width)]
+                ) + '\n')
+        self.record_count += 1
+
+    def close(self):
+        """ Flushes output stream, which is left open.
+
+            No return value.
+        """
+        self.output_stream.flush()
+
+if __name__ == '__main__':
+    import unittest
+    import shutil
+    import random
+    from cStringIO import StringIO
+
+    class TestUniqueRecords(unittest.TestCase):
+        """ Tests UniqueRecords against sorting and deduplicating a list. """
+        def setUp(self):
+            self.temp_dir_path = tempfile.mkdtemp()
+
+        def test_in_memory(self):
+            """ Fails if records aren't unique and sorted. """
+            unique_records = UniqueRecords(temp_dir=self.temp_dir_path)
+            for record in [('b', 'C'), ('a', 'G'), ('b', 'C'), ('a', 'A')]:
+                unique_records.add(record)
+            self.assertEqual([('a', 'A'), ('a', 'G'), ('b', 'C')],
+                             list(unique_records))
+            self.assertEqual([], list(unique_records))
+
+        def test_spill(self):
+            """ Fails if spilled records aren't merged correctly. """
+            random.seed(5)
+            records = [('>' + str(random.randint(0, 500)),
+                        ''.join([random.choice('ACGT') for _ in xrange(5)]),
+                        str(random.randint(0, 2)))
+                       for _ in xrange(2000)]
+            unique_records = UniqueRecords(memory_bytes=5000,
+                                            temp_dir=self.temp_dir_path)
+            for record in records:
+                unique_records.add(record)
+            self.assertTrue(len(unique_records.run_filenames) > 2)
+            self.assertEqual(sorted(set(records)), list(unique_records))
+            self.assertEqual([], os.listdir(self.temp_dir_path))
+
+        def tearDown(self):
+            shutil.rmtree(self.temp_dir_path)
+
+    class TestFastaWriter(unittest.TestCase):
+        """ Tests FastaWriter against wrapping with a list of slices. """
+        def test_wrapping(self):
+            """ Fails if output differs from slicing into lines. """
+            random.seed(7)
+            records = [('>r%d' % i, 'A' * random.choice([0, 1, 79, 80, 81,
+                                                           160, 161, 1000]))
+                       for i in xrange(200)]
+            output_stream = StringIO()
+            fasta_writer = FastaWriter(output_stream)
+            expected = []
+            for name, seq in records:
+                fasta_writer.write(name, seq)
+                expected.append(name + '\n' + '\n'.join(
+                        [seq[i:i+80] for i in xrange(0, len(seq), 80)]
+                    ) + '\n')
+            fasta_writer.close()
+            self.assertEqual(''.join(expected), output_stream.getvalue())
+            self.assertEqual(200, fasta_writer.record_count)
+
+    unittest.main()
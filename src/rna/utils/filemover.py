@@ -13,6 +13,7 @@ import time
 import threading
 import pipes
 import re
+import tempfile
 
 def add_args(parser):
     """ Sets up arguments related to moving files around. """
@@ -57,6 +58,135 @@ class CommandThread(threading.Thread):
                 print >>sys.stderr, line,
         self.process_return = self.process.wait()
 
+class UploadStream(object):
+    """ File-like object whose contents are uploaded to a URL as written.
+
+        Local and NFS destinations are written directly, to a temporary file
+        in the destination directory that's renamed when the stream is
+        closed; HDFS destinations are streamed to hdfs dfs -put's stdin.
+        Other destinations can't be streamed to, so contents are spooled to
+        a temporary file that's uploaded with FileMover.put() on close.
+        Aborting, or leaving a with block on an exception, discards the
+        contents.
+    """
+    def __init__(self, file_mover, url, temp_dir=None):
+        """
+            file_mover: FileMover that uploads spooled files
+            url: Url of file to write
+            temp_dir: where to spool contents that can't be streamed; None
+                means the default temporary directory
+        """
+        self.file_mover = file_mover
+        self.url = url
+        self.process = None
+        self.filename = None
+        if url.is_curlable:
+            raise RuntimeError('Can\'t upload to http/ftp URLs.')
+        elif url.is_local or url.is_nfs:
+            try:
+                os.makedirs(os.path.dirname(url.to_url()))
+            except OSError:
+                # Directory exists
+                pass
+            self.output_stream = tempfile.NamedTemporaryFile(
+                    dir=os.path.dirname(url.to_url()),
+                    prefix=os.path.basename(url.to_url()) + '.', delete=False
+                )
+            self.filename = self.output_stream.name
+        elif url.is_hdfs:
+            mkdir_command = ' '.join(['/opt/hadoop/bin/hdfs', 'dfs', '-mkdir',
+                                        '-p', os.path.dirname(url.to_url())])
+            print >>sys.stderr, (
+                    'Creating directory with command "{}".'
+                ).format(mkdir_command)
+            subprocess.Popen(mkdir_command,
+                stdout=sys.stderr, shell=True,
+                executable='/bin/bash').wait()
+            self.command = ' '.join(['/opt/hadoop/bin/hdfs', 'dfs', '-put',
+                                        '-', url.to_url()])
+            print >>sys.stderr, 'Streaming upload with command "{}"....'.format(
+                    self.command
+                )
+            self.process = subprocess.Popen(
+                    self.command, stdin=subprocess.PIPE, stdout=sys.stderr,
+                    shell=True, executable='/bin/bash', bufsize=-1
+                )
+            self.output_stream = self.process.stdin
+        else:
+            self.output_stream = tempfile.NamedTemporaryFile(
+                    dir=temp_dir, delete=False
+                )
+            self.filename = self.output_stream.name
+        self.bytes_written = 0
+
+    def write(self, data):
+        """ Writes data to be uploaded.
+
+            data: string to write
+
+            No return value.
+        """
+        self.output_stream.write(data)
+        self.bytes_written += len(data)
+
+    def flush(self):
+        self.output_stream.flush()
+
+    def close(self):
+        """ Finishes upload.
+
+            No return value.
+        """
+        self.output_stream.close()
+        if self.process is not None:
+            exit_level = self.process.wait()
+            if exit_level > 0:
+                raise RuntimeError(
+                        'Non-zero exitlevel %d from push command "%s".'
+                        % (exit_level, self.command)
+                    )
+        elif self.url.is_local or self.url.is_nfs:
+            # Temporary files are private; give the permissions cp would
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(self.filename, 0666 & ~umask)
+            os.rename(self.filename, self.url.to_url())
+        else:
+            try:
+                self.file_mover.put(self.filename, self.url)
+            finally:
+                os.remove(self.filename)
+
+    def abort(self):
+        """ Discards contents.
+
+            No return value.
+        """
+        try:
+            self.output_stream.close()
+        except IOError:
+            pass
+        if self.process is not None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+            self.process.wait()
+        else:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
 class FileMover(object):
     """ Responsible for details on how to move files to and from URLs. """
     
@@ -129,6 +259,17 @@ class FileMover(object):
             raise RuntimeError('Non-zero exitlevel %d from push command "%s".'
                                % (exit_level, command))
 
+    def put_stream(self, url, temp_dir=None):
+        """ Opens a stream whose contents are uploaded to a URL.
+
+            url: URL of file to write; unlike with put(), not a directory
+            temp_dir: where to spool contents for destinations that can't
+                be streamed to; None means the default temporary directory
+
+            Return value: UploadStream
+        """
+        return UploadStream(self, url, temp_dir=temp_dir)
+
     def exists(self, url):
         if url.is_local:
             return os.path.exists(url.to_url())
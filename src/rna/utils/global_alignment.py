@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""
+global_alignment.py
+Part of Rail-RNA
+
+Computes score matrices for global alignment of a read segment to the
+reference with an intron removed; junction_search uses the bottom-right
+entry of a score matrix to choose among candidate junctions.
+
+Two backends are available and chosen at runtime. With NumPy, each row of a
+score matrix is filled with vector operations: diagonal and vertical moves
+depend only on the previous row, and the chain of horizontal moves along a
+row is a running maximum. Many score matrices can be filled at once by
+stacking their rows. Without NumPy (e.g., under PyPy), a pure-Python
+dynamic program fills the matrix cell by cell.
+"""
+
+import string
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+'''Maps characters to rows/columns of a substitution matrix: ACGT to 0-3, '-'
+to 5 and anything else, including N, to 4. Lowercase bases are uppercased.'''
+_code_table = string.maketrans(
+        'ACGTacgt-' + ''.join([chr(i) for i in xrange(256)
+                                if chr(i) not in 'ACGTacgt-']),
+        '\x00\x01\x02\x03\x00\x01\x02\x03\x05' + '\x04' * 247
+    )
+
+_default_substitution_matrix = [[ 0,-1,-1,-1,-1,-1],
+                                [-1, 0,-1,-1,-1,-1],
+                                [-1,-1, 0,-1,-1,-1],
+                                [-1,-1,-1, 0,-1,-1],
+                                [-1,-1,-1,-1,-1,-1],
+                                [-1,-1,-1,-1,-1,-1]]
+
+def available_backends():
+    """ Lists backends that can be used on this installation.
+
+        Return value: list of backend names, fastest first
+    """
+    return (['numpy'] if numpy is not None else []) + ['python']
+
+class GlobalAlignment(object):
+    """ Obtains alignment score matrices with the fastest available backend.
+    """
+
+    def __init__(self, substitution_matrix=_default_substitution_matrix,
+                    backend=None):
+        """ Constructor for GlobalAlignment.
+
+            substitution_matrix: 6 x 6 substitution matrix (list of
+                lists); rows and columns correspond to ACGTN-, where N is
+                aNy and - is a gap. Default: 0 for match, -1 for everything
+                else.
+            backend: 'numpy', 'python' or None to use the first of
+                available_backends()
+        """
+        if backend is None:
+            backend = available_backends()[0]
+        elif backend not in available_backends():
+            raise RuntimeError(
+                    'Global alignment backend "%s" is unavailable; choose '
+                    'from %s.' % (backend, ', '.join(available_backends()))
+                )
+        self.backend = backend
+        self.substitution_matrix = substitution_matrix
+        if backend == 'numpy':
+            self.substitution_array = numpy.array(substitution_matrix,
+                                                    dtype=numpy.int32)
+
+    def score_matrix(self, first_seq, second_seq):
+        """ Computes score matrix for global alignment of two sequences.
+
+            The substitution matrix is specified when the GlobalAlignment
+            class is instantiated.
+
+            first_seq: first sequence (string).
+            second_seq: second sequence (string).
+
+            Return value: score_matrix, a numpy array (list of lists with
+                the python backend) whose dimensions are
+                (len(first_seq) + 1) x (len(second_seq) + 1). It can be
+                used to trace back the best global alignment.
+        """
+        if self.backend == 'numpy':
+            return self._numpy_score_matrix(first_seq, second_seq)
+        return self._python_score_matrix(first_seq, second_seq)
+
+    def scores(self, seq_pairs):
+        """ Computes global alignment scores of many pairs of sequences.
+
+            With the numpy backend, the score matrices of all pairs are
+            filled together, one row at a time, and only the last row of
+            each is kept.
+
+            seq_pairs: list of tuples (first_seq, second_seq)
+
+            Return value: list of bottom-right entries of score matrices of
+                seq_pairs
+        """
+        if not seq_pairs:
+            return []
+        if self.backend == 'numpy':
+            return self._numpy_scores(seq_pairs)
+        return [self._python_score_matrix(first_seq, second_seq)[-1][-1]
+                    for first_seq, second_seq in seq_pairs]
+
+    def _python_score_matrix(self, first_seq, second_seq):
+        """ Fills score matrix cell by cell; see score_matrix(). """
+        first_seq = [ord(char) for char in first_seq.translate(_code_table)]
+        second_seq = [ord(char) for char in second_seq.translate(_code_table)]
+        row_count = len(first_seq) + 1
+        column_count = len(second_seq) + 1
+        score_matrix = [[0 for i in xrange(column_count)]
+                            for j in xrange(row_count)]
+        for j in xrange(1, column_count):
+            score_matrix[0][j] = j \
+                * self.substitution_matrix[5][second_seq[j-1]]
+        for i in xrange(1, row_count):
+            score_matrix[i][0] = i \
+                * self.substitution_matrix[first_seq[i-1]][5]
+        for i in xrange(1, row_count):
+            for j in xrange(1, column_count):
+                score_matrix[i][j] = max(score_matrix[i-1][j-1]
+                                            + self.substitution_matrix[
+                                                    first_seq[i-1]]
+                                                    [second_seq[j-1]
+                                                ], # diagonal
+                                         score_matrix[i-1][j]
+                                            + self.substitution_matrix[
+                                                    first_seq[i-1]][5
+                                                ], # vertical
+                                         score_matrix[i][j-1]
+                                            + self.substitution_matrix[
+                                                    5][second_seq[j-1]
+                                                ] # horizontal
+                                        )
+        return score_matrix
+
+    def _numpy_rows(self, first_codes, second_codes):
+        """ Generates rows of score matrices of stacked sequence pairs.
+
+            Sequences shorter than others in the stack are padded at the
+            end; since entries of a score matrix depend only on entries
+            above and to the left, padding doesn't change the entries of
+            any pair's score matrix.
+
+            first_codes: P x R array of substitution matrix indexes of
+                (padded) first sequences of P pairs
+            second_codes: P x C array of substitution matrix indexes of
+                (padded) second sequences of P pairs
+
+            Yield value: P x (C + 1) array, row i of the P score matrices,
+                for i from 0 to R
+        """
+        substitution = self.substitution_array
+        # Costs of horizontal and vertical moves
+        horizontal = substitution[5][second_codes]
+        vertical = substitution[first_codes, 5]
+        pair_count, column_count = second_codes.shape
+        row = numpy.zeros((pair_count, column_count + 1), dtype=numpy.int32)
+        row[:, 1:] = (numpy.arange(1, column_count + 1, dtype=numpy.int32)
+                        * horizontal)
+        yield row
+        '''A run of horizontal moves from column k to column j of a row costs
+        cumulative[j] - cumulative[k], so the best entry of the row at j is
+        the running maximum of (best without a final horizontal move at k)
+        - cumulative[k], plus cumulative[j].'''
+        cumulative = numpy.zeros((pair_count, column_count + 1),
+                                    dtype=numpy.int32)
+        numpy.cumsum(horizontal, axis=1, out=cumulative[:, 1:])
+        for i in xrange(first_codes.shape[1]):
+            next_row = numpy.empty_like(row)
+            next_row[:, 0] = (i + 1) * vertical[:, i]
+            numpy.maximum(
+                    row[:, :-1]
+                    + substitution[first_codes[:, i, None], second_codes],
+                    row[:, 1:] + vertical[:, i, None],
+                    out=next_row[:, 1:]
+                )
+            next_row -= cumulative
+            numpy.maximum.accumulate(next_row, axis=1, out=next_row)
+            next_row += cumulative
+            row = next_row
+            yield row
+
+    @staticmethod
+    def _codes(seqs):
+        """ Converts sequences to a padded array of substitution indexes.
+
+            seqs: list of sequences (strings)
+
+            Return value: len(seqs) x max(len(seq)) array
+        """
+        width = max([len(seq) for seq in seqs])
+        if not width:
+            return numpy.zeros((len(seqs), 0), dtype=numpy.intp)
+        return numpy.frombuffer(
+                ''.join([seq.ljust(width, 'N') for seq in seqs]
+                    ).translate(_code_table), dtype=numpy.uint8
+            ).reshape(len(seqs), width).astype(numpy.intp)
+
+    def _numpy_score_matrix(self, first_seq, second_seq):
+        """ Fills score matrix row by row with NumPy; see score_matrix(). """
+        return numpy.vstack(list(self._numpy_rows(
+                        self._codes([first_seq]), self._codes([second_seq])
+                    )))
+
+    def _numpy_scores(self, seq_pairs):
+        """ Fills score matrices of many pairs at once; see scores(). """
+        first_sizes = [len(first_seq) for first_seq, _ in seq_pairs]
+        second_sizes = [len(second_seq) for _, second_seq in seq_pairs]
+        pairs_by_row_count = {}
+        for i, first_size in enumerate(first_sizes):
+            pairs_by_row_count.setdefault(first_size, []).append(i)
+        scores = [None] * len(seq_pairs)
+        for i, row in enumerate(self._numpy_rows(
+                    self._codes([first_seq for first_seq, _ in seq_pairs]),
+                    self._codes([second_seq for _, second_seq in seq_pairs])
+                )):
+            for pair in pairs_by_row_count.get(i, []):
+                scores[pair] = int(row[pair, second_sizes[pair]])
+        return scores
+
+if __name__ == '__main__':
+    import sys
+    import unittest
+    import random
+
+    class TestGlobalAlignment(unittest.TestCase):
+        """ Tests that backends agree and score alignments correctly. """
+        def setUp(self):
+            random.seed(5)
+            self.seq_pairs = [(''.join([random.choice('ACGTN')
+                                            for _ in xrange(
+                                                random.randint(0, 30))]),
+                               ''.join([random.choice('ACGTacgtN-')
+                                            for _ in xrange(
+                                                random.randint(0, 40))]))
+                                for _ in xrange(50)]
+            self.substitution_matrix = [[random.randint(-6, 2)
+                                            for _ in xrange(6)]
+                                            for _ in xrange(6)]
+
+        def test_known_scores(self):
+            """ Fails if simple alignments are scored incorrectly. """
+            for backend in available_backends():
+                global_alignment = GlobalAlignment(backend=backend)
+                self.assertEqual(
+                        global_alignment.score_matrix('ACGT', 'ACGT')[-1][-1],
+                        0
+                    )
+                self.assertEqual(
+                        global_alignment.score_matrix('ACGT', 'AGT')[-1][-1],
+                        -1
+                    )
+                self.assertEqual(
+                        global_alignment.score_matrix('ACGT', 'TTTT')[-1][-1],
+                        -3
+                    )
+
+        def test_backends_agree(self):
+            """ Fails if backends or batch and single scores differ. """
+            for substitution_matrix in [_default_substitution_matrix,
+                                        self.substitution_matrix]:
+                python_alignment = GlobalAlignment(substitution_matrix,
+                                                    backend='python')
+                expected = [python_alignment.score_matrix(*seq_pair)
+                                for seq_pair in self.seq_pairs]
+                for backend in available_backends():
+                    global_alignment = GlobalAlignment(substitution_matrix,
+                                                        backend=backend)
+                    for seq_pair, score_matrix in zip(self.seq_pairs,
+                                                        expected):
+                        self.assertEqual(
+                            [list(row) for row in
+                                global_alignment.score_matrix(*seq_pair)],
+                            score_matrix
+                        )
+                    self.assertEqual(
+                            global_alignment.scores(self.seq_pairs),
+                            [score_matrix[-1][-1]
+                                for score_matrix in expected]
+                        )
+
+    unittest.main()
@@ -0,0 +1,357 @@
+"""
+index_cache.py
+Part of Rail-RNA
+
+Contains a class that caches Bowtie 2 indexes by the content of the FASTA
+they were built from, so Rail-RNA-realign_reads builds an index of a given set
+of transcript fragments once rather than once per index group, task or rerun.
+The cache is a directory, on local scratch or shared across nodes, with one
+subdirectory per index named for the SHA-1 of the FASTA. Indexes are built in
+temporary subdirectories and renamed into place, so no task ever sees part of
+an index, and a task about to build an index first takes a lock on its name,
+so concurrent tasks wait for one build rather than racing. When the cache
+grows past its size limit, the indexes used least recently are evicted, each
+under the same lock, so an index is never evicted while a task is building
+it.
+"""
+import os
+import time
+import errno
+import shutil
+import hashlib
+import tempfile
+try:
+    import fcntl
+except ImportError:
+    # Concurrent tasks may build the same index, but only one publishes it
+    fcntl = None
+
+# Name of the index in each cache entry
+_index_basename = 'index'
+# Holds number of seconds the index took to build
+_build_seconds_filename = 'build_seconds'
+
+class IndexCache(object):
+    """ Content-addressed cache of Bowtie 2 indexes with LRU eviction.
+
+        Each entry is a directory whose modification time is updated when it
+        is used; eviction removes the entries modified least recently until
+        the total size of entries is at most max_bytes, except for entries
+        used within the last eviction_grace seconds, which a task may be
+        about to read.
+    """
+    def __init__(self, cache_dir, max_bytes, salt='', eviction_grace=600,
+                    counter=None):
+        """
+            cache_dir: directory holding cache; created if it doesn't exist
+            max_bytes: maximum total size of cached indexes in bytes
+            salt: string hashed along with FASTA, e.g., identifying the
+                build command, so indexes built differently don't collide
+            eviction_grace: entries used within this many seconds are never
+                evicted
+            counter: dooplicity.counters.Counter to which hits, misses and
+                build time saved are reported, or None
+        """
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.salt = salt
+        self.eviction_grace = eviction_grace
+        self.counter = counter
+
+    def _count(self, name, amount=1):
+        if self.counter is not None:
+            self.counter.add(name, amount)
+
+    def _lock(self, key):
+        """ Takes lock on key, waiting for any task holding it.
+
+            Since evict() removes the lock file of an entry it evicts, the
+            lock file locked is checked to still be the one at its path.
+
+            key: key from key()
+
+            Return value: file object whose closing releases lock
+        """
+        lock_path = os.path.join(self.cache_dir, key + '.lock')
+        while True:
+            lock_stream = open(lock_path, 'a')
+            if fcntl is None:
+                return lock_stream
+            fcntl.flock(lock_stream.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.path.samestat(os.fstat(lock_stream.fileno()),
+                                    os.stat(lock_path)):
+                    return lock_stream
+            except OSError:
+                # Lock file was removed by evict()
+                pass
+            lock_stream.close()
+
+    def key(self, fasta_file):
+        """ Computes key of index of FASTA.
+
+            fasta_file: path to FASTA
+
+            Return value: hex digest
+        """
+        digest = hashlib.sha1(self.salt + '\n')
+        with open(fasta_file, 'rb') as fasta_stream:
+            while True:
+                chunk = fasta_stream.read(1048576)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _hit(self, entry_dir):
+        """ Marks entry as used and reports hit.
+
+            entry_dir: path to entry
+
+            Return value: index basename, or None if entry was evicted
+        """
+        try:
+            os.utime(entry_dir, None)
+            with open(os.path.join(entry_dir, _build_seconds_filename)) \
+                    as build_seconds_stream:
+                build_seconds = float(build_seconds_stream.read())
+        except (IOError, OSError, ValueError):
+            return None
+        self._count('index_cache_hits')
+        self._count('index_cache_build_ms_saved', int(build_seconds * 1000))
+        return os.path.join(entry_dir, _index_basename)
+
+    def index(self, fasta_file, build):
+        """ Gets index of FASTA from cache, building it if necessary.
+
+            fasta_file: path to FASTA
+            build: function that takes path to FASTA and index basename,
+                builds the index and returns the exit code of the build
+
+            Return value: tuple (exit code of build, 0 if there was a hit;
+                index basename, or None if build failed)
+        """
+        key = self.key(fasta_file)
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry_dir):
+            index_basename = self._hit(entry_dir)
+            if index_basename is not None:
+                return 0, index_basename
+        # Waits for any other task building this index
+        lock_stream = self._lock(key)
+        try:
+            if os.path.isdir(entry_dir):
+                index_basename = self._hit(entry_dir)
+                if index_basename is not None:
+                    return 0, index_basename
+            self._count('index_cache_misses')
+            temp_dir = tempfile.mkdtemp(dir=self.cache_dir,
+                                        prefix=key + '.')
+            try:
+                start_time = time.time()
+                return_code = build(fasta_file,
+                                    os.path.join(temp_dir, _index_basename))
+                if return_code:
+                    return return_code, None
+                with open(os.path.join(temp_dir, _build_seconds_filename),
+                            'w') as build_seconds_stream:
+                    build_seconds_stream.write(
+                            '%f' % (time.time() - start_time)
+                        )
+                try:
+                    os.rename(temp_dir, entry_dir)
+                except OSError as e:
+                    # Another task without a lock published the index first
+                    if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                        raise
+                else:
+                    temp_dir = None
+            finally:
+                if temp_dir is not None:
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+        finally:
+            lock_stream.close()
+        self.evict()
+        return 0, os.path.join(entry_dir, _index_basename)
+
+    def evict(self):
+        """ Removes least recently used entries until cache fits.
+
+            No return value.
+        """
+        entries = []
+        total_bytes = 0
+        for name in os.listdir(self.cache_dir):
+            if '.' in name:
+                # Lock or index being built
+                continue
+            entry_dir = os.path.join(self.cache_dir, name)
+            try:
+                last_used = os.path.getmtime(entry_dir)
+                size = sum([os.path.getsize(os.path.join(entry_dir, filename))
+                            for filename in os.listdir(entry_dir)])
+            except OSError:
+                # Evicted by another task
+                continue
+            entries.append((last_used, size, name))
+            total_bytes += size
+        entries.sort()
+        now = time.time()
+        for last_used, size, name in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if now - last_used < self.eviction_grace:
+                break
+            if fcntl is None:
+                # Lock files are left, since they can't be taken
+                lock_stream = None
+            else:
+                lock_path = os.path.join(self.cache_dir, name + '.lock')
+                lock_stream = open(lock_path, 'a')
+                try:
+                    fcntl.flock(lock_stream.fileno(),
+                                fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    if not os.path.samestat(
+                                os.fstat(lock_stream.fileno()),
+                                os.stat(lock_path)
+                            ):
+                        raise OSError(errno.ENOENT, 'Lock file was removed')
+                except (IOError, OSError):
+                    # Another task holds the lock; evict another entry
+                    lock_stream.close()
+                    continue
+            try:
+                entry_dir = os.path.join(self.cache_dir, name)
+                # Renamed first so no task finds a partly removed entry
+                evicted_dir = tempfile.mkdtemp(dir=self.cache_dir,
+                                                prefix=name + '.evicted.')
+                try:
+                    os.rename(entry_dir, os.path.join(evicted_dir, name))
+                except OSError:
+                    continue
+                finally:
+                    shutil.rmtree(evicted_dir, ignore_errors=True)
+                if lock_stream is not None:
+                    # Removed under lock; tasks waiting on it take it again
+                    os.remove(lock_path)
+            finally:
+                if lock_stream is not None:
+                    lock_stream.close()
+            total_bytes -= size
+            self._count('index_cache_evictions')
+
+if __name__ == '__main__':
+    import unittest
+
+    class TestIndexCache(unittest.TestCase):
+        """ Tests IndexCache with a fake index builder. """
+        def setUp(self):
+            self.temp_dir_path = tempfile.mkdtemp()
+            self.cache_dir = os.path.join(self.temp_dir_path, 'cache')
+            self.builds = []
+
+        def build(self, fasta_file, index_basename):
+            """ Writes a fake index as big as its FASTA. """
+            self.builds.append(fasta_file)
+            with open(fasta_file) as fasta_stream:
+                fasta = fasta_stream.read()
+            if not fasta:
+                return 1
+            with open(index_basename + '.1.bt2', 'w') as index_stream:
+                index_stream.write(fasta)
+            return 0
+
+        def fasta(self, name, content):
+            """ Writes a FASTA and returns its path. """
+            fasta_file = os.path.join(self.temp_dir_path, name)
+            with open(fasta_file, 'w') as fasta_stream:
+                fasta_stream.write(content)
+            return fasta_file
+
+        def test_reuse(self):
+            """ Fails if identical FASTAs are indexed more than once. """
+            index_cache = IndexCache(self.cache_dir, 10 ** 6)
+            first = index_cache.index(self.fasta('a.fa', '>a\nACGT\n'),
+                                        self.build)
+            second = index_cache.index(self.fasta('b.fa', '>a\nACGT\n'),
+                                        self.build)
+            third = index_cache.index(self.fasta('c.fa', '>a\nACGA\n'),
+                                        self.build)
+            self.assertEqual(first, second)
+            self.assertNotEqual(first, third)
+            self.assertEqual(2, len(self.builds))
+            self.assertTrue(os.path.exists(first[1] + '.1.bt2'))
+            # Salt separates indexes built differently
+            salted = IndexCache(self.cache_dir, 10 ** 6, salt='--threads 2')
+            self.assertNotEqual(first, salted.index(
+                                        self.fasta('d.fa', '>a\nACGT\n'),
+                                        self.build
+                                    ))
+
+        def test_failed_build(self):
+            """ Fails if failed build is cached. """
+            index_cache = IndexCache(self.cache_dir, 10 ** 6)
+            fasta_file = self.fasta('empty.fa', '')
+            self.assertEqual((1, None),
+                             index_cache.index(fasta_file, self.build))
+            self.assertEqual((1, None),
+                             index_cache.index(fasta_file, self.build))
+            self.assertEqual(['empty.fa'] * 2,
+                             [os.path.basename(fasta_file)
+                                for fasta_file in self.builds])
+            self.assertEqual([], [name for name
+                                    in os.listdir(self.cache_dir)
+                                    if not name.endswith('.lock')])
+
+        def test_eviction(self):
+            """ Fails if least recently used index isn't evicted. """
+            index_cache = IndexCache(self.cache_dir, 250, eviction_grace=0)
+            _, a = index_cache.index(self.fasta('a.fa', 'A' * 100),
+                                        self.build)
+            _, b = index_cache.index(self.fasta('b.fa', 'C' * 100),
+                                        self.build)
+            # Make b least recently used
+            os.utime(os.path.dirname(b), (0, 0))
+            _, c = index_cache.index(self.fasta('c.fa', 'G' * 100),
+                                        self.build)
+            self.assertTrue(os.path.exists(a + '.1.bt2'))
+            self.assertFalse(os.path.exists(os.path.dirname(b)))
+            self.assertTrue(os.path.exists(c + '.1.bt2'))
+
+        def test_locked_eviction(self):
+            """ Fails if an index is evicted while its lock is held. """
+            index_cache = IndexCache(self.cache_dir, 150, eviction_grace=60)
+            _, a = index_cache.index(self.fasta('a.fa', 'A' * 100),
+                                        self.build)
+            os.utime(os.path.dirname(a), (0, 0))
+            a_key = os.path.basename(os.path.dirname(a))
+            lock_stream = index_cache._lock(a_key)
+            try:
+                _, b = index_cache.index(self.fasta('b.fa', 'C' * 100),
+                                            self.build)
+                self.assertTrue(os.path.exists(a + '.1.bt2'))
+                self.assertTrue(os.path.exists(
+                        os.path.join(self.cache_dir, a_key + '.lock')
+                    ))
+            finally:
+                lock_stream.close()
+            os.utime(os.path.dirname(a), (0, 0))
+            index_cache.evict()
+            self.assertFalse(os.path.exists(os.path.dirname(a)))
+            self.assertFalse(os.path.exists(
+                        os.path.join(self.cache_dir, a_key + '.lock')
+                    ))
+            self.assertTrue(os.path.exists(b + '.1.bt2'))
+            # Lock file is recreated for the next build
+            self.assertEqual(index_cache.index(self.fasta('c.fa', 'A' * 100),
+                                                self.build), (0, a))
+
+        def tearDown(self):
+            shutil.rmtree(self.temp_dir_path)
+
+    unittest.main()
@@ -0,0 +1,179 @@
+"""
+parallel_gzip.py
+Part of Rail-RNA
+
+Contains a file-like class that writes gzip on several threads as pigz does.
+Input is cut into blocks that are deflated independently and concurrently,
+each but the last ending on a byte boundary with a full flush, so the
+compressed blocks concatenate into one ordinary gzip member that any gzip
+reader can decompress. (BGZF, written by bam_writer.py, is instead a series
+of gzip members, which some older readers stop after the first of.) zlib
+releases the GIL while compressing, so the threads compress in parallel; the
+CRC is computed on the calling thread as data arrives.
+"""
+import struct
+import zlib
+from collections import deque
+
+# Magic bytes, deflate method, no flags, zero mtime, no extra flags, unknown OS
+_gzip_header = '\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+_gzip_footer = struct.Struct('<II')
+
+def _deflated_block(data, level, last):
+    """ Deflates one block independently of the others.
+
+        data: block of uncompressed data
+        level: zlib compression level
+        last: True iff block ends the deflate stream
+
+        Return value: raw deflate data ending on a byte boundary
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH
+        )
+
+class ParallelGzipWriter(object):
+    """ Writes a single gzip member, compressing blocks on a pool of threads.
+
+        Since blocks are compressed without the preceding block as a
+        dictionary, output is slightly larger than that of gzip at the same
+        level; with the default block size, the difference is under 1%.
+    """
+    def __init__(self, output_stream, level=6, threads=1,
+                    block_size=131072):
+        """
+            output_stream: file object to write to
+            level: zlib compression level
+            threads: number of threads that compress blocks
+            block_size: uncompressed bytes per block
+        """
+        self.output_stream = output_stream
+        self.level = level
+        self.threads = threads
+        self.block_size = block_size
+        self.buffer = []
+        self.buffer_size = 0
+        self.crc = zlib.crc32('') & 0xffffffff
+        self.uncompressed_bytes = 0
+        self.compressed_bytes = 0
+        # Started when there's more than one block, so small files are quick
+        self.pool = None
+        self.pending = deque()
+        self._write_compressed(_gzip_header)
+
+    def _write_compressed(self, compressed):
+        """ Writes compressed data to output stream. """
+        self.output_stream.write(compressed)
+        self.compressed_bytes += len(compressed)
+
+    def _flush_block(self, data, last=False):
+        """ Compresses data into a block or queues it for compression.
+
+            data: block of uncompressed data
+            last: True iff no more blocks follow, so block is compressed on
+                this thread
+
+            No return value.
+        """
+        if last or self.threads <= 1:
+            while self.pending:
+                self._write_compressed(self.pending.popleft().get())
+            self._write_compressed(_deflated_block(data, self.level, last))
+            return
+        if self.pool is None:
+            from multiprocessing.pool import ThreadPool
+            self.pool = ThreadPool(self.threads)
+        self.pending.append(
+                self.pool.apply_async(_deflated_block,
+                                        (data, self.level, False))
+            )
+        while len(self.pending) > self.threads * 4:
+            self._write_compressed(self.pending.popleft().get())
+
+    def write(self, data):
+        """ Writes data.
+
+            data: string to write
+
+            No return value.
+        """
+        self.crc = zlib.crc32(data, self.crc) & 0xffffffff
+        self.uncompressed_bytes += len(data)
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.block_size:
+            data = ''.join(self.buffer)
+            block_size = self.block_size
+            full_size = len(data) - len(data) % block_size
+            for i in xrange(0, full_size, block_size):
+                self._flush_block(data[i:i+block_size])
+            self.buffer = [data[full_size:]]
+            self.buffer_size = len(data) - full_size
+
+    def flush(self):
+        """ Flushes output stream; blocks are written only as they fill.
+
+            No return value.
+        """
+        self.output_stream.flush()
+
+    def close(self):
+        """ Compresses remaining data and writes gzip trailer.
+
+            Does not close output stream. No return value.
+        """
+        self._flush_block(''.join(self.buffer), last=True)
+        self.buffer = []
+        self.buffer_size = 0
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self._write_compressed(_gzip_footer.pack(
+                self.crc, self.uncompressed_bytes & 0xffffffff
+            ))
+
+if __name__ == '__main__':
+    import unittest
+    import random
+    import gzip
+    from cStringIO import StringIO
+
+    class TestParallelGzipWriter(unittest.TestCase):
+        """ Tests ParallelGzipWriter output with zlib and gzip readers. """
+        def compressed(self, chunks, threads, block_size=1000):
+            """ Writes chunks and returns compressed output. """
+            output_stream = StringIO()
+            writer = ParallelGzipWriter(output_stream, level=3,
+                                        threads=threads,
+                                        block_size=block_size)
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.close()
+            self.assertEqual(len(output_stream.getvalue()),
+                             writer.compressed_bytes)
+            return output_stream.getvalue()
+
+        def test_single_member(self):
+            """ Fails if output isn't one gzip member with the input. """
+            random.seed(11)
+            chunks = [''.join([random.choice('ACGT')
+                                for _ in xrange(random.randint(0, 3000))])
+                        for _ in xrange(50)]
+            for threads in [1, 4]:
+                compressed = self.compressed(chunks, threads)
+                decompressor = zlib.decompressobj(31)
+                self.assertEqual(''.join(chunks),
+                                 decompressor.decompress(compressed))
+                self.assertEqual('', decompressor.unused_data)
+                self.assertEqual(''.join(chunks),
+                                 gzip.GzipFile(
+                                        fileobj=StringIO(compressed)
+                                    ).read())
+
+        def test_empty(self):
+            """ Fails if empty input doesn't give an empty gzip file. """
+            self.assertEqual('', zlib.decompress(self.compressed([], 2), 31))
+
+    unittest.main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+benchmark_bam.py
+
+Measures time taken to write coordinate-sorted, indexed BAMs from SAM fields
+of synthetic spliced alignments. Compares Rail-RNA-bam's original path,
+which pipes SAM lines into samtools view -bS and then runs samtools index, to
+BamWriter, which encodes records, compresses BGZF blocks on one or more
+threads and builds the BAI as records arrive, and to SizedBamWriter, which
+Rail-RNA-bam uses and which picks one of the two by the number of records.
+Both one large BAM and many small BAMs, as written with
+--output-by-chromosome, are timed. Also reports the number of records below
+which BamWriter beats samtools: the time samtools takes to write and index an
+empty BAM divided by BamWriter's time per record. samtools is called only if
+it's found.
+"""
+import sys
+import os
+import time
+import random
+import site
+import subprocess
+import tempfile
+import shutil
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'utils'))
+
+from bam_writer import BamWriter, SizedBamWriter
+
+def synthetic_records(rname, rname_length, record_count, read_size=100):
+    """ Generates sorted SAM fields of alignments to one reference.
+
+        rname: reference name
+        rname_length: length of reference
+        record_count: number of records
+        read_size: number of bases in each read
+
+        Return value: list of lists of SAM fields
+    """
+    reads = [(''.join([random.choice('ACGT') for _ in xrange(read_size)]),
+              ''.join([chr(random.randint(35, 74))
+                        for _ in xrange(read_size)]))
+                for _ in xrange(100)]
+    positions = sorted([random.randint(1, rname_length - 200000)
+                        for _ in xrange(record_count)])
+    records = []
+    for i, pos in enumerate(positions):
+        seq, qual = random.choice(reads)
+        if random.random() < 0.3:
+            left = random.randint(10, read_size - 10)
+            cigar = '%dM%dN%dM' % (left, random.randint(50, 100000),
+                                    read_size - left)
+            tags = ['XS:A:+']
+        else:
+            cigar = '%dM' % read_size
+            tags = []
+        records.append(['read%d' % i, random.choice(['0', '16', '256']),
+                        rname, str(pos), '255', cigar, '*', '0', '0', seq,
+                        qual, 'NM:i:%d' % random.randint(0, 3),
+                        'MD:Z:%d' % read_size, 'NH:i:1'] + tags)
+    return records
+
+def samtools_bam(filename, header, records, samtools_exe):
+    """ Writes and indexes BAM as Rail-RNA-bam originally did. """
+    with open(filename, 'wb') as samtools_stream:
+        samtools_process = subprocess.Popen(
+                    [samtools_exe, 'view', '-bS', '-'],
+                    stdin=subprocess.PIPE,
+                    stdout=samtools_stream
+                )
+        output_stream = samtools_process.stdin
+        print >>output_stream, header
+        for record in records:
+            print >>output_stream, '\t'.join(record)
+        output_stream.close()
+        if samtools_process.wait():
+            raise RuntimeError('samtools view failed.')
+    subprocess.check_call([samtools_exe, 'index', filename])
+
+def native_bam(filename, header, records, references, threads):
+    """ Writes and indexes BAM with BamWriter. """
+    bam_writer = BamWriter(filename, header, references, threads=threads)
+    for record in records:
+        bam_writer.write(record)
+    bam_writer.close()
+
+def sized_bam(filename, header, records, references, samtools_exe,
+                max_records):
+    """ Writes and indexes BAM with SizedBamWriter. """
+    bam_writer = SizedBamWriter(filename, header, references, samtools_exe,
+                                max_records=max_records)
+    for record in records:
+        bam_writer.write(record)
+    bam_writer.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, required=False,
+            default=200000,
+            help='number of records in large BAM')
+    parser.add_argument('--small-bams', type=int, required=False,
+            default=200,
+            help='number of small BAMs')
+    parser.add_argument('--small-bam-records', type=int, required=False,
+            default=100,
+            help='number of records in each small BAM')
+    parser.add_argument('--threads', type=int, nargs='+', required=False,
+            default=[1, 4],
+            help='numbers of compression threads to try')
+    parser.add_argument('--samtools-exe', type=str, required=False,
+            default='samtools',
+            help='Path to executable for samtools')
+    parser.add_argument('--in-process-bam-records', type=int,
+            required=False, default=300,
+            help='max_records of SizedBamWriter')
+    args = parser.parse_args()
+    random.seed(0)
+    references = [('chr%d' % i, 50000000) for i in xrange(1, 4)]
+    header = '\n'.join(['@HD\tVN:1.0\tSO:coordinate']
+                        + ['@SQ\tSN:%s\tLN:%d' % reference
+                            for reference in references])
+    large_records = []
+    for rname, rname_length in references:
+        large_records.extend(synthetic_records(
+                rname, rname_length, args.records // len(references)
+            ))
+    small_records = [synthetic_records('chr1', references[0][1],
+                                        args.small_bam_records)
+                        for _ in xrange(args.small_bams)]
+    try:
+        subprocess.call([args.samtools_exe], stdout=open(os.devnull, 'w'),
+                            stderr=subprocess.STDOUT)
+    except OSError:
+        print >>sys.stderr, '%s not found; skipping it.' % args.samtools_exe
+        samtools_found = False
+    else:
+        samtools_found = True
+    temp_dir_path = tempfile.mkdtemp()
+    try:
+        writers = [('BamWriter, %d thread(s)' % threads,
+                        lambda filename, records, threads=threads: native_bam(
+                                filename, header, records, references, threads
+                            ))
+                    for threads in args.threads]
+        if samtools_found:
+            writers.insert(0, ('samtools view -bS + samtools index',
+                                lambda filename, records: samtools_bam(
+                                    filename, header, records,
+                                    args.samtools_exe
+                                )))
+            writers.append(('SizedBamWriter, at most %d records in process'
+                                % args.in_process_bam_records,
+                            lambda filename, records: sized_bam(
+                                    filename, header, records, references,
+                                    args.samtools_exe,
+                                    args.in_process_bam_records
+                                )))
+        per_record_time = None
+        for name, writer in writers:
+            filename = os.path.join(temp_dir_path, 'large.bam')
+            start_time = time.time()
+            writer(filename, large_records)
+            elapsed = time.time() - start_time
+            print >>sys.stderr, ('%s: %d records in %.2f s (%.0f records/s); '
+                                 '%d-byte BAM') % (
+                                        name, len(large_records), elapsed,
+                                        len(large_records) / elapsed,
+                                        os.path.getsize(filename)
+                                    )
+            if name.startswith('BamWriter') and per_record_time is None:
+                per_record_time = elapsed / len(large_records)
+            start_time = time.time()
+            for i, records in enumerate(small_records):
+                writer(os.path.join(temp_dir_path, 'small%d.bam' % i),
+                        records)
+            elapsed = time.time() - start_time
+            print >>sys.stderr, '%s: %d small BAMs in %.2f s' % (
+                                        name, len(small_records), elapsed
+                                    )
+        if samtools_found:
+            start_time = time.time()
+            for i in xrange(20):
+                samtools_bam(os.path.join(temp_dir_path, 'empty.bam'),
+                                header, [], args.samtools_exe)
+            startup_time = (time.time() - start_time) / 20
+            print >>sys.stderr, ('samtools takes %.1f ms to write and index '
+                                 'an empty BAM; BamWriter is faster below '
+                                 '~%d records') % (
+                                        startup_time * 1000,
+                                        startup_time / per_record_time
+                                    )
+    finally:
+        shutil.rmtree(temp_dir_path)
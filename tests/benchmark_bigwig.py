@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+benchmark_bigwig.py
+
+Measures time taken and disk used to write a bigWig from synthetic runs of
+constant coverage. Compares Rail-RNA-coverage's original path, which writes a
+bedGraph and a chromosome sizes file to disk and calls bedGraphToBigWig, to
+BigWigWriter, which writes the bigWig directly as runs arrive. Writing the
+bedGraph is always timed; bedGraphToBigWig is called only if it's found. If
+pyBigWig is installed, also checks that it reads back every run written by
+BigWigWriter.
+"""
+import sys
+import os
+import time
+import random
+import site
+import subprocess
+import tempfile
+import shutil
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'utils'))
+
+from bigwig import BigWigWriter
+
+def synthetic_runs(chrom_sizes, covered_fraction=0.05, seed=0):
+    """ Generates runs of coverage like those of an RNA-seq sample.
+
+        chrom_sizes: dictionary mapping chromosome names to sizes
+        covered_fraction: approximate fraction of genome with nonzero
+            coverage
+        seed: random seed
+
+        Return value: list of runs (chrom, start, end, value) tiling every
+            chromosome
+    """
+    random.seed(seed)
+    runs = []
+    for chrom in sorted(chrom_sizes):
+        pos = 0
+        while pos < chrom_sizes[chrom]:
+            if random.random() < covered_fraction * 4:
+                # Exon-like stretch of varying coverage
+                for _ in xrange(random.randint(1, 40)):
+                    end = min(pos + random.randint(1, 60),
+                                chrom_sizes[chrom])
+                    runs.append((chrom, pos, end,
+                                    float(random.randint(1, 200))))
+                    pos = end
+                    if pos == chrom_sizes[chrom]:
+                        break
+            else:
+                end = min(pos + random.randint(100, 20000),
+                            chrom_sizes[chrom])
+                runs.append((chrom, pos, end, 0.0))
+                pos = end
+    return runs
+
+def disk_usage(paths):
+    """ Gets total size of files in bytes. """
+    return sum([os.path.getsize(path) for path in paths])
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chroms', type=int, required=False, default=24,
+            help='number of chromosomes')
+    parser.add_argument('--chrom-size', type=int, required=False,
+            default=20000000,
+            help='number of bases in each chromosome')
+    parser.add_argument('--bigwig-exe', type=str, required=False,
+            default='bedGraphToBigWig',
+            help='Location of the Kent Tools bedGraphToBigWig executable')
+    args = parser.parse_args()
+    chrom_sizes = dict(('chr%d' % (i + 1), args.chrom_size)
+                        for i in xrange(args.chroms))
+    runs = synthetic_runs(chrom_sizes)
+    print >>sys.stderr, '%d runs across %d chromosomes.' % (
+                                            len(runs), len(chrom_sizes)
+                                        )
+    temp_dir_path = tempfile.mkdtemp()
+    try:
+        # Original path
+        start_time = time.time()
+        bed_filename = os.path.join(temp_dir_path, 'temp.bed')
+        sizes_filename = os.path.join(temp_dir_path, 'chrom.sizes')
+        with open(sizes_filename, 'w') as sizes_stream:
+            for chrom in chrom_sizes:
+                print >>sizes_stream, '%s %d' % (chrom, chrom_sizes[chrom])
+        with open(bed_filename, 'w') as bed_stream:
+            for run in runs:
+                print >>bed_stream, '%s\t%d\t%d\t%08f' % run
+        bed_time = time.time() - start_time
+        print >>sys.stderr, ('bedGraph: %.2f s to write; %d bytes') % (
+                        bed_time, disk_usage([bed_filename, sizes_filename])
+                    )
+        original_bigwig = os.path.join(temp_dir_path, 'original.bw')
+        start_time = time.time()
+        try:
+            subprocess.check_call([args.bigwig_exe, bed_filename,
+                                    sizes_filename, original_bigwig])
+        except OSError:
+            print >>sys.stderr, ('%s not found; skipping it.'
+                                    % args.bigwig_exe)
+        else:
+            bigwig_time = time.time() - start_time
+            print >>sys.stderr, ('bedGraph + bedGraphToBigWig: %.2f s; '
+                                 '%d bytes at peak; %d-byte bigWig') % (
+                            bed_time + bigwig_time,
+                            disk_usage([bed_filename, sizes_filename,
+                                        original_bigwig]),
+                            disk_usage([original_bigwig])
+                        )
+        os.remove(bed_filename)
+        # Direct path
+        native_bigwig = os.path.join(temp_dir_path, 'native.bw')
+        start_time = time.time()
+        bigwig_writer = BigWigWriter(native_bigwig, chrom_sizes)
+        for run in runs:
+            bigwig_writer.add(*run)
+        bigwig_writer.close()
+        print >>sys.stderr, 'BigWigWriter: %.2f s; %d-byte bigWig' % (
+                                time.time() - start_time,
+                                disk_usage([native_bigwig])
+                            )
+        try:
+            import pyBigWig
+        except ImportError:
+            print >>sys.stderr, 'pyBigWig not found; skipping check.'
+        else:
+            bigwig = pyBigWig.open(native_bigwig)
+            read_runs = []
+            for chrom in sorted(chrom_sizes):
+                read_runs.extend([(chrom,) + tuple(interval)
+                                    for interval in bigwig.intervals(chrom)])
+            if read_runs != runs:
+                print >>sys.stderr, 'FAIL: pyBigWig reads different runs.'
+                sys.exit(1)
+            print >>sys.stderr, 'pyBigWig reads back every run.'
+    finally:
+        shutil.rmtree(temp_dir_path)
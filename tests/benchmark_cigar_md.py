@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+benchmark_cigar_md.py
+
+Measures time taken to find indels, junctions, exons and mismatches of
+synthetic Bowtie 2-like alignments from their CIGAR and MD strings. Compares
+the original walker, which splits CIGAR strings with re.split() and MD strings
+character by character with re.match(), to walking integer tokens from
+cigar_tokens() and md_tokens(). Also checks that both give the same
+results.
+"""
+import sys
+import os
+import re
+import time
+import random
+import site
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'utils'))
+
+from alignment_handlers import indels_junctions_exons_mismatches
+
+def regex_parsed_md(md):
+    """ Original parsed_md(); splits MD string at boundaries between ^,
+        letters and numbers.
+    """
+    md_to_parse = []
+    md_group = [md[0]]
+    for i, char in enumerate(md):
+        if i == 0: continue
+        if (re.match('[A-Za-z]', char) is not None) \
+            != (re.match('[A-Za-z]', md[i-1]) is not None) or \
+            (re.match('[0-9]', char) is not None) \
+            != (re.match('[0-9]', md[i-1]) is not None):
+            if md_group:
+                md_to_parse.append(''.join(md_group))
+            md_group = [char]
+        else:
+            md_group.append(char)
+    if md_group:
+        md_to_parse.append(''.join(md_group))
+    return [char for char in md_to_parse if char != '0']
+
+def regex_indels_junctions_exons_mismatches(
+            cigar, md, pos, seq, drop_deletions=False, junctions_only=False
+        ):
+    """ Original indels_junctions_exons_mismatches(). """
+    insertions, deletions, junctions, exons, mismatches = [], [], [], [], []
+    cigar = re.split(r'([MINDS])', cigar)[:-1]
+    md = regex_parsed_md(md)
+    seq_size = len(seq)
+    cigar_index, md_index, seq_index = 0, 0, 0
+    max_cigar_index = len(cigar)
+    while cigar_index != max_cigar_index:
+        if cigar[cigar_index+1] == 'M':
+            aligned_base_cap = int(cigar[cigar_index])
+            aligned_bases = 0
+            while True:
+                try:
+                    aligned_bases += int(md[md_index])
+                    if aligned_bases <= aligned_base_cap:
+                        md_index += 1
+                except ValueError:
+                    assert md[md_index] != '^'
+                    if not junctions_only:
+                        mismatches.append(
+                                (pos + aligned_bases,
+                                    seq[seq_index + aligned_bases])
+                            )
+                    correction_length = len(md[md_index])
+                    m_length = aligned_base_cap - aligned_bases
+                    if correction_length > m_length:
+                        md[md_index] = md[md_index][:m_length]
+                        aligned_bases = aligned_base_cap
+                    else:
+                        aligned_bases += correction_length
+                        md_index += 1
+                if aligned_bases > aligned_base_cap:
+                    md[md_index] = aligned_bases - aligned_base_cap
+                    break
+                elif aligned_bases == aligned_base_cap:
+                    break
+            exons.append((pos, pos + aligned_base_cap))
+            pos += aligned_base_cap
+            seq_index += aligned_base_cap
+        elif cigar[cigar_index+1] == 'N':
+            skip_increment = int(cigar[cigar_index])
+            junctions.append((pos, pos + skip_increment,
+                            seq_index, seq_size - seq_index))
+            pos += skip_increment
+        elif cigar[cigar_index+1] == 'I':
+            insert_size = int(cigar[cigar_index])
+            insertions.append(
+                    (pos - 1, seq[seq_index:seq_index+insert_size])
+                )
+            seq_index += insert_size
+        elif cigar[cigar_index+1] == 'D':
+            assert md[md_index] == '^'
+            delete_size = int(cigar[cigar_index])
+            md_delete_size = len(md[md_index+1])
+            assert md_delete_size >= delete_size
+            deletions.append((pos, md[md_index+1][:delete_size]))
+            if not drop_deletions: exons.append((pos, pos + delete_size))
+            if md_delete_size > delete_size:
+                md[md_index+1] = md[md_index+1][delete_size:]
+            else:
+                md_index += 2
+            pos += delete_size
+        else:
+            assert cigar[cigar_index+1] == 'S'
+            seq_index += int(cigar[cigar_index])
+        cigar_index += 2
+    new_exons = []
+    last_exon = exons[0]
+    for exon in exons[1:]:
+        if exon[0] == last_exon[1]:
+            last_exon = (last_exon[0], exon[1])
+        else:
+            new_exons.append(last_exon)
+            last_exon = exon
+    new_exons.append(last_exon)
+    return insertions, deletions, junctions, new_exons, mismatches
+
+def synthetic_alignment(read_size, rname_count=22):
+    """ Generates a Bowtie 2-like alignment with consistent CIGAR and MD.
+
+        read_size: number of bases in read
+        rname_count: number of reference names
+
+        Return value: tuple of tokens from a line of SAM
+    """
+    seq = ''.join([random.choice('ACGT') for _ in xrange(read_size)])
+    cigar, md, run = [], [], 0
+    seq_index = 0
+    left_clip = random.choice([0, 0, 0, random.randint(1, 10)])
+    right_clip = random.choice([0, 0, 0, random.randint(1, 10)])
+    if left_clip:
+        cigar.append('%dS' % left_clip)
+        seq_index += left_clip
+    while seq_index < read_size - right_clip:
+        block = min(random.randint(5, 60), read_size - right_clip - seq_index)
+        cigar.append('%dM' % block)
+        for _ in xrange(block):
+            if random.random() < 0.02:
+                md.append('%d%s' % (run, random.choice('ACGT')))
+                run = 0
+            else:
+                run += 1
+        seq_index += block
+        if seq_index >= read_size - right_clip:
+            break
+        event = random.choice('NNNID')
+        if event == 'N':
+            cigar.append('%dN' % random.randint(50, 50000))
+        elif event == 'I':
+            size = min(random.randint(1, 3),
+                        read_size - right_clip - seq_index - 1)
+            if size > 0:
+                cigar.append('%dI' % size)
+                seq_index += size
+        else:
+            size = random.randint(1, 3)
+            cigar.append('%dD' % size)
+            md.append('%d^%s' % (run, ''.join([random.choice('ACGT')
+                                                for _ in xrange(size)])))
+            run = 0
+    md.append(str(run))
+    if right_clip:
+        cigar.append('%dS' % (read_size - seq_index))
+    return ('read', str(random.choice([0, 16])),
+            'chr%d' % random.randint(1, rname_count),
+            str(random.randint(1, 100000000)), '255', ''.join(cigar), '*',
+            '0', '0', seq, 'I' * read_size, 'AS:i:0', 'XN:i:0',
+            'MD:Z:' + ''.join(md), 'YT:Z:UU')
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reads', type=int, required=False, default=20000,
+            help='number of synthetic reads')
+    parser.add_argument('--read-size', type=int, required=False, default=100,
+            help='number of bases in each read')
+    parser.add_argument('--alignments', type=int, required=False, default=5,
+            help='number of alignments of each read')
+    args = parser.parse_args()
+    random.seed(0)
+    multireads = [[synthetic_alignment(args.read_size)
+                    for _ in xrange(args.alignments)]
+                    for _ in xrange(args.reads)]
+    alignment_count = args.reads * args.alignments
+    results = {}
+    for name, function in [
+                ('regex walker', lambda multiread: [
+                        regex_indels_junctions_exons_mismatches(
+                            alignment[5], alignment[13][5:],
+                            int(alignment[3]), alignment[9]
+                        ) for alignment in multiread
+                    ]),
+                ('token walker', lambda multiread: [
+                        indels_junctions_exons_mismatches(
+                            alignment[5], alignment[13][5:],
+                            int(alignment[3]), alignment[9]
+                        ) for alignment in multiread
+                    ])
+            ]:
+        start_time = time.time()
+        results[name] = [function(multiread) for multiread in multireads]
+        elapsed = time.time() - start_time
+        print >>sys.stderr, '%s: %.2f s per million alignments' % (
+                                name, elapsed * 1000000 / alignment_count
+                            )
+    if results['regex walker'] != results['token walker']:
+        print >>sys.stderr, 'FAIL: walkers differ.'
+        sys.exit(1)
+    print >>sys.stderr, 'Results are identical.'
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+benchmark_coverage_pre.py
+
+Measures throughput (positions/s) of Rail-RNA-coverage_pre's accumulation of
+coverage diffs and computation of means and medians of normalized coverages
+across samples, by number of samples. Compares the original loop, which
+classifies sample indexes with a regex, keeps coverages in defaultdicts and
+rebuilds and sorts a list of every sample's normalized coverage at every
+position, to SampleCoverageAccumulator, which parses each sample index once
+and keeps means and medians up to date as diffs arrive. Also checks that the
+two give the same medians and means that agree to within rounding.
+"""
+import sys
+import os
+import time
+import random
+import itertools
+import site
+from collections import defaultdict
+from re import search
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'utils'))
+
+from coverage_accumulator import SampleCoverageAccumulator
+
+def median(a_list):
+    """ Original median() from Rail-RNA-coverage_pre. """
+    if not a_list:
+        return 0
+    sorted_list = sorted(a_list)
+    list_size = len(a_list)
+    index = (list_size - 1) // 2
+    if (list_size % 2):
+        return sorted_list[index]
+    return (sorted_list[index] + sorted_list[index + 1]) / 2.0
+
+def synthetic_diffs(sample_count, exon_count, seed=0):
+    """ Generates coverage diffs of exons and mismatches for one partition.
+
+        sample_count: number of samples
+        exon_count: number of exons
+        seed: random seed
+
+        Return value: list of tuples (position, sample index, uniqueness,
+            diff) sorted by position and sample index as input to
+            coverage_pre is
+    """
+    random.seed(seed)
+    diffs = []
+    for _ in xrange(exon_count):
+        sample_index = str(random.randrange(sample_count))
+        uniqueness = random.choice('01')
+        start = random.randint(1, 50000)
+        end = start + random.randint(50, 300)
+        diffs.append(('%012d' % start, sample_index, uniqueness, '1'))
+        diffs.append(('%012d' % end, sample_index, uniqueness, '-1'))
+        if random.random() < 0.1:
+            # Mismatch
+            pos = random.randint(start, end - 1)
+            sample_index += '.' + random.choice('ACGTN')
+            diffs.append(('%012d' % pos, sample_index, uniqueness, '1'))
+            diffs.append(('%012d' % (pos + 1), sample_index, uniqueness,
+                            '-1'))
+    diffs.sort()
+    return diffs
+
+def original_centers(diffs, sample_indexes, mapped_read_counts,
+                        unique_mapped_read_counts, library_size):
+    """ Computes centers as coverage_pre originally did.
+
+        Return value: list of tuples (position, mean, unique mean, median,
+            unique median, nonreference mean, unique nonreference mean,
+            nonreference median, unique nonreference median)
+    """
+    mean_weight = 1. / len([_ for _ in mapped_read_counts.values() if _])
+    unique_mean_weight = 1. / len(
+                        [_ for _ in unique_mapped_read_counts.values() if _]
+                    )
+    coverages, unique_coverages = defaultdict(int), defaultdict(int)
+    nonref_coverages, unique_nonref_coverages = (
+            defaultdict(int), defaultdict(int)
+        )
+    centers = []
+    for pos, sample_indexes_and_diffs in itertools.groupby(
+                                            diffs, lambda val: val[0]
+                                        ):
+        for sample_index, group in itertools.groupby(
+                                sample_indexes_and_diffs, lambda val: val[1]
+                            ):
+            for _, _, uniqueness, diff in group:
+                diff = int(diff)
+                coverages[sample_index] += diff
+                if uniqueness == '1':
+                    unique_coverages[sample_index] += diff
+                if search('\.[ATCG]', sample_index):
+                    real_sample_index = sample_index[:-2]
+                    nonref_coverages[real_sample_index] += diff
+                    if uniqueness == '1':
+                        unique_nonref_coverages[real_sample_index] += diff
+        rows = []
+        for coverage_dict, read_counts in [
+                    (coverages, mapped_read_counts),
+                    (unique_coverages, unique_mapped_read_counts),
+                    (nonref_coverages, mapped_read_counts),
+                    (unique_nonref_coverages, unique_mapped_read_counts)
+                ]:
+            rows.append([float(coverage_dict[sample_index])
+                            / read_counts[sample_index] * library_size
+                            for sample_index in sample_indexes
+                            if read_counts[sample_index]])
+        centers.append((pos,
+                        sum([cov * mean_weight for cov in rows[0]]),
+                        sum([cov * unique_mean_weight for cov in rows[1]]),
+                        median(rows[0]), median(rows[1]),
+                        sum([cov * mean_weight for cov in rows[2]]),
+                        sum([cov * unique_mean_weight for cov in rows[3]]),
+                        median(rows[2]), median(rows[3])))
+    return centers
+
+def accumulator_centers(diffs, accumulator):
+    """ Computes centers with SampleCoverageAccumulator.
+
+        Return value: see original_centers()
+    """
+    accumulator.reset()
+    centers = []
+    for pos, sample_indexes_and_diffs in itertools.groupby(
+                                            diffs, lambda val: val[0]
+                                        ):
+        for sample_index, group in itertools.groupby(
+                                sample_indexes_and_diffs, lambda val: val[1]
+                            ):
+            accumulator.add(sample_index, group)
+        centers.append((pos,) + accumulator.centers())
+    return centers
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sample-counts', type=int, nargs='+',
+            required=False, default=[10, 100, 1000],
+            help='numbers of samples to try')
+    parser.add_argument('--exons', type=int, required=False, default=5000,
+            help='number of exons in partition')
+    parser.add_argument('--library-size', type=int, required=False,
+            default=40,
+            help='Rail-RNA\'s --library-size')
+    args = parser.parse_args()
+    library_size = args.library_size * 1000000
+    for sample_count in args.sample_counts:
+        diffs = synthetic_diffs(sample_count, args.exons)
+        random.seed(sample_count)
+        sample_indexes = [str(i) for i in xrange(sample_count)]
+        mapped_read_counts = dict(
+                (sample_index, random.choice([0, 1000000, 12345678]))
+                for sample_index in sample_indexes
+            )
+        unique_mapped_read_counts = dict(
+                (sample_index, count // 2)
+                for sample_index, count in mapped_read_counts.items()
+            )
+        accumulator = SampleCoverageAccumulator(
+                sample_count,
+                [mapped_read_counts[sample_index]
+                    for sample_index in sample_indexes],
+                [unique_mapped_read_counts[sample_index]
+                    for sample_index in sample_indexes],
+                library_size
+            )
+        results = {}
+        for name, function in [
+                    ('original', lambda: original_centers(
+                            diffs, sample_indexes, mapped_read_counts,
+                            unique_mapped_read_counts, library_size
+                        )),
+                    ('accumulator', lambda: accumulator_centers(
+                            diffs, accumulator
+                        ))
+                ]:
+            start_time = time.time()
+            results[name] = function()
+            elapsed = time.time() - start_time
+            print >>sys.stderr, ('%d samples, %s: %d positions in %.2f s '
+                                 '(%.0f positions/s)') % (
+                                    sample_count, name, len(results[name]),
+                                    elapsed, len(results[name]) / elapsed
+                                )
+        for original, accumulated in zip(results['original'],
+                                         results['accumulator']):
+            if (original[0] != accumulated[0]
+                or [original[i] for i in (3, 4, 7, 8)]
+                    != [accumulated[i] for i in (3, 4, 7, 8)]
+                or any([abs(original[i] - accumulated[i])
+                            > 1e-9 * max(1.0, abs(original[i]))
+                        for i in (1, 2, 5, 6)])):
+                print >>sys.stderr, 'FAIL: centers differ at %s.' % (
+                                            original[0]
+                                        )
+                sys.exit(1)
+    print >>sys.stderr, 'Centers agree.'
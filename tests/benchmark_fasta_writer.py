@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+benchmark_fasta_writer.py
+
+Measures time taken and bytes of temporary files written and read to produce
+the FASTAs Rail-RNA-realign_reads and Rail-RNA-junction_index index from
+synthetic transcript fragments with duplicates. Compares realign_reads'
+original path, which writes a prefasta, deduplicates it with sort | uniq and
+rereads the result to wrap sequences with a list of slices, to UniqueRecords
+and FastaWriter, both with everything deduplicated in memory and with a
+memory budget small enough to force spills. Also compares junction_index's
+original wrapping of presorted records to FastaWriter. Outputs of both paths
+are checked for equality.
+"""
+import sys
+import os
+import time
+import random
+import site
+import subprocess
+import tempfile
+import shutil
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'utils'))
+
+from fasta_writer import UniqueRecords, FastaWriter
+
+def synthetic_fragments(fragment_count, duplication=3):
+    """ Generates transcript fragments, each repeated about duplication times.
+
+        fragment_count: number of distinct fragments
+        duplication: mean number of times each fragment appears
+
+        Return value: list of tuples (reference name, sequence)
+    """
+    distinct = [('>chr%d%s\x1d%d\x1d50,%d\x1d%d\x1dp' % (
+                        random.randint(1, 22), random.choice('+-'),
+                        random.randint(1, 10 ** 8), random.randint(30, 100),
+                        random.randint(50, 100000)
+                    ), ''.join([random.choice('ACGT') for _ in
+                                xrange(random.choice([100, 150, 300, 700]))]))
+                    for _ in xrange(fragment_count)]
+    fragments = [random.choice(distinct)
+                    for _ in xrange(fragment_count * duplication)]
+    return fragments
+
+def original_realign(fragments, temp_dir):
+    """ Writes FASTA as realign_reads originally did.
+
+        fragments: list of tuples (reference name, sequence)
+        temp_dir: where to write files
+
+        Return value: tuple (path to FASTA, bytes of temporary files written
+            and read)
+    """
+    prefasta_filename = os.path.join(temp_dir, 'temp.prefa')
+    deduped_fasta_filename = os.path.join(temp_dir, 'temp.deduped.prefa')
+    final_fasta_filename = os.path.join(temp_dir, 'original.fa')
+    with open(prefasta_filename, 'w') as fasta_stream:
+        for rname, seq in fragments:
+            print >>fasta_stream, '\t'.join([rname, seq])
+    subprocess.check_call(
+            'LC_ALL=C sort %s | uniq >%s'
+            % (prefasta_filename, deduped_fasta_filename), shell=True,
+            executable='/bin/bash'
+        )
+    with open(final_fasta_filename, 'w') as final_fasta_stream:
+        with open(deduped_fasta_filename) as fasta_stream:
+            for line in fasta_stream:
+                rname, seq = line.strip().split('\t')
+                print >>final_fasta_stream, rname
+                final_fasta_stream.write(
+                    '\n'.join([seq[i:i+80] for i
+                                in xrange(0, len(seq), 80)])
+                )
+                final_fasta_stream.write('\n')
+    # Prefasta is written, then read by sort; deduped file likewise
+    temp_bytes = 2 * (os.path.getsize(prefasta_filename)
+                        + os.path.getsize(deduped_fasta_filename))
+    os.remove(prefasta_filename)
+    os.remove(deduped_fasta_filename)
+    return final_fasta_filename, temp_bytes
+
+def unique_records_realign(fragments, temp_dir, memory_bytes):
+    """ Writes FASTA with UniqueRecords and FastaWriter.
+
+        fragments: list of tuples (reference name, sequence)
+        temp_dir: where to write files
+        memory_bytes: memory budget of UniqueRecords
+
+        Return value: tuple (path to FASTA, bytes of temporary files written
+            and read)
+    """
+    final_fasta_filename = os.path.join(temp_dir, 'unique_records.fa')
+    unique_records = UniqueRecords(memory_bytes=memory_bytes,
+                                    temp_dir=temp_dir)
+    for fragment in fragments:
+        unique_records.add(fragment)
+    temp_bytes = 2 * sum([os.path.getsize(run_filename)
+                            for run_filename in unique_records.run_filenames])
+    with open(final_fasta_filename, 'w', 1048576) as final_fasta_stream:
+        fasta_writer = FastaWriter(final_fasta_stream)
+        for rname, seq in unique_records:
+            fasta_writer.write(rname, seq)
+        fasta_writer.close()
+    return final_fasta_filename, temp_bytes
+
+def original_junction(fragments, temp_dir):
+    """ Writes FASTA as junction_index originally did.
+
+        fragments: sorted list of tuples (reference name, sequence)
+        temp_dir: where to write files
+
+        Return value: path to FASTA
+    """
+    fasta_file = os.path.join(temp_dir, 'original_junction.fa')
+    with open(fasta_file, 'w') as fasta_stream:
+        for rname, seq in fragments:
+            print >>fasta_stream, rname
+            fasta_stream.write(
+                    '\n'.join([seq[i:i+80] for i
+                                in xrange(0, len(seq), 80)]) + '\n'
+                )
+    return fasta_file
+
+def fasta_writer_junction(fragments, temp_dir):
+    """ Writes FASTA with FastaWriter as junction_index now does.
+
+        fragments: sorted list of tuples (reference name, sequence)
+        temp_dir: where to write files
+
+        Return value: path to FASTA
+    """
+    fasta_file = os.path.join(temp_dir, 'fasta_writer_junction.fa')
+    with open(fasta_file, 'w', 1048576) as fasta_stream:
+        fasta_writer = FastaWriter(fasta_stream)
+        for rname, seq in fragments:
+            fasta_writer.write(rname, seq)
+        fasta_writer.close()
+    return fasta_file
+
+def same_contents(first_filename, second_filename):
+    """ Checks whether two files have the same contents.
+
+        Return value: True iff they do
+    """
+    with open(first_filename) as first_stream:
+        with open(second_filename) as second_stream:
+            return first_stream.read() == second_stream.read()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fragments', type=int, required=False,
+        default=100000,
+        help='Number of distinct transcript fragments')
+    parser.add_argument('--duplication', type=int, required=False,
+        default=3,
+        help='Mean number of times each fragment appears')
+    parser.add_argument('--spill-memory-bytes', type=int, required=False,
+        default=16 * 1024 ** 2,
+        help='Memory budget of UniqueRecords when testing spills')
+    parser.add_argument('--seed', type=int, required=False, default=0,
+        help='Random seed')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    fragments = synthetic_fragments(args.fragments, args.duplication)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        start_time = time.time()
+        original_fasta, original_bytes = original_realign(fragments,
+                                                            temp_dir)
+        original_time = time.time() - start_time
+        print >>sys.stderr, (
+                'realign_reads original: %0.3f s, %d temporary bytes '
+                'written and read' % (original_time, original_bytes)
+            )
+        for label, memory_bytes in [('in memory', 268435456),
+                                    ('spilling', args.spill_memory_bytes)]:
+            start_time = time.time()
+            fasta, temp_bytes = unique_records_realign(fragments, temp_dir,
+                                                        memory_bytes)
+            elapsed = time.time() - start_time
+            print >>sys.stderr, (
+                    'realign_reads UniqueRecords (%s): %0.3f s (%0.2fx), %d '
+                    'temporary bytes written and read' % (
+                            label, elapsed, original_time / elapsed,
+                            temp_bytes
+                        )
+                )
+            assert same_contents(original_fasta, fasta)
+            os.remove(fasta)
+        sorted_fragments = sorted(set(fragments))
+        start_time = time.time()
+        original_fasta = original_junction(sorted_fragments, temp_dir)
+        original_time = time.time() - start_time
+        start_time = time.time()
+        fasta = fasta_writer_junction(sorted_fragments, temp_dir)
+        elapsed = time.time() - start_time
+        print >>sys.stderr, (
+                'junction_index wrapping: original %0.3f s, FastaWriter '
+                '%0.3f s (%0.2fx); FASTA is %d bytes' % (
+                        original_time, elapsed, original_time / elapsed,
+                        os.path.getsize(fasta)
+                    )
+            )
+        assert same_contents(original_fasta, fasta)
+        print >>sys.stderr, 'Outputs are identical.'
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+benchmark_global_alignment.py
+
+Measures throughput (alignments/s) of GlobalAlignment backends on pairs of
+sequences resembling those junctions_from_clique() realigns: the span of a
+read between two readlet alignments and the reference with a candidate
+intron removed, which differs from the read by a few mismatches and small
+indels. Compares the pure-Python backend, the NumPy backend one pair at a
+time with score_matrix() and the NumPy backend with scores(), which scores
+the candidates found between a pair of readlets together. Also checks that
+every method gives the same scores.
+"""
+import sys
+import os
+import time
+import random
+import site
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'utils'))
+
+from global_alignment import GlobalAlignment, available_backends
+
+def mutated(seq, edit_count):
+    """ Introduces random mismatches and 1-3-base indels into a sequence.
+
+        seq: sequence
+        edit_count: number of edits
+
+        Return value: mutated sequence
+    """
+    seq = list(seq)
+    for _ in xrange(edit_count):
+        i = random.randint(0, len(seq) - 1)
+        edit = random.random()
+        if edit < 0.6:
+            seq[i] = random.choice('ACGT')
+        elif edit < 0.8:
+            del seq[i:i+random.randint(1, 3)]
+        else:
+            seq[i:i] = [random.choice('ACGT')
+                            for _ in xrange(random.randint(1, 3))]
+    return ''.join(seq)
+
+def candidate_groups(group_count, span_sizes, seed=0):
+    """ Generates groups of realignments, one group per pair of readlets.
+
+        group_count: number of groups
+        span_sizes: list of sizes of read spans from which to choose
+        seed: random seed
+
+        Return value: list of lists of (read span, reference minus intron)
+    """
+    random.seed(seed)
+    groups = []
+    for _ in xrange(group_count):
+        read_span = ''.join([random.choice('ACGT') for _
+                                in xrange(random.choice(span_sizes))])
+        # Candidate introns differ in where they cut the reference
+        groups.append([(read_span, mutated(read_span, random.randint(0, 4)))
+                        for _ in xrange(random.randint(1, 8))])
+    return groups
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--groups', type=int, required=False, default=500,
+            help='number of groups of candidate realignments')
+    parser.add_argument('--span-sizes', type=str, required=False,
+            default='25,50,76,100,150',
+            help='comma-separated sizes of read spans')
+    args = parser.parse_args()
+    groups = candidate_groups(args.groups,
+                                [int(size) for size
+                                    in args.span_sizes.split(',')])
+    pair_count = sum([len(group) for group in groups])
+    methods = [('python', 'python', False)]
+    if 'numpy' in available_backends():
+        methods.extend([('numpy score_matrix', 'numpy', False),
+                        ('numpy scores (batched)', 'numpy', True)])
+    results = {}
+    for name, backend, batched in methods:
+        global_alignment = GlobalAlignment(backend=backend)
+        start_time = time.time()
+        if batched:
+            results[name] = [score for group in groups
+                                for score in global_alignment.scores(group)]
+        else:
+            results[name] = [
+                    global_alignment.score_matrix(*seq_pair)[-1][-1]
+                    for group in groups for seq_pair in group
+                ]
+        elapsed = time.time() - start_time
+        print >>sys.stderr, '%s: %.0f alignments/s (%.2f s)' % (
+                name, pair_count / elapsed, elapsed
+            )
+    if any([results[name] != results['python'] for name in results]):
+        print >>sys.stderr, 'FAIL: scores differ across backends.'
+        sys.exit(1)
+    print >>sys.stderr, 'Scores are identical across backends.'
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+benchmark_junction_config.py
+
+Regression benchmark for junction combo enumeration in Rail-RNA-junction_config.
+Runs junction_config.py with Rail-RNA's default parameters on introns from
+SRR2097796 that used to stall the step for hours (the immunoglobulin heavy
+chain locus on chr14 has tens of thousands of alternative splicings), reports
+wall-clock time and numbers of combos written, and fails if the step takes
+longer than a time limit.
+
+The legacy enumeration algorithm can also be timed with --legacy; give it a
+generous --time-limit, or it will be killed when the limit is reached.
+"""
+import sys
+import os
+import time
+import gzip
+import subprocess
+import tempfile
+import shutil
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+junction_config = os.path.join(base_path, 'src', 'rna', 'steps',
+                                'junction_config.py')
+blowup = os.path.join(base_path, 'tests', 'data',
+    'input_to_junction_config_script_from_SRR2097796_that_causes_blowup.tsv.gz')
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--time-limit', type=float, required=False,
+            default=120,
+            help='maximum number of seconds junction_config.py may take')
+    parser.add_argument('--readlet-size', type=int, required=False,
+            default=32,
+            help='Rail-RNA\'s --readlet-config-size')
+    parser.add_argument('--min-overlap-exon-size', type=int, required=False,
+            default=9,
+            help='Rail-RNA\'s --min-exon-size')
+    parser.add_argument('--work-budget', type=int, required=False,
+            default=None,
+            help='work budget to pass to junction_config.py; use its default '
+                 'if unspecified')
+    parser.add_argument('--legacy', action='store_const', const=True,
+            default=False,
+            help='time legacy enumeration algorithm instead')
+    args = parser.parse_args()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        input_file = os.path.join(temp_dir, 'introns.tsv')
+        with gzip.open(blowup) as blowup_stream:
+            with open(input_file, 'w') as input_stream:
+                shutil.copyfileobj(blowup_stream, input_stream)
+        command = [sys.executable, junction_config,
+                    '--readlet-size=%d' % args.readlet_size,
+                    '--min-overlap-exon-size=%d'
+                    % args.min_overlap_exon_size]
+        if args.work_budget is not None:
+            command.append('--work-budget=%d' % args.work_budget)
+        if args.legacy:
+            command.append('--legacy')
+        start_time = time.time()
+        with open(input_file) as input_stream:
+            junction_config_process = subprocess.Popen(
+                    command, stdin=input_stream, stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
+                )
+            output_line_count, combos = 0, set()
+            for line in junction_config_process.stdout:
+                output_line_count += 1
+                combos.add(line.partition('\t')[2].partition('\t')[2]
+                            .partition('\t')[0].count(',') + 1)
+                if time.time() - start_time > args.time_limit:
+                    junction_config_process.kill()
+                    break
+            errors = junction_config_process.stderr.read()
+            return_code = junction_config_process.wait()
+        elapsed = time.time() - start_time
+    finally:
+        shutil.rmtree(temp_dir)
+    print >>sys.stderr, '%s: %d lines of output (%s junctions per combo) ' \
+                        'in %.2f s' % (
+                            'legacy' if args.legacy else 'dynamic programming',
+                            output_line_count,
+                            ', '.join(map(str, sorted(combos))),
+                            elapsed
+                        )
+    for line in errors.split('\n'):
+        if 'exhausted' in line:
+            print >>sys.stderr, line
+    if elapsed > args.time_limit:
+        print >>sys.stderr, 'FAIL: time limit of %.0f s exceeded.' \
+                                % args.time_limit
+        sys.exit(1)
+    if return_code:
+        print >>sys.stderr, errors
+        print >>sys.stderr, 'FAIL: junction_config.py exited with code %d.' \
+                                % return_code
+        sys.exit(1)
+    print >>sys.stderr, 'Time limit of %.0f s met.' % args.time_limit
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+benchmark_junction_dag.py
+
+Measures time taken to build the DAG of introns on a synthetic dense
+chromosome strand in Rail-RNA-junction_config. Compares the original
+frontier algorithm, which checked every new intron against every intron that
+could still have children, to intron_dag(), which finds the children and
+parents of all introns by binary search over sorted start/end arrays, both
+with NumPy and in pure Python. Also checks that all three give the same edges.
+"""
+import sys
+import os
+import time
+import random
+import site
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'steps'))
+
+import junction_config
+from junction_config import intron_dag
+
+def synthetic_introns(intron_count, span, seed=0):
+    """ Generates introns densely packed on a stretch of a chromosome.
+
+        intron_count: number of unique introns to generate
+        span: number of bases over which intron start positions are spread
+        seed: random seed
+
+        Return value: list of unique tuples (intron start, intron end)
+            sorted by start and then end position
+    """
+    random.seed(seed)
+    introns = set()
+    while len(introns) < intron_count:
+        intron_start = random.randint(1, span)
+        introns.add((intron_start,
+                     intron_start + int(random.lognormvariate(6, 1.2)) + 20))
+    return sorted(introns)
+
+def frontier_edges(introns, min_overlap_exon_size):
+    """ Finds edges between introns as the original edges_from_input_stream()
+        did.
+
+        Return value: list of tuples (parent index, child index); edges
+            from the fake source and to fake sinks are omitted
+    """
+    edges = []
+    linked_nodes, unlinked_nodes = {}, set([0])
+    for index in xrange(1, len(introns)):
+        intron_start, intron_end = introns[index]
+        nodes_to_trash = []
+        for node in unlinked_nodes:
+            if intron_start >= introns[node][1] + min_overlap_exon_size:
+                nodes_to_trash.append(node)
+        for node in nodes_to_trash:
+            linked_nodes[node] = index
+            unlinked_nodes.remove(node)
+        unlinked_nodes.add(index)
+        nodes_to_trash = []
+        for node in linked_nodes:
+            intermediate_node = linked_nodes[node]
+            if intermediate_node in linked_nodes:
+                nodes_to_trash.append(node)
+            else:
+                edges.append((node, index))
+                if introns[intermediate_node][1] > intron_end:
+                    linked_nodes[node] = index
+        for node in nodes_to_trash:
+            del linked_nodes[node]
+    return edges
+
+def dag_edges(introns, min_overlap_exon_size):
+    """ Finds edges between introns with intron_dag().
+
+        Return value: list of tuples (parent index, child index)
+    """
+    child_indptr, child_indices, _, _ = intron_dag(
+            [intron[0] for intron in introns],
+            [intron[1] for intron in introns],
+            min_overlap_exon_size
+        )
+    return [(i, j) for i in xrange(len(introns))
+                for j in child_indices[child_indptr[i]:child_indptr[i+1]]]
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--introns', type=int, required=False,
+            default=100000,
+            help='number of unique introns on synthetic strand')
+    parser.add_argument('--span', type=int, required=False, default=500000,
+            help='number of bases over which introns are spread')
+    parser.add_argument('--min-overlap-exon-size', type=int, required=False,
+            default=9,
+            help='Rail-RNA\'s --min-exon-size')
+    args = parser.parse_args()
+    introns = synthetic_introns(args.introns, args.span)
+    numpy_module = junction_config.numpy
+    results = {}
+    for name, function, numpy_backend in [
+                ('original frontier', frontier_edges, None),
+                ('sorted arrays (NumPy)', dag_edges, numpy_module),
+                ('sorted arrays (pure Python)', dag_edges, None)
+            ]:
+        if function is dag_edges and name.endswith('(NumPy)') \
+            and numpy_module is None:
+            print >>sys.stderr, '%s: NumPy unavailable' % name
+            continue
+        junction_config.numpy = numpy_backend
+        start_time = time.time()
+        results[name] = sorted(function(introns, args.min_overlap_exon_size))
+        elapsed = time.time() - start_time
+        print >>sys.stderr, '%s: %d edges among %d introns in %.2f s' % (
+                name, len(results[name]), len(introns), elapsed
+            )
+    junction_config.numpy = numpy_module
+    expected = results.pop('original frontier')
+    for name in results:
+        if results[name] != expected:
+            print >>sys.stderr, 'FAIL: %s edges differ.' % name
+            sys.exit(1)
+    print >>sys.stderr, 'Edges are identical.'
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+benchmark_parallel_gzip.py
+
+Measures time taken to package synthetic Bowtie 2 index files into a tar.gz
+as Rail-RNA-junction_index does. Compares the original path, which writes the
+archive with tarfile.TarFile.gzopen() on one thread, to streaming the tar
+through ParallelGzipWriter with several numbers of threads. Archive sizes are
+reported, and archives are checked for identical contents.
+"""
+import sys
+import os
+import time
+import random
+import site
+import tarfile
+import tempfile
+import shutil
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'utils'))
+
+from parallel_gzip import ParallelGzipWriter
+
+def write_index_files(index_dir, total_bytes):
+    """ Writes files resembling a Bowtie 2 index.
+
+        Half of the bytes are DNA text, like the reference names and
+        sequences an index stores, and half are random bytes from a small
+        alphabet, which compress about as well as the index's arrays.
+
+        index_dir: directory in which to write files
+        total_bytes: approximate total size of files
+
+        No return value.
+    """
+    chunk = 1048576
+    for i, extension in enumerate(['1.bt2', '2.bt2', '3.bt2', '4.bt2',
+                                   'rev.1.bt2', 'rev.2.bt2']):
+        with open(os.path.join(index_dir, 'index.' + extension),
+                    'w') as index_stream:
+            for _ in xrange(max(total_bytes // (6 * chunk), 1)):
+                if i % 2:
+                    index_stream.write(''.join([random.choice('ACGT')
+                                                for _ in xrange(chunk)]))
+                else:
+                    index_stream.write(''.join([chr(random.randint(0, 15))
+                                                for _ in xrange(chunk)]))
+
+def original_archive(index_dir, archive_path):
+    """ Writes tar.gz as junction_index originally did. """
+    tar = tarfile.TarFile.gzopen(archive_path, mode='w', compresslevel=3)
+    for index_file in sorted(os.listdir(index_dir)):
+        tar.add(os.path.join(index_dir, index_file), arcname=index_file)
+    tar.close()
+
+def parallel_archive(index_dir, archive_path, threads):
+    """ Writes tar.gz as junction_index now does. """
+    with open(archive_path, 'wb') as archive_stream:
+        gzip_stream = ParallelGzipWriter(archive_stream, level=3,
+                                            threads=threads)
+        tar = tarfile.open(fileobj=gzip_stream, mode='w|')
+        for index_file in sorted(os.listdir(index_dir)):
+            tar.add(os.path.join(index_dir, index_file), arcname=index_file)
+        tar.close()
+        gzip_stream.close()
+
+def archive_contents(archive_path):
+    """ Reads names and contents of files in tar.gz.
+
+        Return value: list of tuples (name, contents)
+    """
+    tar = tarfile.open(archive_path, mode='r:gz')
+    contents = [(member.name, tar.extractfile(member).read())
+                    for member in tar.getmembers()]
+    tar.close()
+    return contents
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-bytes', type=int, required=False,
+        default=64 * 1024 ** 2,
+        help='Approximate total size of index files')
+    parser.add_argument('--threads', type=int, nargs='+', required=False,
+        default=[1, 2, 4, 8],
+        help='Numbers of compression threads to try')
+    parser.add_argument('--seed', type=int, required=False, default=0,
+        help='Random seed')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        index_dir = os.path.join(temp_dir, 'index')
+        os.makedirs(index_dir)
+        write_index_files(index_dir, args.index_bytes)
+        original_path = os.path.join(temp_dir, 'original.tar.gz')
+        start_time = time.time()
+        original_archive(index_dir, original_path)
+        original_time = time.time() - start_time
+        print >>sys.stderr, 'tarfile.gzopen: %0.3f s, %d bytes' % (
+                original_time, os.path.getsize(original_path)
+            )
+        expected = archive_contents(original_path)
+        for threads in args.threads:
+            parallel_path = os.path.join(temp_dir, 'parallel.tar.gz')
+            start_time = time.time()
+            parallel_archive(index_dir, parallel_path, threads)
+            elapsed = time.time() - start_time
+            print >>sys.stderr, (
+                    'ParallelGzipWriter, %d thread(s): %0.3f s (%0.2fx), '
+                    '%d bytes'
+                ) % (threads, elapsed, original_time / elapsed,
+                     os.path.getsize(parallel_path))
+            assert archive_contents(parallel_path) == expected
+            os.remove(parallel_path)
+        print >>sys.stderr, 'Archive contents are identical.'
+    finally:
+        shutil.rmtree(temp_dir)
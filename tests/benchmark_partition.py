@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+benchmark_partition.py
+
+Measures throughput (lines/s) of the partitioning pass of Dooplicity's EMR
+simulator. Compares the original per-line path, which extracts a key with
+parsed_keys() and hashes it with MD5, to the batched task assigner in both
+its md5 (byte-compatible) and crc32 modes. Also checks that md5 mode assigns
+every line to the same task as the original path.
+
+Synthetic input resembles intermediate Rail output: zero-padded positions,
+a handful of reference names and a long trailing field.
+"""
+import sys
+import os
+import time
+import hashlib
+import random
+import site
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'dooplicity'))
+
+from emr_simulator import parsed_keys, task_assigner, _partition_batch_size
+
+def synthetic_lines(line_count, seed=0):
+    """ Generates tab-separated lines resembling Rail intermediates.
+
+        line_count: number of lines to generate
+        seed: random seed
+
+        Return value: list of lines
+    """
+    random.seed(seed)
+    return ['\t'.join(['chr%d' % random.randint(1, 22),
+                        '%012d' % random.randint(0, 250000000),
+                        random.choice('+-'),
+                        ''.join([random.choice('ACGT') for _ in xrange(40)]),
+                        '\n'])
+                for _ in xrange(line_count)]
+
+def legacy_tasks(lines, partition_options, separator, task_count):
+    """ Assigns tasks to lines as the original partitioner did.
+
+        Return value: list of task numbers
+    """
+    partitioned_key = parsed_keys(partition_options, separator)
+    tasks = []
+    for line in lines:
+        key = partitioned_key(line, separator)
+        tasks.append(
+                int(hashlib.md5(separator.join(key)).hexdigest(), 16)
+                % task_count
+            )
+    return tasks
+
+def batched_tasks(lines, partition_options, separator, task_count,
+                    partition_hash):
+    """ Assigns tasks to lines in batches with task_assigner().
+
+        Return value: list of task numbers
+    """
+    assigned_tasks = task_assigner(partition_options, separator, task_count,
+                                    False, partition_hash)
+    # Approximate readlines(_partition_batch_size) batches
+    batch_line_count = max(_partition_batch_size / len(lines[0]), 1)
+    tasks = []
+    for i in xrange(0, len(lines), batch_line_count):
+        tasks.extend(assigned_tasks(lines[i:i+batch_line_count]))
+    return tasks
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, required=False, default=1000000,
+            help='number of synthetic lines to partition')
+    parser.add_argument('--task-count', type=int, required=False,
+            default=64,
+            help='number of reduce tasks')
+    parser.add_argument('--partition-options', type=str, required=False,
+            default='-k1,2',
+            help='sort-like partition options')
+    args = parser.parse_args()
+    lines = synthetic_lines(args.lines)
+    results = {}
+    for name, function, extra_args in [
+                ('original (parsed_keys + md5)', legacy_tasks, []),
+                ('batched md5', batched_tasks, ['md5']),
+                ('batched crc32', batched_tasks, ['crc32'])
+            ]:
+        start_time = time.time()
+        results[name] = function(lines, args.partition_options, '\t',
+                                    args.task_count, *extra_args)
+        elapsed = time.time() - start_time
+        print >>sys.stderr, '%s: %.0f lines/s (%.2f s)' % (
+                name, args.lines / elapsed, elapsed
+            )
+    if results['batched md5'] != results['original (parsed_keys + md5)']:
+        print >>sys.stderr, 'FAIL: md5 task assignments differ.'
+        sys.exit(1)
+    print >>sys.stderr, 'md5 task assignments are identical.'
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+benchmark_readlet_selection.py
+
+Measures time taken by Rail-RNA-junction_search to select readlet alignments
+from synthetic reads whose readlets are highly multimapping. Each read spans
+at most one intron; every readlet has its true alignment with some
+probability and many random alignments to the same or other strands.
+Compares correlation clustering (the --experimental path), which builds a
+graph on all pairs of alignments, to longest-consistent-chain selection,
+which sorts alignments and runs a dynamic program in O(n log n) time. Also
+reports how often each recovers all true alignments of a read.
+"""
+import sys
+import os
+import time
+import random
+import site
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'steps'))
+
+from junction_search import selected_readlet_alignments_by_clustering, \
+    selected_readlet_alignments_by_chaining
+
+def synthetic_reads(read_count, read_size, readlet_size, readlet_interval,
+                        multimapping, span, seed=0):
+    """ Generates readlet alignments of reads from a synthetic genome.
+
+        read_count: number of reads to generate
+        read_size: number of bases in each read
+        readlet_size: number of bases in each readlet
+        readlet_interval: distance between starts of successive readlets
+        multimapping: number of random alignments of each readlet
+        span: number of bases over which random alignments are spread
+        seed: random seed
+
+        Return value: list of tuples (readlets, set of true alignments),
+            where readlets is in the format taken by
+            selected_readlet_alignments_by_chaining()
+    """
+    random.seed(seed)
+    reads = []
+    for _ in xrange(read_count):
+        locus = random.randint(1, span)
+        intron_size = random.choice([0, random.randint(50, 50000)])
+        intron_displacement = random.randint(0, read_size)
+        readlets, truth = [], set()
+        for displacement in xrange(0, read_size - readlet_size + 1,
+                                    readlet_interval):
+            alignments = []
+            if random.random() < 0.8:
+                pos = locus + displacement + (
+                        intron_size if displacement >= intron_displacement
+                        else 0
+                    )
+                alignments.append(('chr1', False, pos, pos + readlet_size,
+                                    displacement))
+                truth.add(alignments[0])
+            for _ in xrange(multimapping):
+                pos = random.randint(1, span)
+                alignments.append((random.choice(['chr1', 'chr2']),
+                                   random.choice([False, True]),
+                                   pos, pos + readlet_size, displacement))
+            if alignments:
+                readlets.append(alignments)
+        reads.append((readlets, truth))
+    return reads
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reads', type=int, required=False, default=200,
+            help='number of synthetic reads')
+    parser.add_argument('--read-size', type=int, required=False, default=100,
+            help='number of bases in each read')
+    parser.add_argument('--readlet-size', type=int, required=False,
+            default=25,
+            help='Rail-RNA\'s --readlet-size')
+    parser.add_argument('--readlet-interval', type=int, required=False,
+            default=4,
+            help='Rail-RNA\'s --readlet-interval')
+    parser.add_argument('--multimapping', type=int, required=False,
+            default=20,
+            help='number of random alignments of each readlet')
+    parser.add_argument('--span', type=int, required=False, default=50000000,
+            help='number of bases over which alignments are spread')
+    args = parser.parse_args()
+    reads = synthetic_reads(args.reads, args.read_size, args.readlet_size,
+                            args.readlet_interval, args.multimapping,
+                            args.span)
+    alignment_count = sum([len(alignments) for readlets, _ in reads
+                            for alignments in readlets])
+    for name, function in [
+                ('correlation clustering',
+                    selected_readlet_alignments_by_clustering),
+                ('longest consistent chain',
+                    selected_readlet_alignments_by_chaining)
+            ]:
+        random.seed(0)
+        recovered, start_time = 0, time.time()
+        for readlets, truth in reads:
+            if truth and truth <= set(function(readlets)[0]):
+                recovered += 1
+        elapsed = time.time() - start_time
+        print >>sys.stderr, '%s: %d alignments of %d reads in %.2f s; ' \
+                            'all true alignments of %d reads selected' % (
+                                name, alignment_count, len(reads), elapsed,
+                                recovered
+                            )
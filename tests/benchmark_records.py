@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+benchmark_records.py
+
+Measures bytes on disk and parse throughput of intermediate data in the text
+format Rail-RNA steps write and in the binary record format of
+dooplicity/records.py. Synthetic records resemble what Rail-RNA-align_reads
+passes to Rail-RNA-coverage_pre: exon differentials and per-base coverage,
+keyed by reference name and zero-padded position in text and by ints in
+binary. Reports sizes with and without gzip, the time xstream takes to read
+each format back into typed fields, and the time the EMR simulator takes to
+partition each into sorted runs and merge them for reducers. Merged records
+are checked for equality.
+"""
+import sys
+import os
+import time
+import random
+import site
+import glob
+import gzip
+import tempfile
+import shutil
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'dooplicity'))
+
+from tools import xstream, xwriter
+from emr_simulator import presorted_tasks, merged_lines
+import records
+
+# Indexes of int fields
+_int_fields = (2, 3, 4)
+
+def synthetic_records(record_count, sample_count=100):
+    """ Generates records like those align_reads writes for coverage_pre.
+
+        record_count: number of records
+        sample_count: number of samples
+
+        Return value: list of tuples (record type, reference name, position,
+            sample index, value)
+    """
+    return [(random.choice(['exon_diff', 'exon_diff', 'coverage']),
+             'chr%d' % random.randint(1, 22),
+             random.randint(1, 250000000),
+             random.randint(0, sample_count - 1),
+             random.choice([-1, 1, random.randint(1, 500)]))
+            for _ in xrange(record_count)]
+
+def write_text(values, filename, gzipped):
+    """ Writes values as a step does now, padding positions. """
+    opener = gzip.open if gzipped else open
+    with opener(filename, 'wb') as output_stream:
+        for record_type, rname, pos, sample_index, value in values:
+            print >>output_stream, '%s\t%s\t%012d\t%d\t%d' % (
+                    record_type, rname, pos, sample_index, value
+                )
+
+def write_binary(values, filename, gzipped):
+    """ Writes values as binary records with xwriter. """
+    opener = gzip.open if gzipped else open
+    with opener(filename, 'wb') as output_stream:
+        output = xwriter(output_stream, binary=True)
+        for value in values:
+            output.write(value)
+
+def read_back(filename, binary):
+    """ Reads records with xstream, converting text fields to ints.
+
+        Return value: list of typed tuples
+    """
+    with open(filename, 'rb') as input_stream:
+        if binary:
+            return [key + value for key, xpartition
+                    in xstream(input_stream, 2, binary=True)
+                    for value in xpartition]
+        return [key + (int(value[0]), int(value[1]), int(value[2]))
+                for key, xpartition in xstream(input_stream, 2)
+                for value in xpartition]
+
+def typed(line):
+    """ Converts a text line to a typed tuple. """
+    fields = line.split('\t')
+    for i in _int_fields:
+        fields[i] = int(fields[i])
+    return tuple(fields)
+
+def simulated_shuffle(input_files, output_dir, task_count, memcap):
+    """ Partitions input into sorted runs and merges each task's runs.
+
+        Return value: list of merged data, one string per task
+    """
+    error = presorted_tasks(input_files, 0, '-k1,2 -k3,3n -k4,4n',
+                            output_dir, 4, '\t', '-k1,2', task_count, memcap,
+                            sorted_runs=True)
+    assert error is None, error
+    return [''.join(merged_lines(glob.glob(os.path.join(output_dir,
+                                                        '%d.*' % task)),
+                                    '-k1,2 -k3,3n -k4,4n', '\t'))
+            for task in xrange(task_count)]
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, required=False,
+        default=500000,
+        help='Number of records')
+    parser.add_argument('--files', type=int, required=False,
+        default=4,
+        help='Number of map output files among which records are divided')
+    parser.add_argument('--tasks', type=int, required=False,
+        default=8,
+        help='Number of reduce tasks')
+    parser.add_argument('--memcap', type=int, required=False,
+        default=16 * 1024,
+        help='KB of records held in memory before runs are spilled')
+    parser.add_argument('--seed', type=int, required=False, default=0,
+        help='Random seed')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    values = synthetic_records(args.records)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        file_size = (len(values) + args.files - 1) // args.files
+        results = {}
+        for label, binary, writer in [('text', False, write_text),
+                                      ('binary', True, write_binary)]:
+            input_files = []
+            for gzipped in [False, True]:
+                filename = os.path.join(temp_dir, '%s.%s' % (label, gzipped))
+                writer(values, filename, gzipped)
+                print >>sys.stderr, '%s%s: %d bytes' % (
+                        label, ', gzip\'d' if gzipped else '',
+                        os.path.getsize(filename)
+                    )
+            start_time = time.time()
+            read_values = read_back(os.path.join(temp_dir,
+                                                    '%s.False' % label),
+                                    binary)
+            parse_time = time.time() - start_time
+            assert read_values == values
+            for i in xrange(args.files):
+                filename = os.path.join(temp_dir, '%s.map.%d' % (label, i))
+                writer(values[i*file_size:(i+1)*file_size], filename, False)
+                input_files.append(filename)
+            output_dir = os.path.join(temp_dir, '%s.tasks' % label)
+            os.makedirs(output_dir)
+            start_time = time.time()
+            tasks = simulated_shuffle(input_files, output_dir, args.tasks,
+                                        args.memcap)
+            shuffle_time = time.time() - start_time
+            if binary:
+                tasks = [[records.decoded(body) for body
+                            in records.record_bodies([task])]
+                         for task in tasks]
+            else:
+                tasks = [map(typed, task.splitlines()) for task in tasks]
+            for task in tasks:
+                assert task == sorted(task)
+            results[label] = (parse_time, shuffle_time,
+                                sorted([value for task in tasks
+                                        for value in task]))
+            print >>sys.stderr, (
+                    '%s: xstream parse %0.3f s (%0.0f records/s); '
+                    'partition, sort and merge %0.3f s'
+                ) % (label, parse_time, len(values) / parse_time,
+                     shuffle_time)
+        print >>sys.stderr, (
+                'binary/text: parse %0.2fx, partition, sort and merge %0.2fx'
+            ) % (results['text'][0] / results['binary'][0],
+                 results['text'][1] / results['binary'][1])
+        assert results['text'][2] == results['binary'][2] == sorted(values)
+        print >>sys.stderr, 'Merged records are identical.'
+    finally:
+        shutil.rmtree(temp_dir)
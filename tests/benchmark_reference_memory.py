@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+benchmark_reference_memory.py
+
+Reports resident memory of worker processes before and after each constructs
+a Bowtie2IndexReference, as concurrent tasks on one machine do, when every
+worker parses the Bowtie 2 index into its own lists and when workers attach
+to the shared record file. Resident set size counts mapped pages shared with
+other workers; private memory does not. Also reports how long get_stretch
+takes to retrieve random stretches in each case.
+
+Requires a Bowtie 2 index, e.g. one built with bowtie2-build from a genome
+FASTA.
+"""
+import sys
+import os
+import site
+import shutil
+import tempfile
+import multiprocessing
+import random
+import time
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src'))
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'utils'))
+
+from bowtie2_index import Bowtie2IndexReference
+from dooplicity.tools import resident_memory
+
+def worker_memory(idx_prefix, shared, barrier):
+    """ Measures memory of a worker before and after loading reference.
+
+        idx_prefix: prefix of Bowtie 2 index
+        shared: True iff record file should be used
+        barrier: multiprocessing.Queue from which to take a token once
+            reference is loaded, so all workers hold it at once
+
+        Return value: tuple (memory before, memory after), where each is a
+            tuple (resident bytes, private resident bytes or None)
+    """
+    before = resident_memory()
+    reference_index = Bowtie2IndexReference(idx_prefix, shared=shared)
+    # Touch every record as get_stretch would
+    for ref_id in reference_index.refnames:
+        reference_index.get_stretch(ref_id, 0, 1)
+    after = resident_memory()
+    barrier.get()
+    return before, after
+
+def stretch_time(idx_prefix, shared, stretch_count, stretch_size=100):
+    """ Measures time get_stretch takes to retrieve random stretches.
+
+        idx_prefix: prefix of Bowtie 2 index
+        shared: True iff record file should be used
+        stretch_count: number of stretches to retrieve
+        stretch_size: number of characters per stretch
+
+        Return value: tuple (seconds taken, list of stretches)
+    """
+    reference_index = Bowtie2IndexReference(idx_prefix, shared=shared)
+    random.seed(0)
+    stretches = [(ref_id, random.randint(0, max(
+                        reference_index.lengths[
+                                reference_index.ref_id_to_offset[ref_id]
+                            ] - stretch_size, 0
+                    )))
+                    for ref_id in [random.choice(reference_index.refnames)
+                                    for _ in xrange(stretch_count)]]
+    start_time = time.time()
+    retrieved = [reference_index.get_stretch(ref_id, ref_off, stretch_size)
+                    for ref_id, ref_off in stretches]
+    return time.time() - start_time, retrieved
+
+def megabytes(byte_count):
+    """ Formats bytes as megabytes.
+
+        byte_count: number of bytes or None
+
+        Return value: string
+    """
+    if byte_count is None:
+        return 'NA'
+    return '%.1f MB' % (byte_count / 1048576.)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bowtie2-idx', type=str, required=True,
+            help='prefix of Bowtie 2 index')
+    parser.add_argument('--workers', type=int, required=False, default=8,
+            help='number of concurrent worker processes')
+    parser.add_argument('--stretches', type=int, required=False,
+            default=100000,
+            help='number of random stretches to retrieve with get_stretch')
+    args = parser.parse_args()
+    extension = ('.bt2' if os.path.exists(args.bowtie2_idx + '.3.bt2')
+                    else '.bt2l')
+    # Copy index so its record file is written somewhere writable
+    temp_dir = tempfile.mkdtemp()
+    try:
+        idx_prefix = os.path.join(temp_dir,
+                                    os.path.basename(args.bowtie2_idx))
+        for i in [1, 3, 4]:
+            shutil.copy(args.bowtie2_idx + '.%d' % i + extension,
+                        idx_prefix + '.%d' % i + extension)
+        # Build record file once, as the first task would
+        Bowtie2IndexReference(idx_prefix)
+        for name, shared in [('parsed lists', False),
+                             ('shared record file', True)]:
+            manager = multiprocessing.Manager()
+            barrier = manager.Queue()
+            for _ in xrange(args.workers):
+                barrier.put(None)
+            pool = multiprocessing.Pool(args.workers)
+            results = [pool.apply_async(worker_memory,
+                                        (idx_prefix, shared, barrier))
+                        for _ in xrange(args.workers)]
+            memories = [result.get() for result in results]
+            pool.close()
+            pool.join()
+            print >>sys.stderr, '%s:' % name
+            for i, (before, after) in enumerate(memories):
+                print >>sys.stderr, (
+                        '    worker %d: resident %s -> %s; '
+                        'private %s -> %s'
+                    ) % (i, megabytes(before[0]), megabytes(after[0]),
+                         megabytes(before[1]), megabytes(after[1]))
+            if all([before[1] is not None for before, _ in memories]):
+                print >>sys.stderr, (
+                        '    total private growth across workers: %s'
+                        % megabytes(sum([after[1] - before[1]
+                                            for before, after in memories]))
+                    )
+        retrieved = []
+        for name, shared in [('parsed lists', False),
+                             ('shared record file', True)]:
+            seconds, stretches = stretch_time(idx_prefix, shared,
+                                                args.stretches)
+            retrieved.append(stretches)
+            print >>sys.stderr, (
+                    '%s: get_stretch %0.3f s (%0.0f stretches/s)'
+                    % (name, seconds, args.stretches / seconds)
+                )
+        assert retrieved[0] == retrieved[1]
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+benchmark_reference_startup.py
+
+Measures how long constructing a BowtieIndexReference takes, as every Rail
+task that needs the reference does on startup, when the Bowtie index is
+parsed and when its sidecar is memory-mapped instead. Also times the first
+stretch extracted from each reference, since sidecar tables are loaded
+lazily, and checks that both paths extract the same stretches.
+
+Requires a Bowtie index, e.g. one built with bowtie-build from a genome
+FASTA.
+"""
+import sys
+import os
+import time
+import random
+import site
+import shutil
+import tempfile
+
+base_path = os.path.abspath(
+                    os.path.dirname(os.path.dirname(os.path.realpath(
+                        __file__)))
+                )
+site.addsitedir(os.path.join(base_path, 'src', 'rna', 'utils'))
+
+from bowtie_index import BowtieIndexReference
+
+def startup_time(idx_prefix, repeats, sidecar):
+    """ Times construction of BowtieIndexReference.
+
+        idx_prefix: prefix of Bowtie index
+        repeats: number of times to construct reference
+        sidecar: True iff sidecar should be used
+
+        Return value: tuple (mean seconds per construction, last reference)
+    """
+    start_time = time.time()
+    for _ in xrange(repeats):
+        reference_index = BowtieIndexReference(idx_prefix, sidecar=sidecar)
+    return (time.time() - start_time) / repeats, reference_index
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__,
+                formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bowtie-idx', type=str, required=True,
+            help='prefix of Bowtie index')
+    parser.add_argument('--repeats', type=int, required=False, default=10,
+            help='number of times to construct reference per mode')
+    parser.add_argument('--stretches', type=int, required=False,
+            default=10000,
+            help='number of random stretches to compare across modes')
+    args = parser.parse_args()
+    # Copy index so its sidecar is written somewhere writable
+    temp_dir = tempfile.mkdtemp()
+    try:
+        idx_prefix = os.path.join(temp_dir,
+                                    os.path.basename(args.bowtie_idx))
+        for extension in ['.1.ebwt', '.3.ebwt', '.4.ebwt']:
+            shutil.copy(args.bowtie_idx + extension, idx_prefix + extension)
+        results = {}
+        for name, sidecar in [('parse index', False),
+                              ('mmap sidecar', True)]:
+            if sidecar:
+                # Write sidecar once, as the first task would
+                BowtieIndexReference(idx_prefix)
+            elapsed, reference_index = startup_time(idx_prefix,
+                                                    args.repeats, sidecar)
+            start_time = time.time()
+            for ref_id in reference_index.length:
+                reference_index.get_stretch(ref_id, 0, 100)
+            first_stretches = time.time() - start_time
+            print >>sys.stderr, ('%s: %.4f s per construction; %.4f s for '
+                                 'first stretch of every reference') % (
+                                        name, elapsed, first_stretches
+                                    )
+            results[name] = reference_index
+        random.seed(0)
+        ref_ids = sorted(results['parse index'].length)
+        stretches = []
+        for _ in xrange(args.stretches):
+            ref_id = random.choice(ref_ids)
+            stretches.append((ref_id,
+                random.randint(0, results['parse index'].length[ref_id]),
+                random.randint(1, 500)))
+        if (results['parse index'].get_stretches(stretches)
+                != results['mmap sidecar'].get_stretches(stretches)):
+            print >>sys.stderr, 'FAIL: stretches differ.'
+            sys.exit(1)
+        print >>sys.stderr, 'Stretches are identical.'
+    finally:
+        shutil.rmtree(temp_dir)